@@ -0,0 +1,28 @@
+"""
+Offline benchmarks for the Virtual Stylist Lambda code.
+
+Run them from the `source` directory, for example:
+
+    python -m benchmarks.customer_profiles
+"""
+import os
+import sys
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(SOURCE_DIR, "lambda")
+SEARCH_SERVICE_DIR = os.path.join(SOURCE_DIR, "searchservice", "search_app")
+
+
+def use_lambda_code(*function_dirs):
+    """Makes the common layer and the given Lambda function directories importable."""
+    for name in ("CommonLayer/python",) + function_dirs:
+        path = os.path.join(LAMBDA_DIR, name)
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def use_search_service():
+    """Makes the common layer and the search service importable."""
+    use_lambda_code()
+    if SEARCH_SERVICE_DIR not in sys.path:
+        sys.path.insert(0, SEARCH_SERVICE_DIR)
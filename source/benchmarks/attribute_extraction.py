@@ -0,0 +1,87 @@
+"""
+Accuracy and latency of the local attribute extractor on labelled queries.
+
+For each attribute it reports how many of the confident values passed to the
+agent are right (precision), how many labelled values are found (recall), and
+how often a value is passed that the query does not mention. "complete" counts
+queries where every labelled attribute was passed, so the agent has nothing
+left to extract. With --classifier, naive Bayes classifiers are trained and
+evaluated by k-fold cross-validation, so no query is scored by a classifier
+that saw it.
+"""
+import argparse
+import os
+import random
+import time
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.attributes import ATTRIBUTES, confident, extract, read_examples, train_classifiers  # noqa: E402
+
+DEFAULT_EXAMPLES = os.path.join(os.path.dirname(__file__), "data", "attribute_queries.jsonl")
+
+
+def evaluate(examples, predictions):
+    print(f"{'attribute':>10}{'labelled':>10}{'passed':>8}{'correct':>9}{'precision':>11}{'recall':>8}{'spurious':>10}")
+    for attribute in ATTRIBUTES:
+        labelled = sum(1 for _, labels in examples if attribute in labels)
+        passed = [(labels.get(attribute), predicted[attribute]) for (_, labels), predicted in zip(examples, predictions)
+                  if attribute in predicted]
+        correct = sum(1 for truth, value in passed if truth == value)
+        spurious = sum(1 for truth, _ in passed if truth is None)
+        print(f"{attribute:>10}{labelled:>10}{len(passed):>8}{correct:>9}{correct / max(len(passed), 1):>11.1%}"
+              f"{correct / max(labelled, 1):>8.1%}{spurious:>10}")
+    complete = sum(1 for (_, labels), predicted in zip(examples, predictions)
+                   if labels and all(predicted.get(a) == v for a, v in labels.items()))
+    print(f"complete: {complete} of {sum(1 for _, labels in examples if labels)} queries with attributes")
+
+
+def errors(examples, predictions):
+    for (text, labels), predicted in zip(examples, predictions):
+        wrong = {a: (labels.get(a), predicted.get(a)) for a in ATTRIBUTES if labels.get(a) != predicted.get(a)}
+        if wrong:
+            print(f"  {text!r}: " + ", ".join(f"{a} {truth} -> {value}" for a, (truth, value) in wrong.items()))
+
+
+def run(path, threshold, repeat, folds, show_errors):
+    examples = read_examples(path)
+    texts = [text for text, _ in examples]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            extract(text)
+    elapsed_us = (time.perf_counter() - start) * 1e6 / (repeat * len(texts))
+    predictions = [confident(extract(text), threshold) for text in texts]
+    print(f"{len(examples)} labelled queries, confidence >= {threshold}; rules take {elapsed_us:.0f}us per query")
+    evaluate(examples, predictions)
+    if show_errors:
+        errors(examples, predictions)
+
+    if folds:
+        order = list(range(len(examples)))
+        random.Random(0).shuffle(order)
+        predictions = [None] * len(examples)
+        for fold in range(folds):
+            held_out = set(order[fold::folds])
+            classifiers = train_classifiers([examples[i] for i in order if i not in held_out])
+            for i in held_out:
+                predictions[i] = confident(extract(texts[i], classifiers), threshold)
+        print(f"\nrules plus classifiers, {folds}-fold cross-validation")
+        evaluate(examples, predictions)
+        if show_errors:
+            errors(examples, predictions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--examples", default=DEFAULT_EXAMPLES, help="JSON lines with `query` and its attributes")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Same as the text function's ATTRIBUTE_CONFIDENCE")
+    parser.add_argument("--repeat", type=int, default=50, help="Passes over the queries when timing")
+    parser.add_argument("--classifier", type=int, default=0, metavar="FOLDS",
+                        help="Also evaluate the optional classifiers with this many folds")
+    parser.add_argument("--errors", action="store_true", help="List the queries with a wrong or missing value")
+    args = parser.parse_args()
+    run(args.examples, args.threshold, args.repeat, args.classifier, args.errors)
@@ -0,0 +1,78 @@
+"""
+Per-query cost of batch search (POST /search) against one /search call per query.
+
+Each batch size runs the same queries through the search handler twice: once
+as separate single-query invocations and once as one batch request. Fake AWS
+calls take --io-ms and model calls --embed-ms. Queries are drawn from a small
+pool of outfit items, so larger batches repeat some queries and share their
+results' images, as an outfit's items and merchandising lists do.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import time
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, EMBEDDINGS_TABLE, SCENARIOS, TABLE_KEYS, seed_catalog
+
+SCENARIO = SCENARIOS["imagequery_function"]
+OUTFIT_ITEMS = ["linen shirt", "white sneakers", "navy chinos", "leather belt", "straw hat", "denim jacket",
+                "silk scarf", "wool coat", "red evening dress", "ankle boots", "canvas tote", "aviator sunglasses"]
+
+
+def counts(fakes):
+    calls = fakes.bedrock_runtime.calls + fakes.s3.calls + fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls
+    return {operation: sum(1 for name, _ in calls if name == operation)
+            for operation in ("InvokeModel", "Scan", "BatchGetItem", "GetObject")}
+
+
+def measure(fakes, fn):
+    for service in (fakes.bedrock_runtime, fakes.s3, fakes.dynamodb.Table(EMBEDDINGS_TABLE)):
+        service.calls.clear()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    return (time.perf_counter() - start) * 1000, counts(fakes)
+
+
+def run(items, batch_sizes, embed_ms, io_ms, k):
+    os.environ.update(COMMON_ENV, **SCENARIO["env"], TRACE_SAMPLE_RATE="0")
+    use_lambda_code(SCENARIO["function_dir"])
+    fakes = FakeAws(latency=io_ms / 1000, table_keys=TABLE_KEYS).install()
+    fakes.bedrock_runtime.latency = embed_ms / 1000
+    seed_catalog(fakes, images=items)
+    handler = importlib.import_module("imagequery_function").handler
+    measure(fakes, lambda: handler({"queryStringParameters": {"query": "warm up"}}, None))
+
+    print(f"{items} items, model call {embed_ms:.0f}ms, DynamoDB/S3 call {io_ms:.0f}ms, k={k}; costs per query")
+    print(f"{'queries':>8}{'request':>10}{'ms':>10}{'model':>8}{'scans':>8}{'batch gets':>12}{'S3 gets':>9}")
+    for size in batch_sizes:
+        queries = [OUTFIT_ITEMS[i % len(OUTFIT_ITEMS)] for i in range(size)]
+
+        def singles():
+            for query in queries:
+                handler({"queryStringParameters": {"query": query}}, None)
+
+        def batch():
+            body = json.dumps({"queries": [{"query": query, "k": k} for query in queries]})
+            handler({"httpMethod": "POST", "body": body}, None)
+
+        for name, fn in (("single", singles), ("batch", batch)):
+            elapsed, calls = measure(fakes, fn)
+            print(f"{size:>8}{name:>10}{elapsed / size:>10.1f}{calls['InvokeModel'] / size:>8.2f}{calls['Scan'] / size:>8.2f}"
+                  f"{calls['BatchGetItem'] / size:>12.2f}{calls['GetObject'] / size:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 12, 25])
+    parser.add_argument("--embed-ms", type=float, default=60)
+    parser.add_argument("--io-ms", type=float, default=10)
+    parser.add_argument("-k", type=int, default=3, help="Results per query in batch requests")
+    args = parser.parse_args()
+    run(args.items, args.batch_sizes, args.embed_ms, args.io_ms, args.k)
@@ -0,0 +1,101 @@
+"""
+Tail latency of model calls with and without hedging to a second region.
+
+Two fake regions answer in --latency-ms, except for a --slow-fraction of calls
+that take --slow-ms, drawn independently per region. The same workload runs
+without hedging, with a fixed hedge delay, and with the adaptive p95 delay.
+The outage run throttles every call in the home region, so calls fail over.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from benchmarks.fakes import FakeBedrockRuntime  # noqa: E402
+from stylist_common import runtime  # noqa: E402
+from stylist_common.bedrock import BedrockInvoker, BedrockUnavailable, parse_targets  # noqa: E402
+
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+BODY = json.dumps({"messages": [{"role": "user", "content": "what color goes with navy"}]})
+HOME, SECONDARY = "us-east-1", "us-west-2"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_workload(name, invoker, fakes, requests, concurrency):
+    latencies, failures = [], 0
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            invoker.invoke_model(MODEL_ID, BODY)["body"].read()
+            return (time.perf_counter() - start) * 1000
+        except BedrockUnavailable:
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for result in executor.map(one, range(requests)):
+            if result is None:
+                failures += 1
+            else:
+                latencies.append(result)
+    calls = sum(len(fake.calls) for fake in fakes.values())
+    print(f"{name:<22}{statistics.median(latencies):>8.0f}{percentile(latencies, 0.95):>8.0f}"
+          f"{percentile(latencies, 0.99):>8.0f}{max(latencies):>8.0f}{calls / requests - 1:>10.1%}{failures:>10}")
+
+
+def regions(latency_ms, slow_fraction, slow_ms, seed):
+    runtime.reset()
+    fakes = {}
+    for offset, region in enumerate((HOME, SECONDARY)):
+        fakes[region] = FakeBedrockRuntime(latency_ms / 1000, slow_probability=slow_fraction,
+                                           slow_latency=slow_ms / 1000, seed=seed + offset)
+        runtime.set_client("bedrock-runtime", fakes[region], region_name=region)
+    return fakes
+
+
+def run(requests, concurrency, latency_ms, slow_fraction, slow_ms, delay_ms, budget):
+    os.environ["AWS_REGION"] = HOME
+    print(f"{requests} calls at concurrency {concurrency}: {latency_ms:.0f}ms, {slow_fraction:.0%} take {slow_ms:.0f}ms")
+    print(f"{'':<22}{'p50 ms':>8}{'p95':>8}{'p99':>8}{'max':>8}{'extra':>10}{'failed':>10}")
+    options = dict(rate=10000, burst=10000, max_concurrency=64, max_attempts=2, sleep=lambda seconds: None)
+    targets = parse_targets(SECONDARY)
+    runs = [
+        ("no hedging", dict(hedge_targets=[])),
+        (f"hedge after {delay_ms:.0f}ms", dict(hedge_targets=targets, hedge_delay=delay_ms / 1000, hedge_budget=budget)),
+        ("hedge after p95", dict(hedge_targets=targets, hedge_budget=budget)),
+    ]
+    for name, hedging in runs:
+        fakes = regions(latency_ms, slow_fraction, slow_ms, seed=1)
+        run_workload(name, BedrockInvoker(**options, **hedging), fakes, requests, concurrency)
+
+    for name, hedging in (("outage, no failover", dict(hedge_targets=[])),
+                          ("outage, failover", dict(hedge_targets=targets, hedge_budget=budget))):
+        fakes = regions(latency_ms, slow_fraction, slow_ms, seed=1)
+        fakes[HOME].throttle_probability = 1.0
+        try:
+            run_workload(name, BedrockInvoker(**options, **hedging), fakes, requests, concurrency)
+        except statistics.StatisticsError:
+            print(f"{name:<22}{'every call failed':>42}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--slow-fraction", type=float, default=0.03)
+    parser.add_argument("--slow-ms", type=float, default=1000)
+    parser.add_argument("--delay-ms", type=float, default=100, help="Fixed hedge delay")
+    parser.add_argument("--budget", type=float, default=0.1, help="Hedged calls as a fraction of calls")
+    args = parser.parse_args()
+    run(args.requests, args.concurrency, args.latency_ms, args.slow_fraction, args.slow_ms, args.delay_ms, args.budget)
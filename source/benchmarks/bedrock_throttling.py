@@ -0,0 +1,82 @@
+"""
+Load test of the shared Bedrock invoker against a fake endpoint that throttles.
+
+The fake model serves a fixed number of calls in flight and throttles the
+rest, plus a small random throttle rate. The same workload runs through a
+naive client that retries immediately, and through the invoker with its token
+bucket, AIMD concurrency limit, jittered backoff and circuit breaker.
+"""
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from benchmarks.fakes import FakeBedrockRuntime  # noqa: E402
+from stylist_common.bedrock import BedrockInvoker, BedrockUnavailable  # noqa: E402
+
+MODEL_ID = "amazon.titan-embed-image-v1"
+BODY = json.dumps({"inputText": "red evening dress"})
+
+
+def naive_call(fake, attempts):
+    for _ in range(attempts):
+        try:
+            return fake.invoke_model(body=BODY, modelId=MODEL_ID)
+        except ClientError:
+            continue
+    raise BedrockUnavailable("retries exhausted")
+
+
+def run_workload(name, call, fake, requests, concurrency):
+    latencies, failures = [], 0
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            call()
+            return time.perf_counter() - start, True
+        except BedrockUnavailable:
+            return time.perf_counter() - start, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, ok in executor.map(one, range(requests)):
+            latencies.append(latency)
+            failures += not ok
+    wall = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<10} success {100 * (requests - failures) / requests:6.1f}%  throttles {fake.throttles:>6}  "
+          f"p50 {statistics.median(latencies) * 1000:7.1f}ms  p99 {p99 * 1000:7.1f}ms  {requests / wall:7.1f} req/s")
+
+
+def run(requests, concurrency, capacity, latency, throttle_probability, attempts):
+    fake = FakeBedrockRuntime(latency=latency, capacity=capacity, throttle_probability=throttle_probability)
+    run_workload("naive", lambda: naive_call(fake, attempts), fake, requests, concurrency)
+
+    fake = FakeBedrockRuntime(latency=latency, capacity=capacity, throttle_probability=throttle_probability)
+    invoker = BedrockInvoker(rate=capacity / latency, burst=capacity, max_concurrency=capacity * 2,
+                             max_attempts=attempts, base_delay=latency / 2, breaker_reset_seconds=1.0)
+    run_workload("invoker", lambda: invoker.call(MODEL_ID, fake.invoke_model, body=BODY, modelId=MODEL_ID),
+                 fake, requests, concurrency)
+    guard = invoker.guard(MODEL_ID)
+    print(f"{'':<10} adaptive concurrency limit settled at {guard.limiter.limit:.1f}, breaker {guard.breaker.state}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--capacity", type=int, default=4, help="Calls the fake model serves in flight")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per fake model call")
+    parser.add_argument("--throttle-probability", type=float, default=0.02)
+    parser.add_argument("--attempts", type=int, default=4)
+    args = parser.parse_args()
+    run(args.requests, args.concurrency, args.capacity, args.latency, args.throttle_probability, args.attempts)
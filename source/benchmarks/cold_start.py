@@ -0,0 +1,83 @@
+"""
+Cold start cost of every Lambda handler: module import time, heaviest imports and first invocation.
+
+Each handler runs in a fresh interpreter with `-X importtime`, then its first
+invocation is served by the in-process fakes.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks import LAMBDA_DIR
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS
+
+SOURCE_DIR = os.path.dirname(LAMBDA_DIR)
+
+CHILD = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import {module} as handler_module
+imported = time.perf_counter()
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import prepare
+fakes = FakeAws(table_keys={table_keys!r}).install()
+event = prepare({module!r}, fakes)
+invoke_start = time.perf_counter()
+handler_module.handler(event, None)
+invoked = time.perf_counter()
+print("COLD_START " + json.dumps({{"import_ms": (imported - start) * 1000, "first_invoke_ms": (invoked - invoke_start) * 1000}}))
+"""
+
+
+def parse_importtime(stderr, module):
+    """Returns the handler's cumulative import time and its heaviest direct imports, in milliseconds."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, int(cumulative) / 1000, name.strip()))
+    total, children = 0.0, []
+    for i, (depth, cumulative, name) in enumerate(rows):
+        if name == module and depth == 0:
+            total = cumulative
+            j = i - 1
+            while j >= 0 and rows[j][0] > 0:
+                if rows[j][0] == 1:
+                    children.append((rows[j][2], rows[j][1]))
+                j -= 1
+    return total, sorted(children, key=lambda child: -child[1])
+
+
+def measure(module):
+    scenario = SCENARIOS[module]
+    paths = [os.path.join(LAMBDA_DIR, "CommonLayer", "python"), os.path.join(LAMBDA_DIR, scenario["function_dir"]), SOURCE_DIR]
+    env = dict(os.environ, **COMMON_ENV, **scenario["env"])
+    script = CHILD.format(paths=paths, module=module, table_keys=TABLE_KEYS)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(f"{module} failed:\n{result.stderr[-2000:]}")
+    line = next(line for line in result.stdout.splitlines() if line.startswith("COLD_START "))
+    timings = json.loads(line[len("COLD_START "):])
+    timings["importtime_ms"], timings["heaviest_imports"] = parse_importtime(result.stderr, module)
+    return timings
+
+
+def run(modules, top):
+    print(f"{'handler':<28}{'import ms':>10}{'first invoke ms':>17}  heaviest imports")
+    for module in modules:
+        timings = measure(module)
+        heaviest = ", ".join(f"{name} {ms:.1f}" for name, ms in timings["heaviest_imports"][:top])
+        print(f"{module:<28}{timings['import_ms']:>10.1f}{timings['first_invoke_ms']:>17.1f}  {heaviest}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("handlers", nargs="*", default=list(SCENARIOS), help="Handler modules to measure")
+    parser.add_argument("--top", type=int, default=3, help="Number of heaviest imports to show")
+    args = parser.parse_args()
+    run(args.handlers, args.top)
@@ -0,0 +1,64 @@
+"""Build time, memory and lookup latency of the co-purchase index on a synthetic order history."""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.copurchase import CoPurchaseIndex  # noqa: E402
+from stylist_common.orders import Order  # noqa: E402
+
+
+def synthetic_arrays(orders, customers, items, seed=0):
+    rng = np.random.default_rng(seed)
+    # Popular items dominate real order histories, so draw items from a Zipf distribution
+    item_codes = (rng.zipf(1.3, orders) - 1) % items
+    customer_codes = rng.integers(0, customers, orders)
+    return customer_codes, item_codes
+
+
+def run(orders, customers, items, increment):
+    customer_codes, item_codes = synthetic_arrays(orders, customers, items)
+    customer_ids = [str(i) for i in range(customers)]
+    labels = [f"Item{i} (Brand{i % 50})" for i in range(items)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = CoPurchaseIndex.from_arrays(customer_codes, item_codes, customer_ids, labels, last_order_id=orders)
+    build = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rng = np.random.default_rng(1)
+    new_orders = [
+        Order(orders + i + 1, str(rng.integers(customers)), f"Item{code}", "M", f"Brand{code % 50}", [])
+        for i, code in enumerate(rng.integers(0, items, increment).tolist())
+    ]
+    start = time.perf_counter()
+    index.add_orders(new_orders)
+    incremental = time.perf_counter() - start
+
+    queries = [labels[i] for i in rng.integers(0, items, 100_000).tolist()]
+    start = time.perf_counter()
+    for query in queries:
+        index.recommend(query)
+    lookup = (time.perf_counter() - start) / len(queries)
+
+    print(f"orders: {orders:,}  customers: {customers:,}  items: {items:,}  pairs: {len(index.pair_keys):,}")
+    print(f"build:        {build:8.2f}s  {orders / build:>12,.0f} orders/s  peak traced memory {peak / 2**20:,.0f} MiB")
+    print(f"incremental:  {incremental:8.3f}s for {increment:,} orders")
+    print(f"lookup:       {lookup * 1e6:8.2f}us per query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=10_000_000)
+    parser.add_argument("--customers", type=int, default=1_000_000)
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--increment", type=int, default=10_000)
+    args = parser.parse_args()
+    run(args.orders, args.customers, args.items, args.increment)
@@ -0,0 +1,69 @@
+"""Throughput of the customer profile aggregation on synthetic order histories."""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.orders import Order  # noqa: E402
+from stylist_common.profiles import LocalFileProfileStore, aggregate  # noqa: E402
+
+NAMES = ["Shirt", "Pant", "Shorts", "Shoes", "Socks", "Tie", "Jackets", "Jeans", "Dress", "Skirt"]
+SIZES = ["XS", "S", "M", "L", "XL"]
+BRANDS = ["H&M", "Zara", "Louis V", "Gucci", "Prada", "Dior", "Celine", "Target", "Walmart", "Tomy"]
+COLORS = ["white", "black", "brown", "blue", "maroon", "green", "navy"]
+STYLES = ["formal", "casual"]
+
+
+def synthetic_orders(count, customers, start_id=1, seed=0):
+    rng = random.Random(seed)
+    return [
+        Order(
+            order_id=order_id,
+            customer_id=str(rng.randrange(customers)),
+            name=rng.choice(NAMES),
+            size=rng.choice(SIZES),
+            brand=rng.choice(BRANDS),
+            tags=[rng.choice(COLORS), rng.choice(STYLES)],
+        )
+        for order_id in range(start_id, start_id + count)
+    ]
+
+
+def run(orders, customers, increment):
+    history = synthetic_orders(orders, customers)
+    new_orders = synthetic_orders(increment, customers, start_id=orders + 1, seed=1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalFileProfileStore(os.path.join(tmp, "profiles.json"))
+
+        start = time.perf_counter()
+        aggregate(history, store)
+        full = time.perf_counter() - start
+
+        # Re-uploading the whole export plus a small batch of new orders
+        start = time.perf_counter()
+        applied = aggregate(history + new_orders, store)
+        incremental = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for customer_id in range(customers):
+            store.get(str(customer_id))
+        lookup = (time.perf_counter() - start) / customers
+
+    print(f"full build:   {orders:>9} orders  {full:8.3f}s  {orders / full:>12,.0f} orders/s")
+    print(f"incremental:  {applied:>9} applied {incremental:8.3f}s  {(orders + increment) / incremental:>12,.0f} orders/s scanned")
+    print(f"lookup:       {lookup * 1e6:8.2f}us per profile")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orders", type=int, default=500_000)
+    parser.add_argument("--customers", type=int, default=50_000)
+    parser.add_argument("--increment", type=int, default=5_000)
+    args = parser.parse_args()
+    run(args.orders, args.customers, args.increment)
@@ -0,0 +1,87 @@
+"""
+Throughput of the near-duplicate similarity join on a synthetic catalog of 1M vectors.
+
+A catalog of --vectors random unit vectors is generated in chunks, and
+--duplicates of the first --rows images get a near copy (cosine similarity
+about 0.99) elsewhere in the catalog. The join of `stylist_common.duplicates`
+is run for the pairs whose first image is among the first --rows, at each
+--block size, and compared with joining one row at a time. The whole join
+(every pair of the catalog) is projected from the measured comparisons per
+second. Requires numpy; the catalog takes --vectors x --dimension x 4 bytes.
+"""
+import argparse
+import time
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.duplicates import DEFAULT_BLOCK, DEFAULT_THRESHOLD, similar_pairs  # noqa: E402
+
+CHUNK = 65536
+
+
+def synthetic_catalog(vectors, dimension, rows, duplicates, seed=7):
+    """Returns unit float32 vectors and the planted (original, copy) pairs."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    matrix = np.empty((vectors, dimension), dtype=np.float32)
+    for start in range(0, vectors, CHUNK):
+        matrix[start:start + CHUNK] = rng.standard_normal((min(CHUNK, vectors - start), dimension), dtype=np.float32)
+    originals = rng.choice(rows, duplicates, replace=False)
+    copies = rng.choice(np.arange(rows, vectors), duplicates, replace=False)
+    matrix[copies] = matrix[originals] + 0.1 * rng.standard_normal((duplicates, dimension), dtype=np.float32)
+    for start in range(0, vectors, CHUNK):
+        chunk = matrix[start:start + CHUNK]
+        chunk /= np.linalg.norm(chunk, axis=1, keepdims=True)
+    return matrix, {(int(a), int(b)) for a, b in zip(originals, copies)}
+
+
+def row_at_a_time(matrix, threshold, rows):
+    import numpy as np
+    for i in range(rows):
+        scores = matrix[i + 1:] @ matrix[i]
+        columns = np.nonzero(scores >= threshold)[0]
+        if len(columns):
+            yield np.full(len(columns), i), columns + i + 1, scores[columns]
+
+
+def measure(label, pairs, comparisons, total, planted, memory):
+    start = time.perf_counter()
+    found = {(int(i), int(j)) for rows, columns, _ in pairs for i, j in zip(rows, columns)}
+    seconds = time.perf_counter() - start
+    rate = comparisons / seconds
+    print(f"{label:<16}{seconds:>9.2f}{rate / 1e6:>14,.0f}{len(found):>8}{len(planted & found) / len(planted):>9.1%}"
+          f"{memory / 2**20:>12.1f}{total / rate / 60:>14.1f}")
+
+
+def run(vectors, dimension, rows, blocks, duplicates, threshold, row_sample):
+    matrix, planted = synthetic_catalog(vectors, dimension, rows, duplicates)
+    total = vectors * (vectors - 1) // 2
+    comparisons = sum(vectors - i - 1 for i in range(rows))
+    print(f"{vectors:,} vectors of {dimension} dimensions ({matrix.nbytes / 2**20:.0f} MB); pairs of the first "
+          f"{rows:,} rows ({comparisons / total:.2%} of the join); threshold {threshold:g}")
+    print(f"{'join':<16}{'seconds':>9}{'M pairs/s':>14}{'found':>8}{'planted':>9}{'scores MB':>12}{'full join min':>14}")
+    for block in blocks:
+        # Scores of one block product, and the boolean mask compared against the threshold
+        memory = min(block, rows) * block * 5
+        measure(f"block {block}", similar_pairs(matrix, threshold, block, stop=rows), comparisons, total, planted,
+                memory)
+    sample = sum(vectors - i - 1 for i in range(row_sample))
+    in_sample = {pair for pair in planted if pair[0] < row_sample}
+    print(f"row at a time, first {row_sample} rows only:")
+    measure("row at a time", row_at_a_time(matrix, threshold, row_sample), sample, total, in_sample or planted,
+            vectors * 5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--dimension", type=int, default=256, help="EMBEDDING_DIMENSION, or a projection's size")
+    parser.add_argument("--rows", type=int, default=4096)
+    parser.add_argument("--block", type=int, nargs="+", default=[1024, 2048, DEFAULT_BLOCK])
+    parser.add_argument("--duplicates", type=int, default=100)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--row-sample", type=int, default=256)
+    args = parser.parse_args()
+    run(args.vectors, args.dimension, args.rows, args.block, args.duplicates, args.threshold, args.row_sample)
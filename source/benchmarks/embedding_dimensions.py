@@ -0,0 +1,98 @@
+"""
+Recall, storage and scoring cost of reduced-dimension image embeddings.
+
+Each PCA size is trained on the catalog and compared with exact search on the
+full vectors: recall@k of the top-k, the DynamoDB item size of a vector stored
+as Decimals, and the pure Python scoring time the search handler spends per
+thousand items.
+
+The synthetic catalog has the low-rank cluster structure of real image
+embeddings, so PCA results on it are only indicative. For a real decision,
+export the catalog's vectors (and text query vectors) to .npy files and pass
+them with --vectors/--query-vectors; to compare Titan's native 256/384 outputs,
+export the catalog at each length and run once per file.
+"""
+import argparse
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from benchmarks import use_lambda_code
+
+use_lambda_code("ImageQueryHandlingFunction")
+
+from stylist_common.embeddings import Projection  # noqa: E402
+
+
+def synthetic_catalog(items, dimension=1024, rank=64, clusters=200, seed=0):
+    """Unit vectors around `clusters` centres in a `rank`-dimensional subspace, plus isotropic noise."""
+    rng = np.random.default_rng(seed)
+    basis = rng.normal(size=(rank, dimension))
+    centres = rng.normal(size=(clusters, rank)) * 2
+    latent = centres[rng.integers(0, clusters, items)] + rng.normal(size=(items, rank))
+    vectors = latent @ basis + rng.normal(size=(items, dimension)) * 2
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def noisy_queries(catalog, count, noise=0.8, seed=1):
+    """Queries near catalog items, standing in for text queries that describe a product."""
+    rng = np.random.default_rng(seed)
+    queries = catalog[rng.integers(0, len(catalog), count)]
+    queries = queries + rng.normal(size=queries.shape) * noise / np.sqrt(catalog.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def top_k(catalog, queries, k):
+    scores = queries @ catalog.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall(expected, found):
+    return float(np.mean([len(set(e) & set(f)) / len(e) for e, f in zip(expected, found)]))
+
+
+def item_bytes(vector):
+    # DynamoDB stores numbers as variable-length decimals; the handler writes Decimal(str(float))
+    return sum(len(str(Decimal(str(float(x))))) for x in vector)
+
+
+def python_scoring_ms(query, vectors):
+    from imagequery_function import cosine_similarity
+    rows = [list(map(float, row)) for row in vectors]
+    start = time.perf_counter()
+    for row in rows:
+        cosine_similarity(query, row)
+    return (time.perf_counter() - start) * 1000 * 1000 / len(rows)
+
+
+def run(catalog, queries, sizes, k):
+    exact = top_k(catalog, queries, k)
+    sample = catalog[:200]
+    print(f"catalog {catalog.shape[0]} x {catalog.shape[1]}, {len(queries)} queries")
+    print(f"{'vector':<16}{f'recall@{k}':>10}{'item bytes':>12}{'score ms/1k':>13}")
+    full_query = list(map(float, queries[0]))
+    print(f"{f'full {catalog.shape[1]}':<16}{1.0:>10.3f}{item_bytes(catalog[0]):>12}"
+          f"{python_scoring_ms(full_query, sample):>13.1f}")
+    for size in sizes:
+        projection = Projection.fit(catalog, size, f"pca{size}")
+        projected = np.asarray([projection.apply(v) for v in catalog], dtype=np.float32)
+        projected_queries = np.asarray([projection.apply(q) for q in queries], dtype=np.float32)
+        found = top_k(projected, projected_queries, k)
+        print(f"{f'pca {size}':<16}{recall(exact, found):>10.3f}{item_bytes(projected[0]):>12}"
+              f"{python_scoring_ms(list(map(float, projected_queries[0])), projected[:200]):>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--queries", dest="query_count", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256, 384])
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--vectors", help=".npy file of catalog vectors, one per row")
+    parser.add_argument("--query-vectors", help=".npy file of query vectors in the same space as --vectors")
+    args = parser.parse_args()
+    catalog = np.load(args.vectors).astype(np.float32) if args.vectors else synthetic_catalog(args.items)
+    queries = (np.load(args.query_vectors).astype(np.float32) if args.query_vectors
+               else noisy_queries(catalog, args.query_count))
+    run(catalog, queries, args.sizes, args.k)
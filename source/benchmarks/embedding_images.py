@@ -0,0 +1,102 @@
+"""
+Bytes sent to the embeddings model and CPU time per catalog image, with and without preprocessing.
+
+Synthetic studio photos (a large JPEG with EXIF, a large PNG with transparency,
+and an already small JPEG) are embedded as stored, as the embeddings function
+used to, and after `prepare_for_embedding`.
+
+Embeddings of the two are compared by a stand-in: the cosine similarity of
+32x32 thumbnails of the upright images, which shows the content survives.
+With --live the images are embedded by the real model through Bedrock (needs
+AWS credentials) and the cosine similarity of those embeddings is reported
+instead. Requires Pillow.
+"""
+import argparse
+import base64
+import io
+import json
+import time
+
+from benchmarks import use_lambda_code
+from benchmarks.image_formats import synthetic_artifact
+
+use_lambda_code()
+
+from stylist_common.images import DEFAULT_EMBEDDING_SIZE, prepare_for_embedding  # noqa: E402
+
+MODEL_ID = "amazon.titan-embed-image-v1"
+
+
+def studio_photos():
+    """Yields (label, bytes) of photo-like catalog images."""
+    from PIL import Image
+    with Image.open(io.BytesIO(base64.b64decode(synthetic_artifact(1024)))) as base:
+        photo = base.convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # taken rotated, as cameras record it
+    out = io.BytesIO()
+    photo.resize((4000, 3000), Image.Resampling.BICUBIC).save(out, format="JPEG", quality=95, exif=exif)
+    yield "4000x3000 JPEG q95 EXIF", out.getvalue()
+    cutout = photo.resize((2048, 2048), Image.Resampling.BICUBIC).convert("RGBA")
+    cutout.putalpha(Image.radial_gradient("L").resize((2048, 2048)).point(lambda v: 255 if v < 200 else 0))
+    out = io.BytesIO()
+    cutout.save(out, format="PNG")
+    yield "2048x2048 PNG alpha", out.getvalue()
+    out = io.BytesIO()
+    photo.resize((480, 480)).save(out, format="JPEG", quality=85)
+    yield "480x480 JPEG q85", out.getvalue()
+
+
+def thumbnail_vector(data):
+    """Stand-in embedding: the mean-centred pixels of a 32x32 thumbnail of the upright image as displayed."""
+    import numpy as np
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert("RGBA")
+        shown = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        shown.alpha_composite(image)
+        image = shown.convert("RGB").resize((32, 32), Image.Resampling.BOX)
+    vector = np.asarray(image, dtype=np.float32).ravel()
+    return vector - vector.mean()
+
+
+def model_vector(data):
+    import numpy as np
+    from stylist_common.bedrock import invoke_model
+    response = invoke_model(body=json.dumps({"inputImage": base64.b64encode(data).decode("utf-8")}), modelId=MODEL_ID,
+                            accept="application/json", contentType="application/json")
+    return np.asarray(json.loads(response["body"].read())["embedding"], dtype=np.float32)
+
+
+def cosine(a, b):
+    import numpy as np
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def cpu_ms(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = fn()
+    return (time.process_time() - start) * 1000 / repeat, result
+
+
+def run(max_size, repeat, live):
+    embed = model_vector if live else thumbnail_vector
+    print(f"longest edge {max_size}px; similarity from {'the model' if live else '32x32 thumbnails'}")
+    print(f"{'image':<26}{'stored bytes':>14}{'sent bytes':>12}{'prepared':>10}{'prepare ms':>12}"
+          f"{'base64 ms':>11}{'before':>8}{'similarity':>12}")
+    for label, data in studio_photos():
+        prepare_ms, prepared = cpu_ms(lambda: prepare_for_embedding(data, max_size), repeat)
+        before_ms, encoded = cpu_ms(lambda: base64.b64encode(data), repeat)
+        after_ms, sent = cpu_ms(lambda: base64.b64encode(prepared), repeat)
+        print(f"{label:<26}{len(data):>14,}{len(sent):>12,}{len(sent) / len(encoded):>10.1%}"
+              f"{prepare_ms:>12.1f}{after_ms:>11.2f}{before_ms:>8.2f}{cosine(embed(data), embed(prepared)):>12.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-size", type=int, default=DEFAULT_EMBEDDING_SIZE, help="EMBEDDING_IMAGE_SIZE")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--live", action="store_true", help="Compare embeddings from the real model")
+    args = parser.parse_args()
+    run(args.max_size, args.repeat, args.live)
@@ -0,0 +1,385 @@
+"""
+Deterministic in-process fakes for the AWS services used by the handlers.
+
+The fakes implement only the calls the handlers make and are installed through
+`stylist_common.runtime`, so handler code runs unchanged.
+"""
+import base64
+import hashlib
+import json
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+
+EMBEDDING_DIMENSION = 1024
+
+
+def _client_error(code, operation):
+    from botocore.exceptions import ClientError
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+def deterministic_embedding(content, dimension=EMBEDDING_DIMENSION):
+    """Returns a unit-length vector derived from a hash of the content."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    rng = random.Random(hashlib.sha256(content).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimension)]
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector]
+
+
+def tiny_png(width=8, height=8, seed=0):
+    """Builds a valid RGB PNG without an imaging library."""
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + bytes(rng.randrange(256) for _ in range(width * 3)) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+class FakeStreamingBody:
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+        self.closed = False
+
+    def read(self, amt=None):
+        end = len(self._data) if amt is None else min(len(self._data), self._position + amt)
+        chunk = self._data[self._position:end]
+        self._position = end
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeService:
+    """
+    Base for the fakes, with optional latency and throttling.
+
+    :param latency: Seconds each call takes; `latencies` overrides it per operation.
+    :param throttle_probability: Chance that a call fails with ThrottlingException.
+    :param capacity: Calls allowed in flight at once; calls beyond it are throttled.
+    :param slow_probability: Chance that a call takes `slow_latency` seconds instead, a tail of slow responses.
+    """
+
+    def __init__(self, latency=0.0, throttle_probability=0.0, capacity=None, seed=0, slow_probability=0.0,
+                 slow_latency=0.0):
+        self.latency = latency
+        self.latencies = {}
+        self.slow_probability = slow_probability
+        self.slow_latency = slow_latency
+        self.throttle_probability = throttle_probability
+        self.capacity = capacity
+        self.calls = []
+        self.throttles = 0
+        self.in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, operation, **kwargs):
+        with self._lock:
+            self.calls.append((operation, kwargs))
+            throttled = ((self.capacity is not None and self.in_flight >= self.capacity)
+                         or (self.throttle_probability and self._rng.random() < self.throttle_probability))
+            if throttled:
+                self.throttles += 1
+            else:
+                self.in_flight += 1
+            slow = self.slow_probability and self._rng.random() < self.slow_probability
+        if throttled:
+            raise _client_error("ThrottlingException", operation)
+        try:
+            latency = self.slow_latency if slow else self.latencies.get(operation, self.latency)
+            if latency:
+                time.sleep(latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class FakeBedrockRuntime(FakeService):
+    """Fake `bedrock-runtime` returning embeddings, images or text depending on the model id."""
+
+    def __init__(self, latency=0.0, embedding_dimension=EMBEDDING_DIMENSION, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.embedding_dimension = embedding_dimension
+        # Text answers per model id, as (text, stop_reason)
+        self.texts = {}
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None, **kwargs):
+        self._call("InvokeModel", modelId=modelId)
+        request = json.loads(body)
+        if "embed" in modelId:
+            content = request.get("inputText") or request.get("inputImage") or ""
+            dimension = request.get("embeddingConfig", {}).get("outputEmbeddingLength", self.embedding_dimension)
+            payload = {"embedding": deterministic_embedding(content, dimension), "inputTextTokenCount": 8}
+        elif "stability" in modelId:
+            payload = {"artifacts": [{"base64": base64.b64encode(tiny_png(64, 64)).decode("utf-8"), "finishReason": "SUCCESS"}]}
+        else:
+            text, stop_reason = self.texts.get(modelId, ("Try a navy blazer with light chinos and white sneakers.", "end_turn"))
+            payload = {"content": [{"type": "text", "text": text}], "stop_reason": stop_reason,
+                       "usage": {"input_tokens": 120, "output_tokens": 24}}
+        return {"body": FakeStreamingBody(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+
+class FakeAgentRuntime(FakeService):
+    """Fake `bedrock-agent-runtime` with canned agent completions and knowledge base results."""
+
+    def __init__(self, latency=0.0, chunks=("Here are some outfit ideas ", "for your trip."), **kwargs):
+        super().__init__(latency, **kwargs)
+        self.chunks = chunks
+
+    def invoke_agent(self, **kwargs):
+        self._call("InvokeAgent", **kwargs)
+        return {"completion": iter([{"chunk": {"bytes": chunk.encode("utf-8")}} for chunk in self.chunks]),
+                "sessionId": kwargs.get("sessionId")}
+
+    def retrieve_and_generate(self, **kwargs):
+        self._call("RetrieveAndGenerate", **kwargs)
+        return {"output": {"text": "".join(self.chunks)}}
+
+    def retrieve(self, **kwargs):
+        self._call("Retrieve", **kwargs)
+        results = [{"content": {"text": f"Catalog entry {i}: a light linen shirt for summer."}, "score": 1.0 - i / 10}
+                   for i in range(kwargs.get("retrievalConfiguration", {}).get("vectorSearchConfiguration", {}).get("numberOfResults", 5))]
+        return {"retrievalResults": results}
+
+
+class FakeBedrockAgent(FakeService):
+    def start_ingestion_job(self, **kwargs):
+        self._call("StartIngestionJob", **kwargs)
+        return {"ingestionJob": {"ingestionJobId": "job-1", "status": "STARTING"}}
+
+
+class FakeS3(FakeService):
+    """In-memory S3 keyed by (bucket, key)."""
+
+    def __init__(self, latency=0.0, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call("PutObject", Bucket=Bucket, Key=Key)
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        self.objects[(Bucket, Key)] = data
+        return {"ETag": '"%s"' % hashlib.md5(data).hexdigest()}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("GetObject", Bucket=Bucket, Key=Key, **kwargs)
+        if (Bucket, Key) not in self.objects:
+            raise _client_error("NoSuchKey", "GetObject")
+        data = self.objects[(Bucket, Key)]
+        etag = hashlib.md5(data).hexdigest()
+        if kwargs.get("IfNoneMatch", "").strip('"') == etag:
+            raise _client_error("304", "GetObject")
+        return {"Body": FakeStreamingBody(data), "ContentLength": len(data), "ETag": '"%s"' % etag}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self._call("CopyObject", Bucket=Bucket, Key=Key, CopySource=CopySource)
+        source = (CopySource["Bucket"], CopySource["Key"])
+        if source not in self.objects:
+            raise _client_error("NoSuchKey", "CopyObject")
+        self.objects[(Bucket, Key)] = self.objects[source]
+        return {"CopyObjectResult": {"ETag": '"%s"' % hashlib.md5(self.objects[source]).hexdigest()}}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call("DeleteObject", Bucket=Bucket, Key=Key)
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("HeadObject", Bucket=Bucket, Key=Key)
+        if (Bucket, Key) not in self.objects:
+            raise _client_error("404", "HeadObject")
+        data = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(data), "ETag": '"%s"' % hashlib.md5(data).hexdigest()}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        self._call("ListObjectsV2", Bucket=Bucket, Prefix=Prefix)
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {"Contents": [{"Key": key, "Size": len(self.objects[(Bucket, key)])} for key in keys], "KeyCount": len(keys)}
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+
+class FakeTable(FakeService):
+    """In-memory DynamoDB table with a single string partition key."""
+
+    def __init__(self, name, key="id", latency=0.0):
+        super().__init__(latency)
+        self.name = name
+        self.key = key
+        self.items = {}
+        # As the boto3 Table resource describes it; set to None for a table without a stream
+        self.stream_specification = {"StreamEnabled": True, "StreamViewType": "NEW_IMAGE"}
+
+    def put_item(self, Item, **kwargs):
+        self._call("PutItem")
+        self.items[Item[self.key]] = dict(Item)
+        return {}
+
+    @staticmethod
+    def _project(item, expression, names):
+        if not expression:
+            return dict(item)
+        attributes = [(names or {}).get(name.strip(), name.strip()) for name in expression.split(",")]
+        return {name: item[name] for name in attributes if name in item}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call("GetItem")
+        item = self.items.get(Key[self.key])
+        if item is None:
+            return {}
+        return {"Item": self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        # Supports the plain "SET a = :x, b = :y" and "REMOVE a, b" forms
+        self._call("UpdateItem")
+        item = self.items.setdefault(Key[self.key], dict(Key))
+        action, clauses = UpdateExpression.split(None, 1)
+        if action.upper() == "REMOVE":
+            for name in clauses.split(","):
+                item.pop((ExpressionAttributeNames or {}).get(name.strip(), name.strip()), None)
+            return {}
+        for assignment in clauses.split(","):
+            name, value = (part.strip() for part in assignment.split("="))
+            item[(ExpressionAttributeNames or {}).get(name, name)] = ExpressionAttributeValues[value]
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self._call("DeleteItem")
+        self.items.pop(Key[self.key], None)
+        return {}
+
+    def scan(self, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call("Scan")
+        items = [self._project(item, ProjectionExpression, ExpressionAttributeNames) for item in self.items.values()]
+        return {"Items": items, "Count": len(items)}
+
+    def query(self, KeyConditionExpression, IndexName=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+              **kwargs):
+        # Supports a single equality condition, on the table's key or a secondary index's
+        self._call("Query", IndexName=IndexName)
+        expression = KeyConditionExpression.get_expression()
+        key, value = expression["values"]
+        items = [self._project(item, ProjectionExpression, ExpressionAttributeNames)
+                 for item in self.items.values() if key.name in item and item[key.name] == value]
+        return {"Items": items, "Count": len(items)}
+
+    def batch_writer(self, **kwargs):
+        return _BatchWriter(self)
+
+
+class FakeDynamoDB:
+    """Stands in for the boto3 DynamoDB resource."""
+
+    def __init__(self, latency=0.0, keys=None):
+        self.latency = latency
+        self.keys = keys or {}
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, key=self.keys.get(name, "id"), latency=self.latency)
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            table._call("BatchGetItem")
+            found = (table.items.get(key[table.key]) for key in request["Keys"])
+            responses[name] = [table._project(item, request.get("ProjectionExpression"), request.get("ExpressionAttributeNames"))
+                               for item in found if item is not None]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+class FakeLambda(FakeService):
+    """Invokes registered handlers in-process, keyed by function name."""
+
+    def __init__(self, latency=0.0, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.functions = {}
+
+    def invoke(self, FunctionName, Payload, **kwargs):
+        self._call("Invoke", FunctionName=FunctionName)
+        try:
+            result = self.functions[FunctionName](json.loads(Payload), None)
+        except Exception as e:
+            return {"StatusCode": 200, "FunctionError": "Unhandled",
+                    "Payload": FakeStreamingBody(json.dumps({"errorMessage": str(e)}).encode("utf-8"))}
+        return {"StatusCode": 200, "Payload": FakeStreamingBody(json.dumps(result).encode("utf-8"))}
+
+
+class FakeHttpResponse:
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+
+class FakeHttp(FakeService):
+    """Stands in for the urllib3 pool used by the weather client."""
+
+    def request(self, method, url, **kwargs):
+        self._call("HttpRequest", method=method, url=url)
+        payload = {"name": "Seattle", "main": {"temp": 14.2}, "weather": [{"description": "light rain"}]}
+        return FakeHttpResponse(200, json.dumps(payload).encode("utf-8"))
+
+
+class FakeAws:
+    """Bundle of fakes installed into the shared runtime."""
+
+    def __init__(self, latency=0.0, table_keys=None):
+        self.bedrock_runtime = FakeBedrockRuntime(latency)
+        self.agent_runtime = FakeAgentRuntime(latency)
+        self.bedrock_agent = FakeBedrockAgent(latency)
+        self.s3 = FakeS3(latency)
+        self.dynamodb = FakeDynamoDB(latency, keys=table_keys)
+        self.http = FakeHttp(latency)
+        self.lambda_ = FakeLambda(latency)
+
+    def install(self):
+        from stylist_common import image_cache, runtime, weather
+        runtime.reset()
+        image_cache.reset()
+        runtime.set_client("bedrock-runtime", self.bedrock_runtime)
+        runtime.set_client("bedrock-agent-runtime", self.agent_runtime)
+        runtime.set_client("bedrock-agent", self.bedrock_agent)
+        runtime.set_client("s3", self.s3)
+        runtime.set_client("lambda", self.lambda_)
+        runtime.set_resource("dynamodb", self.dynamodb)
+        weather._http = self.http
+        weather._cache.clear()
+        return self
+
+    def services(self):
+        return [self.bedrock_runtime, self.agent_runtime, self.bedrock_agent, self.s3, self.http, self.lambda_,
+                *self.dynamodb.tables.values()]
+
+    def operations(self):
+        """Names of every call made to the fakes so far, e.g. ["GetObject", "InvokeModel"]."""
+        return [name for service in self.services() for name, _ in service.calls]
+
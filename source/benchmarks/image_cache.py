@@ -0,0 +1,101 @@
+"""
+Image fetch latency and S3 reads per search as the hot-image cache tiers are added.
+
+Search results follow popularity: each request returns --k distinct images
+drawn from a catalog of --catalog items with Zipf weights (exponent --skew),
+so a few items appear in most results. One warm container serves --requests
+requests in turn, reading its results as the search function did before
+(serially, no cache), concurrently without a cache, with the memory tier only,
+and with memory and /tmp disk tiers.
+
+S3 is a fake whose GetObject takes --first-byte-ms plus the transfer of an
+--image-kb object at --mb-per-second. Disk reads are real, in a temporary
+directory.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import IMAGE_BUCKET
+
+use_lambda_code()
+
+from stylist_common.image_cache import MB, ImageCache  # noqa: E402
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def zipf_requests(catalog, requests, k, skew, seed=7):
+    """Yields each request's `k` distinct image keys, popular items first in the catalog."""
+    rng = random.Random(seed)
+    keys = [f"catalog/item-{rank:05d}.jpg" for rank in range(catalog)]
+    weights = [1 / (rank + 1) ** skew for rank in range(catalog)]
+    for _ in range(requests):
+        chosen = set()
+        while len(chosen) < k:
+            chosen.update(rng.choices(keys, weights, k=k - len(chosen)))
+        yield sorted(chosen)
+
+
+def run(catalog, requests, k, skew, image_kb, first_byte_ms, mb_per_second, memory_mb, disk_mb):
+    fakes = FakeAws().install()
+    data = bytes(image_kb * 1024)
+    for rank in range(catalog):
+        fakes.s3.objects[(IMAGE_BUCKET, f"catalog/item-{rank:05d}.jpg")] = data
+    fakes.s3.latency = first_byte_ms / 1000 + image_kb / 1024 / mb_per_second
+    workload = list(zipf_requests(catalog, requests, k, skew))
+
+    print(f"{requests} requests of {k} from {catalog:,} images of {image_kb} KB, Zipf exponent {skew:g}; "
+          f"GetObject {fakes.s3.latency * 1000:.1f}ms; memory {memory_mb:g} MB, disk {disk_mb:g} MB")
+    print(f"{'configuration':<22}{'hit rate':>10}{'memory':>9}{'disk':>8}{'GETs/req':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        configurations = [
+            ("serial, no cache", False, dict(memory_bytes=0)),
+            ("concurrent, no cache", True, dict(memory_bytes=0)),
+            ("memory", True, dict(memory_bytes=int(memory_mb * MB))),
+            ("memory + disk", True, dict(memory_bytes=int(memory_mb * MB), disk_dir=directory,
+                                         disk_bytes=int(disk_mb * MB))),
+        ]
+        for label, concurrent, settings in configurations:
+            cache = ImageCache(**settings)
+            fakes.s3.calls.clear()
+            latencies = []
+            with ThreadPoolExecutor(max_workers=k) as executor:
+                for keys in workload:
+                    start = time.perf_counter()
+                    if concurrent:
+                        list(executor.map(lambda key: cache.get(IMAGE_BUCKET, key), keys))
+                    else:
+                        for key in keys:
+                            cache.get(IMAGE_BUCKET, key)
+                    latencies.append((time.perf_counter() - start) * 1000)
+            stats = cache.stats()
+            reads = requests * k
+            print(f"{label:<22}{(stats['memory_hits'] + stats['disk_hits']) / reads:>10.1%}"
+                  f"{stats['memory_hits'] / reads:>9.1%}{stats['disk_hits'] / reads:>8.1%}"
+                  f"{len(fakes.s3.calls) / requests:>10.2f}{statistics.median(latencies):>9.1f}"
+                  f"{percentile(latencies, 0.95):>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--image-kb", type=int, default=512)
+    parser.add_argument("--first-byte-ms", type=float, default=15)
+    parser.add_argument("--mb-per-second", type=float, default=90)
+    parser.add_argument("--memory-mb", type=float, default=16, help="IMAGE_CACHE_MEMORY_MB")
+    parser.add_argument("--disk-mb", type=float, default=256, help="IMAGE_CACHE_DISK_MB")
+    args = parser.parse_args()
+    run(args.catalog, args.requests, args.k, args.skew, args.image_kb, args.first_byte_ms, args.mb_per_second,
+        args.memory_mb, args.disk_mb)
@@ -0,0 +1,90 @@
+"""
+CPU time and payload size of each /image output format.
+
+A synthetic 1024x1024 photo-like PNG stands in for the model artifact. The
+previous path decoded and re-encoded the base64 in the handler, then decoded
+it in the Streamlit client and re-encoded it as PNG with Pillow; it is
+compared with passing the PNG through and with transcoding once to WebP or
+JPEG. Requires Pillow.
+"""
+import argparse
+import base64
+import io
+import time
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.images import transcode  # noqa: E402
+
+
+def synthetic_artifact(size=1024, seed=7):
+    """Returns base64 PNG with smooth gradients, shapes and sensor-like noise, roughly like a generated photo."""
+    from PIL import Image, ImageDraw, ImageFilter
+    red = Image.linear_gradient("L").resize((size, size))
+    green = Image.radial_gradient("L").resize((size, size))
+    blue = red.rotate(90)
+    image = Image.merge("RGB", (red, green, blue))
+    draw = ImageDraw.Draw(image)
+    for i in range(12):
+        offset = (i * 83 + seed * 31) % (size // 2)
+        draw.ellipse((offset, offset // 2, offset + size // 3, offset // 2 + size // 2),
+                     fill=((i * 40) % 256, (i * 90) % 256, (i * 20) % 256))
+    image = image.filter(ImageFilter.GaussianBlur(6))
+    noise = Image.effect_noise((size, size), 12).convert("RGB")
+    image = Image.blend(image, noise, 0.08)
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return base64.b64encode(out.getvalue()).decode("utf-8")
+
+
+def cpu_ms(fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = fn()
+    return (time.process_time() - start) * 1000 / repeat, result
+
+
+def previous_server(artifact):
+    return base64.b64encode(base64.b64decode(artifact.encode())).decode("utf-8")
+
+
+def previous_client(body):
+    from PIL import Image
+    with Image.open(io.BytesIO(base64.b64decode(body))) as image:
+        out = io.BytesIO()
+        image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def variants():
+    yield "previous round trip", previous_server, previous_client
+    yield "png passthrough", lambda artifact: artifact, base64.b64decode
+    for fmt, quality, max_size in (("png", None, 800), ("webp", 85, None), ("webp", 85, 800),
+                                   ("jpeg", 85, None), ("jpeg", 85, 800)):
+        label = f"{fmt} q{quality or '-'} {max_size or 'full'}"
+
+        def server(artifact, fmt=fmt, quality=quality, max_size=max_size):
+            data = transcode(base64.b64decode(artifact), fmt, quality or 80, max_size)
+            return base64.b64encode(data).decode("utf-8")
+
+        yield label, server, base64.b64decode
+
+
+def run(size, repeat):
+    artifact = synthetic_artifact(size)
+    print(f"model artifact: {size}x{size} PNG, {len(artifact)} base64 chars")
+    print(f"{'variant':<22}{'server cpu ms':>14}{'client cpu ms':>14}{'payload bytes':>15}{'vs png':>8}")
+    for label, server, client in variants():
+        server_ms, body = cpu_ms(lambda: server(artifact), repeat)
+        client_ms, _ = cpu_ms(lambda: client(body), repeat)
+        print(f"{label:<22}{server_ms:>14.1f}{client_ms:>14.1f}{len(body):>15}{len(body) / len(artifact):>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024, help="Edge of the square model image in pixels")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.size, args.repeat)
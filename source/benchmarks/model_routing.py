@@ -0,0 +1,106 @@
+"""
+Offline replay of requests through the model router at several thresholds.
+
+Each request is scored with the router's `complexity()` and sent to the fast
+or the strong model as the router would. For every threshold it reports the
+share answered by the fast model, the requests labelled as needing the strong
+model that the fast one answers ("under-served"), and the expected latency and
+cost per request. --escalation-rate is the share of under-served requests whose
+fast answer is escalated and so pays for both models.
+
+Latency and tokens per model default to rough assumptions for Claude 3 Haiku
+and Sonnet. Pass --metrics with the router's metric records, exported from
+CloudWatch Logs as JSON lines, to use measured values instead.
+"""
+import argparse
+import json
+import os
+from collections import defaultdict
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.routing import FAST, STRONG, complexity  # noqa: E402
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(__file__), "data", "routing_queries.jsonl")
+# Latency (ms), input and output tokens, and USD per million input and output tokens
+DEFAULT_PROFILES = {
+    FAST: {"ModelLatency": 1200.0, "InputTokens": 600.0, "OutputTokens": 250.0, "prices": (0.25, 1.25)},
+    STRONG: {"ModelLatency": 4500.0, "InputTokens": 600.0, "OutputTokens": 300.0, "prices": (3.0, 15.0)},
+}
+
+
+def measured_profiles(path):
+    """Mean latency and tokens per tier from exported metric records."""
+    sums = defaultdict(lambda: defaultdict(float))
+    counts = defaultdict(lambda: defaultdict(int))
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line) if line.strip() else {}
+            tier = record.get("Tier")
+            if tier not in DEFAULT_PROFILES:
+                continue
+            for name in ("ModelLatency", "InputTokens", "OutputTokens"):
+                if name in record:
+                    sums[tier][name] += record[name]
+                    counts[tier][name] += 1
+    profiles = {}
+    for tier, default in DEFAULT_PROFILES.items():
+        profiles[tier] = dict(default)
+        for name, total in sums[tier].items():
+            profiles[tier][name] = total / counts[tier][name]
+        print(f"{tier}: {counts[tier]['ModelLatency']} calls measured, {profiles[tier]['ModelLatency']:.0f}ms, "
+              f"{profiles[tier]['InputTokens']:.0f} in / {profiles[tier]['OutputTokens']:.0f} out tokens")
+    return profiles
+
+
+def cost(profile):
+    input_price, output_price = profile["prices"]
+    return (profile["InputTokens"] * input_price + profile["OutputTokens"] * output_price) / 1e6
+
+
+def replay(requests, profiles, thresholds, escalation_rate):
+    fast, strong = profiles[FAST], profiles[STRONG]
+    print(f"{'threshold':>10}{'fast':>8}{'under-served':>14}{'escalated':>11}{'over-served':>13}"
+          f"{'latency ms':>12}{'$ / 1000':>10}")
+    for threshold in [None] + thresholds:
+        latency = dollars = routed_fast = under = over = 0.0
+        for score, tier in requests:
+            if threshold is not None and score < threshold:
+                routed_fast += 1
+                latency += fast["ModelLatency"]
+                dollars += cost(fast)
+                if tier == STRONG:
+                    under += 1
+                    latency += escalation_rate * strong["ModelLatency"]
+                    dollars += escalation_rate * cost(strong)
+            else:
+                latency += strong["ModelLatency"]
+                dollars += cost(strong)
+                over += tier == FAST
+        n = len(requests)
+        label = "strong" if threshold is None else f"{threshold:.2f}"
+        print(f"{label:>10}{routed_fast / n:>8.0%}{under:>14.0f}{under * escalation_rate:>11.1f}{over:>13.0f}"
+              f"{latency / n:>12.0f}{dollars / n * 1000:>10.2f}")
+
+
+def run(path, metrics, thresholds, escalation_rate):
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    requests = [(complexity(row["query"]), row.get("tier")) for row in rows]
+    profiles = measured_profiles(metrics) if metrics else DEFAULT_PROFILES
+    labelled = sum(1 for _, tier in requests if tier)
+    print(f"{len(requests)} requests, {labelled} labelled; first row sends everything to the strong model")
+    replay(requests, profiles, thresholds, escalation_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", default=DEFAULT_QUERIES,
+                        help="JSON lines with `query` and optionally `tier` (fast or strong), the model it needs")
+    parser.add_argument("--metrics", help="Exported router metric records (JSON lines) to measure each model")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.2, 0.25, 0.3, 0.35, 0.4, 0.5, 0.6])
+    parser.add_argument("--escalation-rate", type=float, default=0.5)
+    args = parser.parse_args()
+    run(args.queries, args.metrics, args.thresholds, args.escalation_rate)
@@ -0,0 +1,109 @@
+"""
+Added scoring latency and relevance of fusing catalog text vectors with image vectors.
+
+A synthetic catalog of --images images belongs to --topics topics (looks). Each
+image vector is its topic plus noise (--image-noise), as photos of different
+items of one look differ. --text-fraction of the images also carry one or
+two text vectors: their look's description plus less noise (--text-noise).
+Queries are a topic plus noise (--query-noise), and an image is relevant when it belongs to
+the query's topic.
+
+For image-only scoring (`VectorIndex`) and each fusion of `MultiVectorIndex`,
+the benchmark reports precision@3 and nDCG@10 over --queries queries, and the
+median time to score one query against the whole catalog.
+"""
+import argparse
+import math
+import statistics
+import time
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.embeddings import Space  # noqa: E402
+from stylist_common.multivector import DEFAULT_RRF_K, DEFAULT_TEXT_WEIGHT, MultiVectorIndex  # noqa: E402
+from stylist_common.vector_index import VectorIndex  # noqa: E402
+
+
+def unit(matrix):
+    import numpy as np
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+
+def synthetic_catalog(images, topics, dimension, image_noise, text_noise, text_fraction, seed=7):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centres = unit(rng.standard_normal((topics, dimension), dtype=np.float32))
+    topic_of = rng.integers(0, topics, images)
+    noise = image_noise / math.sqrt(dimension)
+    vectors = unit(centres[topic_of] + noise * rng.standard_normal((images, dimension), dtype=np.float32))
+    items = []
+    for i in range(images):
+        item = {"image_key": f"catalog/{i:07d}.jpg", "vector": vectors[i]}
+        if rng.random() < text_fraction:
+            count = int(rng.integers(1, 3))
+            item["text_vectors"] = list(unit(centres[topic_of[i]] + text_noise / math.sqrt(dimension)
+                                        * rng.standard_normal((count, dimension), dtype=np.float32)))
+        items.append(item)
+    return items, topic_of, centres
+
+
+def ndcg(relevant, k):
+    gains = sum(1 / math.log2(rank + 2) for rank, hit in enumerate(relevant[:k]) if hit)
+    return gains / sum(1 / math.log2(rank + 2) for rank in range(k))
+
+
+def timed(fn, queries):
+    times, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(fn(query))
+        times.append((time.perf_counter() - start) * 1000)
+    return results, statistics.median(times)
+
+
+def run(images, topics, dimension, queries, image_noise, text_noise, query_noise, text_fraction, text_weight, rrf_k):
+    import numpy as np
+    items, topic_of, centres = synthetic_catalog(images, topics, dimension, image_noise, text_noise, text_fraction)
+    rng = np.random.default_rng(11)
+    query_topics = rng.integers(0, topics, queries)
+    query_vectors = unit(centres[query_topics] + query_noise / math.sqrt(dimension)
+                         * rng.standard_normal((queries, dimension), dtype=np.float32))
+    space = Space(dimension, "none")
+    plain = VectorIndex.build(space, items)
+    fused = MultiVectorIndex.build(space, items)
+    row = {key: i for i, key in enumerate(plain.image_keys)}
+
+    print(f"{images:,} images of {topics} looks, {dimension} dimensions, {text_fraction:.0%} with text "
+          f"({len(fused.matrix) - images:,} text vectors); noise of images {image_noise:g}, text {text_noise:g}, "
+          f"queries {query_noise:g}")
+    print(f"{'scoring':<22}{'P@3':>8}{'nDCG@10':>9}{'p50 ms':>9}")
+    runs = [
+        ("image only", lambda q: plain.search_many([q], 10)[0]),
+        ("multi-vector, none", lambda q: fused.search(q, 10, "none")),
+        (f"weighted {text_weight:g}", lambda q: fused.search(q, 10, "weighted", text_weight=text_weight)),
+        (f"rrf k={rrf_k}", lambda q: fused.search(q, 10, "rrf", rrf_k=rrf_k)),
+    ]
+    for label, search in runs:
+        results, p50 = timed(search, query_vectors)
+        hits = [[topic_of[row[key]] == topic for key, _ in found] for found, topic in zip(results, query_topics)]
+        print(f"{label:<22}{statistics.mean(sum(h[:3]) / 3 for h in hits):>8.3f}"
+              f"{statistics.mean(ndcg(h, 10) for h in hits):>9.3f}{p50:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20000)
+    parser.add_argument("--topics", type=int, default=2000)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--image-noise", type=float, default=2.5)
+    parser.add_argument("--text-noise", type=float, default=1.0)
+    parser.add_argument("--query-noise", type=float, default=1.0)
+    parser.add_argument("--text-fraction", type=float, default=0.7)
+    parser.add_argument("--text-weight", type=float, default=DEFAULT_TEXT_WEIGHT, help="TEXT_WEIGHT")
+    parser.add_argument("--rrf-k", type=int, default=DEFAULT_RRF_K, help="RRF_K")
+    args = parser.parse_args()
+    run(args.images, args.topics, args.dimension, args.queries, args.image_noise, args.text_noise, args.query_noise,
+        args.text_fraction, args.text_weight, args.rrf_k)
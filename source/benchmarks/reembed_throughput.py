@@ -0,0 +1,67 @@
+"""
+Throughput of re-embedding the catalog into a shadow generation for a model migration.
+
+--images catalog images of about --image-kb are re-embedded by
+`stylist_common.migration.reembed` at each --rate limit (images per second)
+and --concurrency. S3 GetObject takes --s3-ms, InvokeModel --bedrock-ms and
+PutItem --dynamodb-ms. Each run writes to an empty shadow table and reports
+images and MB per second, the latency of one image (including resizing it),
+and the hours it would take to re-embed a --catalog of images at that rate.
+As the migration CLI does, the shared Bedrock invoker's rate limit is lifted
+so that --rate alone paces the job.
+"""
+import argparse
+import itertools
+import math
+import os
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, tiny_png
+from benchmarks.scenarios import IMAGE_BUCKET, seed_catalog
+
+use_lambda_code()
+
+from stylist_common.migration import Deployment, Generation, Progress, reembed  # noqa: E402
+
+
+def run(images, image_kb, rates, concurrencies, s3_ms, bedrock_ms, dynamodb_ms, catalog):
+    os.environ.update(BEDROCK_RATE_LIMIT="10000", BEDROCK_BURST="10000")
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=images)
+    # Noise PNGs barely compress, so a side of sqrt(bytes / 3) pixels gives about --image-kb
+    side = int(math.sqrt(image_kb * 1024 / 3))
+    photos = [tiny_png(side, side, seed=seed) for seed in range(8)]
+    for i, key in enumerate(sorted(fakes.s3.objects)):
+        fakes.s3.objects[key] = photos[i % len(photos)]
+    fakes.s3.latency = s3_ms / 1000
+    fakes.bedrock_runtime.latency = bedrock_ms / 1000
+    live = Generation("embeddings", "amazon.titan-embed-image-v1", "1", 1024, "none")
+
+    print(f"{images} images of {image_kb} KB; GetObject {s3_ms:g}ms, InvokeModel {bedrock_ms:g}ms, "
+          f"PutItem {dynamodb_ms:g}ms")
+    print(f"{'rate':>8}{'concurrency':>13}{'images/s':>10}{'MB/s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'failed':>8}{f'{catalog:,} in h':>16}")
+    for run_number, (rate, concurrency) in enumerate(itertools.product(rates, concurrencies)):
+        shadow = Generation(f"embeddings-shadow-{run_number}", "amazon.titan-embed-image-v2", "2", 1024, "none")
+        fakes.dynamodb.Table(shadow.table).latency = dynamodb_ms / 1000
+        progress = Progress(images, every=0, out=lambda message: None)
+        reembed(Deployment(live).start(shadow, 0.0), IMAGE_BUCKET, rate, concurrency, progress=progress)
+        s = progress.summary()
+        hours = catalog / s["images_per_second"] / 3600 if s["images_per_second"] else float("inf")
+        print(f"{rate:>8g}{concurrency:>13}{s['images_per_second']:>10.1f}{s['mb_per_second']:>8.2f}"
+              f"{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['failed']:>8}{hours:>16.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--image-kb", type=int, default=300)
+    parser.add_argument("--rate", type=float, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--s3-ms", type=float, default=30)
+    parser.add_argument("--bedrock-ms", type=float, default=120)
+    parser.add_argument("--dynamodb-ms", type=float, default=8)
+    parser.add_argument("--catalog", type=int, default=1_000_000, help="Images to project the run time for")
+    args = parser.parse_args()
+    run(args.images, args.image_kb, args.rate, args.concurrency, args.s3_ms, args.bedrock_ms, args.dynamodb_ms,
+        args.catalog)
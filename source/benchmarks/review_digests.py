@@ -0,0 +1,134 @@
+"""
+Prompt tokens of review context retrieved for replayed queries, raw review rows against review digests.
+
+Digests of `customer_reviews.csv` are built with `stylist_common.reviews` (the
+embeddings model is a fake, so the sentences chosen are arbitrary but the
+document sizes are real). A query set is replayed: --templates questions about
+every review category. For each query the best --results documents are
+retrieved by a lexical (idf-weighted term overlap) stand-in for the knowledge
+base, from one of three indexed setups: the raw rows alone (before digests),
+the raw rows and the digests together (digests published next to an export
+that stays in the data source), and the digests alone (the deployed setup:
+the review digest function moves each export out of the data bucket). The
+savings reported are those of the digests alone against the other two.
+
+The benchmark reports the review context each query puts into the prompt, in
+full (as the agent's knowledge base tool returns it) and cut to --passage-chars
+(as the text function's direct path does), in tokens estimated as characters
+/ 4. It also reports how often the query's own category was retrieved, and
+how many reviews the retrieved documents summarise. --copies grows the
+catalog with variants of every review, as categories gather more reviews.
+"""
+import argparse
+import math
+import os
+import re
+import statistics
+from collections import Counter
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import read_csv
+
+use_lambda_code()
+
+from stylist_common.reviews import ReviewDigests, category_key, parse_reviews  # noqa: E402
+
+TEMPLATES = [
+    "What do customers say about the {name}?",
+    "Are the {name} comfortable and good quality according to reviews?",
+    "I need {name} for a summer trip, which ones do reviewers recommend?",
+    "Do the {name} run true to size?",
+    "Any complaints about {name}?",
+]
+STOPWORDS = frozenset("a an and any are about do for i ones of the to which what reviews reviewers customers "
+                      "say according need trip summer run true size complaints good quality comfortable".split())
+_WORD = re.compile(r"[a-z]+")
+
+
+def terms(text):
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+class LexicalRetriever:
+    """Ranks documents by the idf of the query terms they contain."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.terms = [set(terms(text)) for _, text in documents]
+        frequency = Counter(term for found in self.terms for term in found)
+        self.idf = {term: math.log(len(documents) / count) + 1 for term, count in frequency.items()}
+
+    def retrieve(self, query, results):
+        query_terms = set(terms(query))
+        scores = [sum(self.idf[term] for term in query_terms & found) for found in self.terms]
+        ranked = sorted(range(len(scores)), key=lambda i: -scores[i])
+        return [self.documents[i] for i in ranked[:results] if scores[i] > 0]
+
+
+def estimate_tokens(text):
+    return len(text) / 4
+
+
+def more_reviews(reviews, copies):
+    """The reviews and `copies - 1` variants of each, its sentences rotated, as if more had been written."""
+    grown = list(reviews)
+    for copy in range(1, copies):
+        for category, review in reviews:
+            sentences = re.split(r"(?<=[.!?])\s+", review)
+            shift = copy % len(sentences)
+            grown.append((category, " ".join(sentences[shift:] + sentences[:shift]) + f" ({copy})"))
+    return grown
+
+
+def run(templates, results, passage_chars, copies):
+    os.environ.update(BEDROCK_RATE_LIMIT="10000", BEDROCK_BURST="10000")
+    FakeAws().install()
+    reviews = more_reviews(parse_reviews(read_csv("customer_reviews.csv").decode("utf-8")), copies)
+    digests = ReviewDigests()
+    digests.add_reviews(reviews)
+    raw = [(category_key(category), f"{category},{review}") for category, review in reviews]
+    documents = [(key, digests.document(key)) for key in digests.categories]
+    corpora = {"raw rows": LexicalRetriever(raw), "raw + digests": LexicalRetriever(raw + documents),
+               "digests": LexicalRetriever(documents)}
+    counts = {key: digests.digest(key)["reviews"] for key in digests.categories}
+    names = sorted({digests.categories[key]["name"] for key in digests.categories}, key=str.lower)
+    queries = [(category_key(name), template.format(name=name)) for name in names for template in TEMPLATES[:templates]]
+
+    print(f"{len(queries)} queries over {len(reviews)} reviews in {len(counts)} categories; top {results} documents, "
+          f"direct path passages cut to {passage_chars} characters; tokens estimated as characters / 4")
+    print(f"{'context':<15}{'doc tokens':>11}{'full mean':>11}{'full p95':>10}{'direct mean':>13}"
+          f"{'found':>8}{'reviews':>9}")
+    means = {}
+    for label, retriever in corpora.items():
+        full, direct, found, summarised = [], [], 0, []
+        for key, query in queries:
+            documents = retriever.retrieve(query, results)
+            full.append(sum(estimate_tokens(text) for _, text in documents))
+            direct.append(sum(estimate_tokens(text[:passage_chars]) for _, text in documents))
+            found += any(document_key == key for document_key, _ in documents)
+            keys = [document_key for document_key, _ in documents]
+            # A digest summarises every review of its category, a raw row one review
+            is_digest = [text.startswith("Customer reviews of ") for _, text in documents]
+            summarised.append(sum(counts[k] for k in {k for k, digest in zip(keys, is_digest) if digest})
+                              + is_digest.count(False))
+        means[label] = (statistics.mean(full), statistics.mean(direct))
+        document_tokens = statistics.mean(estimate_tokens(text) for _, text in retriever.documents)
+        print(f"{label:<15}{document_tokens:>11.0f}{statistics.mean(full):>11.0f}"
+              f"{sorted(full)[int(0.95 * (len(full) - 1))]:>10.0f}{statistics.mean(direct):>13.0f}"
+              f"{found / len(queries):>8.0%}{statistics.mean(summarised):>9.1f}")
+    digest_full, digest_direct = means["digests"]
+    for label in ("raw rows", "raw + digests"):
+        full, direct = means[label]
+        print(f"digests alone use {1 - digest_full / full:.0%} fewer review tokens in full and "
+              f"{1 - digest_direct / direct:.0%} fewer on the direct path than {label}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--templates", type=int, default=len(TEMPLATES), choices=range(1, len(TEMPLATES) + 1))
+    parser.add_argument("--results", type=int, default=4, help="RETRIEVE_RESULTS")
+    parser.add_argument("--passage-chars", type=int, default=600, help="PASSAGE_CHARS")
+    parser.add_argument("--copies", type=int, default=1, help="Grow the reviews to this many variants of each")
+    args = parser.parse_args()
+    run(args.templates, args.results, args.passage_chars, args.copies)
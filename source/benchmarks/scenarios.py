@@ -0,0 +1,182 @@
+"""One representative request per Lambda handler, with the environment and seed data it needs."""
+import os
+import uuid
+from decimal import Decimal
+
+from benchmarks.fakes import deterministic_embedding, tiny_png
+
+CSV_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "csv_files")
+
+DATA_BUCKET = "stylist-data"
+IMAGE_BUCKET = "stylist-images"
+ARTIFACT_BUCKET = "stylist-artifacts"
+EMBEDDINGS_TABLE = "embeddings"
+PROFILE_TABLE = "profiles"
+TABLE_KEYS = {EMBEDDINGS_TABLE: "id", PROFILE_TABLE: "customer_id"}
+
+COMMON_ENV = {
+    "AWS_REGION": "us-east-1",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+}
+
+
+def agent_event(api_path, **parameters):
+    return {
+        "messageVersion": "1.0",
+        "actionGroup": "stylist-tools",
+        "apiPath": api_path,
+        "httpMethod": "GET",
+        "parameters": [{"name": name, "type": "string", "value": value} for name, value in parameters.items()],
+        "sessionAttributes": {},
+        "promptSessionAttributes": {},
+    }
+
+
+def s3_event(bucket, key):
+    return {"Records": [{"s3": {"bucket": {"name": bucket}, "object": {"key": key}}}]}
+
+
+def eventbridge_event(bucket, key):
+    return {"detail-type": "Object Created", "source": "aws.s3", "detail": {"bucket": {"name": bucket}, "object": {"key": key}}}
+
+
+def read_csv(name):
+    with open(os.path.join(CSV_DIR, name), "rb") as f:
+        return f.read()
+
+
+def seed_catalog(fakes, images=200, dimension=1024):
+    """Stores `images` product images and their embeddings, as written by the image embeddings function."""
+    from stylist_common.quantize import encode
+    from stylist_common.shards import SLOT_ATTRIBUTE, slot_of
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    for i in range(images):
+        key = f"catalog/item-{i:05d}.png"
+        fakes.s3.objects[(IMAGE_BUCKET, key)] = tiny_png(32, 32, seed=i)
+        vector = deterministic_embedding(key, dimension)
+        table.items[str(uuid.UUID(int=i))] = {
+            "id": str(uuid.UUID(int=i)),
+            "image_key": key,
+            "vector": [Decimal(str(x)) for x in vector],
+            "embedding_dim": dimension,
+            "projection": "none",
+            SLOT_ATTRIBUTE: slot_of(key),
+            **encode(vector),
+        }
+
+
+def stream_event(images=10, dimension=1024):
+    """DynamoDB stream records of newly embedded images, as the embeddings table emits them."""
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    records = []
+    for i in range(images):
+        image = {"id": f"stream-{i}", "image_key": f"new/item-{i}.png", "embedding_dim": dimension, "projection": "none",
+                 "vector": [Decimal(str(x)) for x in deterministic_embedding(f"stream-{i}", dimension)]}
+        records.append({"eventName": "INSERT", "eventSource": "aws:dynamodb",
+                        "dynamodb": {"Keys": {"id": {"S": image["id"]}},
+                                     "NewImage": {name: serializer.serialize(value) for name, value in image.items()}}})
+    return {"Records": records}
+
+
+def seed_data_bucket(fakes):
+    fakes.s3.objects[(DATA_BUCKET, "order_history.csv")] = read_csv("order_history.csv")
+
+
+def seed_recommendations(fakes):
+    from stylist_common.copurchase import CoPurchaseIndex
+    from stylist_common.orders import parse_orders
+    index = CoPurchaseIndex.build(parse_orders(read_csv("order_history.csv").decode("utf-8")))
+    fakes.s3.objects[(ARTIFACT_BUCKET, "recommendations/copurchase.npz")] = index.dumps()
+
+
+def seed_profiles(fakes):
+    from stylist_common.orders import parse_orders
+    from stylist_common.profiles import DynamoDBProfileStore, aggregate
+    aggregate(parse_orders(read_csv("order_history.csv").decode("utf-8")), DynamoDBProfileStore(fakes.dynamodb.Table(PROFILE_TABLE)))
+
+
+SCENARIOS = {
+    "text_function": {
+        "function_dir": "TextFunction",
+        "env": {"knowledgeBaseId": "KB1", "TEXT_MODEL_ID": "anthropic.claude-3-sonnet-20240229-v1:0",
+                "FAST_TEXT_MODEL_ID": "anthropic.claude-3-haiku-20240307-v1:0", "agentId": "AGENT1",
+                "agentAliasId": "ALIAS1", "PROFILE_TABLE": PROFILE_TABLE, "YOUR_OPENWEATHERMAP_API_KEY": "test"},
+        "seed": [seed_profiles],
+        "event": lambda: {"queryStringParameters": {"query": "What should I wear to the office in Seattle?", "customer_id": "2"}},
+    },
+    "image_function": {
+        "function_dir": "ImageFunction",
+        "env": {"IMAGE_MODEL_ID": "stability.stable-diffusion-xl-v1", "TEXT_MODEL_ID": "anthropic.claude-3-sonnet-20240229-v1:0",
+                "FAST_TEXT_MODEL_ID": "anthropic.claude-3-haiku-20240307-v1:0"},
+        "seed": [],
+        "event": lambda: {"queryStringParameters": {"query": "linen summer suit"}},
+    },
+    "imagequery_function": {
+        "function_dir": "ImageQueryHandlingFunction",
+        "env": {"dynamodb_table": EMBEDDINGS_TABLE, "EMBEDDINGS_MODEL_ID": "amazon.titan-embed-image-v1", "bucket": IMAGE_BUCKET},
+        "seed": [seed_catalog],
+        "event": lambda: {"queryStringParameters": {"query": "red evening dress"}},
+    },
+    "image_embeddings_function": {
+        "function_dir": "ImageEmbeddingFunction",
+        "env": {"dynamodb_table": EMBEDDINGS_TABLE, "EMBEDDINGS_MODEL_ID": "amazon.titan-embed-image-v1"},
+        "seed": [lambda fakes: fakes.s3.objects.__setitem__((IMAGE_BUCKET, "new/item.png"), tiny_png(64, 64))],
+        "event": lambda: s3_event(IMAGE_BUCKET, "new/item.png"),
+    },
+    "index_snapshot_function": {
+        "function_dir": "IndexSnapshotFunction",
+        "env": {"dynamodb_table": EMBEDDINGS_TABLE, "ARTIFACT_BUCKET": ARTIFACT_BUCKET},
+        "seed": [],
+        "event": stream_event,
+    },
+    "ingestion_function": {
+        "function_dir": "IngestionFunction",
+        "env": {"DATASOURCEID": "DS1", "KNOWLEDGEBASEID": "KB1"},
+        "seed": [],
+        "event": lambda: s3_event(DATA_BUCKET, "products_catalog.csv"),
+    },
+    "weather_function": {
+        "function_dir": "WeatherFunction",
+        "env": {"YOUR_OPENWEATHERMAP_API_KEY": "test"},
+        "seed": [],
+        "event": lambda: agent_event("/get-weather-info", location="Seattle"),
+    },
+    "customer_profile_function": {
+        "function_dir": "CustomerProfileFunction",
+        "env": {"PROFILE_TABLE": PROFILE_TABLE},
+        "seed": [seed_data_bucket],
+        "event": lambda: eventbridge_event(DATA_BUCKET, "order_history.csv"),
+    },
+    "review_digest_function": {
+        "function_dir": "ReviewDigestFunction",
+        "env": {"ARTIFACT_BUCKET": ARTIFACT_BUCKET},
+        "seed": [lambda fakes: fakes.s3.objects.__setitem__((DATA_BUCKET, "customer_reviews.csv"), read_csv("customer_reviews.csv"))],
+        "event": lambda: eventbridge_event(DATA_BUCKET, "customer_reviews.csv"),
+    },
+    "recommendation_function": {
+        "function_dir": "RecommendationFunction",
+        "env": {"DATA_BUCKET": DATA_BUCKET, "ARTIFACT_BUCKET": ARTIFACT_BUCKET},
+        "seed": [seed_data_bucket],
+        "event": lambda: agent_event("/get-frequently-bought-together", item="Shirt"),
+    },
+    "action_group_function": {
+        "function_dir": "ActionGroupFunction",
+        "env": {"YOUR_OPENWEATHERMAP_API_KEY": "test", "PROFILE_TABLE": PROFILE_TABLE, "DATA_BUCKET": DATA_BUCKET,
+                "ARTIFACT_BUCKET": ARTIFACT_BUCKET},
+        "seed": [seed_data_bucket, seed_recommendations, seed_profiles],
+        "event": lambda: {"invocations": [agent_event("/get-weather-info", location="Seattle"),
+                                          agent_event("/get-frequently-bought-together", item="Shirt"),
+                                          agent_event("/get-customer-profile", customer_id="2")]},
+    },
+}
+
+
+def prepare(name, fakes):
+    """Seeds the fakes for a scenario and returns its event."""
+    scenario = SCENARIOS[name]
+    for seed in scenario["seed"]:
+        seed(fakes)
+    return scenario["event"]()
@@ -0,0 +1,181 @@
+"""
+Load test of the micro-batching search service against the per-invocation search Lambda.
+
+Both paths search the same seeded catalog through the fake AWS services, with
+latency added to every embeddings model call (--embed-ms) and every DynamoDB
+and S3 call (--io-ms).
+
+- lambda: every invocation runs on its own, as in a separate Lambda execution
+  environment, so latencies are measured one request at a time and throughput
+  at concurrency C is modelled as C / mean latency. That assumes perfect
+  scaling with no cold starts or concurrency quota, which favours Lambda.
+- service: the search service runs in a subprocess and C clients send requests
+  in a loop for --duration seconds; QPS and percentiles are measured.
+
+The fake model builds each embedding in Python (about 2ms of CPU), which runs
+inside the service process and so caps the service's measured QPS below what
+it reaches against Bedrock.
+
+Queries are unique by default, so the service's embedding cache saves nothing;
+--distinct-queries N lets N popular queries repeat. The Bedrock rate limits are
+raised for both paths so the account quota is not what is measured.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import SOURCE_DIR, use_lambda_code, use_search_service
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS, seed_catalog
+
+SCENARIO = SCENARIOS["imagequery_function"]
+BENCHMARK_ENV = {
+    **COMMON_ENV,
+    **SCENARIO["env"],
+    "TRACE_SAMPLE_RATE": "0",
+    "LOG_LEVEL": "WARNING",
+    "BEDROCK_RATE_LIMIT": "100000",
+    "BEDROCK_BURST": "100000",
+    "BEDROCK_MAX_CONCURRENCY": "512",
+}
+
+
+def install_fakes(items, embed_ms, io_ms):
+    fakes = FakeAws(latency=io_ms / 1000, table_keys=TABLE_KEYS).install()
+    fakes.bedrock_runtime.latency = embed_ms / 1000
+    seed_catalog(fakes, images=items)
+    return fakes
+
+
+def query_text(i, distinct):
+    return f"summer outfit {i % distinct if distinct else i}"
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[max(0, int(len(latencies) * 0.99) - 1)]
+
+
+def run_lambda(items, embed_ms, io_ms, requests, distinct, concurrency):
+    use_lambda_code(SCENARIO["function_dir"])
+    install_fakes(items, embed_ms, io_ms)
+    handler = importlib.import_module("imagequery_function").handler
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler({"queryStringParameters": {"query": "warm up"}}, None)
+        for i in range(requests):
+            start = time.perf_counter()
+            handler({"queryStringParameters": {"query": query_text(i, distinct)}}, None)
+            latencies.append(time.perf_counter() - start)
+    p50, p99 = percentiles(latencies)
+    mean = statistics.mean(latencies)
+    for c in concurrency:
+        print(f"{'lambda':<10}{c:>6}{c / mean:>10.1f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}{'1.00':>14}{'1.0':>12}")
+
+
+def serve(port, items, embed_ms, io_ms):
+    use_search_service()
+    import server
+    from aiohttp import web
+    install_fakes(items, embed_ms, io_ms)
+    web.run_app(server.create_app(server.service_from_env()), port=port, print=None, access_log=None)
+
+
+async def drive(base_url, concurrency, duration, distinct, offset):
+    import aiohttp
+    latencies, failures = [], 0
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def health():
+            async with session.get(base_url + "/health") as response:
+                return await response.json()
+
+        async def client(n):
+            nonlocal failures
+            i = offset + n
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                async with session.get(base_url + "/search", params={"query": query_text(i, distinct)}) as response:
+                    await response.read()
+                    failures += response.status != 200
+                latencies.append(time.perf_counter() - start)
+                i += concurrency
+
+        before = await health()
+        start = time.perf_counter()
+        stop = start + duration
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        after = await health()
+    return latencies, failures, elapsed, before, after
+
+
+async def wait_until_ready(base_url, timeout=120):
+    import aiohttp
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(base_url + "/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Search service did not start")
+
+
+def run_service(items, embed_ms, io_ms, duration, distinct, concurrency, port):
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.search_service_load", "--serve", str(port), "--items", str(items),
+         "--embed-ms", str(embed_ms), "--io-ms", str(io_ms)], cwd=SOURCE_DIR, env=os.environ.copy())
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        offset = 0
+        for c in concurrency:
+            latencies, failures, elapsed, before, after = asyncio.run(drive(base_url, c, duration, distinct, offset))
+            offset += len(latencies) + c
+            p50, p99 = percentiles(latencies)
+            calls = (after["embedding_calls"] - before["embedding_calls"]) / len(latencies)
+            batch = ((len(latencies) / (after["scoring_batches"] - before["scoring_batches"]))
+                     if after["scoring_batches"] > before["scoring_batches"] else 0.0)
+            errors = f"  ({failures} errors)" if failures else ""
+            print(f"{'service':<10}{c:>6}{len(latencies) / elapsed:>10.1f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}"
+                  f"{calls:>14.2f}{batch:>12.1f}{errors}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run(args):
+    print(f"{args.items} items, model call {args.embed_ms:.0f}ms, DynamoDB/S3 call {args.io_ms:.0f}ms, "
+          f"{'unique queries' if not args.distinct_queries else f'{args.distinct_queries} distinct queries'}")
+    print(f"{'path':<10}{'conc':>6}{'QPS':>10}{'p50 ms':>10}{'p99 ms':>10}{'model calls/q':>14}{'batch size':>12}")
+    run_lambda(args.items, args.embed_ms, args.io_ms, args.requests, args.distinct_queries, args.concurrency)
+    run_service(args.items, args.embed_ms, args.io_ms, args.duration, args.distinct_queries, args.concurrency, args.port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--embed-ms", type=float, default=60)
+    parser.add_argument("--io-ms", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=100, help="Lambda invocations measured")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per service concurrency level")
+    parser.add_argument("--distinct-queries", type=int, default=0, help="Repeat this many queries; 0 makes every query unique")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.environ.update(BENCHMARK_ENV)
+    if args.serve:
+        serve(args.serve, args.items, args.embed_ms, args.io_ms)
+    else:
+        run(args)
@@ -0,0 +1,115 @@
+"""
+Latency of scatter-gather search as a synthetic catalog is split over more shards.
+
+A catalog of --vectors int8 prefilter codes, as held by the shard index, is
+generated once. For each shard count, every shard's work is run for each
+query: scoring its codes with the search function's prefilter, then re-ranking
+its best RERANK_DEPTH vectors exactly. Codes are scored in chunks of 128k to
+bound this benchmark's memory; the time is that of one pass.
+
+Reads are modelled rather than run: the shard's codes arrive in 1 MB Query
+pages of --page-ms each, and its candidates' float vectors in BatchGetItem
+calls of 100 taking --batch-get-ms. Shards run in separate Lambda invocations,
+so a request takes its slowest shard plus --invoke-ms. A --straggler-fraction
+of invocations take --straggler-ms longer, like cold starts, and the
+partial-result timeout --timeout-ms answers without them.
+"""
+import argparse
+import math
+import random
+import statistics
+import time
+
+from benchmarks import use_lambda_code
+
+use_lambda_code()
+
+from stylist_common.quantize import prefilter_scores, top_indices  # noqa: E402
+from stylist_common.shards import ShardMap, merge_top_k  # noqa: E402
+from stylist_common.vector_index import VectorIndex  # noqa: E402
+
+CHUNK = 131072
+PAGE_BYTES = 1024 * 1024
+# Key, image key, space and DynamoDB overhead of each item in the shard index
+ITEM_OVERHEAD_BYTES = 80
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def search_shard(codes, query, depth, k):
+    """Prefilters a shard's codes and re-ranks its best `depth`; returns the matches and the seconds taken."""
+    import numpy as np
+    start = time.perf_counter()
+    candidates = []
+    for offset in range(0, len(codes), CHUNK):
+        scores = prefilter_scores("int8", query, codes[offset:offset + CHUNK])
+        candidates.extend((float(scores[i]), offset + int(i)) for i in top_indices(scores, depth))
+    rows = [row for _, row in sorted(candidates, reverse=True)[:depth]]
+    index = VectorIndex(None, [str(row) for row in rows], codes[rows].astype(np.float32) / 127)
+    index.matrix /= np.linalg.norm(index.matrix, axis=1, keepdims=True)
+    found = index.search_many([query], k)[0]
+    return found, time.perf_counter() - start
+
+
+def run(vectors, dimension, queries, shard_counts, depth, page_ms, batch_get_ms, invoke_ms,
+        straggler_fraction, straggler_ms, timeout_ms):
+    import numpy as np
+    rng = np.random.default_rng(7)
+    print(f"Generating {vectors:,} codes of {dimension} dimensions ({vectors * dimension / 2**20:.0f} MB)")
+    codes = rng.integers(-127, 128, size=(vectors, dimension), dtype=np.int8)
+    query_vectors = rng.standard_normal((queries, dimension)).astype(np.float32)
+    per_page = PAGE_BYTES // (dimension + ITEM_OVERHEAD_BYTES)
+    stragglers = random.Random(7)
+
+    print(f"{queries} queries; page {page_ms:g}ms, BatchGetItem {batch_get_ms:g}ms, invoke {invoke_ms:g}ms, "
+          f"{straggler_fraction:.0%} of invocations +{straggler_ms:g}ms, timeout {timeout_ms:g}ms")
+    print(f"{'shards':>6}{'items/shard':>13}{'MB/shard':>10}{'read ms':>9}{'score ms':>10}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p95 timeout':>13}{'answered':>10}")
+    for shards in shard_counts:
+        # Hash slots spread items evenly, so each shard holds a contiguous share of the synthetic catalog
+        sizes = [len(slots) * vectors // 256 for slots in ShardMap.even(shards).shards]
+        bounds = np.cumsum([0] + sizes)
+        bounds[-1] = vectors
+        waits, cut, answered, compute = [], [], [], []
+        for query in query_vectors:
+            latencies, results = [], []
+            for shard in range(shards):
+                shard_codes = codes[bounds[shard]:bounds[shard + 1]]
+                found, seconds = search_shard(shard_codes, query, depth, 3)
+                compute.append(seconds * 1000)
+                read_ms = math.ceil(len(shard_codes) / per_page) * page_ms + math.ceil(depth / 100) * batch_get_ms
+                slow = straggler_ms if stragglers.random() < straggler_fraction else 0.0
+                latencies.append(invoke_ms + slow + read_ms + seconds * 1000)
+                results.append(found)
+            start = time.perf_counter()
+            merge_top_k(results, 3)
+            merge_ms = (time.perf_counter() - start) * 1000
+            waits.append(max(latencies) + merge_ms)
+            cut.append(min(max(latencies), timeout_ms) + merge_ms)
+            answered.append(sum(latency <= timeout_ms for latency in latencies) / shards)
+        largest = max(sizes)
+        print(f"{shards:>6}{largest:>13,}{largest * dimension / 2**20:>10.1f}"
+              f"{math.ceil(largest / per_page) * page_ms:>9.0f}{statistics.median(compute):>10.1f}"
+              f"{statistics.median(waits):>9.0f}{percentile(waits, 0.95):>9.0f}{percentile(cut, 0.95):>13.0f}"
+              f"{statistics.mean(answered):>10.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=2_000_000)
+    parser.add_argument("--dimension", type=int, default=256, help="EMBEDDING_DIMENSION, or a projection's size")
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--depth", type=int, default=200, help="RERANK_DEPTH")
+    parser.add_argument("--page-ms", type=float, default=12)
+    parser.add_argument("--batch-get-ms", type=float, default=15)
+    parser.add_argument("--invoke-ms", type=float, default=25)
+    parser.add_argument("--straggler-fraction", type=float, default=0.02)
+    parser.add_argument("--straggler-ms", type=float, default=1500)
+    parser.add_argument("--timeout-ms", type=float, default=2000, help="SHARD_TIMEOUT_MS")
+    args = parser.parse_args()
+    run(args.vectors, args.dimension, args.queries, args.shards, args.depth, args.page_ms, args.batch_get_ms,
+        args.invoke_ms, args.straggler_fraction, args.straggler_ms, args.timeout_ms)
@@ -0,0 +1,74 @@
+"""
+Per-stage latency breakdown of a handler, and the overhead of tracing it.
+
+The handler serves repeated requests against the in-process fakes. Every
+request in the traced run is forced with `X-Trace: 1` and the emitted stage
+latencies are summarised; the untraced run uses a sample rate of zero so the
+difference shows what sampling saves.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+from benchmarks import use_lambda_code
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS
+
+
+def serve(handler, make_event, headers):
+    event = make_event()
+    event["headers"] = dict(headers)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler(event, None)
+    return (time.perf_counter() - start) * 1000
+
+
+def run(module, requests, latency):
+    scenario = SCENARIOS[module]
+    os.environ.update(COMMON_ENV, **scenario["env"], TRACE_SAMPLE_RATE="0")
+    use_lambda_code(scenario["function_dir"])
+    from benchmarks.fakes import FakeAws
+    from benchmarks.scenarios import prepare
+    from stylist_common import tracing
+
+    fakes = FakeAws(latency=latency, table_keys=TABLE_KEYS).install()
+    event = prepare(module, fakes)
+    handler = importlib.import_module(module).handler
+    make_event = lambda: json.loads(json.dumps(event, default=str))  # noqa: E731
+
+    records = []
+    tracing.set_sink(records.append)
+    serve(handler, make_event, {})  # warm the container
+    untraced, traced = [], []
+    # Interleave traced and untraced requests so drift in the host affects both equally
+    for _ in range(requests):
+        untraced.append(serve(handler, make_event, {}))
+        traced.append(serve(handler, make_event, {"X-Trace": "1"}))
+    tracing.set_sink(print)
+
+    stages = {}
+    for record in map(json.loads, records):
+        for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+            stages.setdefault(metric["Name"], []).append(record[metric["Name"]])
+    print(f"{module}: {requests} requests, fake AWS latency {latency * 1000:.1f}ms")
+    print(f"{'stage':<28}{'p50 ms':>10}{'max ms':>10}")
+    for name, values in sorted(stages.items(), key=lambda item: -statistics.median(item[1])):
+        print(f"{name:<28}{statistics.median(values):>10.3f}{max(values):>10.3f}")
+    overhead = statistics.median(traced) - statistics.median(untraced)
+    print(f"median request {statistics.median(untraced):.3f}ms untraced, {statistics.median(traced):.3f}ms traced "
+          f"({overhead * 1000:+.1f}us per traced request)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("handler", nargs="?", default="imagequery_function", choices=sorted(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every fake AWS call")
+    args = parser.parse_args()
+    sys.exit(run(args.handler, args.requests, args.latency))
@@ -0,0 +1,184 @@
+"""
+Benchmark suite: every Lambda handler against the in-process fakes, compared with a stored baseline.
+
+Each handler runs in a fresh interpreter. After a warm-up request, --requests
+requests are timed with every request traced, so the stage latencies are
+collected too. The Bedrock client-side rate limit is lifted so it does not
+hide the handler's own cost. A second pass runs under tracemalloc to measure the peak memory
+of a request and the memory blocks still allocated after it.
+
+Results are compared with --baseline, and the run exits with status 1 when a
+handler regresses:
+- p50 latency grows by more than --tolerance and more than --slack-ms
+- peak memory per request grows by more than --tolerance and more than 64 KiB
+- retained blocks per request grow by more than 10
+- it makes more AWS calls per request
+
+Latency depends on the host, so record the baseline on the machine that
+compares against it, with --update-baseline.
+"""
+import argparse
+import contextlib
+import gc
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks import LAMBDA_DIR, use_lambda_code
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS
+
+SOURCE_DIR = os.path.dirname(LAMBDA_DIR)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "data", "baseline.json")
+MEMORY_SLACK_KIB = 64
+BLOCK_SLACK = 10
+MARKER = "SUITE "
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(name, requests, latency_ms):
+    """Runs one handler in this interpreter and returns its results."""
+    scenario = SCENARIOS[name]
+    os.environ.update(COMMON_ENV, **scenario["env"], TRACE_SAMPLE_RATE="1", BEDROCK_RATE_LIMIT="10000", BEDROCK_BURST="10000")
+    use_lambda_code(scenario["function_dir"])
+    from benchmarks.fakes import FakeAws
+    from benchmarks.scenarios import prepare
+    from stylist_common import tracing
+
+    fakes = FakeAws(latency=latency_ms / 1000, table_keys=TABLE_KEYS).install()
+    payload = json.dumps(prepare(name, fakes), default=str)
+    handler = importlib.import_module(name).handler
+    records = []
+    tracing.set_sink(records.append)
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        def serve():
+            event = json.loads(payload)
+            start = time.perf_counter()
+            handler(event, None)
+            return (time.perf_counter() - start) * 1000
+
+        serve()  # warm the container
+        records.clear()
+        calls = len(fakes.operations())
+        started = time.perf_counter()
+        latencies = [serve() for _ in range(requests)]
+        elapsed = time.perf_counter() - started
+        calls = (len(fakes.operations()) - calls) / requests
+
+        tracing.set_sink(lambda record: None)
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        peaks = []
+        for _ in range(requests):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            serve()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+        gc.collect()
+        retained = (sys.getallocatedblocks() - blocks) / requests
+
+    stages = {}
+    for record in map(json.loads, records):
+        if "TotalLatency" not in record:
+            continue  # model metrics, not a request trace
+        for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+            if metric["Name"] != "TotalLatency":
+                stages.setdefault(metric["Name"][:-len("Latency")], []).append(record[metric["Name"]])
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "requests_per_second": round(requests / elapsed, 1),
+        "peak_kib": round(statistics.median(peaks) / 1024, 1),
+        "retained_blocks": round(retained, 1),
+        "calls": calls,
+        "stages_ms": {stage: round(statistics.median(values), 3) for stage, values in stages.items()},
+    }
+
+
+def run_child(name, requests, latency_ms):
+    command = [sys.executable, "-m", "benchmarks.suite", "--child", name,
+               "--requests", str(requests), "--latency-ms", str(latency_ms)]
+    result = subprocess.run(command, cwd=SOURCE_DIR, capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith(MARKER):
+            return json.loads(line[len(MARKER):])
+    raise RuntimeError(f"{name} failed:\n{result.stderr}")
+
+
+def regressions(current, baseline, tolerance, slack_ms):
+    """Describes how `current` is worse than `baseline`, as a list of messages."""
+    found = []
+    if current["p50_ms"] > baseline["p50_ms"] * (1 + tolerance) and current["p50_ms"] - baseline["p50_ms"] > slack_ms:
+        found.append(f"p50 {baseline['p50_ms']:.2f}ms -> {current['p50_ms']:.2f}ms")
+    if (current["peak_kib"] > baseline["peak_kib"] * (1 + tolerance)
+            and current["peak_kib"] - baseline["peak_kib"] > MEMORY_SLACK_KIB):
+        found.append(f"peak memory {baseline['peak_kib']:.0f}KiB -> {current['peak_kib']:.0f}KiB")
+    if current["retained_blocks"] - baseline["retained_blocks"] > BLOCK_SLACK:
+        found.append(f"retained blocks {baseline['retained_blocks']:.0f} -> {current['retained_blocks']:.0f} per request")
+    if current["calls"] > baseline["calls"]:
+        found.append(f"AWS calls {baseline['calls']:g} -> {current['calls']:g} per request")
+    return found
+
+
+def run(names, requests, latency_ms, baseline_path, tolerance, slack_ms, update):
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(f"{requests} requests per handler, fake AWS latency {latency_ms:g}ms")
+    print(f"{'handler':<28}{'p50 ms':>9}{'p95 ms':>9}{'req/s':>9}{'peak KiB':>10}{'blocks':>8}{'calls':>7}  slowest stages")
+    results, failed = {}, []
+    for name in names:
+        result = results[name] = run_child(name, requests, latency_ms)
+        slowest = sorted(result["stages_ms"].items(), key=lambda item: -item[1])[:3]
+        print(f"{name:<28}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['requests_per_second']:>9.0f}"
+              f"{result['peak_kib']:>10.0f}{result['retained_blocks']:>8.1f}{result['calls']:>7g}  "
+              + ", ".join(f"{stage} {ms:.2f}" for stage, ms in slowest))
+        if name in baseline and not update:
+            for message in regressions(result, baseline[name], tolerance, slack_ms):
+                failed.append(f"{name}: {message}")
+
+    if update:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {baseline_path}")
+        return 0
+    missing = [name for name in names if name not in baseline]
+    if missing:
+        print(f"no baseline for {', '.join(missing)}")
+    for message in failed:
+        print(f"REGRESSION {message}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handlers", nargs="*", help=f"Any of {', '.join(sorted(SCENARIOS))} (default all)")
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added to every fake AWS call")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed relative growth of latency and memory")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="Latency growth always allowed, for noise")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = sorted(set(args.handlers) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"unknown handlers: {', '.join(unknown)}")
+    if args.child:
+        print(MARKER + json.dumps(measure(args.child, args.requests, args.latency_ms)))
+        sys.exit(0)
+    sys.exit(run(args.handlers or sorted(SCENARIOS), args.requests, args.latency_ms, args.baseline,
+                 args.tolerance, args.slack_ms, args.update_baseline))
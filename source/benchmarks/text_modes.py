@@ -0,0 +1,83 @@
+"""
+Latency of the text function's agent, direct and auto modes on replayed requests.
+
+Every request in the query files runs through the handler once per mode
+against the in-process fakes. A model call takes --model-ms. An agent turn
+takes --agent-steps model calls plus a knowledge base search, which models
+its planning, tool and answer round trips. A knowledge base search takes
+--retrieve-ms and a weather lookup --weather-ms, cached per city as in a
+warm container.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import statistics
+import time
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DEFAULT_QUERIES = [os.path.join(DATA_DIR, "routing_queries.jsonl"), os.path.join(DATA_DIR, "attribute_queries.jsonl")]
+SCENARIO = SCENARIOS["text_function"]
+
+
+def read_queries(paths):
+    queries = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            queries.extend(json.loads(line)["query"] for line in f if line.strip())
+    return list(dict.fromkeys(queries))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(paths, model_ms, agent_steps, retrieve_ms, weather_ms, io_ms):
+    os.environ.update(COMMON_ENV, **SCENARIO["env"], TRACE_SAMPLE_RATE="0")
+    use_lambda_code(SCENARIO["function_dir"])
+    fakes = FakeAws(latency=io_ms / 1000, table_keys=TABLE_KEYS).install()
+    fakes.bedrock_runtime.latency = model_ms / 1000
+    fakes.agent_runtime.latencies = {"InvokeAgent": (agent_steps * model_ms + retrieve_ms) / 1000,
+                                     "Retrieve": retrieve_ms / 1000}
+    fakes.http.latency = weather_ms / 1000
+    module = importlib.import_module("text_function")
+    queries = read_queries(paths)
+
+    print(f"{len(queries)} requests; model call {model_ms:.0f}ms, agent turn {agent_steps} model calls, "
+          f"retrieve {retrieve_ms:.0f}ms, weather {weather_ms:.0f}ms")
+    print(f"{'mode':>8}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'direct':>8}{'agent':>7}{'retrieve':>10}{'model':>7}")
+    for mode in ("agent", "direct", "auto"):
+        module.TEXT_MODE = mode
+        for service in (fakes.agent_runtime, fakes.bedrock_runtime, fakes.http):
+            service.calls.clear()
+        latencies, direct = [], 0
+        for query in queries:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                module.handler({"queryStringParameters": {"query": query}}, None)
+            latencies.append((time.perf_counter() - start) * 1000)
+            direct += not module.needs_agent(query)
+        operations = [name for name, _ in fakes.agent_runtime.calls + fakes.bedrock_runtime.calls]
+        n = len(queries)
+        print(f"{mode:>8}{statistics.median(latencies):>10.0f}{percentile(latencies, 0.95):>10.0f}"
+              f"{statistics.mean(latencies):>10.0f}{direct / n:>8.0%}{operations.count('InvokeAgent') / n:>7.2f}"
+              f"{operations.count('Retrieve') / n:>10.2f}{operations.count('InvokeModel') / n:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES, help="JSON lines files with a `query` field")
+    parser.add_argument("--model-ms", type=float, default=400)
+    parser.add_argument("--agent-steps", type=int, default=3)
+    parser.add_argument("--retrieve-ms", type=float, default=60)
+    parser.add_argument("--weather-ms", type=float, default=40)
+    parser.add_argument("--io-ms", type=float, default=5, help="DynamoDB profile lookups")
+    args = parser.parse_args()
+    run(args.queries, args.model_ms, args.agent_steps, args.retrieve_ms, args.weather_ms, args.io_ms)
@@ -0,0 +1,80 @@
+"""
+Recall and latency of two-stage search against exact search, across catalog sizes.
+
+Exact search converts every stored Decimal vector to floats and scores it.
+Two-stage search scores compact int8 or sign-bit codes of every item, then
+converts and re-ranks only the best `depth` candidates exactly. Decimal
+conversion is timed on a sample and scaled to the candidates converted, which
+is how the search function spends most of its time; bytes scanned per item
+compare the Decimal vector with each code.
+"""
+import argparse
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from benchmarks import use_lambda_code
+from benchmarks.embedding_dimensions import item_bytes, noisy_queries, recall, synthetic_catalog
+
+use_lambda_code()
+
+from stylist_common.quantize import code_matrix, encode, prefilter_scores, top_indices  # noqa: E402
+
+
+def decimal_conversion_ms(catalog, sample=200):
+    decimals = [[Decimal(str(float(x))) for x in row] for row in catalog[:sample]]
+    start = time.perf_counter()
+    for row in decimals:
+        [float(x) for x in row]
+    return (time.perf_counter() - start) * 1000 / len(decimals)
+
+
+def exact_top(catalog, query, k):
+    return top_indices(catalog @ query, k)
+
+
+def two_stage_top(catalog, codes, quantizer, query, depth, k):
+    candidates = top_indices(prefilter_scores(quantizer, query, codes), depth)
+    return candidates[top_indices(catalog[candidates] @ query, k)]
+
+
+def run(sizes, dimension, depths, query_count):
+    print(f"{'items':>8}{'search':>16}{'recall@3':>10}{'recall@10':>11}{'score ms':>10}{'total ms':>10}{'scan B/item':>13}")
+    for size in sizes:
+        catalog = synthetic_catalog(size, dimension)
+        queries = noisy_queries(catalog, query_count, noise=1.5)
+        convert_ms = decimal_conversion_ms(catalog)
+        attributes = [encode(vector) for vector in catalog]
+        exact3 = [exact_top(catalog, q, 3) for q in queries]
+        exact10 = [exact_top(catalog, q, 10) for q in queries]
+
+        start = time.perf_counter()
+        for q in queries:
+            exact_top(catalog, q, 10)
+        score_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"{size:>8}{'exact':>16}{1.0:>10.3f}{1.0:>11.3f}{score_ms:>10.2f}{score_ms + convert_ms * size:>10.1f}"
+              f"{item_bytes(catalog[0]):>13}")
+
+        for quantizer, attribute in (("int8", "vector_int8"), ("binary", "vector_bits")):
+            codes = code_matrix(quantizer, [a[attribute] for a in attributes])
+            for depth in depths:
+                found3, found10 = [], []
+                start = time.perf_counter()
+                for q in queries:
+                    found10.append(two_stage_top(catalog, codes, quantizer, q, depth, 10))
+                score_ms = (time.perf_counter() - start) * 1000 / len(queries)
+                found3 = [f[:3] for f in found10]
+                total_ms = score_ms + convert_ms * min(depth, size)
+                print(f"{size:>8}{f'{quantizer} d={depth}':>16}{recall(exact3, found3):>10.3f}"
+                      f"{recall(exact10, found10):>11.3f}{score_ms:>10.2f}{total_ms:>10.1f}{len(attributes[0][attribute]):>13}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("--depths", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+    run(args.sizes, args.dimension, args.depths, args.queries)
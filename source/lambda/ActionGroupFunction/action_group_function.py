@@ -0,0 +1,101 @@
+import os
+from collections import deque
+from botocore.exceptions import ClientError
+
+from stylist_common import runtime
+from stylist_common.actions import ActionError, ActionRouter, integer, required
+from stylist_common.cached_object import CachedObject
+from stylist_common.orders import iter_orders, stream_lines
+from stylist_common.profiles import DynamoDBProfileStore
+from stylist_common.tracing import traced
+from stylist_common.weather import get_weather
+
+# Clients come from the shared runtime and the caches below live for the warm container
+API_KEY = os.environ.get('YOUR_OPENWEATHERMAP_API_KEY')
+DATA_BUCKET = os.environ.get('DATA_BUCKET')
+ORDER_HISTORY_KEY = os.environ.get('ORDER_HISTORY_KEY', 'order_history.csv')
+ARTIFACT_BUCKET = os.environ.get('ARTIFACT_BUCKET')
+SNAPSHOT_KEY = os.environ.get('SNAPSHOT_KEY', 'recommendations/copurchase.npz')
+PROFILE_TABLE = os.environ.get('PROFILE_TABLE')
+# How long the snapshot and the order history are served before their ETags are checked
+SNAPSHOT_TTL_SECONDS = float(os.environ.get('SNAPSHOT_TTL_SECONDS', 60))
+# Most recent orders kept per customer, the largest `limit` /get-order-history accepts
+ORDER_HISTORY_LIMIT = int(os.environ.get('ORDER_HISTORY_LIMIT', 50))
+MAX_RECOMMENDATIONS = 10
+
+router = ActionRouter()
+
+
+def load_copurchase_index(body):
+    # Imported lazily so numpy is only loaded by containers that serve recommendations
+    from stylist_common.copurchase import CoPurchaseIndex
+    return CoPurchaseIndex.loads(body.read())
+
+
+def load_orders_by_customer(body):
+    """Streams the order history, keeping each customer's latest ORDER_HISTORY_LIMIT orders."""
+    grouped = {}
+    for order in iter_orders(stream_lines(body)):
+        orders = grouped.get(order.customer_id)
+        if orders is None:
+            orders = grouped[order.customer_id] = deque(maxlen=ORDER_HISTORY_LIMIT)
+        orders.append((order.name, order.size, order.brand, tuple(order.tags)))
+    return grouped
+
+
+_copurchase_snapshot = CachedObject(ARTIFACT_BUCKET, SNAPSHOT_KEY, load_copurchase_index, ttl=SNAPSHOT_TTL_SECONDS)
+_order_history = CachedObject(DATA_BUCKET, ORDER_HISTORY_KEY, load_orders_by_customer, ttl=SNAPSHOT_TTL_SECONDS)
+
+
+def copurchase_index():
+    try:
+        return _copurchase_snapshot.get()
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            raise ActionError("Recommendations are not available yet", status_code=503)
+        raise
+
+
+def orders_by_customer():
+    return _order_history.get()
+
+
+@router.route('/get-weather-info')
+def weather_info(parameters):
+    return get_weather(required(parameters, 'location'), API_KEY)
+
+
+@router.route('/get-frequently-bought-together')
+def frequently_bought_together(parameters):
+    item = required(parameters, 'item')
+    recommendations = copurchase_index().recommend(item, integer(parameters, 'limit', 5, MAX_RECOMMENDATIONS))
+    return {
+        'item': item,
+        'frequently_bought_together': [{'item': label, 'customers': count} for label, count in recommendations]
+    }
+
+
+@router.route('/get-customer-profile')
+def customer_profile(parameters):
+    customer_id = required(parameters, 'customer_id')
+    profile = DynamoDBProfileStore(runtime.table(PROFILE_TABLE)).get(customer_id)
+    if profile is None:
+        raise ActionError(f"No profile found for customer {customer_id}", status_code=404)
+    return {'customer_id': customer_id, 'summary': profile.get('summary'), 'order_count': profile['order_count']}
+
+
+@router.route('/get-order-history')
+def order_history(parameters):
+    customer_id = required(parameters, 'customer_id')
+    limit = integer(parameters, 'limit', 10, ORDER_HISTORY_LIMIT)
+    orders = list(orders_by_customer().get(str(customer_id), ()))[-limit:]
+    return {
+        'customer_id': customer_id,
+        'orders': [{'name': name, 'size': size, 'brand': brand, 'tags': list(tags)}
+                   for name, size, brand, tags in reversed(orders)]
+    }
+
+
+@traced("action_group_function")
+def handler(event, context):
+    return router.handle(event)
@@ -0,0 +1 @@
+# Shared helpers for the Virtual Stylist Lambda functions, deployed as a Lambda layer.
@@ -0,0 +1,123 @@
+import contextvars
+import json
+import time
+
+from stylist_common.log import get_logger
+from stylist_common.tracing import emit_metrics
+
+logger = get_logger(__name__)
+
+
+class ActionError(Exception):
+    """Raised by a tool to return an error status to the agent instead of failing the invocation."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_parameters(event):
+    """
+    Collects action group parameters by name.
+
+    Bedrock Agents send query and path parameters as a `parameters` list and
+    JSON request bodies as a list of properties, so both are merged into one dict.
+    """
+    parameters = {parameter["name"]: parameter.get("value") for parameter in event.get("parameters") or []}
+    content = (event.get("requestBody") or {}).get("content") or {}
+    for media in content.values():
+        for prop in media.get("properties") or []:
+            parameters.setdefault(prop["name"], prop.get("value"))
+    return parameters
+
+
+def required(parameters, name):
+    value = parameters.get(name)
+    if value in (None, ''):
+        raise ActionError(f"Missing required parameter '{name}'")
+    return value
+
+
+def integer(parameters, name, default, maximum):
+    """An optional positive integer parameter, capped at `maximum`."""
+    value = parameters.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ActionError(f"Parameter '{name}' must be an integer, got {value!r}")
+    if number < 1:
+        raise ActionError(f"Parameter '{name}' must be at least 1")
+    return min(number, maximum)
+
+
+class ActionRouter:
+    """
+    Dispatches Bedrock Agent action group invocations to registered tools by `apiPath`.
+
+    Tools are plain functions taking a dict of parameters and returning a
+    JSON-serialisable response body. Clients and caches created at module level
+    by the tools are shared by every invocation in the warm container.
+    """
+
+    def __init__(self, max_workers=8):
+        self.routes = {}
+        self.max_workers = max_workers
+
+    def route(self, api_path, http_method="GET"):
+        def register(tool):
+            self.routes[(api_path, http_method.upper())] = tool
+            return tool
+        return register
+
+    def _invoke(self, event):
+        api_path = event.get("apiPath")
+        http_method = (event.get("httpMethod") or "GET").upper()
+        tool = self.routes.get((api_path, http_method))
+        start = time.perf_counter()
+        if tool is None:
+            status_code, body = 404, {"error": f"Unknown action {http_method} {api_path}"}
+        else:
+            try:
+                status_code, body = 200, tool(parse_parameters(event))
+            except ActionError as e:
+                status_code, body = e.status_code, {"error": str(e)}
+            except Exception as e:
+                logger.error("Tool failed", api_path=api_path, error=repr(e))
+                status_code, body = 500, {"error": "The tool failed to respond"}
+        emit_metrics({"Tool": api_path}, {"ToolLatency": (time.perf_counter() - start) * 1000}, {"StatusCode": status_code})
+        return {
+            "messageVersion": "1.0",
+            "response": {
+                "actionGroup": event.get("actionGroup"),
+                "apiPath": api_path,
+                "httpMethod": event.get("httpMethod"),
+                "httpStatusCode": status_code,
+                "responseBody": {"application/json": {"body": json.dumps(body, default=str)}},
+            },
+            "sessionAttributes": event.get("sessionAttributes", {}),
+            "promptSessionAttributes": event.get("promptSessionAttributes", {}),
+        }
+
+    def handle(self, event):
+        """
+        Handles one action group event, or a batch of them passed as `{"invocations": [...]}`.
+
+        Bedrock Agents invoke the function with one event at a time; the batch
+        envelope is internal, for callers in this repository (such as the
+        benchmarks) that invoke several tools directly. Batched invocations are
+        independent, so they run concurrently, each in a copy of the caller's
+        context so tracing and logging keep the request id, and the responses
+        are returned in the same order.
+        """
+        if "invocations" not in event:
+            return self._invoke(event)
+        invocations = event["invocations"]
+        if len(invocations) <= 1:
+            return {"responses": [self._invoke(invocation) for invocation in invocations]}
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(invocations))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self._invoke, invocation)
+                       for invocation in invocations]
+            return {"responses": [future.result() for future in futures]}
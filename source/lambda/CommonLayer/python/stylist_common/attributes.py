@@ -0,0 +1,360 @@
+"""
+Deterministic extraction of the customer attributes the stylist agent asks for.
+
+Otherwise the agent spends a model round trip finding the age group, gender,
+season and location in every message. Keyword rules, regular expressions and
+small gazetteers find them in microseconds, each with a confidence, and the
+text function passes the confident ones to the agent as prompt session
+attributes. An optional naive Bayes classifier, trained offline on labelled
+queries, fills in an attribute when no rule fires.
+
+Values use the vocabulary of the extraction prompt: age group 10-20, 20-30,
+30-50 or 50+; gender Mens, Womens or Other; season summer, winter, spring or
+fall; location as the gazetteer spells it. Months and holidays map to
+northern hemisphere seasons.
+"""
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from stylist_common.log import get_logger
+
+logger = get_logger(__name__)
+
+ATTRIBUTES = ("age_group", "gender", "season", "location")
+NONE = "none"
+
+
+class Attribute(namedtuple("Attribute", ["value", "confidence", "source"])):
+    """An extracted value, how sure the rule that found it is (0-1), and which rule it was."""
+
+
+def _words(*groups):
+    return {word: value for value, words in groups for word in words.split()}
+
+
+# The person being dressed is usually named by a relation ("for my wife"), which outranks the speaker
+RELATIONS = _words(
+    ("Womens", "wife girlfriend mom mother mum daughter sister aunt niece grandma grandmother bride bridesmaid fiancee"),
+    ("Mens", "husband boyfriend dad father son brother uncle nephew grandpa grandfather groom groomsman fiance"),
+)
+GENDER_WORDS = _words(
+    ("Womens", "woman women women's womens female lady ladies girl girls gal"),
+    ("Mens", "man men men's mens male guy guys gentleman gentlemen boy boys"),
+    ("Other", "non-binary nonbinary enby genderfluid genderqueer androgynous agender"),
+)
+PRONOUNS = _words(("Womens", "she her hers herself"), ("Mens", "he him his himself"))
+GARMENTS = _words(
+    ("Womens", "dress dresses skirt skirts blouse blouses gown gowns heels bikini maternity sundress"),
+    ("Mens", "tuxedo tux necktie cufflinks"),
+)
+FIRST_NAMES = _words(
+    ("Womens", "mary patricia jennifer linda elizabeth barbara susan jessica sarah karen lisa nancy betty emily "
+               "emma olivia sophia isabella mia charlotte amelia hannah grace chloe laura anna maria priya "
+               "aisha fatima mei yuki sofia lucia ana julia rachel rebecca megan nicole amanda"),
+    ("Mens", "james john robert michael william david richard joseph thomas charles christopher daniel matthew "
+             "anthony mark steven paul andrew joshua kevin brian george edward liam noah oliver ethan lucas "
+             "raj arjun mohammed ahmed hiroshi wei carlos juan diego luca marco pedro"),
+)
+SEASONS = {"summer": "summer", "winter": "winter", "spring": "spring", "autumn": "fall", "fall": "fall"}
+MONTHS = _words(
+    ("winter", "december january february dec jan feb"),
+    ("spring", "march april may mar apr"),
+    ("summer", "june july august jun jul aug"),
+    ("fall", "september october november sep sept oct nov"),
+)
+HOLIDAYS = {"christmas": "winter", "new year's": "winter", "new years": "winter", "hanukkah": "winter",
+            "valentine's": "winter", "easter": "spring", "fourth of july": "summer", "4th of july": "summer",
+            "halloween": "fall", "thanksgiving": "fall"}
+SEASON_HINTS = _words(("summer", "beach poolside swimwear"), ("winter", "ski skiing snow snowy"))
+# "fall" is also a verb, so it only counts as a season next to words that make that clear
+FALL = re.compile(r"\b(?:this|next|last|the|in|for|early|late|during)\s+fall\b|\bfall\s+(?:season|wedding|outfits?|"
+                  r"weather|fashion|collection|wardrobe|look|trip|vacation|semester)\b")
+
+LOCATIONS = (
+    "New York", "New York City", "NYC", "Los Angeles", "San Francisco", "Seattle", "Chicago", "Boston", "Miami",
+    "Austin", "Dallas", "Houston", "Denver", "Phoenix", "Las Vegas", "San Diego", "Portland", "Atlanta",
+    "Nashville", "New Orleans", "Washington DC", "Philadelphia", "Minneapolis", "Detroit", "Honolulu", "Anchorage",
+    "Salt Lake City", "Orlando", "Toronto", "Vancouver", "Montreal", "Mexico City", "Cancun", "London",
+    "Paris", "Berlin", "Munich", "Madrid", "Barcelona", "Lisbon", "Rome", "Milan", "Florence", "Venice",
+    "Amsterdam", "Brussels", "Vienna", "Prague", "Zurich", "Geneva", "Stockholm", "Oslo", "Copenhagen",
+    "Helsinki", "Reykjavik", "Dublin", "Edinburgh", "Athens", "Istanbul", "Dubai", "Abu Dhabi", "Cairo",
+    "Marrakech", "Cape Town", "Nairobi", "Mumbai", "Delhi", "New Delhi", "Bangalore", "Singapore", "Bangkok",
+    "Bali", "Hong Kong", "Shanghai", "Beijing", "Tokyo", "Kyoto", "Osaka", "Seoul", "Sydney", "Melbourne",
+    "Auckland", "Rio de Janeiro", "Sao Paulo", "Buenos Aires", "Lima", "Bogota", "Santiago",
+    "Alaska", "Hawaii", "Florida", "California", "Texas", "Arizona", "Colorado", "Vermont", "Maine", "Iceland",
+    "Norway", "Canada", "Mexico", "Italy", "France", "Spain", "Portugal", "Greece", "Japan", "Thailand",
+    "India", "Australia", "Scotland", "Ireland", "Switzerland", "Egypt", "Morocco", "Brazil",
+)
+_LOCATION_PATTERN = re.compile(r"\b(" + "|".join(re.escape(name) for name in sorted(LOCATIONS, key=len, reverse=True))
+                               + r")\b", re.IGNORECASE)
+_CANONICAL_LOCATIONS = {name.lower(): name for name in LOCATIONS}
+# A capitalised place name after these words, when it is not in the gazetteer
+_PLACE_AFTER = re.compile(r"\b(?:in|to|visiting|around)\s+((?:[A-Z][a-z]+)(?:\s+[A-Z][a-z]+){0,2})")
+_DESTINATION_BEFORE = re.compile(r"(?:\bto|\bin|\bvisiting|\baround|\bat)\s+$", re.IGNORECASE)
+
+_AGE_NUMBER = re.compile(r"\b(\d{1,2})[\s-]*(?:years?|yrs?)[\s-]*old\b|\b(\d{1,2})\s*yo\b"
+                         r"|\b(?:aged?|i am|i'm|im|turning|turned)\s+(\d{1,2})\b(?!\s*(?:%|percent|inch|in\b|cm|kg|lb|waist|size))")
+_AGE_DECADE = re.compile(r"\b(?:in|into)\s+(?:my|her|his|their|your|our)\s+(?:early\s+|mid\s+|late\s+)?"
+                         r"(teens|twenties|thirties|forties|fifties|sixties|seventies|eighties|20s|30s|40s|50s|60s|70s|80s)\b")
+DECADES = {"teens": "10-20", "twenties": "20-30", "20s": "20-30", "thirties": "30-50", "30s": "30-50",
+           "forties": "30-50", "40s": "30-50"}
+AGE_WORDS = _words(("10-20", "teen teens teenager teenagers teenage"), ("50+", "retired retiree retirees senior seniors"))
+AGE_PHRASES = {"high school": "10-20", "college student": "20-30", "university student": "20-30",
+               "grandmother": "50+", "grandfather": "50+", "grandma": "50+", "grandpa": "50+"}
+_NAME = re.compile(r"\b(?:[Ii] am|[Ii]'m|[Ii]m|[Mm]y name is|[Tt]his is|[Cc]all me|[Nn]amed)\s+([A-Z][a-z]+)")
+_TOKEN = re.compile(r"[a-z0-9]+(?:['-][a-z]+)?")
+_MAY = re.compile(r"\b(?:in|during|early|late|mid|next|this|last)\s+may\b")
+
+
+def _tokens(lower):
+    # "my niece's" names the niece
+    return [token[:-2] if token.endswith("'s") and token[:-2] in RELATIONS else token for token in _TOKEN.findall(lower)]
+
+
+def _age_bucket(age):
+    if age < 10:
+        return None
+    if age < 20:
+        return "10-20"
+    if age < 30:
+        return "20-30"
+    return "30-50" if age < 50 else "50+"
+
+
+def _best(candidates, source_ranks):
+    """Picks the highest-confidence candidate; equally strong candidates that disagree are not trusted."""
+    if not candidates:
+        return None
+    candidates.sort(key=lambda c: (-c.confidence, source_ranks.index(c.source)))
+    best = candidates[0]
+    if any(c.value != best.value and c.confidence == best.confidence for c in candidates[1:]):
+        return best._replace(confidence=0.5)
+    return best
+
+
+def _age(lower, tokens):
+    for match in _AGE_NUMBER.finditer(lower):
+        bucket = _age_bucket(int(next(group for group in match.groups() if group)))
+        if bucket:
+            return Attribute(bucket, 0.95, "age")
+    match = _AGE_DECADE.search(lower)
+    if match:
+        return Attribute(DECADES.get(match.group(1), "50+"), 0.9, "decade")
+    for phrase, bucket in AGE_PHRASES.items():
+        if phrase in lower:
+            return Attribute(bucket, 0.85, "phrase")
+    for token in tokens:
+        if token in AGE_WORDS:
+            return Attribute(AGE_WORDS[token], 0.85, "keyword")
+    return None
+
+
+GENDER_SOURCES = ("relation", "keyword", "name", "pronoun", "garment")
+
+
+def _gender(text, tokens):
+    candidates = []
+    for token in tokens:
+        if token in RELATIONS:
+            candidates.append(Attribute(RELATIONS[token], 1.0, "relation"))
+        elif token in GENDER_WORDS:
+            candidates.append(Attribute(GENDER_WORDS[token], 0.9, "keyword"))
+        elif token in PRONOUNS:
+            candidates.append(Attribute(PRONOUNS[token], 0.7, "pronoun"))
+        elif token in GARMENTS:
+            candidates.append(Attribute(GARMENTS[token], 0.6, "garment"))
+    for match in _NAME.finditer(text):
+        gender = FIRST_NAMES.get(match.group(1).lower())
+        if gender:
+            candidates.append(Attribute(gender, 0.85, "name"))
+    return _best(candidates, GENDER_SOURCES)
+
+
+SEASON_SOURCES = ("season", "holiday", "month", "hint")
+
+
+def _season(lower, tokens):
+    candidates = []
+    for token in tokens:
+        if token in SEASONS and token != "fall":
+            candidates.append(Attribute(SEASONS[token], 0.95, "season"))
+        elif token in MONTHS and (len(token) > 3 or token == "may"):
+            # "may" is also a verb, so it is only a month after words like "in"
+            weak = token == "may" and not _MAY.search(lower)
+            candidates.append(Attribute(MONTHS[token], 0.6 if weak else 0.85, "month"))
+        elif token in SEASON_HINTS:
+            candidates.append(Attribute(SEASON_HINTS[token], 0.6, "hint"))
+    if FALL.search(lower):
+        candidates.append(Attribute("fall", 0.95, "season"))
+    for holiday, season in HOLIDAYS.items():
+        if holiday in lower:
+            candidates.append(Attribute(season, 0.85, "holiday"))
+    return _best(candidates, SEASON_SOURCES)
+
+
+def _location(text):
+    matches = list(_LOCATION_PATTERN.finditer(text))
+    if matches:
+        # Prefer where the customer is going over where they are from
+        destinations = [m for m in matches if _DESTINATION_BEFORE.search(text[:m.start()])]
+        chosen = (destinations or matches)[0]
+        names = {_CANONICAL_LOCATIONS[m.group(1).lower()] for m in (destinations or matches)}
+        return Attribute(_CANONICAL_LOCATIONS[chosen.group(1).lower()], 0.9 if len(names) == 1 else 0.6, "gazetteer")
+    for match in _PLACE_AFTER.finditer(text):
+        words = match.group(1).split()
+        while words and (words[-1].lower() in MONTHS or words[-1].lower() in SEASONS or words[-1].lower() in HOLIDAYS):
+            words.pop()
+        if words and words[0].lower() not in MONTHS and words[0].lower() not in SEASONS and words[0] != "I":
+            return Attribute(" ".join(words), 0.6, "pattern")
+    return None
+
+
+def extract(text, classifiers=None):
+    """
+    Finds the customer attributes in a message.
+
+    :param text: The customer's message.
+    :param classifiers: Optional {attribute: NaiveBayes}, consulted when no rule finds that attribute.
+    :return: {attribute: Attribute} for every attribute found.
+    """
+    lower = text.lower()
+    tokens = _tokens(lower)
+    found = {
+        "age_group": _age(lower, tokens),
+        "gender": _gender(text, tokens),
+        "season": _season(lower, tokens),
+        "location": _location(text),
+    }
+    for attribute, classifier in (classifiers or {}).items():
+        if found.get(attribute) is None:
+            value, probability = classifier.predict(text)
+            if value != NONE:
+                found[attribute] = Attribute(value, probability, "classifier")
+    return {attribute: value for attribute, value in found.items() if value is not None}
+
+
+def confident(found, threshold=0.8):
+    """The values of the attributes extracted with at least `threshold` confidence."""
+    return {attribute: value.value for attribute, value in found.items() if value.confidence >= threshold}
+
+
+class NaiveBayes:
+    """
+    Multinomial naive Bayes over word unigrams and bigrams, small enough to ship as JSON.
+
+    Trained per attribute on labelled queries, with NONE as the label of queries
+    that do not mention the attribute.
+    """
+
+    def __init__(self, log_priors, log_likelihoods, log_unknown):
+        self.log_priors = log_priors
+        self.log_likelihoods = log_likelihoods
+        self.log_unknown = log_unknown
+
+    @staticmethod
+    def features(text):
+        tokens = _TOKEN.findall(text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    @classmethod
+    def fit(cls, texts, labels, alpha=1.0):
+        counts = defaultdict(Counter)
+        for text, label in zip(texts, labels):
+            counts[label].update(cls.features(text))
+        vocabulary = set().union(*counts.values())
+        label_counts = Counter(labels)
+        log_priors, log_likelihoods, log_unknown = {}, {}, {}
+        for label, features in counts.items():
+            total = sum(features.values()) + alpha * (len(vocabulary) + 1)
+            log_priors[label] = math.log(label_counts[label] / len(labels))
+            log_likelihoods[label] = {feature: math.log((count + alpha) / total) for feature, count in features.items()}
+            log_unknown[label] = math.log(alpha / total)
+        return cls(log_priors, log_likelihoods, log_unknown)
+
+    def predict(self, text):
+        """Returns the most likely label and its posterior probability."""
+        features = self.features(text)
+        scores = {label: prior + sum(self.log_likelihoods[label].get(f, self.log_unknown[label]) for f in features)
+                  for label, prior in self.log_priors.items()}
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+    def to_dict(self):
+        return {"log_priors": self.log_priors, "log_likelihoods": self.log_likelihoods, "log_unknown": self.log_unknown}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["log_priors"], data["log_likelihoods"], data["log_unknown"])
+
+
+def train_classifiers(examples, attributes=("gender", "season", "age_group")):
+    """Fits one classifier per attribute on [(text, {attribute: value})]."""
+    texts = [text for text, _ in examples]
+    return {attribute: NaiveBayes.fit(texts, [labels.get(attribute, NONE) for _, labels in examples])
+            for attribute in attributes}
+
+
+def dumps_classifiers(classifiers):
+    return json.dumps({attribute: classifier.to_dict() for attribute, classifier in classifiers.items()})
+
+
+def loads_classifiers(data):
+    return {attribute: NaiveBayes.from_dict(value) for attribute, value in json.loads(data).items()}
+
+
+DEFAULT_CLASSIFIERS_TTL_SECONDS = 300.0
+
+_classifiers = {}
+_unavailable_until = {}
+_classifiers_lock = threading.Lock()
+
+
+def load_classifiers(bucket, key, ttl=DEFAULT_CLASSIFIERS_TTL_SECONDS):
+    """
+    Returns classifiers stored in S3, checking every `ttl` seconds whether they were retrained.
+
+    A missing or unreadable object returns None, so extraction uses the rules alone; it is tried
+    again after `ttl` seconds.
+    """
+    from botocore.exceptions import ClientError
+    from stylist_common.cached_object import CachedObject
+    with _classifiers_lock:
+        cached = _classifiers.get((bucket, key))
+        if cached is None:
+            cached = _classifiers[(bucket, key)] = CachedObject(
+                bucket, key, lambda body: loads_classifiers(body.read()), ttl=ttl)
+        if time.monotonic() < _unavailable_until.get((bucket, key), 0.0):
+            return None
+    try:
+        return cached.get()
+    except (ClientError, ValueError, KeyError) as e:
+        logger.warning("Attribute classifiers unavailable, using the rules alone", bucket=bucket, key=key,
+                       error=str(e))
+        with _classifiers_lock:
+            _unavailable_until[(bucket, key)] = time.monotonic() + ttl
+        return None
+
+
+def read_examples(path):
+    """Reads labelled queries, one JSON object per line with `query` and the attributes it mentions."""
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["query"], {attribute: row[attribute] for attribute in ATTRIBUTES if attribute in row}) for row in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Trains the optional attribute classifiers on labelled queries.")
+    parser.add_argument("examples", help="JSON lines with `query` plus age_group, gender, season and location when mentioned")
+    parser.add_argument("--bucket", required=True, help="Artifacts bucket the classifiers are written to")
+    parser.add_argument("--key", default="attributes/classifiers.json", help="Set it as ATTRIBUTE_CLASSIFIERS_KEY to use it")
+    args = parser.parse_args()
+    from stylist_common import runtime
+    runtime.client("s3").put_object(Bucket=args.bucket, Key=args.key,
+                                    Body=dumps_classifiers(train_classifiers(read_examples(args.examples))))
+    print(f"Uploaded classifiers to s3://{args.bucket}/{args.key}")
@@ -0,0 +1,449 @@
+"""
+Rate limited, self-retrying Bedrock invocation shared by the handlers.
+
+Each model id gets a token bucket, an adaptive (AIMD) concurrency limit and a
+circuit breaker. Throttles are retried with full-jitter backoff and, once
+retries are exhausted or the breaker is open, surface as BedrockUnavailable so
+handlers can degrade gracefully instead of exiting the warm container.
+
+Tuned through environment variables:
+
+- BEDROCK_RATE_LIMIT / BEDROCK_BURST: sustained requests per second and burst per model (default 5 / 10)
+- BEDROCK_MAX_CONCURRENCY: upper bound of the adaptive concurrency limit per model (default 8)
+- BEDROCK_MAX_ATTEMPTS: attempts per call including retries of throttles and transport errors (default 4)
+- BEDROCK_BREAKER_THRESHOLD / BEDROCK_BREAKER_RESET_SECONDS: consecutive failures that open the breaker and how long it stays open (default 5 / 30)
+
+Model calls can also be hedged against slow responses and fail over when a
+region has problems. Set BEDROCK_HEDGE_TARGETS to secondary endpoints, each a
+region (`us-west-2`) or a region and cross-region inference profile prefix
+(`us-east-1:us`, calling `us.<model id>`). A call that has not answered after
+the hedge delay is sent to the next healthy endpoint as well, and the first
+success wins; a call that fails with a regional error moves on at once. Each
+endpoint has its own guard, so its breaker tracks that region's health.
+
+- BEDROCK_HEDGE_DELAY_MS: fixed hedge delay; when unset, the p95 latency of the model's recent calls (2000ms until 20 calls have been seen)
+- BEDROCK_HEDGE_BUDGET: extra calls allowed as a fraction of calls (default 0.05), with a burst of BEDROCK_HEDGE_BURST (default 5)
+"""
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+
+from stylist_common import runtime
+
+RETRYABLE_ERRORS = frozenset([
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "InternalServerException",
+])
+
+
+class BedrockUnavailable(Exception):
+    """Raised when a Bedrock call cannot be served right now; the warm container stays usable."""
+
+
+def is_retryable(error):
+    if not isinstance(error, ClientError):
+        return False
+    # Errors raised while reading event streams use lower camel case codes, e.g. throttlingException
+    code = error.response.get("Error", {}).get("Code") or ""
+    return code[:1].upper() + code[1:] in RETRYABLE_ERRORS
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adjusted by additive increase, multiplicative decrease.
+
+    Each success raises the limit by 1/limit (about +1 per window of calls) and
+    each throttle halves it, so the limit converges on what the account quota allows.
+    """
+
+    def __init__(self, max_limit, min_limit=1, initial=None):
+        self.max_limit = float(max_limit)
+        self.min_limit = float(min_limit)
+        self.limit = float(initial or max(min_limit, max_limit / 2))
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled):
+        """Releases a slot; `throttled` of None leaves the limit unchanged."""
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            elif throttled is False:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call through after `reset_seconds`."""
+
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+class ModelGuard:
+    """Rate limiter, concurrency limiter and breaker for one model id."""
+
+    def __init__(self, rate, burst, max_concurrency, breaker_threshold, breaker_reset_seconds):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_seconds)
+        self.throttles = 0
+        self.calls = 0
+        # Hedged calls sent to this endpoint, and answers from it that were used
+        self.hedges = 0
+        self.wins = 0
+
+
+class HedgeBudget:
+    """
+    Caps hedged calls at a fraction of all calls.
+
+    Every call earns `ratio` of a token, up to `burst` tokens, and every hedge spends one.
+    """
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self.lock = threading.Lock()
+
+    def earn(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class LatencyWindow:
+    """Recent successful call latencies of one model, for the adaptive hedge delay."""
+
+    def __init__(self, size=256):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, fraction, min_samples=20):
+        with self.lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Endpoint:
+    """Where a model call is sent: a region and the model id to call there."""
+
+    def __init__(self, region, model_id, home):
+        self.region = region
+        self.model_id = model_id
+        # The home endpoint keeps the model id as its guard key, as calls without hedging do
+        self.key = model_id if home else f"{region}/{model_id}"
+
+
+def parse_targets(value):
+    """Parses BEDROCK_HEDGE_TARGETS into (region, inference profile prefix or None) pairs."""
+    targets = []
+    for entry in (value or "").split(","):
+        if entry.strip():
+            region, _, prefix = entry.strip().partition(":")
+            targets.append((region, prefix or None))
+    return targets
+
+
+def is_regional(error):
+    """Whether another region might serve a call that failed with `error`."""
+    return isinstance(error, (BedrockUnavailable, BotocoreConnectionError, HTTPClientError)) or is_retryable(error)
+
+
+class BedrockInvoker:
+    def __init__(self, rate=None, burst=None, max_concurrency=None, max_attempts=None,
+                 breaker_threshold=None, breaker_reset_seconds=None, base_delay=0.2, max_delay=8.0,
+                 acquire_timeout=30.0, sleep=time.sleep, hedge_targets=None, hedge_delay=None,
+                 hedge_budget=None, hedge_burst=None):
+        env = os.environ.get
+        self.rate = rate or float(env("BEDROCK_RATE_LIMIT", 5))
+        self.burst = burst or float(env("BEDROCK_BURST", 10))
+        self.max_concurrency = max_concurrency or int(env("BEDROCK_MAX_CONCURRENCY", 8))
+        self.max_attempts = max_attempts or int(env("BEDROCK_MAX_ATTEMPTS", 4))
+        self.breaker_threshold = breaker_threshold or int(env("BEDROCK_BREAKER_THRESHOLD", 5))
+        self.breaker_reset_seconds = breaker_reset_seconds or float(env("BEDROCK_BREAKER_RESET_SECONDS", 30))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.acquire_timeout = acquire_timeout
+        self.sleep = sleep
+        self.guards = {}
+        self.lock = threading.Lock()
+        self.hedge_targets = parse_targets(env("BEDROCK_HEDGE_TARGETS")) if hedge_targets is None else hedge_targets
+        if hedge_delay is None and env("BEDROCK_HEDGE_DELAY_MS"):
+            hedge_delay = float(env("BEDROCK_HEDGE_DELAY_MS")) / 1000
+        self.hedge_delay = hedge_delay
+        self.hedge_budget = HedgeBudget(float(env("BEDROCK_HEDGE_BUDGET", 0.05)) if hedge_budget is None else hedge_budget,
+                                        float(env("BEDROCK_HEDGE_BURST", 5)) if hedge_burst is None else hedge_burst)
+        self.latencies = {}
+        self._executor = None
+
+    def guard(self, key):
+        with self.lock:
+            if key not in self.guards:
+                self.guards[key] = ModelGuard(self.rate, self.burst, self.max_concurrency,
+                                              self.breaker_threshold, self.breaker_reset_seconds)
+            return self.guards[key]
+
+    def backoff(self, attempt):
+        # Full jitter: uniform between 0 and the capped exponential delay
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, key, fn, *args, **kwargs):
+        """
+        Calls `fn` under the guard for `key`, retrying throttles and transport errors with jittered backoff.
+
+        Every error except a request Bedrock rejected on its merits (a
+        non-retryable ClientError such as ValidationException) counts as a
+        breaker failure, and the breaker's half-open trial always ends with the
+        attempt, whatever it raised.
+
+        :param key: Usually the model id; calls sharing a key share limits.
+        :raises BedrockUnavailable: When the breaker is open, limits cannot be acquired or retries are exhausted.
+        """
+        guard = self.guard(key)
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if not guard.bucket.acquire(self.acquire_timeout):
+                raise BedrockUnavailable(f"Rate limit wait exceeded for {key}")
+            if not guard.limiter.acquire(self.acquire_timeout):
+                raise BedrockUnavailable(f"Concurrency limit wait exceeded for {key}")
+            throttled = None
+            allowed = healthy = False
+            try:
+                if not guard.breaker.allow():
+                    raise BedrockUnavailable(f"Circuit open for {key}")
+                allowed = True
+                guard.calls += 1
+                try:
+                    result = fn(*args, **kwargs)
+                except ClientError as e:
+                    if not is_retryable(e):
+                        throttled = False
+                        healthy = True
+                        raise
+                    throttled = True
+                    guard.throttles += 1
+                    last_error = e
+                except (BotocoreConnectionError, HTTPClientError) as e:
+                    # Connection failures and read timeouts: Bedrock did not answer, so try again
+                    last_error = e
+                else:
+                    throttled = False
+                    healthy = True
+                    return result
+            finally:
+                guard.limiter.release(throttled)
+                if allowed:
+                    if healthy:
+                        guard.breaker.record_success()
+                    else:
+                        guard.breaker.record_failure()
+            if attempt + 1 < self.max_attempts:
+                self.sleep(self.backoff(attempt))
+        raise BedrockUnavailable(
+            f"Bedrock call for {key} failed after {self.max_attempts} attempts: {last_error}") from last_error
+
+    def invoke_model(self, modelId, body, **kwargs):
+        if self.hedge_targets:
+            return self.hedged_invoke_model(modelId, body, **kwargs)
+        # The invoker owns retries, so the client itself makes a single attempt
+        client = runtime.client("bedrock-runtime", max_attempts=1)
+        return self.call(modelId, client.invoke_model, modelId=modelId, body=body, **kwargs)
+
+    def endpoints(self, model_id):
+        """The home endpoint and the hedge targets, healthy ones first."""
+        endpoints = [Endpoint(os.environ.get("AWS_REGION"), model_id, home=True)]
+        endpoints += [Endpoint(region, f"{prefix}.{model_id}" if prefix else model_id, home=False)
+                      for region, prefix in self.hedge_targets]
+        return sorted(endpoints, key=lambda endpoint: self.guard(endpoint.key).breaker.state == "open")
+
+    def delay(self, model_id):
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        window = self.latencies.get(model_id)
+        p95 = window.percentile(0.95) if window else None
+        return 2.0 if p95 is None else p95
+
+    def _invoke_endpoint(self, endpoint, body, kwargs):
+        client = runtime.client("bedrock-runtime", region_name=endpoint.region, max_attempts=1)
+        start = time.monotonic()
+        result = self.call(endpoint.key, client.invoke_model, modelId=endpoint.model_id, body=body, **kwargs)
+        return result, time.monotonic() - start
+
+    def hedged_invoke_model(self, modelId, body, **kwargs):
+        """
+        Invokes a model on the first healthy endpoint, hedging slow calls and failing over on regional errors.
+
+        Calls that lose the race are left to finish in the background and their
+        responses are closed; boto3 cannot abort a request in flight.
+        """
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=int(os.environ.get("BEDROCK_HEDGE_WORKERS", 16)))
+            window = self.latencies.setdefault(modelId, LatencyWindow())
+        self.hedge_budget.earn()
+        remaining = self.endpoints(modelId)
+        pending = {}
+        errors = []
+
+        def start(endpoint):
+            future = self._executor.submit(contextvars.copy_context().run, self._invoke_endpoint, endpoint, body, kwargs)
+            pending[future] = endpoint
+
+        start(remaining.pop(0))
+        delay = self.delay(modelId)
+        while pending:
+            done, _ = wait(pending, timeout=delay if remaining else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # Too slow: send the same call to the next endpoint too, if the budget allows
+                if self.hedge_budget.spend():
+                    endpoint = remaining.pop(0)
+                    self.guard(endpoint.key).hedges += 1
+                    start(endpoint)
+                else:
+                    delay = None
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result, elapsed = future.result()
+                except Exception as e:
+                    if not is_regional(e) and endpoint.key == modelId:
+                        # The request itself was rejected, and other regions would reject it too
+                        _abandon(pending)
+                        raise
+                    # A secondary region can also reject a call, e.g. when the model is not enabled there
+                    errors.append(e)
+                    if remaining and not pending:
+                        # Fail over at once; this replaces the failed call, so it is not charged to the budget
+                        start(remaining.pop(0))
+                    continue
+                window.add(elapsed)
+                self.guard(endpoint.key).wins += 1
+                _abandon(pending)
+                return result
+        regional = [e for e in errors if is_regional(e)]
+        if not regional:
+            raise errors[-1]
+        raise BedrockUnavailable(f"Every endpoint failed for {modelId}: {regional[-1]}") from regional[-1]
+
+
+def _abandon(futures):
+    """Closes the responses of calls that lost the race once they finish."""
+    for future in futures:
+        future.add_done_callback(_close_response)
+
+
+def _close_response(future):
+    """Releases the connection of a response nobody will read."""
+    try:
+        result, _ = future.result()
+        result["body"].close()
+    except Exception:
+        pass
+
+
+_default = None
+
+
+def invoker():
+    """Returns the invoker shared by every request in the warm container."""
+    global _default
+    if _default is None:
+        _default = BedrockInvoker()
+    return _default
+
+
+def invoke_model(modelId, body, **kwargs):
+    return invoker().invoke_model(modelId, body, **kwargs)
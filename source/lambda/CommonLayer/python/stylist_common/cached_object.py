@@ -0,0 +1,68 @@
+"""
+An S3 object loaded once per warm container and reloaded when it changes.
+
+Snapshots such as the co-purchase index are rewritten by other functions while
+containers that loaded them stay warm for hours. The loaded value is served
+for `ttl` seconds after it was read or checked; after that a conditional GET
+(If-None-Match with the object's ETag) confirms it is current, and only a
+changed object is transferred and loaded again.
+"""
+import threading
+import time
+
+
+class CachedObject:
+    """
+    The value loaded from one S3 object, revalidated by ETag every `ttl` seconds.
+
+    :param load: Function turning the object's streaming body into the value.
+    :param ttl: Seconds the value is served before S3 is asked whether it changed.
+    """
+
+    def __init__(self, bucket, key, load, ttl=60.0, clock=None):
+        self.bucket = bucket
+        self.key = key
+        self.load = load
+        self.ttl = ttl
+        self.clock = clock or time.monotonic
+        self.loads = 0
+        self._lock = threading.Lock()
+        self._value = self._etag = None
+        self._checked = None
+
+    def get(self):
+        """
+        The current value, reading the object on first use or when it changed.
+
+        Raises botocore's ClientError (NoSuchKey) when the object does not exist.
+        """
+        from botocore.exceptions import ClientError
+        from stylist_common import runtime
+        with self._lock:
+            now = self.clock()
+            if self._checked is not None and now - self._checked < self.ttl:
+                return self._value
+            kwargs = {"IfNoneMatch": self._etag} if self._etag else {}
+            try:
+                response = runtime.client("s3").get_object(Bucket=self.bucket, Key=self.key, **kwargs)
+            except ClientError as e:
+                if self._etag and e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                    self._checked = now
+                    return self._value
+                raise
+            self._value = self.load(response["Body"])
+            self._etag = response.get("ETag", "").strip('"') or None
+            self._checked = now
+            self.loads += 1
+            return self._value
+
+    def set(self, value, etag):
+        """Adopts a value this container has just written to the object, with the ETag S3 returned."""
+        with self._lock:
+            self._value = value
+            self._etag = (etag or "").strip('"') or None
+            self._checked = self.clock()
+
+    def reset(self):
+        with self._lock:
+            self._value = self._etag = self._checked = None
@@ -0,0 +1,242 @@
+import io
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Pair and basket keys pack two 32-bit indexes into one int64 so they sort by the first index
+SHIFT = np.int64(32)
+MASK = np.int64(0xFFFFFFFF)
+
+# Upper bound on the number of (item, item) pairs materialised at once while building
+PAIR_CHUNK = 20_000_000
+
+
+def item_label(name, brand):
+    return f"{name} ({brand})" if brand else name
+
+
+def _pack(high, low):
+    return (np.asarray(high, dtype=np.int64) << SHIFT) | np.asarray(low, dtype=np.int64)
+
+
+def _basket_pairs(items, starts, lengths):
+    """Returns packed (item, other item) keys for every ordered pair inside each basket."""
+    row_lengths = np.repeat(lengths, lengths)
+    row_starts = np.repeat(starts, lengths)
+    rows = np.arange(starts[0], starts[-1] + lengths[-1])
+    repeated = np.repeat(rows, row_lengths)
+    block_starts = np.cumsum(row_lengths) - row_lengths
+    offsets = np.arange(len(repeated)) - np.repeat(block_starts, row_lengths)
+    partners = np.repeat(row_starts, row_lengths) + offsets
+    keep = repeated != partners
+    return _pack(items[repeated[keep]], items[partners[keep]])
+
+
+class CoPurchaseIndex:
+    """
+    "Frequently bought together" index built from order history.
+
+    Two items co-occur once for every customer who has bought both. Counts are
+    kept as a sorted sparse array of packed (item, item) keys plus a small
+    dict of increments from orders added since the last compaction, and the
+    top neighbours of every item are precomputed so a lookup is a dict access.
+    """
+
+    def __init__(self, items, customers, basket_keys, pair_keys, pair_counts, top_n=10, last_order_id=0):
+        self.items = list(items)
+        self.item_ids = {label: i for i, label in enumerate(self.items)}
+        self.customers = list(customers)
+        self.customer_ids = {customer: i for i, customer in enumerate(self.customers)}
+        self.basket_keys = basket_keys
+        self.pair_keys = pair_keys
+        self.pair_counts = pair_counts
+        self.top_n = top_n
+        self.last_order_id = last_order_id
+        self.new_baskets = defaultdict(set)
+        self.new_pairs = defaultdict(Counter)
+        self.neighbours = {}
+        self._by_name = defaultdict(list)
+        for i, label in enumerate(self.items):
+            self._by_name[label.split(" (")[0].lower()].append(i)
+        self._rank_all()
+
+    @classmethod
+    def from_arrays(cls, customer_codes, item_codes, customers, items, top_n=10, last_order_id=0):
+        """
+        Builds the index from parallel arrays of customer and item indexes, one entry per order.
+
+        :param customer_codes: Index into `customers` for each order.
+        :param item_codes: Index into `items` for each order.
+        :param customers: Customer ids.
+        :param items: Item labels.
+        """
+        basket_keys = np.unique(_pack(customer_codes, item_codes))
+        basket_items = basket_keys & MASK
+        basket_customers = basket_keys >> SHIFT
+        starts = np.flatnonzero(np.r_[True, basket_customers[1:] != basket_customers[:-1]])
+        lengths = np.diff(np.r_[starts, len(basket_keys)])
+
+        # Materialise pairs for a bounded number of baskets at a time
+        chunk_keys, chunk_counts = [], []
+        pair_totals = np.cumsum(lengths.astype(np.int64) ** 2)
+        first = 0
+        while first < len(starts):
+            budget = (pair_totals[first - 1] if first else 0) + PAIR_CHUNK
+            last = max(first + 1, int(np.searchsorted(pair_totals, budget, side="right")))
+            keys = _basket_pairs(basket_items, starts[first:last], lengths[first:last])
+            keys, counts = np.unique(keys, return_counts=True)
+            chunk_keys.append(keys)
+            chunk_counts.append(counts)
+            first = last
+
+        if chunk_keys:
+            keys, inverse = np.unique(np.concatenate(chunk_keys), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate(chunk_counts)).astype(np.int64)
+        else:
+            keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return cls(items, customers, basket_keys, keys, counts, top_n=top_n, last_order_id=last_order_id)
+
+    @classmethod
+    def build(cls, orders, top_n=10):
+        """Builds the index from Order tuples."""
+        items, item_ids = [], {}
+        customers, customer_ids = [], {}
+        customer_codes, item_codes = [], []
+        last_order_id = 0
+        for order in orders:
+            label = item_label(order.name, order.brand)
+            if label not in item_ids:
+                item_ids[label] = len(items)
+                items.append(label)
+            if order.customer_id not in customer_ids:
+                customer_ids[order.customer_id] = len(customers)
+                customers.append(order.customer_id)
+            customer_codes.append(customer_ids[order.customer_id])
+            item_codes.append(item_ids[label])
+            last_order_id = max(last_order_id, order.order_id)
+        return cls.from_arrays(customer_codes, item_codes, customers, items, top_n=top_n, last_order_id=last_order_id)
+
+    def _basket(self, customer):
+        lo, hi = np.searchsorted(self.basket_keys, [customer << 32, (customer + 1) << 32])
+        return set((self.basket_keys[lo:hi] & MASK).tolist()) | self.new_baskets.get(customer, set())
+
+    def _row(self, item):
+        lo, hi = np.searchsorted(self.pair_keys, [item << 32, (item + 1) << 32])
+        row = Counter(dict(zip((self.pair_keys[lo:hi] & MASK).tolist(), self.pair_counts[lo:hi].tolist())))
+        row.update(self.new_pairs.get(item, {}))
+        return row
+
+    def _rank(self, item):
+        ranked = sorted(self._row(item).items(), key=lambda pair: (-pair[1], pair[0]))[:self.top_n]
+        self.neighbours[self.items[item]] = [(self.items[other], count) for other, count in ranked]
+
+    def _rank_all(self):
+        self.neighbours = {label: [] for label in self.items}
+        if not len(self.pair_keys):
+            return
+        rows = self.pair_keys >> SHIFT
+        order = np.lexsort((self.pair_keys & MASK, -self.pair_counts, rows))
+        rows = rows[order]
+        row_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        ranks = np.arange(len(rows)) - np.repeat(row_starts, np.diff(np.r_[row_starts, len(rows)]))
+        keep = order[ranks < self.top_n]
+        for item, other, count in zip((self.pair_keys[keep] >> SHIFT).tolist(), (self.pair_keys[keep] & MASK).tolist(), self.pair_counts[keep].tolist()):
+            self.neighbours[self.items[item]].append((self.items[other], count))
+        for item in set(self.new_pairs):
+            self._rank(item)
+
+    def add_orders(self, orders):
+        """
+        Applies orders newer than `last_order_id` and re-ranks only the items they touch.
+
+        :return: Number of orders applied.
+        """
+        touched = set()
+        applied = 0
+        for order in sorted(orders, key=lambda order: order.order_id):
+            if order.order_id <= self.last_order_id:
+                continue
+            applied += 1
+            self.last_order_id = order.order_id
+            label = item_label(order.name, order.brand)
+            if label not in self.item_ids:
+                self.item_ids[label] = len(self.items)
+                self.items.append(label)
+                self._by_name[order.name.lower()].append(self.item_ids[label])
+                self.neighbours[label] = []
+            if order.customer_id not in self.customer_ids:
+                self.customer_ids[order.customer_id] = len(self.customers)
+                self.customers.append(order.customer_id)
+            item = self.item_ids[label]
+            customer = self.customer_ids[order.customer_id]
+            basket = self._basket(customer)
+            if item in basket:
+                continue
+            for other in basket:
+                self.new_pairs[item][other] += 1
+                self.new_pairs[other][item] += 1
+                touched.add(other)
+            self.new_baskets[customer].add(item)
+            touched.add(item)
+        for item in touched:
+            self._rank(item)
+        return applied
+
+    def compact(self):
+        """Folds incremental updates back into the sorted base arrays."""
+        if self.new_pairs:
+            delta_keys = np.array([(item << 32) | other for item, row in self.new_pairs.items() for other in row], dtype=np.int64)
+            delta_counts = np.array([count for row in self.new_pairs.values() for count in row.values()], dtype=np.int64)
+            keys, inverse = np.unique(np.concatenate([self.pair_keys, delta_keys]), return_inverse=True)
+            self.pair_counts = np.bincount(inverse, weights=np.concatenate([self.pair_counts, delta_counts])).astype(np.int64)
+            self.pair_keys = keys
+        if self.new_baskets:
+            delta_keys = np.array([(customer << 32) | item for customer, items in self.new_baskets.items() for item in items], dtype=np.int64)
+            self.basket_keys = np.union1d(self.basket_keys, delta_keys)
+        self.new_pairs = defaultdict(Counter)
+        self.new_baskets = defaultdict(set)
+
+    def recommend(self, query, limit=5):
+        """
+        Returns items most often bought together with `query`.
+
+        :param query: An item label such as "Shirt (H&M)", or just an item name to merge all brands.
+        :param limit: Maximum number of recommendations.
+        :return: A list of (item label, co-purchase count) tuples.
+        """
+        if query in self.neighbours:
+            return self.neighbours[query][:limit]
+        matches = self._by_name.get(query.strip().lower(), [])
+        if len(matches) == 1:
+            return self.neighbours[self.items[matches[0]]][:limit]
+        merged = Counter()
+        excluded = {self.items[item] for item in matches}
+        for item in matches:
+            for other, count in self.neighbours[self.items[item]]:
+                if other not in excluded:
+                    merged[other] += count
+        return sorted(merged.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+
+    def dumps(self):
+        """Serialises the compacted index to bytes."""
+        self.compact()
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            items=np.array(self.items, dtype=str),
+            customers=np.array(self.customers, dtype=str),
+            basket_keys=self.basket_keys,
+            pair_keys=self.pair_keys,
+            pair_counts=self.pair_counts,
+            meta=np.array([self.top_n, self.last_order_id], dtype=np.int64),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            top_n, last_order_id = arrays["meta"].tolist()
+            return cls(
+                arrays["items"].tolist(), arrays["customers"].tolist(), arrays["basket_keys"],
+                arrays["pair_keys"], arrays["pair_counts"], top_n=top_n, last_order_id=last_order_id,
+            )
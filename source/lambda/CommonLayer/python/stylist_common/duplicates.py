@@ -0,0 +1,210 @@
+"""
+Offline detection of near-duplicate catalog images.
+
+Product shoots upload many near-identical images of one item. This job finds
+every pair of images in the same embedding space whose cosine similarity is at
+least a threshold, with a similarity join computed as blocked matrix
+multiplies: each block of rows is multiplied by the blocks of rows after it.
+
+The catalog is never held in memory as one matrix. The table is scanned page
+by page and every space's unit vectors are written to a spill directory in
+blocks of `block` rows (float32, so 1M vectors of 1024 dimensions take 4 GB of
+disk), which the join reads back memory-mapped. Memory is bounded by two
+blocks and one `block` x `block` matrix of scores, plus the id and image key
+of every image.
+
+Images are then grouped around canonical images. Taking images in image key
+order, an image not yet claimed becomes canonical and claims its unclaimed
+neighbours, so the first shot of a series (e.g. `_01`) is the one kept and
+every duplicate is within the threshold of its canonical image, without
+chains of similar images merging distinct products. Duplicates are marked
+with `duplicate_of`, the id of their canonical image, and are left out of
+search results.
+
+Run from the `source` directory:
+
+    PYTHONPATH=lambda/CommonLayer/python python -m stylist_common.duplicates --table <EmbeddingsTable name>
+"""
+import os
+import tempfile
+
+DUPLICATE_ATTRIBUTE = "duplicate_of"
+DEFAULT_THRESHOLD = 0.97
+DEFAULT_BLOCK = 4096
+
+
+def similar_pairs(matrix, threshold, block=DEFAULT_BLOCK, stop=None):
+    """
+    Yields every pair of rows (i < j) of a unit-normalised matrix whose dot product is at least `threshold`.
+
+    :param stop: Only pairs whose first row is below `stop`, to split the join or sample it.
+    :return: Generator of (rows, columns, scores) arrays, one per block product with any pair.
+    """
+    return join_blocks([matrix[start:start + block] for start in range(0, len(matrix), block)], threshold, block, stop)
+
+
+def join_blocks(blocks, threshold, block=DEFAULT_BLOCK, stop=None):
+    """
+    Yields the pairs of `similar_pairs` for a matrix given as consecutive blocks of rows.
+
+    :param blocks: A sequence of arrays of `block` rows (the last may be shorter), such as memory-mapped files;
+        only two are read at a time.
+    """
+    import numpy as np
+    for a in range(len(blocks)):
+        start = a * block
+        if stop is not None and start >= stop:
+            break
+        own = np.asarray(blocks[a])
+        rows = own if stop is None else own[:stop - start]
+        for b in range(a, len(blocks)):
+            column = b * block
+            scores = rows @ (own if b == a else np.asarray(blocks[b])).T
+            if b == a:
+                # Each pair once, and not an image with itself
+                scores[np.tril_indices(len(rows), m=len(own))] = -np.inf
+            i, j = np.nonzero(scores >= threshold)
+            if len(i):
+                yield i + start, j + column, scores[i, j]
+
+
+class SpilledVectors:
+    """
+    The unit vectors of one embedding space, written to `directory` in blocks of `block` rows as they are added.
+
+    Reading the blocks back (`blocks`) memory-maps them, so only the blocks being multiplied are resident.
+    """
+
+    def __init__(self, directory, name, dimension, block=DEFAULT_BLOCK):
+        import numpy as np
+        self.directory = directory
+        self.name = name
+        self.block = block
+        self.ids = []
+        self.image_keys = []
+        self.paths = []
+        self._pending = np.empty((block, dimension), dtype=np.float32)
+        self._filled = 0
+
+    def add(self, item_id, image_key, vector):
+        self.ids.append(item_id)
+        self.image_keys.append(image_key)
+        self._pending[self._filled] = [float(x) for x in vector]
+        self._filled += 1
+        if self._filled == self.block:
+            self.flush()
+
+    def flush(self):
+        import numpy as np
+        if not self._filled:
+            return
+        matrix = self._pending[:self._filled]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        path = os.path.join(self.directory, f"{self.name}-{len(self.paths):06d}.npy")
+        np.save(path, matrix / norms)
+        self.paths.append(path)
+        self._filled = 0
+
+    def blocks(self):
+        import numpy as np
+        self.flush()
+        return [np.load(path, mmap_mode="r") for path in self.paths]
+
+    def duplicates(self, threshold):
+        """Returns {duplicate id: canonical id} among the vectors added."""
+        found = assign_canonical(self.image_keys, join_blocks(self.blocks(), threshold, self.block))
+        return {self.ids[row]: self.ids[canonical] for row, canonical in found.items()}
+
+
+def assign_canonical(keys, pairs):
+    """
+    Groups rows into canonical images and their duplicates.
+
+    :param keys: Sort key of each row; the smallest of a group is its canonical image.
+    :param pairs: (rows, columns, scores) arrays from `similar_pairs`.
+    :return: {duplicate row: canonical row}.
+    """
+    neighbours = {}
+    for rows, columns, _ in pairs:
+        for i, j in zip(rows.tolist(), columns.tolist()):
+            neighbours.setdefault(i, []).append(j)
+            neighbours.setdefault(j, []).append(i)
+    claimed = {}
+    for row in sorted(neighbours, key=lambda row: keys[row]):
+        if row in claimed:
+            continue
+        claimed[row] = row
+        for neighbour in neighbours[row]:
+            claimed.setdefault(neighbour, row)
+    return {row: canonical for row, canonical in claimed.items() if row != canonical}
+
+
+def find_duplicates(items, threshold=DEFAULT_THRESHOLD, block=DEFAULT_BLOCK):
+    """Returns {duplicate id: canonical id} for table items with vectors."""
+    from stylist_common.vector_index import build_indexes
+    duplicates = {}
+    for index in build_indexes(items).values():
+        found = assign_canonical(index.image_keys, similar_pairs(index.matrix, threshold, block))
+        duplicates.update({index.ids[row]: index.ids[canonical] for row, canonical in found.items()})
+    return duplicates
+
+
+def mark_duplicates(table_name, threshold=DEFAULT_THRESHOLD, block=DEFAULT_BLOCK, dry_run=False, spill_dir=None):
+    """
+    Marks the duplicates of the embeddings table and unmarks images no longer duplicates.
+
+    :param spill_dir: Where the vectors are spilled during the join; the system's temporary directory by default.
+    :return: (items, duplicates found, items updated).
+    """
+    from stylist_common import runtime
+    from stylist_common.embeddings import item_space, scan_pages
+    table = runtime.table(table_name)
+    items = 0
+    # Only the ids already marked are kept from the scan, to find the marks to change
+    marked = {}
+    duplicates = {}
+    pages = scan_pages(table, ProjectionExpression="id, image_key, embedding_dim, #projection, #vector, #duplicate",
+                       ExpressionAttributeNames={"#projection": "projection", "#vector": "vector",
+                                                 "#duplicate": DUPLICATE_ATTRIBUTE})
+    with tempfile.TemporaryDirectory(prefix="duplicates-", dir=spill_dir) as directory:
+        spaces = {}
+        for page in pages:
+            for item in page:
+                items += 1
+                if DUPLICATE_ATTRIBUTE in item:
+                    marked[item["id"]] = item[DUPLICATE_ATTRIBUTE]
+                if "vector" not in item:
+                    continue
+                space = item_space(item)
+                if space not in spaces:
+                    spaces[space] = SpilledVectors(directory, f"space-{len(spaces)}", len(item["vector"]), block)
+                spaces[space].add(item["id"], item["image_key"], item["vector"])
+        for vectors in spaces.values():
+            duplicates.update(vectors.duplicates(threshold))
+
+    changes = {item_id: canonical for item_id, canonical in duplicates.items() if marked.get(item_id) != canonical}
+    changes.update((item_id, None) for item_id in marked if item_id not in duplicates)
+    if not dry_run:
+        for item_id, canonical in changes.items():
+            if canonical is None:
+                table.update_item(Key={"id": item_id}, UpdateExpression="REMOVE #duplicate",
+                                  ExpressionAttributeNames={"#duplicate": DUPLICATE_ATTRIBUTE})
+            else:
+                table.update_item(Key={"id": item_id}, UpdateExpression="SET #duplicate = :canonical",
+                                  ExpressionAttributeNames={"#duplicate": DUPLICATE_ATTRIBUTE},
+                                  ExpressionAttributeValues={":canonical": canonical})
+    return items, len(duplicates), len(changes)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Marks near-duplicate images in the product embeddings table.")
+    parser.add_argument("--table", required=True, help="Product embeddings table")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Cosine similarity of duplicates")
+    parser.add_argument("--block", type=int, default=DEFAULT_BLOCK, help="Rows multiplied at a time")
+    parser.add_argument("--dry-run", action="store_true", help="Count the duplicates without updating the table")
+    parser.add_argument("--spill-dir", help="Directory the vectors are spilled to, 4 bytes per dimension per image")
+    args = parser.parse_args()
+    total, found, changed = mark_duplicates(args.table, args.threshold, args.block, args.dry_run, args.spill_dir)
+    print(f"{found} of {total} images are duplicates; {changed} items " + ("to update" if args.dry_run else "updated"))
@@ -0,0 +1,174 @@
+"""
+Embedding spaces for product image search.
+
+A space is the output length requested from the embeddings model plus the
+version of an optional PCA projection applied to the model output. Every
+stored vector records its space (`embedding_dim` and `projection`), so a
+table holding vectors from several spaces is searched by embedding the query
+once per space instead of comparing vectors that live in different spaces.
+
+Tuned through environment variables:
+
+- EMBEDDING_DIMENSION: output length requested from the model; Titan Multimodal Embeddings offers 256, 384 and 1024 (default 1024)
+- PROJECTION_VERSION: PCA projection applied to new vectors, stored in ARTIFACT_BUCKET under `embeddings/projection-<version>.npz` (default none)
+
+Projections are trained offline on the catalog's own vectors by running this
+module (see `train_projection`), and numpy is only imported when one is in use.
+"""
+import io
+import json
+import os
+import threading
+from collections import namedtuple
+
+DEFAULT_DIMENSION = 1024
+NO_PROJECTION = "none"
+PROJECTION_KEY = "embeddings/projection-{version}.npz"
+
+
+class Space(namedtuple("Space", ["dimension", "projection"])):
+    """Model output length and projection version that together define comparable vectors."""
+
+
+def configured_space():
+    """The space new vectors and queries are written in."""
+    return Space(int(os.environ.get("EMBEDDING_DIMENSION", DEFAULT_DIMENSION)),
+                 os.environ.get("PROJECTION_VERSION") or NO_PROJECTION)
+
+
+def item_space(item):
+    # Vectors stored before spaces were recorded are full model outputs
+    return Space(int(item.get("embedding_dim") or len(item["vector"])), item.get("projection") or NO_PROJECTION)
+
+
+def request_body(dimension, text=None, image_base64=None):
+    """Builds an embeddings model request for the given output length."""
+    body = {}
+    if text is not None:
+        body["inputText"] = text
+    if image_base64 is not None:
+        body["inputImage"] = image_base64
+    # Only ask for a length explicitly when it differs from the default, so models without the option keep working
+    if dimension != DEFAULT_DIMENSION:
+        body["embeddingConfig"] = {"outputEmbeddingLength": dimension}
+    return json.dumps(body)
+
+
+class Projection:
+    """
+    PCA projection from the model's output to fewer dimensions.
+
+    :param version: Identifies the projection; vectors record it so a retrained projection never mixes with an old one.
+    :param mean: Mean of the training vectors, shape (dimension,).
+    :param components: Principal axes, shape (components, dimension).
+    """
+
+    def __init__(self, version, mean, components):
+        self.version = version
+        self.mean = mean
+        self.components = components
+
+    @property
+    def input_dimension(self):
+        return self.components.shape[1]
+
+    @property
+    def output_dimension(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors, components, version):
+        """Learns the top `components` principal axes of `vectors` (a list or 2-D array)."""
+        import numpy as np
+        matrix = np.asarray(vectors, dtype=np.float64)
+        mean = matrix.mean(axis=0)
+        _, _, vt = np.linalg.svd(matrix - mean, full_matrices=False)
+        return cls(version, mean.astype(np.float32), vt[:components].astype(np.float32))
+
+    def apply(self, vector):
+        """Projects one vector and returns it unit length, as a list of floats."""
+        import numpy as np
+        projected = self.components @ (np.asarray(vector, dtype=np.float32) - self.mean)
+        norm = np.linalg.norm(projected) or 1.0
+        return (projected / norm).tolist()
+
+    def dumps(self):
+        import numpy as np
+        buffer = io.BytesIO()
+        np.savez(buffer, mean=self.mean, components=self.components, version=np.array(self.version))
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        import numpy as np
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(str(arrays["version"]), arrays["mean"], arrays["components"])
+
+
+_projections = {}
+_projections_lock = threading.Lock()
+
+
+def load_projection(version, bucket=None):
+    """Returns a projection from the artifacts bucket, cached for the warm container."""
+    with _projections_lock:
+        if version not in _projections:
+            from stylist_common import runtime
+            bucket = bucket or os.environ["ARTIFACT_BUCKET"]
+            data = runtime.client("s3").get_object(Bucket=bucket, Key=PROJECTION_KEY.format(version=version))["Body"].read()
+            _projections[version] = Projection.loads(data)
+        return _projections[version]
+
+
+def to_space(embedding, space):
+    """Turns a model embedding of length `space.dimension` into the vector stored for `space`."""
+    if space.projection == NO_PROJECTION:
+        return embedding
+    projection = load_projection(space.projection)
+    if projection.input_dimension != len(embedding):
+        raise ValueError(f"Projection {space.projection} expects {projection.input_dimension} dimensions, got {len(embedding)}")
+    return projection.apply(embedding)
+
+
+def scan_pages(table, **kwargs):
+    """Yields the items of a table one scan page at a time, so callers need not hold them all."""
+    response = table.scan(**kwargs)
+    yield response["Items"]
+    while "LastEvaluatedKey" in response:
+        response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"], **kwargs)
+        yield response["Items"]
+
+
+def scan_all(table, **kwargs):
+    """Reads every item of a table, following scan pagination."""
+    return [item for page in scan_pages(table, **kwargs) for item in page]
+
+
+def train_projection(table_name, components, version, bucket, dimension=DEFAULT_DIMENSION):
+    """
+    Fits a projection on the unprojected vectors of `dimension` in a table and uploads it.
+
+    :return: The fitted projection.
+    """
+    from stylist_common import runtime
+    source = Space(dimension, NO_PROJECTION)
+    vectors = [[float(x) for x in item["vector"]] for item in scan_all(runtime.table(table_name))
+               if item_space(item) == source]
+    if len(vectors) < components:
+        raise ValueError(f"Need at least {components} vectors of dimension {dimension}, found {len(vectors)}")
+    projection = Projection.fit(vectors, components, version)
+    runtime.client("s3").put_object(Bucket=bucket, Key=PROJECTION_KEY.format(version=version), Body=projection.dumps())
+    return projection
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Trains a PCA projection on the catalog's image embeddings.")
+    parser.add_argument("--table", required=True, help="Product embeddings table")
+    parser.add_argument("--bucket", required=True, help="Artifacts bucket the projection is written to")
+    parser.add_argument("--components", type=int, default=256)
+    parser.add_argument("--version", required=True, help="e.g. pca256-v1; set it as PROJECTION_VERSION to use it")
+    parser.add_argument("--dimension", type=int, default=DEFAULT_DIMENSION, help="Model output length of the vectors to train on")
+    args = parser.parse_args()
+    trained = train_projection(args.table, args.components, args.version, args.bucket, args.dimension)
+    print(f"Uploaded projection {trained.version}: {trained.input_dimension} -> {trained.output_dimension} dimensions")
@@ -0,0 +1,192 @@
+"""
+Two-tier cache of S3 objects for a warm container, such as the images returned by search.
+
+Popular catalog items appear in the results of many queries. Objects are kept
+in memory, in an LRU bounded by bytes, and in the function's `/tmp` storage,
+evicted by size in least recently used order. Entries are keyed by bucket,
+key and ETag. An entry is served without asking S3 for `ttl` seconds after it
+was fetched or checked. After that it is revalidated with a conditional GET,
+which transfers the object again only if its ETag changed.
+
+Tuned through environment variables:
+
+- IMAGE_CACHE_MEMORY_MB: bytes kept in memory (default 16)
+- IMAGE_CACHE_DISK_MB: bytes kept under IMAGE_CACHE_DIR, 0 to disable (default 256)
+- IMAGE_CACHE_DIR: directory for the disk tier (default /tmp/image-cache)
+- IMAGE_CACHE_TTL_SECONDS: how long an entry is served before it is revalidated (default 300)
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+MB = 1024 * 1024
+
+
+class ImageCache:
+    """
+    Memory and disk tiers in front of S3 GetObject.
+
+    :param memory_bytes: Largest total size of the objects kept in memory.
+    :param disk_dir: Directory of the disk tier; None disables it.
+    :param disk_bytes: Largest total size of the files kept in `disk_dir`.
+    :param ttl: Seconds an entry is served before it is revalidated with S3.
+    """
+
+    def __init__(self, memory_bytes=16 * MB, disk_dir=None, disk_bytes=256 * MB, ttl=300.0, clock=time.monotonic):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir if disk_dir and disk_bytes > 0 else None
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.memory_hits = self.disk_hits = self.revalidated = self.misses = 0
+        self._lock = threading.Lock()
+        # (bucket, key) -> (etag, data, checked) in LRU order, and its total size
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # (bucket, key) -> (etag, path, size, checked) in LRU order, and its total size
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # A new process cannot tell which object an old file belongs to, so start empty
+            for name in os.listdir(self.disk_dir):
+                os.remove(os.path.join(self.disk_dir, name))
+
+    def stats(self):
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits,
+                "revalidated": self.revalidated, "misses": self.misses}
+
+    def get(self, bucket, key):
+        """
+        Returns the object's bytes and where they came from: "memory", "disk",
+        "revalidated" (cached bytes S3 confirmed are current) or "miss".
+        """
+        name = (bucket, key)
+        now = self.clock()
+        with self._lock:
+            entry = self._memory.get(name)
+            if entry is not None:
+                self._memory.move_to_end(name)
+            disk = self._disk.get(name) if entry is None else None
+            if disk is not None:
+                self._disk.move_to_end(name)
+        if entry is not None:
+            etag, data, checked = entry
+            tier = "memory"
+        elif disk is not None:
+            etag, path, _, checked = disk
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                etag = data = None
+            tier = "disk"
+        else:
+            etag = data = None
+
+        if data is not None and now - checked < self.ttl:
+            with self._lock:
+                if tier == "memory":
+                    self.memory_hits += 1
+                else:
+                    self.disk_hits += 1
+            if tier == "disk":
+                self._store_memory(name, etag, data, checked)
+            return data, tier
+
+        fetched_etag, fetched = self._fetch(bucket, key, etag if data is not None else None)
+        with self._lock:
+            if fetched is None:
+                self.revalidated += 1
+                tier = "revalidated"
+            else:
+                self.misses += 1
+                tier = "miss"
+        if fetched is not None:
+            etag, data = fetched_etag, fetched
+        self._store_memory(name, etag, data, now)
+        self._store_disk(name, etag, data, now)
+        return data, tier
+
+    @staticmethod
+    def _fetch(bucket, key, etag):
+        """Reads an object, or returns (etag, None) when it still has `etag`."""
+        from botocore.exceptions import ClientError
+        from stylist_common import runtime
+        kwargs = {"IfNoneMatch": etag} if etag else {}
+        try:
+            response = runtime.client("s3").get_object(Bucket=bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if etag and e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                return etag, None
+            raise
+        return response.get("ETag", "").strip('"'), response["Body"].read()
+
+    def _store_memory(self, name, etag, data, checked):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(name, None)
+            if previous is not None:
+                self._memory_size -= len(previous[1])
+            self._memory[name] = (etag, data, checked)
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, (_, evicted, _) = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _store_disk(self, name, etag, data, checked):
+        if self.disk_dir is None or len(data) > self.disk_bytes:
+            return
+        digest = hashlib.sha256("\0".join((*name, etag)).encode("utf-8")).hexdigest()
+        path = os.path.join(self.disk_dir, digest)
+        removed = []
+        with self._lock:
+            previous = self._disk.pop(name, None)
+            if previous is not None:
+                self._disk_size -= previous[2]
+                if previous[1] != path:
+                    removed.append(previous[1])
+            self._disk[name] = (etag, path, len(data), checked)
+            self._disk_size += len(data)
+            while self._disk_size > self.disk_bytes:
+                _, (_, evicted, size, _) = self._disk.popitem(last=False)
+                self._disk_size -= size
+                removed.append(evicted)
+        if previous is None or previous[1] != path:
+            # Write then rename, so a concurrent reader never sees a partial file
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        for path in removed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def image_cache():
+    """The container's cache, configured from the environment on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            env = os.environ.get
+            _cache = ImageCache(memory_bytes=int(float(env("IMAGE_CACHE_MEMORY_MB", 16)) * MB),
+                                disk_dir=env("IMAGE_CACHE_DIR", "/tmp/image-cache"),
+                                disk_bytes=int(float(env("IMAGE_CACHE_DISK_MB", 256)) * MB),
+                                ttl=float(env("IMAGE_CACHE_TTL_SECONDS", 300)))
+        return _cache
+
+
+def reset():
+    """Forgets the container's cache, used by tests and benchmarks."""
+    global _cache
+    with _cache_lock:
+        _cache = None
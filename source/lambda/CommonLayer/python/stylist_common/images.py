@@ -0,0 +1,147 @@
+"""
+Output encoding for generated images, and preparation of catalog images for embedding.
+
+The image model returns a base64 PNG, which is served as is unless the client
+asks for another format or a smaller size. Catalog photos are often several
+megabytes; before they are sent to the embeddings model they are decoded once,
+turned upright, converted to RGB, shrunk and re-encoded as a compact JPEG
+without metadata (see `prepare_for_embedding`).
+
+Decoding needs Pillow, which is not part of the Lambda runtime; it is supplied
+by an optional layer (see the `pillow_layer_arn` context value) and imported
+only when needed. Without it, generated images are served as PNG and catalog
+images are embedded as stored.
+"""
+import io
+
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+DEFAULT_QUALITY = 80
+# Formats the embeddings model accepts, by the bytes every file of the format starts with
+SIGNATURES = {b"\x89PNG\r\n\x1a\n": "png", b"\xff\xd8\xff": "jpeg"}
+SIGNATURE_BYTES = 8
+DEFAULT_EMBEDDING_SIZE = 512
+EMBEDDING_QUALITY = 90
+METADATA = {"exif", "xmp", "icc_profile", "comment"}
+
+
+class InvalidImage(ValueError):
+    """An object that is not an image the embeddings model can read."""
+
+
+def output_options(params):
+    """
+    Reads the requested output format from query string parameters.
+
+    :param params: May contain `format` (png, webp or jpeg), `quality` (1-100) and `max_size` (pixels of the longest edge).
+    :return: A (format, quality, max_size) tuple.
+    :raises ValueError: When a parameter is not valid.
+    """
+    params = params or {}
+    fmt = (params.get("format") or "png").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported image format '{fmt}', use one of {', '.join(CONTENT_TYPES)}")
+    quality = int(params.get("quality") or DEFAULT_QUALITY)
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    max_size = int(params["max_size"]) if params.get("max_size") else None
+    if max_size is not None and max_size < 16:
+        raise ValueError("max_size must be at least 16 pixels")
+    return fmt, quality, max_size
+
+
+def needs_transcode(fmt, max_size):
+    return fmt != "png" or max_size is not None
+
+
+def transcode(data, fmt, quality=DEFAULT_QUALITY, max_size=None):
+    """
+    Decodes an image once and encodes it in `fmt`, shrinking it to fit `max_size` if given.
+
+    :raises ImportError: When Pillow is not available.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        if max_size is not None and max(image.size) > max_size:
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        if fmt == "png":
+            image.save(out, format="PNG")
+        elif fmt == "webp":
+            image.save(out, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+def sniff(head):
+    """
+    Returns the format of a file from its first bytes.
+
+    :raises InvalidImage: When it is not a PNG or JPEG.
+    """
+    for signature, fmt in SIGNATURES.items():
+        if head.startswith(signature):
+            return fmt
+    raise InvalidImage("Not a PNG or JPEG image")
+
+
+def read_image_object(response, max_bytes):
+    """
+    Reads an S3 GetObject response holding an image, checking it before the whole object is read.
+
+    :raises InvalidImage: When the object is larger than `max_bytes` or does not start like an image.
+    """
+    body = response["Body"]
+    size = response.get("ContentLength")
+    if size is not None and size > max_bytes:
+        body.close()
+        raise InvalidImage(f"Image of {size} bytes is larger than {max_bytes}")
+    head = body.read(SIGNATURE_BYTES)
+    try:
+        sniff(head)
+    except InvalidImage:
+        body.close()
+        raise
+    return head + body.read()
+
+
+def prepare_for_embedding(data, max_size=DEFAULT_EMBEDDING_SIZE, quality=EMBEDDING_QUALITY):
+    """
+    Decodes an image once and returns it as an RGB JPEG of at most `max_size` pixels on its longest edge.
+
+    EXIF orientation is applied before the metadata is dropped, transparent areas are
+    laid on white, and JPEGs are decoded directly at a reduced scale when they are
+    much larger than `max_size`. RGB images already small enough and without
+    metadata are returned unchanged.
+
+    :raises InvalidImage: When the data is not a readable PNG or JPEG.
+    :raises ImportError: When Pillow is not available.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    sniff(data[:SIGNATURE_BYTES])
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_size and image.mode == "RGB" and not METADATA.intersection(image.info):
+                image.load()  # surfaces truncated or corrupt data
+                return data
+            image.draft("RGB", (max_size, max_size))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            if max(image.size) > max_size:
+                image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=quality, optimize=True)
+            return out.getvalue()
+    except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(f"Unreadable image: {e}") from e
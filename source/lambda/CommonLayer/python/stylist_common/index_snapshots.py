@@ -0,0 +1,243 @@
+"""
+Versioned snapshots of the image vector index, kept current from the embeddings table's changes.
+
+Rebuilding an index from a full table scan reads every vector again after each
+new image. Instead, the table's DynamoDB stream is captured as an append-only
+log of deltas, and deltas are periodically compacted into a new base snapshot.
+Under the store's prefix (in S3, or a local directory in tests):
+
+- deltas/<time>-<id>.json: the changes of one batch of stream records
+- bases/<time>-<id>.npz: a full index (see `vector_index.dumps_indexes`)
+- latest.json: the newest base and the last delta folded into it
+
+An `IndexFollower` polls latest.json, loads a new base when it changes and
+applies the deltas written since, so a long-lived process swaps in a fresh
+index without a restart.
+
+Deltas are named by the time they are written. The changes of one item come
+from a single stream shard in order, and a batch's delta is written before the
+next batch of that shard is read, so name order keeps each item's changes in
+order. Because clocks and listings are not exact, followers look back
+SKEW_SECONDS for deltas they have not applied yet.
+
+Each embeddings table, one per embeddings generation (see
+`stylist_common.migration`), keeps its snapshots under its own prefix,
+`table_prefix`, so a promoted generation is served from its own vectors.
+"""
+import json
+import os
+import time
+import uuid
+
+from stylist_common.vector_index import apply_changes, dumps_indexes, load_indexes, loads_indexes
+
+DEFAULT_PREFIX = "index/"
+DELTAS = "deltas/"
+BASES = "bases/"
+LATEST = "latest.json"
+SKEW_SECONDS = 60
+
+
+def table_prefix(prefix, table_name):
+    """Where the snapshots of one embeddings table are kept under `prefix`."""
+    return f"{prefix}{table_name}/"
+
+
+def _new_name(directory, suffix):
+    return f"{directory}{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}{suffix}"
+
+
+def _lookback(name, directory, seconds):
+    """The name every entry written `seconds` before `name` sorts after."""
+    if not name:
+        return ""
+    written_ms = int(name[len(directory):len(directory) + 13])
+    return f"{directory}{max(0, written_ms - int(seconds * 1000)):013d}"
+
+
+class S3Store:
+    """Snapshot objects under a prefix of an S3 bucket."""
+
+    def __init__(self, bucket, prefix=DEFAULT_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def read(self, name):
+        """Returns an object's bytes, or None when it does not exist."""
+        from botocore.exceptions import ClientError
+        from stylist_common import runtime
+        try:
+            return runtime.client("s3").get_object(Bucket=self.bucket, Key=self.prefix + name)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+
+    def write(self, name, data):
+        from stylist_common import runtime
+        runtime.client("s3").put_object(Bucket=self.bucket, Key=self.prefix + name, Body=data)
+
+    def list(self, directory, start_after=""):
+        """Names in a directory that sort after `start_after`, in order."""
+        from stylist_common import runtime
+        kwargs = {"Bucket": self.bucket, "Prefix": self.prefix + directory}
+        if start_after:
+            kwargs["StartAfter"] = self.prefix + start_after
+        names = []
+        while True:
+            response = runtime.client("s3").list_objects_v2(**kwargs)
+            names.extend(entry["Key"][len(self.prefix):] for entry in response.get("Contents", []))
+            if not response.get("IsTruncated"):
+                return sorted(name for name in names if name > start_after)
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def delete(self, names):
+        from stylist_common import runtime
+        names = list(names)
+        for start in range(0, len(names), 1000):
+            runtime.client("s3").delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": self.prefix + name} for name in names[start:start + 1000]], "Quiet": True})
+
+
+class LocalStore:
+    """Snapshot files under a local directory, with the same interface as `S3Store`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, *name.split("/"))
+
+    def read(self, name):
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name, data):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a reader never sees a partial file
+        with open(path + ".tmp", "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+        os.replace(path + ".tmp", path)
+
+    def list(self, directory, start_after=""):
+        try:
+            entries = os.listdir(self._path(directory))
+        except FileNotFoundError:
+            return []
+        names = (directory + entry for entry in entries if not entry.endswith(".tmp"))
+        return sorted(name for name in names if name > start_after)
+
+    def delete(self, names):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+def write_delta(store, changes):
+    """
+    Appends one delta to the log and returns its name.
+
+    :param changes: Changes as accepted by `vector_index.apply_changes`.
+    """
+    name = _new_name(DELTAS, ".json")
+    store.write(name, json.dumps({"changes": changes}, default=float))
+    return name
+
+
+class IndexFollower:
+    """
+    In-memory copy of the newest snapshot plus the deltas written after it.
+
+    `indexes` is replaced, never modified, so readers holding the previous
+    value keep a consistent view.
+    """
+
+    def __init__(self, store, skew_seconds=SKEW_SECONDS):
+        self.store = store
+        self.skew_seconds = skew_seconds
+        self.indexes = None
+        self.base = None
+        # Newest delta in the index, and the deltas applied within the look-back window before it
+        self.newest = ""
+        self.applied = set()
+        self.deltas_since_base = 0
+
+    def refresh(self):
+        """Loads a newer base if there is one and applies new deltas; returns True when the index changed."""
+        pointer = self.store.read(LATEST)
+        if pointer is None:
+            return False
+        pointer = json.loads(pointer)
+        changed = False
+        if pointer["base"] != self.base:
+            data = self.store.read(pointer["base"])
+            if data is None:
+                # Replaced by a newer compaction while we read the pointer; pick that up next time
+                return False
+            self.indexes = loads_indexes(data)
+            self.base = pointer["base"]
+            self.newest = pointer["through"]
+            self.applied = set(pointer["folded"])
+            self.deltas_since_base = 0
+            changed = True
+
+        pending = [name for name in self.store.list(DELTAS, _lookback(self.newest, DELTAS, self.skew_seconds))
+                   if name not in self.applied]
+        changes = []
+        for name in pending:
+            data = self.store.read(name)
+            if data is not None:
+                changes.extend(json.loads(data)["changes"])
+        if pending:
+            self.indexes = apply_changes(self.indexes, changes)
+            self.applied.update(pending)
+            self.deltas_since_base += len(pending)
+            self.newest = max(self.newest, pending[-1])
+            window = _lookback(self.newest, DELTAS, self.skew_seconds)
+            self.applied = {name for name in self.applied if name > window}
+            changed = True
+        return changed
+
+
+def compact(store, table=None, retain_seconds=3600, skew_seconds=SKEW_SECONDS):
+    """
+    Folds every delta into a new base snapshot and points latest.json at it.
+
+    The first base is built from a scan of `table`; deltas listed before that scan
+    are treated as folded, and every later one is applied on top. Deltas and bases
+    older than `retain_seconds` are deleted once a newer base covers them.
+
+    :return: The name of the newest base, or None when there was nothing to do.
+    """
+    follower = IndexFollower(store, skew_seconds)
+    follower.refresh()
+    if follower.base is None:
+        if table is None:
+            raise ValueError("There is no snapshot yet and no table to build the first one from")
+        # List before scanning, so a change made during the scan is replayed over it
+        listed = store.list(DELTAS)
+        follower.newest = listed[-1] if listed else ""
+        window = _lookback(follower.newest, DELTAS, skew_seconds)
+        follower.applied = {name for name in listed if name > window}
+        follower.indexes = load_indexes(table)
+    elif not follower.deltas_since_base:
+        return None
+
+    base = _new_name(BASES, ".npz")
+    store.write(base, dumps_indexes(follower.indexes))
+    store.write(LATEST, json.dumps({"base": base, "through": follower.newest, "folded": sorted(follower.applied)}))
+
+    # Only delete deltas this base has folded in: those applied, or too old to still be arriving
+    window = _lookback(follower.newest, DELTAS, skew_seconds)
+    cutoff = _lookback(follower.newest, DELTAS, retain_seconds)
+    store.delete(name for name in store.list(DELTAS) if name[:len(cutoff)] <= cutoff and name <= follower.newest
+                 and (name in follower.applied or name <= window))
+    cutoff = _lookback(base, BASES, retain_seconds)
+    store.delete(name for name in store.list(BASES) if name[:len(cutoff)] <= cutoff and name != base)
+    return base
@@ -0,0 +1,117 @@
+"""
+Structured, size-bounded logging for the Lambda handlers.
+
+Each record is one JSON line carrying the level, logger name, message, the
+request id from `stylist_common.tracing` and any extra fields. Field values
+are made safe for CloudWatch before they are written: bytes and base64 blobs
+(generated images, image embeddings input) are replaced by their size, long
+strings are truncated, and large lists and dicts are cut short.
+
+Tuned through environment variables:
+
+- LOG_LEVEL: DEBUG, INFO, WARNING or ERROR (default INFO)
+- LOG_MAX_FIELD_CHARS: longest string kept in a field before truncation (default 512)
+
+High-volume records such as full model responses are logged with
+`sampled=True` and only written for requests that are being traced (see
+TRACE_SAMPLE_RATE), so a traced request keeps its payloads next to its
+latency metrics.
+"""
+import json
+import os
+import re
+
+from stylist_common import tracing
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+MAX_ITEMS = 20
+MAX_DEPTH = 4
+# Long runs of the base64 alphabet are binary payloads, not text worth reading
+_BASE64 = re.compile(r"[A-Za-z0-9+/=\r\n]{256,}")
+
+_level = LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), LEVELS["INFO"])
+_max_chars = int(os.environ.get("LOG_MAX_FIELD_CHARS", 512))
+_sink = print
+
+
+def set_sink(sink):
+    """Replaces the function that receives each JSON log line (print by default)."""
+    global _sink
+    _sink = sink
+
+
+def set_level(level):
+    global _level
+    _level = LEVELS[level.upper()]
+
+
+def redact(value, max_chars=None, depth=0):
+    """
+    Returns a copy of `value` that is small and safe to log.
+
+    :param value: Any JSON-like value; other objects are logged by their repr.
+    :param max_chars: Overrides LOG_MAX_FIELD_CHARS.
+    """
+    max_chars = max_chars or _max_chars
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        if _BASE64.fullmatch(value):
+            return f"<base64 {len(value)} chars>"
+        value = _BASE64.sub(lambda match: f"<base64 {len(match.group())} chars>", value)
+        if len(value) > max_chars:
+            return f"{value[:max_chars]}...<{len(value) - max_chars} more chars>"
+        return value
+    if depth >= MAX_DEPTH:
+        return f"<{type(value).__name__}>"
+    if isinstance(value, dict):
+        items = list(value.items())
+        redacted = {str(key): redact(item, max_chars, depth + 1) for key, item in items[:MAX_ITEMS]}
+        if len(items) > MAX_ITEMS:
+            redacted["..."] = f"<{len(items) - MAX_ITEMS} more keys>"
+        return redacted
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        redacted = [redact(item, max_chars, depth + 1) for item in items[:MAX_ITEMS]]
+        if len(items) > MAX_ITEMS:
+            redacted.append(f"<{len(items) - MAX_ITEMS} more items>")
+        return redacted
+    return redact(repr(value), max_chars, depth)
+
+
+class Logger:
+    def __init__(self, name):
+        self.name = name
+
+    def log(self, level, message, sampled=False, **fields):
+        """
+        Writes one record if `level` is enabled.
+
+        :param sampled: Only write the record when the current request is traced.
+        """
+        if LEVELS[level] < _level or (sampled and not tracing.is_traced()):
+            return
+        record = {"level": level, "logger": self.name, "message": redact(message)}
+        request_id = tracing.current_request_id()
+        if request_id:
+            record["request_id"] = request_id
+        record.update({key: redact(value) for key, value in fields.items()})
+        _sink(json.dumps(record, default=str))
+
+    def debug(self, message, **fields):
+        self.log("DEBUG", message, **fields)
+
+    def info(self, message, **fields):
+        self.log("INFO", message, **fields)
+
+    def warning(self, message, **fields):
+        self.log("WARNING", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("ERROR", message, **fields)
+
+
+def get_logger(name):
+    return Logger(name)
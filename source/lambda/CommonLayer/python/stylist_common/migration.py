@@ -0,0 +1,459 @@
+"""
+Zero-downtime migration of the image vectors to a new embeddings model.
+
+Vectors from different models are not comparable, so a model change cannot
+happen in place. Every vector records the model and version it was written
+with (`embedding_model`, `embedding_version`), and a *generation* is one
+embeddings table together with the model, version and space of its vectors.
+
+A small JSON *deployment* document in the artifacts bucket names the live
+generation, an optional shadow generation being built, the previous live
+generation kept for rollback, and the fraction of searches also run against
+the shadow. A migration:
+
+1. `start` records a shadow generation in a second table. From then on the
+   image embeddings function writes new images to both generations.
+2. `reembed` re-embeds the live generation's images into the shadow at a
+   controlled rate, copying their duplicate marks and, with `--catalog`,
+   embedding the looks' text with the new model. It can be stopped and
+   resumed. `promote` refuses a shadow missing images, text vectors or
+   duplicate marks the live generation has, unless forced, and always refuses
+   a shadow table without a stream, as its index snapshots follow the stream.
+3. The search function runs a sample of searches against the shadow as well,
+   and reports how many top results both share (`ShadowOverlap`) and the
+   shadow's latency (`ShadowLatency`).
+4. `promote` makes the shadow live, keeping the old live generation as
+   `previous`. New images are still written to `previous` until its rollback
+   window closes (7 days by default), so `rollback` swaps back to a
+   generation that has every image. Once the window has closed `previous`
+   stops receiving writes and rollback is refused.
+
+Each step rewrites the document with one PUT, so every reader sees either
+the old or the new deployment. Functions cache it for DEPLOYMENT_TTL_SECONDS.
+Without EMBEDDINGS_DEPLOYMENT_KEY the live generation is read from the
+environment, as before migrations existed.
+
+Run from the `source` directory, for example:
+
+    PYTHONPATH=lambda/CommonLayer/python python -m stylist_common.migration --bucket <artifacts bucket> start --table <second table> --model-id <new model> --version 2
+    PYTHONPATH=lambda/CommonLayer/python python -m stylist_common.migration --bucket <artifacts bucket> reembed --image-bucket <s3Imagebucket> --rate 20 --catalog <products_catalog.csv>
+    PYTHONPATH=lambda/CommonLayer/python python -m stylist_common.migration --bucket <artifacts bucket> promote
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from stylist_common.duplicates import DUPLICATE_ATTRIBUTE
+from stylist_common.embeddings import DEFAULT_DIMENSION, NO_PROJECTION, Space
+from stylist_common.multivector import TEXT_PRODUCTS, catalog_products, embed_catalog
+
+MODEL_ATTRIBUTE = "embedding_model"
+VERSION_ATTRIBUTE = "embedding_version"
+DEFAULT_KEY = "search/embedding-deployment.json"
+DEFAULT_MODEL_ID = "amazon.titan-embed-image-v1"
+DEFAULT_VERSION = "1"
+DEFAULT_ROLLBACK_SECONDS = 7 * 24 * 3600
+
+
+class Generation(namedtuple("Generation", ["table", "model_id", "version", "dimension", "projection"])):
+    """One embeddings table and the model, version and space its vectors are written with."""
+
+    @property
+    def space(self):
+        return Space(self.dimension, self.projection)
+
+    def tags(self):
+        return {MODEL_ATTRIBUTE: self.model_id, VERSION_ATTRIBUTE: self.version}
+
+    def owns(self, item):
+        """Whether a vector was written by this generation; untagged vectors predate tagging and count as its own."""
+        return (item.get(MODEL_ATTRIBUTE, self.model_id) == self.model_id
+                and str(item.get(VERSION_ATTRIBUTE, self.version)) == self.version)
+
+
+def configured_generation():
+    """The generation described by the function's environment."""
+    return Generation(os.environ.get("dynamodb_table"), os.environ.get("EMBEDDINGS_MODEL_ID") or DEFAULT_MODEL_ID,
+                      os.environ.get("EMBEDDINGS_VERSION", DEFAULT_VERSION),
+                      int(os.environ.get("EMBEDDING_DIMENSION", DEFAULT_DIMENSION)),
+                      os.environ.get("PROJECTION_VERSION") or NO_PROJECTION)
+
+
+class Deployment:
+    """
+    Which generation search reads, which is being built, and which to roll back to.
+
+    :param sample_rate: Fraction of searches also run against the shadow to compare results.
+    :param rollback_until: Epoch seconds until which `previous` is still written to and can be rolled back to;
+        None keeps it written to indefinitely.
+    """
+
+    def __init__(self, live, shadow=None, previous=None, sample_rate=0.0, rollback_until=None):
+        self.live = live
+        self.shadow = shadow
+        self.previous = previous
+        self.sample_rate = sample_rate
+        self.rollback_until = rollback_until
+
+    def can_roll_back(self, now=None):
+        return self.previous is not None and (
+            self.rollback_until is None or (time.time() if now is None else now) < self.rollback_until)
+
+    def generations(self, now=None):
+        """The generations new vectors are written to: live, shadow, and previous while it can be rolled back to."""
+        generations = [self.live] + ([self.shadow] if self.shadow else [])
+        return generations + ([self.previous] if self.can_roll_back(now) else [])
+
+    def start(self, shadow, sample_rate):
+        if shadow.table == self.live.table:
+            raise ValueError("The shadow generation needs its own table")
+        return Deployment(self.live, shadow, self.previous, sample_rate, self.rollback_until)
+
+    def promote(self, rollback_seconds=DEFAULT_ROLLBACK_SECONDS, now=None):
+        if self.shadow is None:
+            raise ValueError("There is no shadow generation to promote")
+        now = time.time() if now is None else now
+        return Deployment(self.shadow, None, self.live, rollback_until=now + rollback_seconds)
+
+    def rollback(self, now=None):
+        if self.previous is None:
+            raise ValueError("There is no previous generation to roll back to")
+        if not self.can_roll_back(now):
+            raise ValueError("The rollback window has closed; the previous generation no longer has every image")
+        # The rolled back generation becomes the shadow again, so it can be compared and promoted later
+        return Deployment(self.previous, self.live, None, self.sample_rate)
+
+    def dumps(self):
+        as_dict = lambda generation: generation._asdict() if generation else None
+        return json.dumps({"live": as_dict(self.live), "shadow": as_dict(self.shadow),
+                           "previous": as_dict(self.previous), "sample_rate": self.sample_rate,
+                           "rollback_until": self.rollback_until}).encode("utf-8")
+
+    @classmethod
+    def loads(cls, data):
+        document = json.loads(data)
+        generation = lambda value: Generation(**value) if value else None
+        return cls(generation(document["live"]), generation(document.get("shadow")),
+                   generation(document.get("previous")), float(document.get("sample_rate", 0.0)),
+                   document.get("rollback_until"))
+
+
+_deployment_lock = threading.Lock()
+_deployments = {}
+
+
+def read_deployment(bucket, key=DEFAULT_KEY):
+    """Reads the deployment document, or returns None when none has been written."""
+    from botocore.exceptions import ClientError
+    from stylist_common import runtime
+    try:
+        return Deployment.loads(runtime.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+            raise
+        return None
+
+
+def write_deployment(bucket, deployment, key=DEFAULT_KEY):
+    from stylist_common import runtime
+    runtime.client("s3").put_object(Bucket=bucket, Key=key, Body=deployment.dumps(), ContentType="application/json")
+
+
+def current_deployment():
+    """
+    The deployment a function should follow, cached for DEPLOYMENT_TTL_SECONDS (default 30).
+
+    Without EMBEDDINGS_DEPLOYMENT_KEY, or before a document is written, only the
+    configured generation is live.
+    """
+    key = os.environ.get("EMBEDDINGS_DEPLOYMENT_KEY")
+    if not key:
+        return Deployment(configured_generation())
+    bucket = os.environ.get("ARTIFACT_BUCKET")
+    ttl = float(os.environ.get("DEPLOYMENT_TTL_SECONDS", 30))
+    with _deployment_lock:
+        cached = _deployments.get((bucket, key))
+        if cached is None or time.monotonic() - cached[1] >= ttl:
+            cached = (read_deployment(bucket, key) or Deployment(configured_generation()), time.monotonic())
+            _deployments[(bucket, key)] = cached
+        return cached[0]
+
+
+def reset():
+    """Forgets cached deployments, used by tests."""
+    with _deployment_lock:
+        _deployments.clear()
+
+
+def vector_item(item_id, image_key, vector, generation):
+    """The embeddings table item of an image's vector in `generation`'s space."""
+    from decimal import Decimal
+    from stylist_common.quantize import encode
+    from stylist_common.shards import SLOT_ATTRIBUTE, slot_of
+    return {
+        'id': item_id,
+        'image_key': image_key,
+        'vector': [Decimal(str(float(x))) for x in vector],
+        # Recorded so search only compares vectors from the same space and model
+        'embedding_dim': generation.dimension,
+        'projection': generation.projection,
+        **generation.tags(),
+        # Compact codes scanned by the search prefilter
+        **encode(vector),
+        # Hash slot that places the image in a search shard
+        SLOT_ATTRIBUTE: slot_of(image_key),
+    }
+
+
+def store_vector(item_id, image_key, vector, generation, **attributes):
+    """
+    Writes an image's vector, and `attributes`, to `generation`'s table.
+
+    Only those fields are set, so the text vectors of `multivector.embed_catalog` and the
+    `duplicate_of` mark of `duplicates.mark_duplicates` survive an image being embedded again.
+    """
+    from stylist_common import runtime
+    fields = {name: value for name, value in {**vector_item(item_id, image_key, vector, generation),
+                                              **attributes}.items() if name != 'id'}
+    runtime.table(generation.table).update_item(
+        Key={'id': item_id}, UpdateExpression="SET " + ", ".join(f"#f{i} = :f{i}" for i in range(len(fields))),
+        ExpressionAttributeNames={f"#f{i}": name for i, name in enumerate(fields)},
+        ExpressionAttributeValues={f":f{i}": value for i, value in enumerate(fields.values())})
+
+
+def embed_image(image_base64, generation):
+    """Embeds an image with `generation`'s model and returns its vector in the generation's space."""
+    from stylist_common.bedrock import invoke_model
+    from stylist_common.embeddings import request_body, to_space
+    response = invoke_model(body=request_body(generation.dimension, image_base64=image_base64),
+                            modelId=generation.model_id, accept="application/json", contentType="application/json")
+    return to_space(json.loads(response["body"].read())["embedding"], generation.space)
+
+
+class Progress:
+    """Throughput of a re-embedding run, reported every `every` seconds."""
+
+    def __init__(self, total, every=30.0, out=print):
+        self.total = total
+        self.every = every
+        self.out = out
+        self.done = self.failed = self.bytes = 0
+        self.latencies = []
+        self.started = self.reported = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, seconds, size=0, failed=False):
+        with self.lock:
+            self.done += 1
+            self.failed += failed
+            self.bytes += size
+            self.latencies.append(seconds)
+            if self.every and time.monotonic() - self.reported >= self.every:
+                self.reported = time.monotonic()
+                self.out(self.report())
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        ordered = sorted(self.latencies) or [0.0]
+        rate = self.done / elapsed if elapsed else 0.0
+        return {"done": self.done, "total": self.total, "failed": self.failed, "seconds": round(elapsed, 1),
+                "images_per_second": round(rate, 2), "mb_per_second": round(self.bytes / 2**20 / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 1),
+                "eta_seconds": round((self.total - self.done) / rate, 0) if rate else None}
+
+    def report(self):
+        s = self.summary()
+        return (f"{s['done']}/{s['total']} images ({s['failed']} failed) in {s['seconds']}s: "
+                f"{s['images_per_second']} images/s, {s['mb_per_second']} MB/s, p50 {s['p50_ms']}ms, "
+                f"p95 {s['p95_ms']}ms, ETA {s['eta_seconds']}s")
+
+
+def reembed(deployment, image_bucket, rate=10.0, concurrency=4, image_size=None, progress=None, catalog=None):
+    """
+    Re-embeds the live generation's images into the shadow generation, skipping those already there.
+
+    Duplicate marks are copied from the live images, as both generations share image ids. Text vectors
+    belong to the live model's space, so they are embedded again with the shadow model from `catalog`.
+
+    :param rate: Images started per second at most, to leave Bedrock capacity to live traffic.
+    :param catalog: Looks from `multivector.catalog_products`, when the live images have text vectors.
+    :return: The run's `Progress`.
+    """
+    import base64
+    from concurrent.futures import ThreadPoolExecutor
+    from botocore.exceptions import ClientError
+    from stylist_common import runtime
+    from stylist_common.bedrock import BedrockUnavailable, TokenBucket
+    from stylist_common.embeddings import scan_all
+    from stylist_common.images import DEFAULT_EMBEDDING_SIZE, InvalidImage, prepare_for_embedding, read_image_object
+    live, shadow = deployment.live, deployment.shadow
+    if shadow is None:
+        raise ValueError("Start a shadow generation first")
+    done = {item["id"]: item for item in scan_all(runtime.table(shadow.table),
+                                                  ProjectionExpression="id, #model, #version, #duplicate",
+                                                  ExpressionAttributeNames={"#model": MODEL_ATTRIBUTE,
+                                                                            "#version": VERSION_ATTRIBUTE,
+                                                                            "#duplicate": DUPLICATE_ATTRIBUTE})
+            if MODEL_ATTRIBUTE in item and shadow.owns(item)}
+    images = list(scan_all(runtime.table(live.table), ProjectionExpression="id, image_key, #duplicate",
+                           ExpressionAttributeNames={"#duplicate": DUPLICATE_ATTRIBUTE}))
+    todo = [item for item in images if item["id"] not in done]
+    # Images re-embedded before the duplicates job marked them in the live generation
+    for item in images:
+        if item["id"] in done and item.get(DUPLICATE_ATTRIBUTE) != done[item["id"]].get(DUPLICATE_ATTRIBUTE):
+            mark_duplicate(shadow.table, item["id"], item.get(DUPLICATE_ATTRIBUTE))
+    progress = progress or Progress(len(todo))
+    bucket = TokenBucket(rate, max(1.0, rate))
+
+    def copy(item):
+        bucket.acquire(float("inf"))
+        start = time.monotonic()
+        size, failed = 0, False
+        try:
+            data = read_image_object(runtime.client("s3").get_object(Bucket=image_bucket, Key=item["image_key"]),
+                                     50 * 1024 * 1024)
+            size = len(data)
+            try:
+                data = prepare_for_embedding(data, image_size or DEFAULT_EMBEDDING_SIZE)
+            except ImportError:
+                pass
+            vector = embed_image(base64.b64encode(data).decode("utf-8"), shadow)
+            marks = {DUPLICATE_ATTRIBUTE: item[DUPLICATE_ATTRIBUTE]} if DUPLICATE_ATTRIBUTE in item else {}
+            store_vector(item["id"], item["image_key"], vector, shadow, **marks)
+        except (InvalidImage, ClientError, BedrockUnavailable) as e:
+            failed = True
+            progress.out(f"Skipped {item['image_key']}: {e}")
+        progress.record(time.monotonic() - start, size, failed)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(copy, todo))
+    if catalog is not None:
+        embedded, updated = embed_catalog(shadow.table, catalog, shadow.model_id, concurrency)
+        progress.out(f"Embedded {embedded} looks onto {updated} images")
+    return progress
+
+
+def mark_duplicate(table_name, item_id, canonical_id):
+    from stylist_common import runtime
+    if canonical_id is None:
+        runtime.table(table_name).update_item(Key={"id": item_id}, UpdateExpression="REMOVE #duplicate",
+                                              ExpressionAttributeNames={"#duplicate": DUPLICATE_ATTRIBUTE})
+    else:
+        runtime.table(table_name).update_item(Key={"id": item_id}, UpdateExpression="SET #duplicate = :canonical",
+                                              ExpressionAttributeNames={"#duplicate": DUPLICATE_ATTRIBUTE},
+                                              ExpressionAttributeValues={":canonical": canonical_id})
+
+
+def coverage(deployment):
+    """(live images, of them already in the shadow generation)."""
+    from stylist_common import runtime
+    from stylist_common.embeddings import scan_all
+    names = {"#model": MODEL_ATTRIBUTE, "#version": VERSION_ATTRIBUTE}
+    live = {item["id"] for item in scan_all(runtime.table(deployment.live.table), ProjectionExpression="id")}
+    shadow = {item["id"] for item in scan_all(runtime.table(deployment.shadow.table),
+                                              ProjectionExpression="id, #model, #version", ExpressionAttributeNames=names)
+              if MODEL_ATTRIBUTE in item and deployment.shadow.owns(item)}
+    return len(live), len(live & shadow)
+
+
+def has_stream(table_name):
+    """Whether a table streams its new items, which the index snapshot function turns into index deltas."""
+    from stylist_common import runtime
+    specification = runtime.table(table_name).stream_specification or {}
+    return bool(specification.get("StreamEnabled")) and specification.get("StreamViewType") in ("NEW_IMAGE",
+                                                                                              "NEW_AND_OLD_IMAGES")
+
+
+def missing_attributes(deployment):
+    """
+    Live images whose text vectors or duplicate mark the shadow generation lacks, by attribute.
+
+    Search would silently stop fusing text or filtering duplicates if such a shadow were promoted.
+    """
+    from stylist_common import runtime
+    from stylist_common.embeddings import scan_all
+    names = {"#products": TEXT_PRODUCTS, "#duplicate": DUPLICATE_ATTRIBUTE}
+    projection = "id, #products, #duplicate"
+    shadow = {item["id"]: item for item in scan_all(runtime.table(deployment.shadow.table),
+                                                    ProjectionExpression=projection, ExpressionAttributeNames=names)}
+    missing = {TEXT_PRODUCTS: 0, DUPLICATE_ATTRIBUTE: 0}
+    for item in scan_all(runtime.table(deployment.live.table), ProjectionExpression=projection,
+                         ExpressionAttributeNames=names):
+        for name in missing:
+            missing[name] += name in item and name not in shadow.get(item["id"], {})
+    return missing
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Migrates the image vectors to a new embeddings model.")
+    parser.add_argument("--bucket", required=True, help="Artifacts bucket holding the deployment document")
+    parser.add_argument("--key", default=DEFAULT_KEY)
+    commands = parser.add_subparsers(dest="command", required=True)
+    start = commands.add_parser("start", help="Record a shadow generation; new images are then written to both")
+    start.add_argument("--table", required=True, help="Empty table for the shadow generation's vectors")
+    start.add_argument("--model-id", required=True)
+    start.add_argument("--version", required=True)
+    start.add_argument("--dimension", type=int, default=DEFAULT_DIMENSION)
+    start.add_argument("--projection", default=NO_PROJECTION)
+    start.add_argument("--sample-rate", type=float, default=0.05, help="Fraction of searches compared with the shadow")
+    start.add_argument("--live-table", help="Live table, when no deployment document exists yet")
+    start.add_argument("--live-model-id", default=DEFAULT_MODEL_ID)
+    start.add_argument("--live-version", default=DEFAULT_VERSION)
+    start.add_argument("--live-dimension", type=int, default=DEFAULT_DIMENSION)
+    start.add_argument("--live-projection", default=NO_PROJECTION)
+    copy_parser = commands.add_parser("reembed", help="Re-embed the live images into the shadow generation")
+    copy_parser.add_argument("--image-bucket", required=True)
+    copy_parser.add_argument("--rate", type=float, default=10.0, help="Images per second")
+    copy_parser.add_argument("--concurrency", type=int, default=4)
+    copy_parser.add_argument("--catalog", help="Path of products_catalog.csv, to embed the looks' text with the new model")
+    promote = commands.add_parser("promote", help="Make the shadow generation live")
+    promote.add_argument("--force", action="store_true", help="Promote even if some images are not re-embedded")
+    promote.add_argument("--rollback-hours", type=float, default=DEFAULT_ROLLBACK_SECONDS / 3600,
+                         help="Hours new images are still written to the old generation, so it can be rolled back to")
+    commands.add_parser("rollback", help="Make the previous generation live again")
+    commands.add_parser("status")
+    args = parser.parse_args()
+
+    current = read_deployment(args.bucket, args.key)
+    if args.command == "start":
+        if current is None:
+            if not args.live_table:
+                parser.error("--live-table is needed for the first migration")
+            current = Deployment(Generation(args.live_table, args.live_model_id, args.live_version,
+                                            args.live_dimension, args.live_projection))
+        current = current.start(Generation(args.table, args.model_id, args.version, args.dimension, args.projection),
+                                args.sample_rate)
+        write_deployment(args.bucket, current, args.key)
+    elif current is None:
+        parser.error("No deployment document yet; run start first")
+    elif args.command == "reembed":
+        # --rate paces the job, so the shared Bedrock invoker's own limit (default 5 per second) must not be lower
+        os.environ.setdefault("BEDROCK_RATE_LIMIT", str(args.rate))
+        os.environ.setdefault("BEDROCK_BURST", str(max(1.0, args.rate)))
+        catalog = None
+        if args.catalog:
+            import csv
+            with open(args.catalog, newline="", encoding="utf-8") as f:
+                catalog = catalog_products(csv.DictReader(f))
+        print(reembed(current, args.image_bucket, args.rate, args.concurrency, catalog=catalog).report())
+    elif args.command == "promote":
+        if current.shadow and not has_stream(current.shadow.table):
+            parser.error(f"{current.shadow.table} has no stream of new images, so its index snapshots would go stale; "
+                         "enable one with NEW_IMAGE and subscribe the index snapshot function to it")
+        total, covered = coverage(current) if current.shadow else (0, 0)
+        if covered < total and not args.force:
+            parser.error(f"Only {covered} of {total} images are in the shadow generation; reembed or use --force")
+        missing = missing_attributes(current) if current.shadow else {}
+        if any(missing.values()) and not args.force:
+            parser.error(f"The shadow generation lacks the text vectors of {missing[TEXT_PRODUCTS]} images and the "
+                         f"duplicate marks of {missing[DUPLICATE_ATTRIBUTE]}; reembed with --catalog or use --force")
+        current = current.promote(args.rollback_hours * 3600)
+        write_deployment(args.bucket, current, args.key)
+    elif args.command == "rollback":
+        current = current.rollback()
+        write_deployment(args.bucket, current, args.key)
+    print(current.dumps().decode("utf-8"))
@@ -0,0 +1,219 @@
+"""
+Catalog text vectors carried by product images, and fusion of image and text scores.
+
+The product catalog (`products_catalog.csv`) describes looks: a department,
+seasons, occasions, categories, a description and the physical IDs of the
+images of its items. An offline job embeds the text of every look with the
+same model and space as the images, and stores the vectors on each image of
+the look as `text_vectors` (at most MAX_TEXT_VECTORS, the most recently
+curated looks first). An image's image vector and text vectors are thus read
+together, and are held in consecutive rows of one matrix by `MultiVectorIndex`,
+so a query is scored against all of them in one pass.
+
+An image's image score is the cosine similarity of its image vector to the
+query, and its text score the best one of its text vectors. They are fused
+either by weight (`weighted`: (1 - weight) * image + weight * text) or by
+reciprocal rank (`rrf`: 1 / (rrf_k + image rank) + 1 / (rrf_k + text rank)).
+Images without text vectors keep their image score, or their image rank term.
+
+Images are matched to looks by the file name of their image key without its
+extension, e.g. `catalog/41BBrjBcKeL.jpg` is the physical ID `41BBrjBcKeL`.
+Run from the `source` directory:
+
+    PYTHONPATH=lambda/CommonLayer/python python -m stylist_common.multivector --table <EmbeddingsTable name> --catalog csv_files/products_catalog.csv
+"""
+import json
+import os
+
+TEXT_VECTORS = "text_vectors"
+TEXT_PRODUCTS = "text_products"
+# Codes of the mean text vector, scanned by the search prefilter like the image's own codes
+TEXT_CODE_PREFIX = "text_"
+MAX_TEXT_VECTORS = 4
+# Titan's text input is limited in tokens, so long descriptions are cut
+MAX_TEXT_WORDS = 100
+FUSIONS = ("none", "weighted", "rrf")
+DEFAULT_TEXT_WEIGHT = 0.3
+DEFAULT_RRF_K = 60
+
+
+def physical_id(image_key):
+    return os.path.splitext(os.path.basename(image_key))[0]
+
+
+def _values(row, field):
+    return [value for name, value in sorted(row.items(), key=lambda pair: pair[0])
+            if name.startswith(f"data/{field}/") and value]
+
+
+def catalog_products(rows):
+    """
+    Reads looks from rows of `products_catalog.csv` as read by csv.DictReader.
+
+    :return: [{"product_id", "text", "physical_ids", "curated"}], skipping rows without any image.
+    """
+    products = []
+    for row in rows:
+        physical_ids = _values(row, "physical IDs")
+        if not physical_ids:
+            continue
+        parts = [row.get("data/description", "").strip(),
+                 " ".join(filter(None, [row.get("data/department"), *_values(row, "season"), *_values(row, "occasion")])),
+                 ", ".join(_values(row, "categories"))]
+        text = ". ".join(part for part in parts if part)
+        products.append({
+            # Looks have no id of their own; their images identify them
+            "product_id": "+".join(physical_ids),
+            "text": " ".join(text.split()[:MAX_TEXT_WORDS]),
+            "physical_ids": physical_ids,
+            "curated": row.get("data/curation date", ""),
+        })
+    return products
+
+
+class MultiVectorIndex:
+    """
+    Image and text vectors of the images of one space, each image's vectors in consecutive rows.
+
+    :param image_keys: Image key of each image.
+    :param matrix: float32 array of unit rows; image i owns rows offsets[i] to offsets[i + 1], its image vector first.
+    :param offsets: int array of len(image_keys) + 1 row offsets.
+    """
+
+    def __init__(self, space, image_keys, matrix, offsets):
+        import numpy as np
+        self.space = space
+        self.image_keys = list(image_keys)
+        self.matrix = matrix
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.has_text = np.diff(self.offsets) > 1
+
+    def __len__(self):
+        return len(self.image_keys)
+
+    @classmethod
+    def build(cls, space, items):
+        import numpy as np
+        rows, offsets = [], [0]
+        for item in items:
+            rows.append(item["vector"])
+            rows.extend(item.get(TEXT_VECTORS) or [])
+            offsets.append(len(rows))
+        matrix = np.asarray([[float(x) for x in row] for row in rows], dtype=np.float32).reshape(len(rows), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return cls(space, [item["image_key"] for item in items], matrix / norms, offsets)
+
+    def scores(self, query):
+        """Returns the image score and the text score (-inf without text vectors) of every image."""
+        import numpy as np
+        query = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        scores = self.matrix @ (query / norm if norm else query)
+        image = scores[self.offsets[:-1]]
+        scores[self.offsets[:-1]] = -np.inf
+        text = np.maximum.reduceat(scores, self.offsets[:-1]) if len(self) else scores
+        return image, text
+
+    def search(self, query, k, fusion, text_weight=DEFAULT_TEXT_WEIGHT, rrf_k=DEFAULT_RRF_K):
+        """Returns the best `k` (image_key, fused score), best first."""
+        from stylist_common.quantize import top_indices
+        image, text = self.scores(query)
+        fused = fuse(image, text, fusion, text_weight, rrf_k)
+        return [(self.image_keys[i], float(fused[i])) for i in top_indices(fused, k)]
+
+
+def fuse(image, text, fusion, text_weight=DEFAULT_TEXT_WEIGHT, rrf_k=DEFAULT_RRF_K):
+    """
+    Fuses image and text scores of the same images.
+
+    :param text: Text scores, -inf for images without text vectors.
+    """
+    import numpy as np
+    image, text = np.asarray(image, dtype=np.float32), np.asarray(text, dtype=np.float32)
+    has_text = np.isfinite(text)
+    if fusion == "weighted":
+        return np.where(has_text, (1 - text_weight) * image + text_weight * text, image)
+    if fusion == "rrf":
+        fused = 1 / (rrf_k + _ranks(image))
+        fused[has_text] += 1 / (rrf_k + _ranks(text[has_text]))
+        return fused
+    return image
+
+
+def _ranks(scores):
+    """1-based rank of every score, best first."""
+    import numpy as np
+    ranks = np.empty(len(scores), dtype=np.float64)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(1, len(scores) + 1)
+    return ranks
+
+
+def embed_text(text, space, model_id):
+    from stylist_common.bedrock import invoke_model
+    from stylist_common.embeddings import request_body, to_space
+    response = invoke_model(body=request_body(space.dimension, text=text), modelId=model_id,
+                            accept="application/json", contentType="application/json")
+    return to_space(json.loads(response["body"].read())["embedding"], space)
+
+
+def embed_catalog(table_name, products, model_id, concurrency=8):
+    """
+    Embeds the text of every look and stores it on the look's images.
+
+    :return: (looks embedded, images updated).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from decimal import Decimal
+    import numpy as np
+    from stylist_common import runtime
+    from stylist_common.embeddings import item_space, scan_all
+    from stylist_common.quantize import encode
+    table = runtime.table(table_name)
+    images = {}
+    for item in scan_all(table, ProjectionExpression="id, image_key, embedding_dim, #projection, #vector",
+                         ExpressionAttributeNames={"#projection": "projection", "#vector": "vector"}):
+        if "vector" in item:
+            images.setdefault(physical_id(item["image_key"]), []).append(item)
+    looks = {}
+    for product in sorted(products, key=lambda product: product["curated"], reverse=True):
+        for image_id in product["physical_ids"]:
+            for item in images.get(image_id, []):
+                owned = looks.setdefault(item["id"], (item, []))[1]
+                if len(owned) < MAX_TEXT_VECTORS and product not in owned:
+                    owned.append(product)
+
+    requests = list(dict.fromkeys((product["product_id"], product["text"], item_space(item))
+                                  for item, owned in looks.values() for product in owned))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        vectors = dict(zip(((product_id, space) for product_id, _, space in requests),
+                           executor.map(lambda request: embed_text(request[1], request[2], model_id), requests)))
+
+    for item, owned in looks.values():
+        space = item_space(item)
+        text_vectors = [vectors[(product["product_id"], space)] for product in owned]
+        mean = np.mean(np.asarray(text_vectors, dtype=np.float32), axis=0)
+        codes = {TEXT_CODE_PREFIX + name: code for name, code in encode(mean).items()}
+        names = {"#vectors": TEXT_VECTORS, "#products": TEXT_PRODUCTS, **{f"#code{i}": name for i, name in enumerate(codes)}}
+        values = {":vectors": [[Decimal(str(float(x))) for x in vector] for vector in text_vectors],
+                  ":products": [product["product_id"] for product in owned],
+                  **{f":code{i}": code for i, code in enumerate(codes.values())}}
+        table.update_item(Key={"id": item["id"]},
+                          UpdateExpression="SET #vectors = :vectors, #products = :products, "
+                                           + ", ".join(f"#code{i} = :code{i}" for i in range(len(codes))),
+                          ExpressionAttributeNames=names, ExpressionAttributeValues=values)
+    return len({product_id for product_id, _, _ in requests}), len(looks)
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+    parser = argparse.ArgumentParser(description="Embeds the product catalog's text onto the images of each look.")
+    parser.add_argument("--table", required=True, help="Product embeddings table")
+    parser.add_argument("--catalog", required=True, help="Path of products_catalog.csv")
+    parser.add_argument("--model-id", default=os.environ.get("EMBEDDINGS_MODEL_ID", "amazon.titan-embed-image-v1"))
+    args = parser.parse_args()
+    with open(args.catalog, newline="", encoding="utf-8") as f:
+        catalog = catalog_products(csv.DictReader(f))
+    embedded, updated = embed_catalog(args.table, catalog, args.model_id)
+    print(f"Embedded {embedded} of {len(catalog)} looks onto {updated} images")
@@ -0,0 +1,62 @@
+import codecs
+import csv
+import io
+from collections import namedtuple
+
+# One row of order_history.csv
+Order = namedtuple("Order", ["order_id", "customer_id", "name", "size", "brand", "tags"])
+
+TAG_PREFIX = "orders/tags/"
+
+
+def _tag_columns(fieldnames):
+    # Keep tag columns in numeric order (orders/tags/0, orders/tags/1, ...)
+    columns = [name for name in fieldnames if name and name.startswith(TAG_PREFIX)]
+    return sorted(columns, key=lambda name: int(name[len(TAG_PREFIX):]))
+
+
+def iter_orders(lines):
+    """
+    Parses an order history CSV export one row at a time.
+
+    :param lines: The CSV document's lines, with their line endings.
+    :return: An iterator of Order tuples, skipping rows without a customer id.
+    """
+    reader = csv.DictReader(lines)
+    tag_columns = _tag_columns(reader.fieldnames or [])
+    for row in reader:
+        customer_id = (row.get("customer/id") or "").strip()
+        if not customer_id:
+            continue
+        tags = [row[column].strip().lower() for column in tag_columns if row.get(column) and row[column].strip()]
+        yield Order(
+            order_id=int(row["orders/id"]),
+            customer_id=customer_id,
+            name=(row.get("orders/name") or "").strip(),
+            size=(row.get("orders/size") or "").strip(),
+            brand=(row.get("orders/brand") or "").strip(),
+            tags=tags,
+        )
+
+
+def parse_orders(text):
+    """
+    Parses the contents of an order history CSV export.
+
+    :param text: CSV document with the `orders/*` and `customer/id` columns.
+    :return: A list of Order tuples, skipping rows without a customer id.
+    """
+    return list(iter_orders(io.StringIO(text)))
+
+
+def stream_lines(body, chunk_size=1 << 16):
+    """Decodes a streaming S3 body into UTF-8 lines, keeping their endings, without reading it whole."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for chunk in iter(lambda: body.read(chunk_size), b""):
+        *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
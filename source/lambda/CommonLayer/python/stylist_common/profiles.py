@@ -0,0 +1,171 @@
+import json
+import os
+from collections import defaultdict
+from decimal import Decimal
+
+# Tags in order_history.csv that describe a color rather than a style or fit
+COLORS = frozenset([
+    "beige", "black", "blue", "brown", "burgundy", "cream", "gold", "green", "grey", "gray",
+    "khaki", "maroon", "navy", "olive", "orange", "pink", "purple", "red", "silver", "tan",
+    "white", "yellow",
+])
+STYLES = ("formal", "casual")
+# Keys per BatchGetItem request, the DynamoDB limit
+BATCH_GET_SIZE = 100
+
+
+def empty_profile(customer_id):
+    return {
+        "customer_id": str(customer_id),
+        "order_count": 0,
+        "last_order_id": 0,
+        "sizes": {},
+        "brands": {},
+        "colors": {},
+        "styles": {},
+    }
+
+
+def _increment(counts, key):
+    if key:
+        counts[key] = counts.get(key, 0) + 1
+
+
+def apply_orders(profile, orders):
+    """
+    Folds new orders into a profile in place.
+
+    Order ids are assumed to grow monotonically, so orders at or below the
+    profile's `last_order_id` have already been counted and are skipped. This
+    makes re-processing a full order history export idempotent.
+
+    :param profile: Profile dict as returned by empty_profile().
+    :param orders: Iterable of Order tuples for this customer.
+    :return: Number of orders that were applied.
+    """
+    applied = 0
+    last_order_id = profile["last_order_id"]
+    for order in orders:
+        if order.order_id <= last_order_id:
+            continue
+        _increment(profile["sizes"], order.size)
+        _increment(profile["brands"], order.brand)
+        for tag in order.tags:
+            if tag in COLORS:
+                _increment(profile["colors"], tag)
+            elif tag in STYLES:
+                _increment(profile["styles"], tag)
+        profile["order_count"] += 1
+        profile["last_order_id"] = max(profile["last_order_id"], order.order_id)
+        applied += 1
+    return applied
+
+
+def _top(counts, limit):
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [key for key, _ in ranked[:limit]]
+
+
+def summarize(profile, limit=2):
+    """Renders a profile as a single compact line suitable for a model prompt."""
+    parts = []
+    for label, field in (("sizes", "sizes"), ("brands", "brands"), ("colors", "colors")):
+        top = _top(profile[field], limit)
+        if top:
+            parts.append(f"{label}: {', '.join(top)}")
+    styled = sum(profile["styles"].get(style, 0) for style in STYLES)
+    if styled:
+        ratio = ", ".join(f"{round(100 * profile['styles'].get(style, 0) / styled)}% {style}" for style in STYLES)
+        parts.append(f"style: {ratio}")
+    parts.append(f"orders: {profile['order_count']}")
+    return "; ".join(parts)
+
+
+def aggregate(orders, store):
+    """
+    Incrementally updates customer profiles in a store from a batch of orders.
+
+    :param orders: Iterable of Order tuples, in any customer order.
+    :param store: A profile store exposing get_many() and put_many().
+    :return: Number of orders applied across all profiles.
+    """
+    by_customer = defaultdict(list)
+    for order in orders:
+        by_customer[order.customer_id].append(order)
+
+    existing = store.get_many(list(by_customer))
+    changed = []
+    applied = 0
+    for customer_id, customer_orders in by_customer.items():
+        profile = existing.get(customer_id) or empty_profile(customer_id)
+        customer_orders.sort(key=lambda order: order.order_id)
+        count = apply_orders(profile, customer_orders)
+        if count:
+            profile["summary"] = summarize(profile)
+            changed.append(profile)
+            applied += count
+    store.put_many(changed)
+    return applied
+
+
+def _from_dynamodb(value):
+    # DynamoDB returns every number as Decimal; profile counts are integers
+    if isinstance(value, dict):
+        return {key: _from_dynamodb(item) for key, item in value.items()}
+    if isinstance(value, Decimal):
+        return int(value)
+    return value
+
+
+class DynamoDBProfileStore:
+    """Profiles kept in a DynamoDB table keyed by `customer_id`."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, customer_id):
+        item = self.table.get_item(Key={"customer_id": str(customer_id)}).get("Item")
+        return _from_dynamodb(item) if item else None
+
+    def get_many(self, customer_ids):
+        """Reads profiles with BatchGetItem, 100 keys per request, retrying unprocessed keys."""
+        from stylist_common import runtime
+        ids = {str(customer_id): customer_id for customer_id in customer_ids}
+        keys = [{"customer_id": customer_id} for customer_id in ids]
+        profiles = {}
+        for start in range(0, len(keys), BATCH_GET_SIZE):
+            request = {self.table.name: {"Keys": keys[start:start + BATCH_GET_SIZE]}}
+            while request:
+                response = runtime.resource("dynamodb").batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table.name, []):
+                    profiles[ids[item["customer_id"]]] = _from_dynamodb(item)
+                request = response.get("UnprocessedKeys") or None
+        return profiles
+
+    def put_many(self, profiles):
+        with self.table.batch_writer() as batch:
+            for profile in profiles:
+                batch.put_item(Item=profile)
+
+
+class LocalFileProfileStore:
+    """Profiles kept in a local JSON file, used for tests and benchmarks."""
+
+    def __init__(self, path):
+        self.path = path
+        self.profiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.profiles = json.load(f)
+
+    def get(self, customer_id):
+        return self.profiles.get(str(customer_id))
+
+    def get_many(self, customer_ids):
+        return {customer_id: self.profiles[customer_id] for customer_id in customer_ids if customer_id in self.profiles}
+
+    def put_many(self, profiles):
+        for profile in profiles:
+            self.profiles[profile["customer_id"]] = profile
+        with open(self.path, "w") as f:
+            json.dump(self.profiles, f)
@@ -0,0 +1,108 @@
+"""
+Compact codes of the stored image vectors, used to prefilter search candidates.
+
+- int8: components scaled by the vector's largest magnitude into -127..127. Ranking by
+  dot(query, code) / |code| is cosine similarity against the dequantized vector.
+- binary: one sign bit per component, ranked by Hamming distance to the query's bits.
+
+Codes are stored next to the float `vector` as DynamoDB binary attributes, so search
+can scan a few hundred bytes per item instead of the Decimal vector and only fetch
+the float vectors of the best candidates for an exact re-rank. Running this module
+backfills the codes for items written before they existed.
+"""
+ATTRIBUTES = {"int8": "vector_int8", "binary": "vector_bits"}
+
+# Number of set bits of every byte value, for Hamming distances without numpy.bitwise_count
+_POPCOUNT = None
+
+
+def _popcount():
+    global _POPCOUNT
+    if _POPCOUNT is None:
+        import numpy as np
+        _POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+    return _POPCOUNT
+
+
+def encode(vector):
+    """Returns the attributes holding every code of one vector."""
+    import numpy as np
+    array = np.asarray([float(x) for x in vector], dtype=np.float32)
+    scale = float(np.abs(array).max()) or 1.0
+    return {
+        ATTRIBUTES["int8"]: np.round(array / scale * 127).astype(np.int8).tobytes(),
+        ATTRIBUTES["binary"]: np.packbits(array > 0).tobytes(),
+    }
+
+
+def _raw(blob):
+    # The DynamoDB resource wraps binary attributes in boto3.dynamodb.types.Binary
+    return bytes(getattr(blob, "value", blob))
+
+
+def code_matrix(quantizer, blobs):
+    """Stacks the stored codes of one quantizer into a matrix."""
+    import numpy as np
+    dtype = np.int8 if quantizer == "int8" else np.uint8
+    return np.frombuffer(b"".join(_raw(blob) for blob in blobs), dtype=dtype).reshape(len(blobs), -1)
+
+
+def prefilter_scores(quantizer, query, codes):
+    """
+    Scores every code against a float query; higher is more similar.
+
+    :param quantizer: "int8" or "binary".
+    :param query: The query vector in the same space as the codes, or a matrix of query
+        vectors (one per row), which returns one column of scores per query.
+    :param codes: Matrix from `code_matrix`.
+    """
+    import numpy as np
+    query = np.asarray(query, dtype=np.float32)
+    if quantizer == "int8":
+        floats = codes.astype(np.float32)
+        norms = np.linalg.norm(floats, axis=1)
+        norms[norms == 0] = 1.0
+        return (floats @ query.T) / (norms[:, None] if query.ndim == 2 else norms)
+    if query.ndim == 2:
+        return np.stack([prefilter_scores(quantizer, row, codes) for row in query], axis=1)
+    query_bits = np.packbits(query > 0)
+    return -_popcount()[np.bitwise_xor(codes, query_bits)].sum(axis=1, dtype=np.int32)
+
+
+def top_indices(scores, depth):
+    """Indices of the `depth` highest scores, best first."""
+    import numpy as np
+    if depth >= len(scores):
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, depth)[:depth]
+    return best[np.argsort(-scores[best])]
+
+
+def backfill(table_name):
+    """Adds codes to every item of the embeddings table that lacks them; returns the number updated."""
+    from stylist_common import runtime
+    from stylist_common.embeddings import item_space, scan_all
+    table = runtime.table(table_name)
+    updated = 0
+    for item in scan_all(table):
+        if all(attribute in item for attribute in ATTRIBUTES.values()):
+            continue
+        space = item_space(item)
+        attributes = dict(encode(item["vector"]), embedding_dim=space.dimension, projection=space.projection)
+        names = {f"#a{i}": name for i, name in enumerate(attributes)}
+        table.update_item(
+            Key={"id": item["id"]},
+            UpdateExpression="SET " + ", ".join(f"{name} = :v{name[2:]}" for name in names),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f":v{i}": value for i, value in enumerate(attributes.values())},
+        )
+        updated += 1
+    return updated
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Adds prefilter codes to image embeddings stored before they existed.")
+    parser.add_argument("--table", required=True, help="Product embeddings table")
+    args = parser.parse_args()
+    print(f"Added codes to {backfill(args.table)} items")
@@ -0,0 +1,241 @@
+"""
+Compact per-category digests of the customer reviews, published for the knowledge base.
+
+`customer_reviews.csv` holds one long review per row, keyed by its category
+(`customer reviews/category/product name`). Retrieving raw rows puts several
+whole reviews into every prompt, so reviews are grouped by category (ignoring
+case) and each category gets one small document: how many reviews it has,
+their sentiment distribution and the sentences most representative of them.
+
+Sentiment is scored per review with a small word list, negation flipping the
+next few words. Representative sentences are chosen by embedding centrality:
+every sentence is embedded and those closest to the mean of the category's
+unit sentence vectors are kept, skipping near repeats of sentences already
+chosen.
+
+The digests' state (hashes of the reviews seen, their sentiment and the
+sentence vectors) is kept as JSON, so new reviews are applied incrementally:
+reviews already seen are skipped, only new sentences are embedded and only
+the documents of categories with new reviews are rewritten.
+"""
+import base64
+import csv
+import hashlib
+import io
+import json
+import re
+
+CATEGORY_COLUMN = "customer reviews/category/product name"
+REVIEW_COLUMN = "customer reviews/customer review"
+DEFAULT_PREFIX = "review-digests/"
+DEFAULT_STATE_KEY = "reviews/digests.json"
+DEFAULT_MODEL_ID = "amazon.titan-embed-image-v1"
+DEFAULT_DIMENSION = 256
+DEFAULT_SENTENCES = 3
+# Chosen sentences at least this similar to one already chosen are near repeats
+REPEAT_SIMILARITY = 0.9
+# Shorter sentences ("Love it!") say little about the product
+MIN_SENTENCE_WORDS = 5
+SENTIMENTS = ("positive", "neutral", "negative")
+
+POSITIVE_WORDS = frozenset("""
+    amazing awesome beautiful best comfortable comfy compliments cute durable elegant excellent fantastic
+    favorite flattering gorgeous great happy impressed love loved lovely nice perfect pleased recommend
+    soft sturdy stylish superb wonderful quality satisfied
+""".split())
+NEGATIVE_WORDS = frozenset("""
+    awful bad broke cheap cheaply disappointed disappointing flimsy faded itchy poor poorly refund return
+    returned ripped scratchy shrank smaller tight terrible uncomfortable unhappy worst worse wrong
+""".split())
+NEGATIONS = frozenset("not no never isn't wasn't don't didn't doesn't aren't weren't hardly".split())
+NEGATION_SPAN = 3
+
+_WORD = re.compile(r"[a-z']+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def category_key(name):
+    return " ".join(name.split()).casefold()
+
+
+def slug(name):
+    return re.sub(r"[^a-z0-9]+", "-", category_key(name)).strip("-") or "reviews"
+
+
+def review_hash(key, review):
+    return hashlib.sha256(f"{key}\n{' '.join(review.split())}".encode("utf-8")).hexdigest()[:16]
+
+
+def parse_reviews(text):
+    """
+    Parses the contents of a customer reviews CSV export.
+
+    :return: A list of (category, review), skipping rows without either.
+    """
+    reviews = []
+    for row in csv.DictReader(io.StringIO(text)):
+        category = " ".join((row.get(CATEGORY_COLUMN) or "").split())
+        review = " ".join((row.get(REVIEW_COLUMN) or "").split())
+        if category and review:
+            reviews.append((category, review))
+    return reviews
+
+
+def split_sentences(review):
+    return [sentence for sentence in _SENTENCE_END.split(review) if len(sentence.split()) >= MIN_SENTENCE_WORDS]
+
+
+def sentiment(review):
+    """positive, neutral or negative, by the review's positive words less its negative ones."""
+    score, negated = 0, 0
+    for word in _WORD.findall(review.lower()):
+        if word in NEGATIONS:
+            negated = NEGATION_SPAN
+            continue
+        polarity = (word in POSITIVE_WORDS) - (word in NEGATIVE_WORDS)
+        score += -polarity if negated else polarity
+        negated = max(0, negated - 1)
+    return "positive" if score > 0 else "negative" if score < 0 else "neutral"
+
+
+def embed_sentences(sentences, model_id=DEFAULT_MODEL_ID, dimension=DEFAULT_DIMENSION, concurrency=8):
+    """Embeds sentences with the text embeddings model, `concurrency` calls at a time."""
+    from concurrent.futures import ThreadPoolExecutor
+    from stylist_common.bedrock import invoke_model
+    from stylist_common.embeddings import request_body
+
+    def embed(sentence):
+        response = invoke_model(body=request_body(dimension, text=sentence), modelId=model_id,
+                                accept="application/json", contentType="application/json")
+        return json.loads(response["body"].read())["embedding"]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(embed, sentences))
+
+
+def central_sentences(sentences, vectors, limit=DEFAULT_SENTENCES):
+    """The `limit` sentences closest to the mean of their unit vectors, skipping near repeats."""
+    import numpy as np
+    if not sentences:
+        return []
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    centrality = matrix @ matrix.mean(axis=0)
+    chosen = []
+    for i in np.argsort(-centrality, kind="stable"):
+        if all(float(matrix[i] @ matrix[j]) < REPEAT_SIMILARITY for j in chosen):
+            chosen.append(int(i))
+            if len(chosen) == limit:
+                break
+    return [sentences[i] for i in chosen]
+
+
+class ReviewDigests:
+    """
+    The reviews seen so far per category, and the digest of each.
+
+    :param categories: {key: {"name", "reviews": {hash: sentiment}, "sentences": {sentence: vector}}}.
+    """
+
+    def __init__(self, categories=None, model_id=DEFAULT_MODEL_ID, dimension=DEFAULT_DIMENSION,
+                 sentences=DEFAULT_SENTENCES):
+        self.categories = categories or {}
+        self.model_id = model_id
+        self.dimension = dimension
+        self.sentences = sentences
+
+    def add_reviews(self, reviews, embed=None):
+        """
+        Applies the reviews not seen before.
+
+        :param reviews: (category, review) pairs, as returned by parse_reviews.
+        :param embed: Function embedding a list of sentences; the text embeddings model by default.
+        :return: The keys of the categories whose digest changed.
+        """
+        embed = embed or (lambda sentences: embed_sentences(sentences, self.model_id, self.dimension))
+        changed, new_sentences = set(), {}
+        for name, review in reviews:
+            key = category_key(name)
+            category = self.categories.setdefault(key, {"name": name, "reviews": {}, "sentences": {}})
+            review_id = review_hash(key, review)
+            if review_id in category["reviews"]:
+                continue
+            category["reviews"][review_id] = sentiment(review)
+            changed.add(key)
+            for sentence in split_sentences(review):
+                if sentence not in category["sentences"]:
+                    new_sentences.setdefault(sentence, []).append(key)
+        if new_sentences:
+            for sentence, vector in zip(new_sentences, embed(list(new_sentences))):
+                for key in new_sentences[sentence]:
+                    self.categories[key]["sentences"][sentence] = vector
+        return changed
+
+    def digest(self, key):
+        category = self.categories[key]
+        labels = list(category["reviews"].values())
+        sentences = list(category["sentences"])
+        return {
+            "category": category["name"],
+            "reviews": len(labels),
+            "sentiment": {label: labels.count(label) for label in SENTIMENTS},
+            "sentences": central_sentences(sentences, [category["sentences"][s] for s in sentences], self.sentences),
+        }
+
+    def document(self, key):
+        """The digest as a small plain text document for the knowledge base."""
+        digest = self.digest(key)
+        counts = ", ".join(f"{count} {label}" for label, count in digest["sentiment"].items() if count)
+        lines = [f"Customer reviews of {digest['category']}: {digest['reviews']} reviews ({counts})."]
+        if digest["sentences"]:
+            lines.append("What reviewers say most often:")
+            lines.extend(f"- {sentence}" for sentence in digest["sentences"])
+        return "\n".join(lines) + "\n"
+
+    def dumps(self):
+        import numpy as np
+        encode = lambda vector: base64.b64encode(np.asarray(vector, dtype=np.float16).tobytes()).decode("ascii")
+        return json.dumps({
+            "model_id": self.model_id,
+            "dimension": self.dimension,
+            "sentences": self.sentences,
+            "categories": {key: {"name": category["name"], "reviews": category["reviews"],
+                                 "sentences": {s: encode(v) for s, v in category["sentences"].items()}}
+                           for key, category in self.categories.items()},
+        }).encode("utf-8")
+
+    @classmethod
+    def loads(cls, data):
+        import numpy as np
+        document = json.loads(data)
+        decode = lambda text: np.frombuffer(base64.b64decode(text), dtype=np.float16).astype(np.float32)
+        categories = {key: {"name": category["name"], "reviews": category["reviews"],
+                            "sentences": {s: decode(v) for s, v in category["sentences"].items()}}
+                      for key, category in document["categories"].items()}
+        return cls(categories, document["model_id"], document["dimension"], document["sentences"])
+
+
+def read_digests(bucket, key=DEFAULT_STATE_KEY, **options):
+    """Reads the digests' state, or starts empty ones with `options` when none has been written."""
+    from botocore.exceptions import ClientError
+    from stylist_common import runtime
+    try:
+        return ReviewDigests.loads(runtime.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+            raise
+        return ReviewDigests(**options)
+
+
+def publish(digests, keys, bucket, prefix=DEFAULT_PREFIX):
+    """Writes the documents of the given categories and returns their object keys."""
+    from stylist_common import runtime
+    written = []
+    for key in sorted(keys):
+        object_key = f"{prefix}{slug(digests.categories[key]['name'])}.txt"
+        runtime.client("s3").put_object(Bucket=bucket, Key=object_key, Body=digests.document(key).encode("utf-8"),
+                                        ContentType="text/plain")
+        written.append(object_key)
+    return written
@@ -0,0 +1,148 @@
+"""
+Routes text generation between a fast and a strong Claude model.
+
+A one-line question such as "what color goes with navy" does not need the
+model that plans a week of outfits. `complexity()` scores a request from its
+wording in a few microseconds, and requests scoring below the threshold go to
+the fast model (Claude 3 Haiku) instead of the strong one (Claude 3 Sonnet).
+A fast answer that looks unreliable (cut off, very short or hedging) or a fast
+model that is unavailable escalates the request to the strong model.
+
+Every call emits a `ModelLatency`, `InputTokens` and `OutputTokens` metric per
+`Tier` and `Model`, with the complexity score and whether the request was
+escalated, so the threshold can be tuned by replaying traffic through
+`benchmarks/model_routing.py`.
+
+Tuned through environment variables:
+
+- ROUTER_THRESHOLD: complexity below which the fast model is used (default 0.25)
+- ROUTER_MIN_CHARS: shorter fast answers are escalated (default 40)
+"""
+import os
+import re
+import time
+from collections import namedtuple
+
+from stylist_common.bedrock import BedrockUnavailable
+from stylist_common.log import get_logger
+from stylist_common.tracing import current_request_id, emit_metrics
+
+logger = get_logger(__name__)
+
+FAST = "fast"
+STRONG = "strong"
+DEFAULT_THRESHOLD = 0.25
+
+Route = namedtuple("Route", ["tier", "target", "score"])
+
+
+class Completion(namedtuple("Completion", ["text", "input_tokens", "output_tokens", "stop_reason"])):
+    """A model's answer; token counts and stop reason are None when the API does not report them."""
+
+    def __new__(cls, text, input_tokens=None, output_tokens=None, stop_reason=None):
+        return super().__new__(cls, text, input_tokens, output_tokens, stop_reason)
+
+
+# Requests asking for a plan across several outfits, days or constraints
+PLANNING_WORDS = frozenset("plan planning wardrobe capsule itinerary pack packing week weekend days daily schedule "
+                           "compare comparing versus vs budget occasions outfits looks trip travel each every".split())
+_DURATION = re.compile(r"\b(?:\d+|two|three|four|five|six|seven|ten|a)[\s-]+(?:days?|nights?|weeks?|months?)\b")
+_CLAUSE = re.compile(r"\?|;|\band\b|\bbut\b|\balso\b|\bthen\b|^\s*(?:[-*]|\d+[.)])\s", re.MULTILINE)
+_WORD = re.compile(r"[a-z]+")
+_HEDGE = re.compile(r"\b(?:i'?m not sure|i am not sure|i don'?t know|i do not know|not enough information|"
+                    r"i'?m unable to|i am unable to)\b", re.IGNORECASE)
+TRUNCATED = frozenset(["max_tokens", "length"])
+
+
+def complexity(text):
+    """
+    Scores how demanding a request is, from 0 (a short single question) to 1.
+
+    Length contributes up to 0.35, planning words 0.2 each up to 0.4, a stated
+    duration 0.2 and extra questions or clauses 0.05 each up to 0.2.
+    """
+    lower = text.lower()
+    words = _WORD.findall(lower)
+    score = 0.35 * min(1.0, len(words) / 40)
+    score += min(0.4, 0.2 * len(PLANNING_WORDS.intersection(words)))
+    if _DURATION.search(lower):
+        score += 0.2
+    score += min(0.2, 0.05 * max(0, len(_CLAUSE.findall(lower)) - 1))
+    return min(1.0, score)
+
+
+def low_confidence(completion, min_chars):
+    """Why a fast answer should not be trusted, or None when it looks fine."""
+    if completion.stop_reason in TRUNCATED:
+        return "truncated"
+    if len(completion.text.strip()) < min_chars:
+        return "short"
+    if _HEDGE.search(completion.text):
+        return "hedged"
+    return None
+
+
+class ModelRouter:
+    """
+    Chooses between a fast and a strong target per request.
+
+    A target is whatever the caller's function invokes, usually a model id, or
+    an agent alias for agents. Without a fast target every request goes to the
+    strong one.
+    """
+
+    def __init__(self, strong, fast=None, threshold=None, min_chars=None):
+        env = os.environ.get
+        self.targets = {STRONG: strong}
+        if fast and fast != strong:
+            self.targets[FAST] = fast
+        self.threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+        if threshold is None and env("ROUTER_THRESHOLD"):
+            self.threshold = float(env("ROUTER_THRESHOLD"))
+        self.min_chars = min_chars if min_chars is not None else int(env("ROUTER_MIN_CHARS", 40))
+
+    def route(self, text):
+        score = complexity(text)
+        tier = FAST if FAST in self.targets and score < self.threshold else STRONG
+        return Route(tier, self.targets[tier], score)
+
+    def run(self, text, call):
+        """
+        Answers a request on the routed target, escalating unreliable fast answers.
+
+        :param text: The request the route is chosen for.
+        :param call: Function of a target returning a `Completion`.
+        :return: The completion used and its `Route`.
+        :raises BedrockUnavailable: When the strong target cannot be reached.
+        """
+        route = self.route(text)
+        if route.tier == FAST:
+            try:
+                completion = self._call(route, call, escalated=False)
+                reason = low_confidence(completion, self.min_chars)
+            except BedrockUnavailable as e:
+                reason = f"unavailable: {e}"
+            if reason is None:
+                return completion, route
+            logger.info("Escalating to the strong model", reason=reason, complexity=round(route.score, 3))
+            route = Route(STRONG, self.targets[STRONG], route.score)
+            return self._call(route, call, escalated=True), route
+        return self._call(route, call, escalated=False), route
+
+    def _call(self, route, call, escalated):
+        start = time.perf_counter()
+        completion = call(route.target)
+        metrics = {"ModelLatency": (time.perf_counter() - start) * 1000}
+        if completion.input_tokens is not None:
+            metrics["InputTokens"] = completion.input_tokens
+        if completion.output_tokens is not None:
+            metrics["OutputTokens"] = completion.output_tokens
+        emit_metrics({"Tier": route.tier, "Model": route.target}, metrics,
+                     {"Complexity": round(route.score, 3), "Escalated": escalated, "RequestId": current_request_id()},
+                     unit={"ModelLatency": "Milliseconds", "InputTokens": "Count", "OutputTokens": "Count"})
+        return completion
+
+
+def text_router():
+    """The router for direct model calls: TEXT_MODEL_ID is the strong model and FAST_TEXT_MODEL_ID the fast one."""
+    return ModelRouter(os.environ["TEXT_MODEL_ID"], os.environ.get("FAST_TEXT_MODEL_ID"))
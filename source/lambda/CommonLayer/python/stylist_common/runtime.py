@@ -0,0 +1,105 @@
+"""
+Lazily created, cached AWS clients shared by the Lambda handlers.
+
+Handlers used to build every boto3 client at import time, including clients
+they never used, which made each cold start pay for them. Clients are now
+created on first use, reused for the life of the warm container and tuned
+through environment variables:
+
+- CLIENT_MAX_POOL_CONNECTIONS: HTTP connections kept per client (default 10)
+- CLIENT_MAX_ATTEMPTS: total attempts including retries (default 3)
+- CLIENT_CONNECT_TIMEOUT / CLIENT_READ_TIMEOUT: seconds (default 5 / 120)
+"""
+import os
+import threading
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+# Clients installed by tests and benchmarks, serving every max_attempts
+_installed = {}
+_resources = {}
+_tables = {}
+
+
+def _config(max_attempts=None):
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=int(os.environ.get("CLIENT_MAX_POOL_CONNECTIONS", 10)),
+        retries={"max_attempts": max_attempts or int(os.environ.get("CLIENT_MAX_ATTEMPTS", 3)), "mode": "standard"},
+        connect_timeout=int(os.environ.get("CLIENT_CONNECT_TIMEOUT", 5)),
+        read_timeout=int(os.environ.get("CLIENT_READ_TIMEOUT", 120)),
+        tcp_keepalive=True,
+    )
+
+
+def _get_session():
+    # boto3's default session is not thread-safe to create clients from, so keep our own
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+def client(service_name, region_name=None, max_attempts=None):
+    """
+    Returns a cached boto3 client, creating it on first use.
+
+    :param service_name: The AWS service, e.g. "bedrock-runtime".
+    :param region_name: Defaults to the function's region.
+    :param max_attempts: Overrides CLIENT_MAX_ATTEMPTS, e.g. 1 when the caller retries itself.
+    """
+    region_name = region_name or os.environ.get("AWS_REGION")
+    installed = _installed.get((service_name, region_name))
+    if installed is not None:
+        return installed
+    # Keyed on max_attempts, so a caller that retries itself never gets a client that retries too
+    key = (service_name, region_name, max_attempts)
+    cached = _clients.get(key)
+    if cached is not None:
+        return cached
+    with _lock:
+        if key not in _clients:
+            _clients[key] = _get_session().client(service_name, region_name=region_name, config=_config(max_attempts))
+        return _clients[key]
+
+
+def resource(service_name, region_name=None):
+    """Returns a cached boto3 resource, creating it on first use."""
+    key = (service_name, region_name or os.environ.get("AWS_REGION"))
+    cached = _resources.get(key)
+    if cached is not None:
+        return cached
+    with _lock:
+        if key not in _resources:
+            _resources[key] = _get_session().resource(service_name, region_name=key[1], config=_config())
+        return _resources[key]
+
+
+def table(table_name):
+    """Returns a cached DynamoDB Table resource."""
+    cached = _tables.get(table_name)
+    if cached is None:
+        cached = _tables.setdefault(table_name, resource("dynamodb").Table(table_name))
+    return cached
+
+
+def set_client(service_name, instance, region_name=None):
+    """Installs a client for a service, used by tests and benchmarks to supply fakes."""
+    _installed[(service_name, region_name or os.environ.get("AWS_REGION"))] = instance
+
+
+def set_resource(service_name, instance, region_name=None):
+    """Installs a resource for a service, used by tests and benchmarks to supply fakes."""
+    _resources[(service_name, region_name or os.environ.get("AWS_REGION"))] = instance
+    _tables.clear()
+
+
+def reset():
+    """Drops every cached client, resource and table."""
+    with _lock:
+        _clients.clear()
+        _installed.clear()
+        _resources.clear()
+        _tables.clear()
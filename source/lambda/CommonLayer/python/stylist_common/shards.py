@@ -0,0 +1,207 @@
+"""
+Partitioning of the image embeddings into shards searched in parallel.
+
+Each image is assigned at write time to one of SLOTS hash slots of its image
+key, stored as `shard_slot` and indexed by the table's shard index. A shard
+is a set of slots, so the number of shards can change without rewriting any
+item: a `ShardMap` assigns every slot to exactly one shard.
+
+The even map gives every shard the same number of slots. Running this module
+rebalances offline: it counts the items of every slot and writes a map whose
+shards hold about the same number of items, together with the embedding
+spaces present in the catalog, to the artifacts bucket. Items written before
+`shard_slot` existed are in no slot, so sharded search cannot find them: the
+map records how many there are, and the rebalance can backfill `shard_slot`
+(and `embedding_dim`, which shards need to tell the item's space without
+reading its vector) on them.
+"""
+import heapq
+import json
+import threading
+import time
+import zlib
+
+SLOTS = 256
+SLOT_ATTRIBUTE = "shard_slot"
+SHARD_INDEX = "shard-index"
+DEFAULT_MAP_KEY = "search/shard-map.json"
+DEFAULT_MAP_TTL_SECONDS = 60.0
+
+
+def slot_of(image_key):
+    """The hash slot of an image, stable across processes and Python versions."""
+    return zlib.crc32(image_key.encode("utf-8")) % SLOTS
+
+
+class ShardMap:
+    """
+    Assignment of hash slots to shards.
+
+    :param shards: One list of slots per shard; together they hold every slot exactly once.
+    :param spaces: (dimension, projection) pairs of the vectors in the catalog, when known.
+    :param unslotted: Items without a slot when the map was written, left out of sharded search.
+    """
+
+    def __init__(self, shards, spaces=(), unslotted=0):
+        slots = sorted(slot for shard in shards for slot in shard)
+        if slots != list(range(SLOTS)):
+            raise ValueError(f"A shard map must assign each of the {SLOTS} slots to exactly one shard")
+        self.shards = [list(shard) for shard in shards]
+        self.spaces = [tuple(space) for space in spaces]
+        self.unslotted = unslotted
+
+    def __len__(self):
+        return len(self.shards)
+
+    @classmethod
+    def even(cls, shards, spaces=(), unslotted=0):
+        """Splits the slots into `shards` contiguous ranges of nearly equal size."""
+        shards = max(1, min(shards, SLOTS))
+        return cls([list(range(i * SLOTS // shards, (i + 1) * SLOTS // shards)) for i in range(shards)], spaces,
+                   unslotted)
+
+    @classmethod
+    def balanced(cls, counts, shards, spaces=(), unslotted=0):
+        """
+        Assigns slots so that every shard holds about the same number of items.
+
+        :param counts: Items per slot, a mapping or a list indexed by slot.
+        """
+        shards = max(1, min(shards, SLOTS))
+        counts = [counts.get(slot, 0) for slot in range(SLOTS)] if isinstance(counts, dict) else list(counts)
+        # Largest slots first, each to the shard holding the fewest items so far
+        heap = [(0, shard) for shard in range(shards)]
+        assignment = [[] for _ in range(shards)]
+        for slot in sorted(range(SLOTS), key=lambda slot: -counts[slot]):
+            total, shard = heapq.heappop(heap)
+            assignment[shard].append(slot)
+            heapq.heappush(heap, (total + counts[slot], shard))
+        return cls([sorted(slots) for slots in assignment], spaces, unslotted)
+
+    def dumps(self):
+        return json.dumps({"shards": self.shards, "spaces": self.spaces, "unslotted": self.unslotted})
+
+    @classmethod
+    def loads(cls, data):
+        payload = json.loads(data)
+        return cls(payload["shards"], payload.get("spaces", ()), payload.get("unslotted", 0))
+
+
+def read_shard_map(body, key=DEFAULT_MAP_KEY):
+    shard_map = ShardMap.loads(body.read())
+    if shard_map.unslotted:
+        from stylist_common.log import get_logger
+        get_logger(__name__).warning("Items without a shard slot are left out of sharded search",
+                                     unslotted=shard_map.unslotted, key=key)
+    return shard_map
+
+
+# {(bucket, key): {"object": CachedObject, "missing_until": monotonic seconds}}
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def load_shard_map(bucket, key, shards, ttl=DEFAULT_MAP_TTL_SECONDS):
+    """
+    Returns the rebalanced map stored in S3, checking its ETag every `ttl` seconds.
+
+    A warm container picks up an offline rebalance within `ttl`. Falls back to the
+    even map of `shards` when none has been written, or when the stored one has a
+    different number of shards.
+    """
+    from botocore.exceptions import ClientError
+    from stylist_common.cached_object import CachedObject
+    with _maps_lock:
+        entry = _maps.get((bucket, key))
+        if entry is None:
+            entry = _maps[(bucket, key)] = {
+                "object": CachedObject(bucket, key, lambda body: read_shard_map(body, key), ttl=ttl),
+                "missing_until": 0.0,
+            }
+        missing = time.monotonic() < entry["missing_until"]
+    shard_map = None
+    if not missing:
+        try:
+            shard_map = entry["object"].get()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+            # Not asked for again until the TTL has passed, like a stored map
+            with _maps_lock:
+                entry["missing_until"] = time.monotonic() + ttl
+    if shard_map is None or len(shard_map) != shards:
+        return ShardMap.even(shards, shard_map.spaces if shard_map else (), shard_map.unslotted if shard_map else 0)
+    return shard_map
+
+
+def merge_top_k(results, k):
+    """Merges per-shard [(image_key, score)] lists into the overall best `k`."""
+    return heapq.nlargest(k, (pair for found in results for pair in found), key=lambda pair: pair[1])
+
+
+def query_slot(table, slot, **kwargs):
+    """Reads every item of one slot from the shard index, following pagination."""
+    from boto3.dynamodb.conditions import Key
+    kwargs.update(IndexName=SHARD_INDEX, KeyConditionExpression=Key(SLOT_ATTRIBUTE).eq(slot))
+    response = table.query(**kwargs)
+    items = response["Items"]
+    while "LastEvaluatedKey" in response:
+        response = table.query(ExclusiveStartKey=response["LastEvaluatedKey"], **kwargs)
+        items.extend(response["Items"])
+    return items
+
+
+def rebalance(table_name, bucket, shards, key=DEFAULT_MAP_KEY, backfill=False):
+    """
+    Counts the items of every slot, writes a balanced map for `shards` shards and returns it.
+
+    :param backfill: Also write `shard_slot`, and `embedding_dim` when it is missing, on items without them.
+    :return: The map, the items per slot and the number of items that were missing either attribute.
+    """
+    from stylist_common import runtime
+    from stylist_common.embeddings import item_space, scan_all
+    table = runtime.table(table_name)
+    counts = [0] * SLOTS
+    spaces = set()
+    missing = unslotted = 0
+    for item in scan_all(table, ProjectionExpression="id, image_key, embedding_dim, #projection, #vector, #slot",
+                         ExpressionAttributeNames={"#projection": "projection", "#vector": "vector",
+                                                   "#slot": SLOT_ATTRIBUTE}):
+        space = item_space(item)
+        spaces.add(tuple(space))
+        slot = item.get(SLOT_ATTRIBUTE)
+        if slot is not None and item.get("embedding_dim"):
+            counts[int(slot)] += 1
+            continue
+        missing += 1
+        if not backfill:
+            unslotted += slot is None
+            if slot is not None:
+                counts[int(slot)] += 1
+            continue
+        slot = slot_of(item["image_key"]) if slot is None else slot
+        table.update_item(Key={"id": item["id"]}, UpdateExpression="SET #slot = :slot, embedding_dim = :dim",
+                          ExpressionAttributeNames={"#slot": SLOT_ATTRIBUTE},
+                          ExpressionAttributeValues={":slot": slot, ":dim": space.dimension})
+        counts[int(slot)] += 1
+    shard_map = ShardMap.balanced(counts, shards, sorted(spaces), unslotted)
+    runtime.client("s3").put_object(Bucket=bucket, Key=key, Body=shard_map.dumps())
+    return shard_map, counts, missing
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebalances the search shards over the catalog's hash slots.")
+    parser.add_argument("--table", required=True, help="Product embeddings table")
+    parser.add_argument("--bucket", required=True, help="Artifacts bucket the shard map is written to")
+    parser.add_argument("--shards", type=int, required=True, help="Set it as SEARCH_SHARDS to use the map")
+    parser.add_argument("--key", default=DEFAULT_MAP_KEY)
+    parser.add_argument("--backfill", action="store_true",
+                        help=f"Write {SLOT_ATTRIBUTE} and embedding_dim on items without them")
+    args = parser.parse_args()
+    written, slot_counts, unassigned = rebalance(args.table, args.bucket, args.shards, args.key, args.backfill)
+    sizes = [sum(slot_counts[slot] for slot in shard) for shard in written.shards]
+    print(f"Wrote {len(written)} shards of {min(sizes)}-{max(sizes)} items to s3://{args.bucket}/{args.key}")
+    if unassigned:
+        print(f"{unassigned} items had no {SLOT_ATTRIBUTE} or embedding_dim"
+              + ("; backfilled" if args.backfill else "; run with --backfill"))
@@ -0,0 +1,175 @@
+"""
+Per-stage latency tracing for the Lambda handlers.
+
+A handler wrapped with `traced()` starts a trace for each request, correlated
+by the `X-Request-Id` header that the Streamlit client sends through API
+Gateway (falling back to the API Gateway or Lambda request id). Code inside
+the handler times its external calls and CPU stages with `stage()` or
+`timed()`, and a sampled request emits one CloudWatch Embedded Metric Format
+record with every stage's latency when it finishes.
+
+TRACE_SAMPLE_RATE sets the fraction of requests that are traced (default 0.1).
+Unsampled requests skip all timing work. A request sent with `X-Trace: 1` is
+always traced.
+"""
+import contextvars
+import functools
+import json
+import os
+import random
+import time
+
+METRICS_NAMESPACE = "VirtualStylist"
+REQUEST_ID_HEADER = "x-request-id"
+FORCE_TRACE_HEADER = "x-trace"
+
+_current = contextvars.ContextVar("stylist_trace", default=None)
+_request_id = contextvars.ContextVar("stylist_request_id", default=None)
+_sink = print
+
+
+def set_sink(sink):
+    """Replaces the function that receives each EMF JSON line (print by default)."""
+    global _sink
+    _sink = sink
+
+
+def emit_metrics(dimensions, metrics, properties=None, unit="Milliseconds"):
+    """
+    Writes one CloudWatch Embedded Metric Format record.
+
+    :param dimensions: Dimension names and values, e.g. {"Function": "imagequery_function"}.
+    :param metrics: Metric names and values.
+    :param properties: Extra searchable fields such as the request id.
+    :param unit: The unit of every metric, or a mapping from metric name to unit.
+    """
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit if isinstance(unit, str) else unit.get(name, "None")}
+                            for name in metrics],
+            }],
+        },
+    }
+    record.update(dimensions)
+    record.update({name: round(value, 3) for name, value in metrics.items()})
+    record.update(properties or {})
+    _sink(json.dumps(record, default=str))
+
+
+class Trace:
+    def __init__(self, function_name, request_id):
+        self.function_name = function_name
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, elapsed_ms):
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def finish(self):
+        metrics = {f"{name}Latency": elapsed for name, elapsed in self.stages.items()}
+        metrics["TotalLatency"] = (time.perf_counter() - self.started) * 1000
+        emit_metrics({"Function": self.function_name}, metrics, {"RequestId": self.request_id})
+
+
+class _Stage:
+    __slots__ = ("trace", "name", "started")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """Context manager timing a stage of the current request; a no-op when the request is not sampled."""
+    trace = _current.get()
+    return _NO_STAGE if trace is None else _Stage(trace, name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as the stage `name`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _headers(event):
+    headers = (event.get("headers") or {}) if isinstance(event, dict) else {}
+    return {str(key).lower(): value for key, value in headers.items()}
+
+
+def request_id(event, context=None):
+    """Returns the correlation id for a request."""
+    client_id = _headers(event).get(REQUEST_ID_HEADER)
+    if client_id:
+        return client_id
+    gateway_id = ((event.get("requestContext") or {}) if isinstance(event, dict) else {}).get("requestId")
+    return gateway_id or getattr(context, "aws_request_id", None) or "local"
+
+
+def current_request_id():
+    """Returns the correlation id of the request being handled, traced or not."""
+    return _request_id.get()
+
+
+def is_traced():
+    return _current.get() is not None
+
+
+def traced(function_name):
+    """
+    Decorator for a Lambda handler that traces a sample of its requests.
+
+    API Gateway responses get an `X-Request-Id` header so the client can
+    correlate its own logs with the handler's metrics.
+    """
+    sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", 0.1))
+
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            rid = request_id(event, context)
+            sampled = _headers(event).get(FORCE_TRACE_HEADER) == "1" or random.random() < sample_rate
+            trace = Trace(function_name, rid) if sampled else None
+            token, rid_token = _current.set(trace), _request_id.set(rid)
+            try:
+                response = handler(event, context)
+            finally:
+                _current.reset(token)
+                _request_id.reset(rid_token)
+                if trace is not None:
+                    trace.finish()
+            if isinstance(response, dict) and "statusCode" in response:
+                response.setdefault("headers", {})["X-Request-Id"] = rid
+            return response
+        return wrapper
+    return decorate
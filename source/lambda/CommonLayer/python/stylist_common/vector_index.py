@@ -0,0 +1,159 @@
+"""
+In-memory matrix of the catalog's image vectors, for processes that outlive a request.
+
+The search Lambda reads the table on every call; a long-lived search service
+instead loads every vector once into one unit-normalised float32 matrix per
+embedding space and answers a batch of queries with a single matrix-matrix
+multiply. Scores are cosine similarities, as in the search function.
+
+Indexes can also be serialised and updated in place of a rebuild (see
+`stylist_common.index_snapshots`).
+"""
+import io
+
+from stylist_common.embeddings import Space, item_space, scan_all
+
+
+class VectorIndex:
+    """
+    Unit-length vectors of one embedding space.
+
+    :param space: The `Space` every vector belongs to.
+    :param image_keys: Image key of each row.
+    :param matrix: float32 array of shape (items, dimension), rows of unit length.
+    :param ids: Table id of each row, needed to apply changes.
+    """
+
+    def __init__(self, space, image_keys, matrix, ids=None):
+        self.space = space
+        self.image_keys = list(image_keys)
+        self.matrix = matrix
+        self.ids = list(ids) if ids is not None else [None] * len(self.image_keys)
+
+    def __len__(self):
+        return len(self.image_keys)
+
+    @classmethod
+    def build(cls, space, items):
+        import numpy as np
+        matrix = np.asarray([[float(x) for x in item["vector"]] for item in items], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return cls(space, [item["image_key"] for item in items], matrix / norms, [item.get("id") for item in items])
+
+    def search_many(self, queries, k):
+        """
+        Scores a batch of queries against every vector with one multiply.
+
+        :param queries: Query vectors in this index's space, one per row.
+        :return: For each query, up to `k` (image_key, score) pairs, best first.
+        """
+        import numpy as np
+        from stylist_common.quantize import top_indices
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = self.matrix @ (queries / norms).T
+        return [[(self.image_keys[i], float(column[i])) for i in top_indices(column, k)] for column in scores.T]
+
+    def search_diverse(self, query, k, weight, depth=None):
+        """
+        Maximal marginal relevance: picks vectors one at a time, each maximising
+        `weight` * its similarity to the query - (1 - `weight`) * its highest
+        similarity to the vectors already picked. A weight of 1 is `search_many`.
+
+        :param depth: Only the `depth` vectors most similar to the query are considered.
+        :return: Up to `k` (image_key, score) pairs in the order picked; scores are similarities to the query.
+        """
+        import numpy as np
+        from stylist_common.quantize import top_indices
+        query = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        relevance = self.matrix @ (query / norm if norm else query)
+        pool = top_indices(relevance, depth or len(self))
+        candidates = self.matrix[pool]
+        gains = weight * relevance[pool]
+        redundancy = np.zeros(len(pool), dtype=np.float32)
+        available = np.ones(len(pool), dtype=bool)
+        picked = []
+        for _ in range(min(k, len(pool))):
+            best = int(np.argmax(np.where(available, gains - (1 - weight) * redundancy, -np.inf)))
+            picked.append(pool[best])
+            available[best] = False
+            similarity = candidates @ candidates[best]
+            redundancy = similarity if len(picked) == 1 else np.maximum(redundancy, similarity)
+        return [(self.image_keys[i], float(relevance[i])) for i in picked]
+
+
+def build_indexes(items):
+    """Groups table items by embedding space into one index per space."""
+    spaces = {}
+    for item in items:
+        spaces.setdefault(item_space(item), []).append(item)
+    return {space: VectorIndex.build(space, space_items) for space, space_items in spaces.items()}
+
+
+def load_indexes(table):
+    """Reads every vector of the embeddings table into one index per space, leaving out marked duplicates."""
+    from stylist_common.duplicates import DUPLICATE_ATTRIBUTE
+    items = scan_all(table, ProjectionExpression="id, image_key, vector, embedding_dim, #projection, #duplicate",
+                     ExpressionAttributeNames={"#projection": "projection", "#duplicate": DUPLICATE_ATTRIBUTE})
+    return build_indexes([item for item in items if DUPLICATE_ATTRIBUTE not in item])
+
+
+def apply_changes(indexes, changes):
+    """
+    Returns new indexes with changes applied; the given indexes are left untouched.
+
+    A change is either a table item (id, image_key, vector and optionally embedding_dim
+    and projection), which inserts or replaces that id, or {"id": ..., "deleted": True}.
+    Only the last change of each id counts. Spaces without changes are shared.
+    """
+    import numpy as np
+    latest = {}
+    for change in changes:
+        latest[change["id"]] = change
+    added = build_indexes([change for change in latest.values() if not change.get("deleted")])
+    result = {}
+    for space in list(indexes) + [space for space in added if space not in indexes]:
+        index = indexes.get(space)
+        keep = [i for i, item_id in enumerate(index.ids) if item_id not in latest] if index is not None else []
+        if space not in added and index is not None and len(keep) == len(index):
+            result[space] = index
+            continue
+        parts = [(index, keep)] if keep else []
+        if space in added:
+            parts.append((added[space], range(len(added[space]))))
+        if not parts:
+            continue
+        result[space] = VectorIndex(
+            space,
+            [part.image_keys[i] for part, rows in parts for i in rows],
+            np.concatenate([part.matrix[list(rows)] for part, rows in parts]),
+            [part.ids[i] for part, rows in parts for i in rows],
+        )
+    return result
+
+
+def dumps_indexes(indexes):
+    """Serialises indexes to npz bytes."""
+    import numpy as np
+    arrays = {"spaces": np.array([[str(space.dimension), space.projection] for space in indexes], dtype=str).reshape(-1, 2)}
+    for i, index in enumerate(indexes.values()):
+        arrays[f"ids_{i}"] = np.array(index.ids, dtype=str)
+        arrays[f"image_keys_{i}"] = np.array(index.image_keys, dtype=str)
+        arrays[f"matrix_{i}"] = index.matrix
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def loads_indexes(data):
+    import numpy as np
+    indexes = {}
+    with np.load(io.BytesIO(data)) as arrays:
+        for i, (dimension, projection) in enumerate(arrays["spaces"]):
+            space = Space(int(dimension), str(projection))
+            indexes[space] = VectorIndex(space, arrays[f"image_keys_{i}"].tolist(), arrays[f"matrix_{i}"],
+                                         arrays[f"ids_{i}"].tolist())
+    return indexes
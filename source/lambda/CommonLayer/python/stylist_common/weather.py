@@ -0,0 +1,61 @@
+import json
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+# Weather changes slowly relative to chat traffic, so cache lookups per city
+CACHE_TTL_SECONDS = 600
+# Cities kept, least recently used first out, so arbitrary locations cannot grow the cache without bound
+CACHE_MAX_ENTRIES = 1024
+
+_http = None
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _pool():
+    # urllib3 ships with botocore in the Lambda runtime; import it only once weather is needed
+    global _http
+    if _http is None:
+        import urllib3
+        _http = urllib3.PoolManager(maxsize=10, timeout=urllib3.Timeout(connect=2.0, read=5.0))
+    return _http
+
+
+def get_weather(city, api_key):
+    """
+    Fetches current weather conditions for a city from OpenWeatherMap.
+
+    :param city: The city name.
+    :param api_key: OpenWeatherMap API key.
+    :return: A dict with the resolved city, temperature in Celsius and condition.
+    """
+    key = city.strip().lower()
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached:
+            _cache.move_to_end(key)
+    if cached and now - cached[0] < CACHE_TTL_SECONDS:
+        return cached[1]
+
+    params = {'q': city, 'appid': api_key, 'units': 'metric'}
+    response = _pool().request("GET", f"{BASE_URL}?{urllib.parse.urlencode(params)}")
+    if response.status >= 400:
+        raise RuntimeError(f"OpenWeatherMap returned HTTP {response.status} for {city}")
+    weather_data = json.loads(response.data)
+
+    weather = {
+        'city': weather_data['name'],
+        'temperature': weather_data['main']['temp'],
+        'condition': weather_data['weather'][0]['description']
+    }
+    with _cache_lock:
+        _cache[key] = (now, weather)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return weather
@@ -0,0 +1,33 @@
+import json
+import os
+
+from stylist_common import runtime
+from stylist_common.log import get_logger
+from stylist_common.orders import parse_orders
+from stylist_common.profiles import DynamoDBProfileStore, aggregate
+from stylist_common.tracing import stage, traced
+
+logger = get_logger(__name__)
+
+PROFILE_TABLE = os.environ.get('PROFILE_TABLE')
+
+
+@traced("customer_profile_function")
+def handler(event, context):
+    # Invoked by EventBridge when an order_history.csv object lands in the data bucket
+    bucket = event['detail']['bucket']['name']
+    key = event['detail']['object']['key']
+
+    with stage("s3_get"):
+        body = runtime.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    with stage("parse"):
+        orders = parse_orders(body)
+    with stage("aggregate"):
+        applied = aggregate(orders, DynamoDBProfileStore(runtime.table(PROFILE_TABLE)))
+
+    logger.info("Updated customer profiles", key=key, orders=len(orders), applied=applied)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'orders': len(orders), 'applied': applied})
+    }
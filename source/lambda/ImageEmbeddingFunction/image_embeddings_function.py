@@ -1,26 +1,54 @@
-import boto3
 import base64
 import json
 import os
 import uuid
 from botocore.exceptions import ClientError
-from decimal import Decimal
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ['AWS_REGION'])
-table = dynamodb.Table(os.environ.get('dynamodb_table'))
+from stylist_common import runtime
+from stylist_common.bedrock import BedrockUnavailable, invoke_model
+from stylist_common.embeddings import request_body, to_space
+from stylist_common.images import DEFAULT_EMBEDDING_SIZE, InvalidImage, prepare_for_embedding, read_image_object
+from stylist_common.log import get_logger
+from stylist_common.migration import current_deployment, store_vector
+from stylist_common.tracing import stage, traced
+
+logger = get_logger(__name__)
+
+# Longest edge, in pixels, of the images sent to the model, and the largest object accepted
+EMBEDDING_IMAGE_SIZE = int(os.environ.get('EMBEDDING_IMAGE_SIZE', DEFAULT_EMBEDDING_SIZE))
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 50 * 1024 * 1024))
+
+def prepare_image(data):
+    try:
+        return prepare_for_embedding(data, EMBEDDING_IMAGE_SIZE)
+    except ImportError:
+        # Without the Pillow layer the image is embedded as stored
+        return data
 
 def encode_image_to_base64(image_data):
     return base64.b64encode(image_data).decode('utf-8')
 
-def get_embedding(image_base64):
-    input_data = {"inputImage": image_base64}
-    body = json.dumps(input_data)
+def image_id(bucket, key):
+    # Derived from the object, so a retried event rewrites the same items instead of adding new ones
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"s3://{bucket}/{key}"))
 
-    response = bedrock_runtime.invoke_model(
+def store_embedding(item_id, key, image_base64, generation):
+    with stage("embed"):
+        embedding = get_embedding(image_base64, generation.dimension, generation.model_id)
+    with stage("projection"):
+        vector = to_space(embedding, generation.space)
+    with stage("dynamodb_update"):
+        # Updates only the vector fields, keeping the image's text vectors and duplicate mark
+        store_vector(item_id, key, vector, generation)
+
+def get_embedding(image_base64, dimension, model_id):
+    body = request_body(dimension, image_base64=image_base64)
+
+    # Throttles are retried by the shared invoker; if Bedrock stays unavailable the exception
+    # fails the invocation so Lambda's asynchronous retry re-delivers the S3 event later
+    response = invoke_model(
         body=body,
-        modelId= os.environ.get("EMBEDDINGS_MODEL_ID"),
+        modelId=model_id,
         accept="application/json",
         contentType="application/json"
     )
@@ -28,37 +56,40 @@ def get_embedding(image_base64):
     response_body = json.loads(response.get("body").read())
     return response_body.get("embedding")
 
-def float_to_decimal(obj):
-    if isinstance(obj, list):
-        return [float_to_decimal(item) for item in obj]
-    elif isinstance(obj, float):
-        return Decimal(str(obj))
-    return obj
-
+@traced("image_embeddings_function")
 def handler(event, context):
     for record in event['Records']:
         bucket = record['s3']['bucket']['name']
         key = record['s3']['object']['key']
 
         try:
-            response = s3.get_object(Bucket=bucket, Key=key)
-            image_data = response['Body'].read()
-            image_base64 = encode_image_to_base64(image_data)
+            with stage("s3_get"):
+                response = runtime.client('s3').get_object(Bucket=bucket, Key=key)
+                original = read_image_object(response, MAX_IMAGE_BYTES)
+            with stage("preprocess"):
+                image_data = prepare_image(original)
+            with stage("base64_encode"):
+                image_base64 = encode_image_to_base64(image_data)
             
-            embedding = get_embedding(image_base64)
-            
-            item = {
-                'id': str(uuid.uuid4()),
-                'image_key': key,
-                'vector': float_to_decimal(embedding)  # Convert float values to Decimal
-            }
-            
-            table.put_item(Item=item)
-            
-            print(f"Processed image {key} and stored embedding in DynamoDB")
-        
+            # While a model migration is under way, the image is embedded by both the live and the shadow model
+            item_id = image_id(bucket, key)
+            live, *others = current_deployment().generations()
+            store_embedding(item_id, key, image_base64, live)
+            for generation in others:
+                # The live vector is stored, so a failed shadow write is left to the next reembed run
+                try:
+                    store_embedding(item_id, key, image_base64, generation)
+                except (BedrockUnavailable, ClientError) as e:
+                    logger.warning("Could not store the image in another generation", image_key=key,
+                                   table=generation.table, model_id=generation.model_id, error=str(e))
+
+            logger.info("Stored image embedding", image_key=key, bytes=len(original), sent_bytes=len(image_data))
+
+        except InvalidImage as e:
+            # Retrying cannot help, so skip the object instead of failing the invocation
+            logger.warning("Skipped object that is not a usable image", image_key=key, error=str(e))
         except ClientError as e:
-            print(f"Error processing image {key}: {str(e)}")
+            logger.error("Error processing image", image_key=key, error=str(e))
 
     return {
         'statusCode': 200,
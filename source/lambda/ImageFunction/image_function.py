@@ -1,24 +1,28 @@
 # Use the native inference API to create an image with Stability.ai Stable Diffusion
 import base64
-import boto3
 import json
 import os
-from base64 import b64decode
 from botocore.exceptions import ClientError
 
+from stylist_common.bedrock import BedrockUnavailable, invoke_model
+from stylist_common.images import CONTENT_TYPES, needs_transcode, output_options, transcode
+from stylist_common.log import get_logger
+from stylist_common.routing import Completion, text_router
+from stylist_common.tracing import stage, traced
+
+logger = get_logger(__name__)
+
 NEGATIVE_PROMPTS = ["bad anatomy", "distorted", "blurry","pixelated", "dull", "unclear","poorly rendered","poorly Rendered face","poorly drawn face","poor facial details","poorly drawn hands","poorly rendered hands","low resolution","Images cut out at the top, left, right, bottom.",
     "bad composition","mutated body parts","blurry image","disfigured","oversaturated","bad anatomy","deformed body features",]
 
-# Create a Bedrock Runtime client in the AWS Region of your choice.
-bedrock_runtime = boto3.client("bedrock-runtime", region_name=os.environ['AWS_REGION'])
-
 # Set the model ID, e.g., Stable Diffusion XL 1.
 image_model_id = os.environ['IMAGE_MODEL_ID']
 
+@traced("image_function")
 def handler(event, context): 
 
     query = str(event.get('queryStringParameters')['query'])
-    print(query)
+    logger.info("Image request", query=query)
     
     if "queryStringParameters" not in event:
         return  {
@@ -26,10 +30,19 @@ def handler(event, context):
         'body': 'No query string parameters passed in'
         }
 
+    try:
+        output_format, quality, max_size = output_options(event['queryStringParameters'])
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': str(e)
+            }
+
     style = query
     
     # Added the option to invoke Text model to refine the style and feed to Image generation model based on user's choice. 
-    text_model_output= text_model(style)
+    with stage("text_model"):
+        text_model_output= text_model(style)
 
     image_strip = ""
     request = json.dumps({
@@ -46,27 +59,46 @@ def handler(event, context):
     accept = "application/json"
     contentType = "application/json"
     
-    response = bedrock_runtime.invoke_model(body=request, modelId=image_model_id, accept=accept, contentType=contentType)
-    response_body = json.loads(response.get("body").read())
-    print(response_body)
+    try:
+        with stage("image_model"):
+            response = invoke_model(body=request, modelId=image_model_id, accept=accept, contentType=contentType)
+    except BedrockUnavailable as e:
+        logger.warning("Image model unavailable", error=str(e))
+        return {
+            'statusCode': 503,
+            'body': 'The image service is busy, please try again shortly.'
+            }
+    with stage("decode"):
+        response_body = json.loads(response.get("body").read())
+    # The artifact is a multi-megabyte base64 image, so only its size is logged
+    logger.info("Image model response", sampled=True, response=response_body)
     
-    base_64_img_str = response_body["artifacts"][0].get("base64")
-    print("base_64_img_str: " + str(base_64_img_str))
-    image_data = base64.b64decode(base_64_img_str.encode())
-    print("image_data : " + str(image_data))
+    # The model already returns base64 PNG, which is exactly what API Gateway expects, so pass it through
+    body = response_body["artifacts"][0].get("base64")
+    content_type = "image/png"
+    if needs_transcode(output_format, max_size):
+        try:
+            with stage("transcode"):
+                image_data = transcode(base64.b64decode(body), output_format, quality, max_size)
+                body = base64.b64encode(image_data).decode('utf-8')
+            content_type = CONTENT_TYPES[output_format]
+        except ImportError:
+            logger.warning("Pillow is not available, serving the PNG as generated", format=output_format)
+    logger.info("Generated image", content_type=content_type, base64_chars=len(body),
+                finish_reason=response_body["artifacts"][0].get("finishReason"))
     
     return {
-            'headers': { "Content-Type": "image/png" },
+            'headers': { "Content-Type": content_type },
             'statusCode': 200,
-            'body': base64.b64encode(image_data).decode('utf-8'),
+            'body': body,
             'isBase64Encoded': True
             }
 
 
 def text_model(prompt):
     
-    # Set the model ID, e.g., Claude 3 Haiku.
-    text_model_id = os.environ["TEXT_MODEL_ID"]
+    # Simple styles go to FAST_TEXT_MODEL_ID (e.g. Claude 3 Haiku), detailed ones to TEXT_MODEL_ID.
+    router = text_router()
             
     # Start a conversation with the user message.
     user_message = "You are a personal virtual stylist. Convert the styles provided here: " + str(prompt) + "into properly defined photorealistic clothing recommendation"
@@ -85,20 +117,25 @@ def text_model(prompt):
 
     # Convert the native request to JSON.
     request = json.dumps(native_request)
+
+    def call(text_model_id):
+        # Invoke the model with the request and decode the response body.
+        response = invoke_model(modelId=text_model_id, body=request)
+        model_response = json.loads(response["body"].read())
+        usage = model_response.get("usage", {})
+        return Completion(model_response["content"][0]["text"], usage.get("input_tokens"),
+                          usage.get("output_tokens"), model_response.get("stop_reason"))
     
     try:
-        # Invoke the model with the request.
-        response = bedrock_runtime.invoke_model(modelId=text_model_id, body=request)
-    
-    except (ClientError, Exception) as e:
-        print(f"ERROR: Can't invoke '{text_model_id}'. Reason: {e}")
-        exit(1)
+        completion, route = router.run(str(prompt), call)
     
-    # Decode the response body.
-    model_response = json.loads(response["body"].read())
+    except (ClientError, BedrockUnavailable) as e:
+        # Degrade to the user's own wording rather than exiting the warm container
+        logger.error("Text model invocation failed", model_id=router.targets, error=str(e))
+        return prompt
     
     # Extract and print the response text.
-    response_text = model_response["content"][0]["text"]
-    print(response_text)
+    response_text = completion.text
+    logger.info("Refined style", sampled=True, model_id=route.target, text=response_text)
 
-    return response_text
\ No newline at end of file
+    return response_text
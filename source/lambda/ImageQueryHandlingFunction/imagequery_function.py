@@ -1,21 +1,57 @@
-import boto3
 import json
 import base64
+import contextvars
 import math
-from decimal import Decimal
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ['AWS_REGION'])
-table = dynamodb.Table(os.environ.get('dynamodb_table')) #product_embeddings
+from stylist_common import runtime
+from stylist_common.bedrock import BedrockUnavailable, invoke_model
+from stylist_common.duplicates import DUPLICATE_ATTRIBUTE
+from stylist_common.embeddings import Space, item_space, request_body, scan_all, to_space
+from stylist_common.image_cache import image_cache
+from stylist_common.log import get_logger
+from stylist_common.migration import MODEL_ATTRIBUTE, VERSION_ATTRIBUTE, current_deployment
+from stylist_common.multivector import DEFAULT_RRF_K, DEFAULT_TEXT_WEIGHT, TEXT_CODE_PREFIX, MultiVectorIndex, fuse
+from stylist_common.quantize import ATTRIBUTES, code_matrix, prefilter_scores, top_indices
+from stylist_common.shards import (DEFAULT_MAP_KEY, DEFAULT_MAP_TTL_SECONDS, ShardMap, load_shard_map, merge_top_k,
+                                   query_slot)
+from stylist_common.tracing import current_request_id, emit_metrics, is_traced, stage, traced
+from stylist_common.vector_index import VectorIndex
 
-def get_embedding(text_description):
-    input_data = {"inputText": text_description}
-    body = json.dumps(input_data)
-    response = bedrock_runtime.invoke_model(
+logger = get_logger(__name__)
+
+TABLE_NAME = os.environ.get('dynamodb_table') #product_embeddings
+# Prefilter codes scanned before the exact re-rank: int8, binary, or none to score every float vector
+QUANTIZER = os.environ.get('QUANTIZER', 'int8')
+RERANK_DEPTH = int(os.environ.get('RERANK_DEPTH', 200))
+# Below 1, results are re-ranked for diversity by maximal marginal relevance among the re-ranked candidates
+MMR_LAMBDA = float(os.environ.get('MMR_LAMBDA', 1.0))
+# Fusion of image scores with catalog text scores (see stylist_common.multivector): none, weighted or rrf
+FUSION = os.environ.get('FUSION', 'none')
+TEXT_WEIGHT = float(os.environ.get('TEXT_WEIGHT', DEFAULT_TEXT_WEIGHT))
+RRF_K = int(os.environ.get('RRF_K', DEFAULT_RRF_K))
+# Batch requests (POST /search): queries per request, results per query, and parallel embedding calls
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', 25))
+MAX_K = 20
+DEFAULT_K = 3
+EMBED_CONCURRENCY = int(os.environ.get('EMBED_CONCURRENCY', 8))
+# Scatter-gather search (see stylist_common.shards): shards searched in parallel, the function that
+# searches one (in-process when unset), and how long to wait before answering with the shards that replied
+SEARCH_SHARDS = int(os.environ.get('SEARCH_SHARDS', 1))
+SHARD_FUNCTION = os.environ.get('SHARD_FUNCTION')
+SHARD_TIMEOUT_MS = int(os.environ.get('SHARD_TIMEOUT_MS', 2000))
+SHARD_MAP_KEY = os.environ.get('SHARD_MAP_KEY', DEFAULT_MAP_KEY)
+# How long a warm container uses its shard map before checking whether it was rebalanced
+SHARD_MAP_TTL_SECONDS = float(os.environ.get('SHARD_MAP_TTL_SECONDS', DEFAULT_MAP_TTL_SECONDS))
+
+def get_embedding(text_description, dimension, model_id=None):
+    body = request_body(dimension, text=text_description)
+    response = invoke_model(
         body=body,
-        modelId=os.environ.get("EMBEDDINGS_MODEL_ID"),
+        modelId=model_id or os.environ.get("EMBEDDINGS_MODEL_ID"),
         accept="application/json",
         contentType="application/json"
     )
@@ -28,31 +64,532 @@ def cosine_similarity(v1, v2):
     norm_v2 = math.sqrt(sum(b * b for b in v2))
     return dot_product / (norm_v1 * norm_v2)
 
+def group_by_space(items):
+    spaces = {}
+    for item in items:
+        spaces.setdefault(item_space(item), []).append(item)
+    return spaces
+
+def score_exactly(items, query_vector):
+    with stage("decimal_conversion"):
+        vectors = [[float(x) for x in item['vector']] for item in items]  # Convert Decimal to float
+    with stage("scoring"):
+        return [
+            {'image_key': item['image_key'], 'score': cosine_similarity(query_vector, vector)}
+            for item, vector in zip(items, vectors)
+        ]
+
+def score_diversely(space, items, query_vector, k):
+    """The `k` items picked by maximal marginal relevance (MMR_LAMBDA), as results of score_exactly."""
+    with stage("decimal_conversion"):
+        index = VectorIndex.build(space, items)
+    with stage("scoring"):
+        return [{'image_key': key, 'score': score}
+                for key, score in index.search_diverse(query_vector, k, MMR_LAMBDA, RERANK_DEPTH)]
+
+def score_fused(space, items, query_vector, k):
+    """The best `k` items by image and text scores fused (FUSION), as results of score_exactly."""
+    with stage("decimal_conversion"):
+        index = MultiVectorIndex.build(space, items)
+    with stage("scoring"):
+        return [{'image_key': key, 'score': score}
+                for key, score in index.search(query_vector, k, FUSION, TEXT_WEIGHT, RRF_K)]
+
+CODES_PROJECTION = 'id, image_key, embedding_dim, #projection, #codes, #textcodes, #duplicate, #model, #version'
+
+def codes_projection_names():
+    return {'#projection': 'projection', '#codes': ATTRIBUTES[QUANTIZER],
+            '#textcodes': TEXT_CODE_PREFIX + ATTRIBUTES[QUANTIZER], '#duplicate': DUPLICATE_ATTRIBUTE,
+            '#model': MODEL_ATTRIBUTE, '#version': VERSION_ATTRIBUTE}
+
+def searchable(items, generation=None):
+    """
+    Leaves out the images marked as near-duplicates of another (see stylist_common.duplicates),
+    and with a generation, the vectors written by another model or version.
+    """
+    return [item for item in items
+            if DUPLICATE_ATTRIBUTE not in item and (generation is None or generation.owns(item))]
+
+def fetch_vectors(ids, table_name=None):
+    """Reads the float vectors of the given items with BatchGetItem."""
+    table_name = table_name or TABLE_NAME
+    items = []
+    keys = [{'id': item_id} for item_id in ids]
+    for start in range(0, len(keys), 100):
+        request = {table_name: {'Keys': keys[start:start + 100]}}
+        while request:
+            response = runtime.resource('dynamodb').batch_get_item(RequestItems=request)
+            items.extend(response['Responses'].get(table_name, []))
+            request = response.get('UnprocessedKeys') or None
+    return items
+
+def prefilter(items, query_vector_for, fusion=None):
+    """
+    Ranks items by their compact codes and returns the ids worth re-ranking exactly.
+
+    Items stored before codes existed are always returned, since they cannot be prefiltered.
+    `query_vector_for(space)` may return one vector or a list of them; with a list the
+    best candidates of every query are returned together. With a fusion (FUSION by default),
+    the best candidates by catalog text codes are returned as well.
+    """
+    fusion = FUSION if fusion is None else fusion
+    attribute = ATTRIBUTES[QUANTIZER]
+    coded = [item for item in items if attribute in item]
+    ids = [item['id'] for item in items if attribute not in item]
+    attributes = [attribute, TEXT_CODE_PREFIX + attribute] if fusion != 'none' else [attribute]
+    for space, space_items in group_by_space(coded).items():
+        query_vector = query_vector_for(space)
+        with stage("prefilter"):
+            for code_attribute in attributes:
+                with_codes = [item for item in space_items if code_attribute in item]
+                if not with_codes:
+                    continue
+                codes = code_matrix(QUANTIZER, [item[code_attribute] for item in with_codes])
+                scores = prefilter_scores(QUANTIZER, query_vector, codes)
+                for column in (scores.T if scores.ndim == 2 else [scores]):
+                    ids.extend(with_codes[i]['id'] for i in top_indices(column, RERANK_DEPTH))
+    return list(dict.fromkeys(ids))
+
+def json_response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body, default=str),
+        'headers': {
+            'Content-Type': 'application/json'
+        }
+    }
+
+def parse_batch(event):
+    """
+    Reads the queries of a batch request, a JSON body of the form
+    {"queries": [{"query": "linen shirt", "k": 5}, "white sneakers", ...]}.
+
+    :return: A list of (query, k).
+    :raises ValueError: With a message for the caller when the body is invalid.
+    """
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    try:
+        queries = json.loads(body or '{}').get('queries')
+    except (ValueError, AttributeError):
+        raise ValueError('The body must be a JSON object')
+    if not isinstance(queries, list) or not queries:
+        raise ValueError('queries must be a non-empty list')
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f'At most {MAX_BATCH_QUERIES} queries are allowed per request')
+    parsed = []
+    for entry in queries:
+        entry = {'query': entry} if isinstance(entry, str) else entry
+        if not isinstance(entry, dict) or not isinstance(entry.get('query'), str) or not entry['query'].strip():
+            raise ValueError('Every query needs a non-empty query string')
+        k = entry.get('k', DEFAULT_K)
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= MAX_K:
+            raise ValueError(f'k must be an integer from 1 to {MAX_K}')
+        parsed.append((entry['query'], k))
+    return parsed
+
+def embed_all(texts, dimensions, model_id=None):
+    """Embeds every distinct (text, dimension) pair, with up to EMBED_CONCURRENCY calls in flight."""
+    keys = list(dict.fromkeys((text, dimension) for text in texts for dimension in dimensions))
+    with stage("embed"):
+        with ThreadPoolExecutor(max_workers=max(1, min(len(keys), EMBED_CONCURRENCY))) as executor:
+            # Each call runs in a copy of the request's context so its logs keep the request id
+            futures = [executor.submit(contextvars.copy_context().run, get_embedding, *key, model_id) for key in keys]
+            return {key: future.result() for key, future in zip(keys, futures)}
+
+def read_image(image_key):
+    """Returns an image's bytes and the cache tier that served them."""
+    return image_cache().get(os.environ.get('bucket'), image_key)
+
+def fetch_images(image_keys):
+    """Reads every distinct image once, concurrently on cache misses, and returns them base64 encoded by key."""
+    keys = list(dict.fromkeys(image_keys))
+    if not keys:
+        return {}
+    with stage("s3_fetch"):
+        with ThreadPoolExecutor(max_workers=min(len(keys), EMBED_CONCURRENCY)) as executor:
+            images, tiers = zip(*executor.map(read_image, keys))
+    emit_metrics({"Function": "imagequery_function"}, {
+        "ImageCacheMemoryHits": tiers.count("memory"),
+        "ImageCacheDiskHits": tiers.count("disk"),
+        "ImageCacheRevalidations": tiers.count("revalidated"),
+        "ImageCacheMisses": tiers.count("miss"),
+    }, unit="Count")
+    with stage("base64_encode"):
+        return {key: base64.b64encode(data).decode('utf-8') for key, data in zip(keys, images)}
+
+def search_batch(queries, generation):
+    """
+    Searches one embeddings generation for several (query, k) at once and returns each query's [(image_key, score)].
+
+    Queries are embedded concurrently, the prefilter scores every query in one pass over
+    the codes, the union of candidates is fetched once and every query is re-ranked
+    against it with one matrix multiply per space.
+    """
+    table = runtime.table(generation.table)
+    texts = [text for text, _ in queries]
+    if QUANTIZER in ATTRIBUTES:
+        with stage("scan"):
+            items = searchable(scan_all(table, ProjectionExpression=CODES_PROJECTION,
+                                        ExpressionAttributeNames=codes_projection_names()), generation)
+    else:
+        with stage("scan"):
+            items = searchable(scan_all(table), generation)
+    # Rows stored before spaces were recorded only reveal theirs once their vectors are fetched
+    embeddings, query_vectors = {}, {}
+    def add_query_vectors(spaces):
+        missing = sorted({space.dimension for space in spaces} - {dimension for _, dimension in embeddings})
+        if missing:
+            embeddings.update(embed_all(texts, missing, generation.model_id))
+        with stage("projection"):
+            for space in spaces:
+                if space not in query_vectors:
+                    query_vectors[space] = [to_space(embeddings[(text, space.dimension)], space) for text in texts]
+
+    if QUANTIZER in ATTRIBUTES:
+        add_query_vectors({item_space(item) for item in items if item.get('embedding_dim')})
+        candidate_ids = prefilter(items, query_vectors.get)
+        with stage("fetch_vectors"):
+            candidates = fetch_vectors(candidate_ids, generation.table)
+    else:
+        candidates = items
+    add_query_vectors(set(group_by_space(candidates)))
+
+    depth = max(k for _, k in queries)
+    matches = [[] for _ in queries]
+    for space, space_items in group_by_space(candidates).items():
+        with stage("decimal_conversion"):
+            index = (MultiVectorIndex if FUSION != 'none' else VectorIndex).build(space, space_items)
+        with stage("scoring"):
+            if FUSION != 'none':
+                ranked = [index.search(vector, depth, FUSION, TEXT_WEIGHT, RRF_K) for vector in query_vectors[space]]
+            elif MMR_LAMBDA < 1:
+                ranked = [index.search_diverse(vector, k, MMR_LAMBDA, RERANK_DEPTH)
+                          for vector, (_, k) in zip(query_vectors[space], queries)]
+            else:
+                ranked = index.search_many(query_vectors[space], depth)
+            for found, pairs in zip(matches, ranked):
+                found.extend(pairs)
+    with stage("sort"):
+        return [sorted(found, key=lambda pair: pair[1], reverse=True)[:k] for found, (_, k) in zip(matches, queries)]
+
+def batch_handler(event):
+    try:
+        queries = parse_batch(event)
+    except ValueError as e:
+        return json_response(400, {'message': str(e)})
+    try:
+        matches = search_batch(queries, current_deployment().live)
+    except BedrockUnavailable as e:
+        logger.warning("Embedding model unavailable", error=str(e))
+        return json_response(503, {'message': 'Search is busy, please try again shortly.'})
+    # Queries often share results, so each image is fetched and returned once
+    images = fetch_images(image_key for found in matches for image_key, _ in found)
+    logger.info("Batch search results", queries=len(queries), images=len(images))
+    return json_response(200, {
+        'results': [
+            {'query': text, 'k': k, 'matches': [{'image_key': key, 'score': score} for key, score in found]}
+            for (text, k), found in zip(queries, matches)
+        ],
+        'images': images,
+    })
+
+def search_slots(slots, embeddings, k, table_name=None, fusion='none', mmr_lambda=1.0):
+    """
+    Searches the items of some hash slots for the coordinator.
+
+    Fused and diverse results cannot be merged by score alone, so with a fusion every
+    candidate's image and text scores are returned, and with `mmr_lambda` below 1 the
+    shard's own MMR picks with their unit vectors; the coordinator selects across shards.
+
+    :param embeddings: The query's model embedding per dimension; items of other dimensions are skipped.
+    :param table_name: The live generation's table (see stylist_common.migration); TABLE_NAME by default.
+    :return: {"matches": best `k` [image_key, score]} and, with a fusion or MMR, "candidates".
+    """
+    table_name = table_name or TABLE_NAME
+    table = runtime.table(table_name)
+    names = {'#projection': 'projection', '#duplicate': DUPLICATE_ATTRIBUTE}
+    expression = 'id, image_key, embedding_dim, #projection, #duplicate'
+    if QUANTIZER in ATTRIBUTES:
+        names['#codes'] = ATTRIBUTES[QUANTIZER]
+        expression += ', #codes'
+        if fusion != 'none':
+            names['#textcodes'] = TEXT_CODE_PREFIX + ATTRIBUTES[QUANTIZER]
+            expression += ', #textcodes'
+    with stage("query_slots"):
+        items = [item for slot in slots
+                 for item in query_slot(table, slot, ProjectionExpression=expression, ExpressionAttributeNames=names)]
+    # Rows without embedding_dim (see stylist_common.shards.rebalance) are checked once their vectors are fetched
+    items = [item for item in searchable(items)
+             if not item.get('embedding_dim') or int(item['embedding_dim']) in embeddings]
+
+    query_vectors = {}
+    def query_vector_for(space):
+        if space not in query_vectors:
+            with stage("projection"):
+                query_vectors[space] = to_space(embeddings[space.dimension], space)
+        return query_vectors[space]
+
+    ids = prefilter(items, query_vector_for, fusion) if QUANTIZER in ATTRIBUTES else [item['id'] for item in items]
+    with stage("fetch_vectors"):
+        candidates = [item for item in fetch_vectors(ids, table_name) if item_space(item).dimension in embeddings]
+    found, selectable = [], []
+    for space, space_items in group_by_space(candidates).items():
+        query_vector = query_vector_for(space)
+        if fusion != 'none':
+            with stage("decimal_conversion"):
+                index = MultiVectorIndex.build(space, space_items)
+            with stage("scoring"):
+                image, text = index.scores(query_vector)
+                # The best by image and by text, as the prefilter keeps, so the payload stays small
+                rows = dict.fromkeys(list(top_indices(image, RERANK_DEPTH)) + list(top_indices(text, RERANK_DEPTH)))
+                found.extend(index.search(query_vector, k, fusion))
+            selectable.extend({'image_key': index.image_keys[i], 'space': list(space), 'image': float(image[i]),
+                               'text': float(text[i]) if index.has_text[i] else None} for i in rows)
+        else:
+            with stage("decimal_conversion"):
+                index = VectorIndex.build(space, space_items)
+            with stage("scoring"):
+                if mmr_lambda < 1:
+                    picks = index.search_diverse(query_vector, k, mmr_lambda, RERANK_DEPTH)
+                    rows = {key: row for row, key in enumerate(index.image_keys)}
+                    selectable.extend({'image_key': key, 'space': list(space),
+                                       'vector': [round(x, 6) for x in index.matrix[rows[key]].tolist()]}
+                                      for key, _ in picks)
+                    found.extend(picks)
+                else:
+                    found.extend(index.search_many([query_vector], k)[0])
+    result = {'matches': merge_top_k([found], k)}
+    if fusion != 'none' or mmr_lambda < 1:
+        result['candidates'] = selectable
+    return result
+
+def select_across_shards(results, embeddings, k):
+    """
+    Merges the shards' results into the best `k`, applying FUSION or MMR_LAMBDA to the
+    candidates of every shard together, as search_generation does to one table's.
+    """
+    if FUSION == 'none' and MMR_LAMBDA >= 1:
+        return merge_top_k([[tuple(pair) for pair in result['matches']] for result in results], k)
+    import numpy as np
+    spaces = {}
+    for result in results:
+        for candidate in result.get('candidates', []):
+            spaces.setdefault(Space(*candidate['space']), []).append(candidate)
+    found = []
+    for space, candidates in spaces.items():
+        keys = [candidate['image_key'] for candidate in candidates]
+        if FUSION != 'none':
+            text = [-np.inf if candidate['text'] is None else candidate['text'] for candidate in candidates]
+            fused = fuse([candidate['image'] for candidate in candidates], text, FUSION, TEXT_WEIGHT, RRF_K)
+            found.extend((keys[i], float(fused[i])) for i in top_indices(fused, k))
+        else:
+            index = VectorIndex(space, keys, np.asarray([candidate['vector'] for candidate in candidates],
+                                                        dtype=np.float32))
+            query_vector = to_space(embeddings[space.dimension], space)
+            found.extend(index.search_diverse(query_vector, k, MMR_LAMBDA, RERANK_DEPTH))
+    return merge_top_k([found], k)
+
+@traced("imagequery_shard")
+def shard_handler(event, context):
+    """
+    Searches one shard for the coordinator: {"slots": [...], "embeddings": {"1024": [...]}, "k": 3, "table": ...,
+    "fusion": "none", "mmr_lambda": 1.0}.
+    """
+    embeddings = {int(dimension): vector for dimension, vector in event['embeddings'].items()}
+    return search_slots(event['slots'], embeddings, event['k'], event.get('table'), event.get('fusion', 'none'),
+                        float(event.get('mmr_lambda', 1.0)))
+
+def invoke_shard(payload):
+    if not SHARD_FUNCTION:
+        return shard_handler(payload, None)
+    response = runtime.client('lambda').invoke(FunctionName=SHARD_FUNCTION, Payload=json.dumps(payload))
+    result = json.loads(response['Payload'].read())
+    if response.get('FunctionError'):
+        raise RuntimeError(result.get('errorMessage') or response['FunctionError'])
+    return result
+
+_shard_executor = None
+
+def shard_executor():
+    # Shared across requests, so a shard that misses the deadline does not hold up the response
+    global _shard_executor
+    if _shard_executor is None:
+        _shard_executor = ThreadPoolExecutor(max_workers=2 * SEARCH_SHARDS)
+    return _shard_executor
+
+def current_shard_map():
+    bucket = os.environ.get('ARTIFACT_BUCKET')
+    if not bucket:
+        return ShardMap.even(SEARCH_SHARDS)
+    return load_shard_map(bucket, SHARD_MAP_KEY, SEARCH_SHARDS, SHARD_MAP_TTL_SECONDS)
+
+def search_sharded(query, k):
+    """
+    Embeds the query once, searches every shard in parallel and merges their best `k`.
+
+    The query is embedded by the live generation's model and the shards search its table, so a promoted
+    migration (see stylist_common.migration) is followed without redeploying the shard function.
+
+    :return: The merged [(image_key, score)] and the number of shards that answered within SHARD_TIMEOUT_MS.
+    """
+    generation = current_deployment().live
+    shard_map = current_shard_map()
+    dimensions = sorted({dimension for dimension, _ in shard_map.spaces} | {generation.dimension})
+    embeddings = embed_all([query], dimensions, generation.model_id)
+    # Shards log the coordinator's request id and are traced when it is
+    headers = {'X-Request-Id': current_request_id(), **({'X-Trace': '1'} if is_traced() else {})}
+    payload = {'embeddings': {str(dimension): embeddings[(query, dimension)] for dimension in dimensions}, 'k': k,
+               'table': generation.table, 'fusion': FUSION, 'mmr_lambda': MMR_LAMBDA, 'headers': headers}
+    with stage("scatter"):
+        futures = [shard_executor().submit(contextvars.copy_context().run, invoke_shard, {**payload, 'slots': slots})
+                   for slots in shard_map.shards]
+        done, _ = wait(futures, timeout=SHARD_TIMEOUT_MS / 1000)
+    results = []
+    for shard, future in enumerate(futures):
+        if future not in done:
+            logger.warning("Shard timed out", shard=shard, timeout_ms=SHARD_TIMEOUT_MS)
+        elif future.exception() is not None:
+            logger.warning("Shard failed", shard=shard, error=str(future.exception()))
+        else:
+            results.append(future.result())
+    with stage("merge"):
+        query_embeddings = {dimension: embeddings[(query, dimension)] for dimension in dimensions}
+        return select_across_shards(results, query_embeddings, k), len(results)
+
+def sharded_handler(query):
+    try:
+        matches, answered = search_sharded(query, DEFAULT_K)
+    except BedrockUnavailable as e:
+        logger.warning("Embedding model unavailable", error=str(e))
+        answered = 0
+    if not answered:
+        return json_response(503, {'message': 'Search is busy, please try again shortly.'})
+    images = fetch_images(image_key for image_key, _ in matches)
+    logger.info("Search results", query=query, shards=SEARCH_SHARDS, answered=answered,
+                top=[{'image_key': key, 'score': round(score, 4)} for key, score in matches])
+    response = json_response(200, [{'image_key': key, 'score': score, 'image_base64': images[key]} for key, score in matches])
+    # Fewer answered than searched means the results are partial
+    response['headers']['X-Search-Shards'] = f"{answered}/{SEARCH_SHARDS}"
+    return response
+
+def search_generation(query, generation, k=DEFAULT_K):
+    """
+    Searches one embeddings generation (see stylist_common.migration) with the query embedded by its model.
+
+    :return: The best `k` results of score_exactly, the number of items scanned and of candidates re-ranked.
+    """
+    table = runtime.table(generation.table)
+
+    # Vectors are only comparable within one space, so embed the query once per space present in the table
+    embeddings = {}
+    def query_vector_for(space):
+        if space.dimension not in embeddings:
+            with stage("embed"):
+                embeddings[space.dimension] = get_embedding(query, space.dimension, generation.model_id)
+        with stage("projection"):
+            return to_space(embeddings[space.dimension], space)
+
+    if QUANTIZER in ATTRIBUTES:
+        # Scan only the compact codes, then fetch float vectors for the best candidates
+        with stage("scan"):
+            items = searchable(scan_all(table, ProjectionExpression=CODES_PROJECTION,
+                                        ExpressionAttributeNames=codes_projection_names()), generation)
+        candidate_ids = prefilter(items, query_vector_for)
+        with stage("fetch_vectors"):
+            candidates = fetch_vectors(candidate_ids, generation.table)
+    else:
+        with stage("scan"):
+            candidates = items = searchable(scan_all(table), generation)
+
+    results = []
+    for space, space_items in group_by_space(candidates).items():
+        if FUSION != 'none':
+            results.extend(score_fused(space, space_items, query_vector_for(space), k))
+        elif MMR_LAMBDA < 1:
+            results.extend(score_diversely(space, space_items, query_vector_for(space), k))
+        else:
+            results.extend(score_exactly(space_items, query_vector_for(space)))
+
+    # Sort results by score in descending order
+    with stage("sort"):
+        results.sort(key=lambda x: x['score'], reverse=True)
+    return results[:k], len(items), len(candidates)
+
+_shadow_executor = None
+
+def shadow_executor():
+    # Shared across requests, so a slow shadow search does not hold up later responses
+    global _shadow_executor
+    if _shadow_executor is None:
+        _shadow_executor = ThreadPoolExecutor(max_workers=4)
+    return _shadow_executor
+
+def timed_search(query, generation):
+    start = time.perf_counter()
+    results, _, _ = search_generation(query, generation)
+    return results, (time.perf_counter() - start) * 1000
+
+def compare_shadow(query, live_results, future):
+    """
+    Reports how many of the live top results the shadow generation also found, once its search finishes.
+
+    The response is not held for the shadow search, and a failed one is only logged.
+    """
+    live_keys = [r['image_key'] for r in live_results]
+    # The report may run after the response is returned, outside the request's context
+    request_id = current_request_id()
+
+    def report(future):
+        if future.exception() is not None:
+            logger.warning("Shadow search failed", request_id=request_id, error=str(future.exception()))
+            return
+        shadow_results, latency = future.result()
+        overlap = len(set(live_keys) & {r['image_key'] for r in shadow_results}) / max(1, len(live_keys))
+        emit_metrics({"Function": "imagequery_function"}, {"ShadowOverlap": overlap, "ShadowLatency": latency},
+                     properties={"request_id": request_id},
+                     unit={"ShadowOverlap": "None", "ShadowLatency": "Milliseconds"})
+        logger.info("Shadow comparison", request_id=request_id, query=query, overlap=round(overlap, 3),
+                    latency_ms=round(latency, 1), live=live_keys, shadow=[r['image_key'] for r in shadow_results])
+
+    future.add_done_callback(report)
+
+@traced("imagequery_function")
 def handler(event, context):
+    if event.get('httpMethod') == 'POST':
+        return batch_handler(event)
+    if SEARCH_SHARDS > 1:
+        return sharded_handler(event['queryStringParameters']['query'])
     query = event['queryStringParameters']['query']
-    query_embedding = get_embedding(query)
-    
-    response = table.scan()
-    items = response['Items']
-    
-    results = []
-    for item in items:
-        vector = [float(x) for x in item['vector']]  # Convert Decimal to float
-        score = cosine_similarity(query_embedding, vector)
-        results.append({
-            'image_key': item['image_key'],
-            'score': score
-        })
+    deployment = current_deployment()
+
+    # A sample of searches also runs against the shadow generation, outside the request's trace
+    shadow = None
+    if deployment.shadow is not None and random.random() < deployment.sample_rate:
+        shadow = shadow_executor().submit(timed_search, query, deployment.shadow)
+
+    try:
+        top_3_results, scanned, reranked = search_generation(query, deployment.live)
+    except BedrockUnavailable as e:
+        logger.warning("Embedding model unavailable", error=str(e))
+        return {
+            'statusCode': 503,
+            'body': json.dumps({'message': 'Search is busy, please try again shortly.'}),
+            'headers': {
+                'Content-Type': 'application/json'
+            }
+        }
     
-    # Sort results by score in descending order
-    results.sort(key=lambda x: x['score'], reverse=True)
-    top_3_results = results[:3]
+    logger.info("Search results", query=query, scanned=scanned, reranked=reranked, quantizer=QUANTIZER,
+                top=[{'image_key': r['image_key'], 'score': round(r['score'], 4)} for r in top_3_results])
     
-    # Fetch and encode images for top 2 results
+    # Fetch and encode images for top 3 results
+    images = fetch_images(result['image_key'] for result in top_3_results)
     for result in top_3_results:
-        image_key = result['image_key']
-        image_data = s3.get_object(Bucket=os.environ.get('bucket'), Key=image_key)['Body'].read()            
-        result['image_base64'] = base64.b64encode(image_data).decode('utf-8')
+        result['image_base64'] = images[result['image_key']]
+    if shadow is not None:
+        compare_shadow(query, top_3_results, shadow)
     
     return {
         'statusCode': 200,
@@ -60,4 +597,4 @@ def handler(event, context):
         'headers': {
             'Content-Type': 'application/json'
         }
-    }
\ No newline at end of file
+    }
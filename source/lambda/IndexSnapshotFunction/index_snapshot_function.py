@@ -0,0 +1,67 @@
+import os
+
+from stylist_common import runtime
+from stylist_common.duplicates import DUPLICATE_ATTRIBUTE
+from stylist_common.index_snapshots import DEFAULT_PREFIX, S3Store, compact, table_prefix, write_delta
+from stylist_common.log import get_logger
+from stylist_common.migration import current_deployment
+from stylist_common.tracing import stage, traced
+
+logger = get_logger(__name__)
+
+# Table of stream records that do not name theirs
+TABLE_NAME = os.environ.get('dynamodb_table')
+# Deltas and old bases are kept this long after a newer base covers them
+RETAIN_SECONDS = int(os.environ.get('INDEX_RETAIN_SECONDS', 3600))
+INDEXED_ATTRIBUTES = ('id', 'image_key', 'vector', 'embedding_dim', 'projection')
+
+def snapshot_store(table_name):
+    return S3Store(os.environ['ARTIFACT_BUCKET'], table_prefix(os.environ.get('INDEX_PREFIX', DEFAULT_PREFIX), table_name))
+
+def table_of(record):
+    # arn:aws:dynamodb:<region>:<account>:table/<name>/stream/<label>
+    arn = record.get('eventSourceARN')
+    return arn.split(':', 5)[5].split('/')[1] if arn else TABLE_NAME
+
+def changes_from_stream(records):
+    """Turns DynamoDB stream records of the embeddings table into index changes."""
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    changes = []
+    for record in records:
+        data = record['dynamodb']
+        if record['eventName'] == 'REMOVE':
+            changes.append({'id': deserializer.deserialize(data['Keys']['id']), 'deleted': True})
+            continue
+        new_image = data.get('NewImage', {})
+        image = {name: deserializer.deserialize(value) for name, value in new_image.items() if name in INDEXED_ATTRIBUTES}
+        # Items without a vector cannot be searched, and marked duplicates are not, so drop any earlier version of them
+        searchable = 'vector' in image and DUPLICATE_ATTRIBUTE not in new_image
+        changes.append(image if searchable else {'id': image['id'], 'deleted': True})
+    return changes
+
+@traced("index_snapshot_function")
+def handler(event, context):
+    if 'Records' in event:
+        # Every embeddings generation's table streams here; each keeps its own snapshots
+        by_table = {}
+        for record in event['Records']:
+            by_table.setdefault(table_of(record), []).append(record)
+        deltas = {}
+        changed = 0
+        for table_name, records in by_table.items():
+            changes = changes_from_stream(records)
+            with stage("write_delta"):
+                deltas[table_name] = write_delta(snapshot_store(table_name), changes) if changes else None
+            changed += len(changes)
+        logger.info("Index delta written", deltas=deltas, changes=changed)
+        return {'deltas': deltas, 'changes': changed}
+
+    # Scheduled compaction of every generation new images are written to, so a shadow is ready when promoted
+    bases = {}
+    for table_name in dict.fromkeys(generation.table for generation in current_deployment().generations()):
+        with stage("compact"):
+            bases[table_name] = compact(snapshot_store(table_name), runtime.table(table_name),
+                                        retain_seconds=RETAIN_SECONDS)
+    logger.info("Index compacted", bases=bases)
+    return {'bases': bases}
@@ -1,25 +1,27 @@
 import os
 import json
-import boto3
 
-bedrockClient = boto3.client('bedrock-agent')
+from stylist_common import runtime
+from stylist_common.log import get_logger
+from stylist_common.tracing import stage, traced
 
+logger = get_logger(__name__)
+
+@traced("ingestion_function")
 def handler(event, context):
     # TODO implement
-    print('Inside Lambda Handler')
-    print('event: ', event)
+    logger.debug("Ingestion event", event=event)
     dataSourceId = os.environ['DATASOURCEID']
     knowledgeBaseId = os.environ['KNOWLEDGEBASEID']
 
-    print('knowledgeBaseId: ', knowledgeBaseId)
-    print('dataSourceId: ', dataSourceId)
-
-    response = bedrockClient.start_ingestion_job(
-        knowledgeBaseId=knowledgeBaseId,
-        dataSourceId=dataSourceId
-    )
+    with stage("start_ingestion_job"):
+        response = runtime.client('bedrock-agent').start_ingestion_job(
+            knowledgeBaseId=knowledgeBaseId,
+            dataSourceId=dataSourceId
+        )
     
-    print('Ingestion Job Response: ', response)
+    logger.info("Started ingestion job", knowledge_base_id=knowledgeBaseId, data_source_id=dataSourceId,
+                job_id=response.get('ingestionJob', {}).get('ingestionJobId'))
     
     return {
         'statusCode': 200,
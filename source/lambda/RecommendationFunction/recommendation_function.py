@@ -0,0 +1,100 @@
+import json
+import os
+from botocore.exceptions import ClientError
+
+from stylist_common import runtime
+from stylist_common.actions import ActionError, integer, parse_parameters
+from stylist_common.cached_object import CachedObject
+from stylist_common.copurchase import CoPurchaseIndex
+from stylist_common.log import get_logger
+from stylist_common.orders import parse_orders
+from stylist_common.tracing import stage, traced
+
+logger = get_logger(__name__)
+
+DATA_BUCKET = os.environ.get('DATA_BUCKET')
+ORDER_HISTORY_KEY = os.environ.get('ORDER_HISTORY_KEY', 'order_history.csv')
+ARTIFACT_BUCKET = os.environ.get('ARTIFACT_BUCKET')
+SNAPSHOT_KEY = os.environ.get('SNAPSHOT_KEY', 'recommendations/copurchase.npz')
+# How long a warm container serves its copy of the snapshot before checking the snapshot's ETag
+SNAPSHOT_TTL_SECONDS = float(os.environ.get('SNAPSHOT_TTL_SECONDS', 60))
+MAX_RECOMMENDATIONS = 10
+
+# Kept for the warm container and reloaded when another container saves a newer snapshot
+snapshot = CachedObject(ARTIFACT_BUCKET, SNAPSHOT_KEY, lambda body: CoPurchaseIndex.loads(body.read()),
+                        ttl=SNAPSHOT_TTL_SECONDS)
+
+
+def read_orders(bucket, key):
+    body = runtime.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+    return parse_orders(body)
+
+
+def save_index(copurchase_index):
+    response = runtime.client('s3').put_object(Bucket=ARTIFACT_BUCKET, Key=SNAPSHOT_KEY, Body=copurchase_index.dumps())
+    snapshot.set(copurchase_index, response.get('ETag'))
+
+
+def load_index():
+    """Loads the co-purchase snapshot, building it from the order history when none has been saved."""
+    try:
+        return snapshot.get()
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise
+    copurchase_index = CoPurchaseIndex.build(read_orders(DATA_BUCKET, ORDER_HISTORY_KEY))
+    save_index(copurchase_index)
+    return copurchase_index
+
+
+def update_index(event):
+    # Invoked by EventBridge when a new order_history.csv lands in the data bucket
+    copurchase_index = load_index()
+    applied = copurchase_index.add_orders(read_orders(event['detail']['bucket']['name'], event['detail']['object']['key']))
+    if applied:
+        save_index(copurchase_index)
+    logger.info("Updated co-purchase index", applied=applied)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'applied': applied})
+    }
+
+
+@traced("recommendation_function")
+def handler(event, context):
+    if 'detail' in event:
+        return update_index(event)
+
+    # Bedrock Agent action group invocation
+    parameters = parse_parameters(event)
+    item = parameters.get('item') or ''
+    try:
+        limit = integer(parameters, 'limit', 5, MAX_RECOMMENDATIONS)
+    except ActionError as e:
+        # Returned to the agent, which can correct the parameter, instead of failing the invocation
+        status_code, response_body = e.status_code, {'error': str(e)}
+    else:
+        with stage("load_index"):
+            copurchase_index = load_index()
+        with stage("recommend"):
+            recommendations = copurchase_index.recommend(item, limit)
+        status_code, response_body = 200, {
+            'item': item,
+            'frequently_bought_together': [{'item': label, 'customers': count} for label, count in recommendations]
+        }
+
+    action_response = {
+        "actionGroup": event["actionGroup"],
+        "apiPath": event["apiPath"],
+        "httpMethod": event["httpMethod"],
+        "parameters": event.get("parameters", []),
+        "httpStatusCode": status_code,
+        "responseBody": {"application/json": {"body": json.dumps(response_body)}},
+    }
+
+    return {
+        "messageVersion": "1.0",
+        "response": action_response,
+        "sessionAttributes": event.get("sessionAttributes", {}),
+        "promptSessionAttributes": event.get("promptSessionAttributes", {}),
+    }
@@ -0,0 +1,71 @@
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+from stylist_common import runtime
+from stylist_common.log import get_logger
+from stylist_common.reviews import DEFAULT_PREFIX, DEFAULT_STATE_KEY, parse_reviews, publish, read_digests
+from stylist_common.tracing import stage, traced
+
+logger = get_logger(__name__)
+
+ARTIFACT_BUCKET = os.environ.get('ARTIFACT_BUCKET')
+DIGEST_STATE_KEY = os.environ.get('DIGEST_STATE_KEY', DEFAULT_STATE_KEY)
+# Digest documents are written to the data bucket, which the knowledge base indexes
+DIGEST_PREFIX = os.environ.get('DIGEST_PREFIX', DEFAULT_PREFIX)
+EMBEDDINGS_MODEL_ID = os.environ.get('EMBEDDINGS_MODEL_ID', 'amazon.titan-embed-image-v1')
+DIGEST_DIMENSION = int(os.environ.get('DIGEST_DIMENSION', 256))
+DIGEST_SENTENCES = int(os.environ.get('DIGEST_SENTENCES', 3))
+# Review exports are moved here in the artifacts bucket, so the knowledge base indexes the digests instead of them
+RAW_REVIEWS_PREFIX = os.environ.get('RAW_REVIEWS_PREFIX', 'reviews/raw/')
+
+
+def archive_export(bucket, key):
+    """Moves a review export out of the data bucket and returns its key in the artifacts bucket."""
+    s3 = runtime.client('s3')
+    archived = f"{RAW_REVIEWS_PREFIX}{key}"
+    try:
+        s3.copy_object(Bucket=ARTIFACT_BUCKET, Key=archived, CopySource={'Bucket': bucket, 'Key': key})
+    except ClientError as e:
+        # A retried event finds the export already moved, and reads the archived copy
+        if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+            raise
+    else:
+        s3.delete_object(Bucket=bucket, Key=key)
+    return archived
+
+
+@traced("review_digest_function")
+def handler(event, context):
+    # Invoked by EventBridge when a customer_reviews*.csv object lands in the data bucket
+    bucket = event['detail']['bucket']['name']
+    key = event['detail']['object']['key']
+
+    # Moved before the digests are published, so the ingestion they trigger no longer finds the raw rows
+    with stage("archive"):
+        archived = archive_export(bucket, key)
+    with stage("s3_get"):
+        body = runtime.client('s3').get_object(Bucket=ARTIFACT_BUCKET, Key=archived)['Body'].read().decode('utf-8')
+    with stage("parse"):
+        reviews = parse_reviews(body)
+    with stage("load_state"):
+        digests = read_digests(ARTIFACT_BUCKET, DIGEST_STATE_KEY, model_id=EMBEDDINGS_MODEL_ID,
+                               dimension=DIGEST_DIMENSION, sentences=DIGEST_SENTENCES)
+    with stage("digest"):
+        changed = digests.add_reviews(reviews)
+    written = []
+    if changed:
+        with stage("publish"):
+            written = publish(digests, changed, bucket, DIGEST_PREFIX)
+        # Saved after publishing, so a failed run applies the same reviews again when retried
+        with stage("save_state"):
+            runtime.client('s3').put_object(Bucket=ARTIFACT_BUCKET, Key=DIGEST_STATE_KEY, Body=digests.dumps())
+
+    logger.info("Updated review digests", key=key, archived=archived, reviews=len(reviews), categories=len(changed),
+                documents=written)
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'reviews': len(reviews), 'updated': len(written)})
+    }
@@ -1,31 +1,48 @@
+import contextvars
 import json
-import boto3
 import os
+import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
-    
-# Bedrock client used to interact with APIs around models
-bedrock = boto3.client(
- service_name='bedrock', 
- region_name=os.environ['AWS_REGION']
-    )
-     
-# Bedrock Runtime client used to invoke and question the models
-bedrock_runtime = boto3.client(
- service_name='bedrock-runtime', 
- region_name=os.environ['AWS_REGION']
-    )
-
-bedrock_agent_client = boto3.client(
-    service_name="bedrock-agent-runtime",
-    region_name=os.environ['AWS_REGION']
-    )
+
+from stylist_common import attributes, runtime, weather
+from stylist_common.bedrock import BedrockUnavailable, invoke_model, invoker
+from stylist_common.log import get_logger
+from stylist_common.routing import Completion, ModelRouter, complexity, text_router
+from stylist_common.tracing import stage, traced
+
+logger = get_logger(__name__)
+
+# Precomputed customer profiles built by the customer profile function
+PROFILE_TABLE = os.environ.get('PROFILE_TABLE')
+
+# Attributes found locally with at least this confidence are given to the agent, so it need not extract them
+ATTRIBUTE_CONFIDENCE = float(os.environ.get('ATTRIBUTE_CONFIDENCE', 0.8))
+# Optional classifiers trained with `python -m stylist_common.attributes`, for messages no rule matches
+ARTIFACT_BUCKET = os.environ.get('ARTIFACT_BUCKET')
+ATTRIBUTE_CLASSIFIERS_KEY = os.environ.get('ATTRIBUTE_CLASSIFIERS_KEY')
+# How long warm containers use their copy before checking whether the classifiers were retrained
+ATTRIBUTE_CLASSIFIERS_TTL_SECONDS = float(os.environ.get('ATTRIBUTE_CLASSIFIERS_TTL_SECONDS', 300))
+SESSION_ATTRIBUTE_NAMES = {'age_group': 'ageGroup', 'gender': 'gender', 'season': 'season', 'location': 'location'}
+
+# "agent" (the default) answers every request through the agent, "direct" with knowledge base passages and one
+# model call, and "auto", opted into, uses the agent only for requests that need its order history tools or several steps
+TEXT_MODE = os.environ.get('TEXT_MODE', 'agent')
+AGENT_COMPLEXITY = float(os.environ.get('AGENT_COMPLEXITY', 0.5))
+RETRIEVE_RESULTS = int(os.environ.get('RETRIEVE_RESULTS', 4))
+PASSAGE_CHARS = int(os.environ.get('PASSAGE_CHARS', 600))
+WEATHER_API_KEY = os.environ.get('YOUR_OPENWEATHERMAP_API_KEY')
+AGENT_ONLY = re.compile(r"\b(?:my (?:last |recent |previous )?(?:orders?|purchases?)|i (?:have )?(?:bought|ordered|purchased)|"
+                        r"order history|bought together|buy together|goes? with what i)\b", re.IGNORECASE)
     
 # Setup environment variables for model and knowledge base configuration
 kb_id= os.environ['knowledgeBaseId']
 model_id = os.environ["TEXT_MODEL_ID"]
 agent_id= os.environ["agentId"]
 agent_alias_id= os.environ["agentAliasId"]
+# Optional alias of an agent version that uses Claude 3 Haiku, for simple requests
+fast_agent_alias_id = os.environ.get("FAST_AGENT_ALIAS_ID")
 region_id = os.environ['AWS_REGION']
 
 textpromptTemplate= """Human: You are a virtual personal Stylist ONLY capable of answering fashion queries to the user. If the user asks question related to prompt, math problem, your capabilities or any other topic  instead from stylist, say "I am sorry, I'm only your virtual personal stylist".
@@ -48,7 +65,7 @@ Assistant:"""
 def retrieveAndGenerate(input, kbId, sessionId=None, model_id=model_id, region_id = "us-east-1"):
     model_arn = f'arn:aws:bedrock:{region_id}::foundation-model/{model_id}'
     if sessionId:
-        return bedrock_agent_client.retrieve_and_generate(
+        return runtime.client('bedrock-agent-runtime').retrieve_and_generate(
             input={
                 'text': input
             },
@@ -68,7 +85,7 @@ def retrieveAndGenerate(input, kbId, sessionId=None, model_id=model_id, region_i
             sessionId=sessionId
         )
     else:
-        return bedrock_agent_client.retrieve_and_generate(
+        return runtime.client('bedrock-agent-runtime').retrieve_and_generate(
             input={
                 'text': input
             },
@@ -94,12 +111,8 @@ def invoke_agent(agent_id, agent_alias_id, session_id, prompt):
         """
 
         try:
-            print("ENDED IN TRY PART")
-            print("agent_id is : "+str(agent_id))
-            print("agent_alias_id is " + str(agent_alias_id))
-            print(session_id)
-            print(prompt)
-            response = bedrock_agent_client.invoke_agent(
+            logger.debug("Invoking agent", agent_id=agent_id, agent_alias_id=agent_alias_id, session_id=session_id, prompt=prompt)
+            response = runtime.client('bedrock-agent-runtime').invoke_agent(
                 agentId=agent_id,
                 agentAliasId=agent_alias_id,
                 sessionId=session_id,
@@ -113,40 +126,183 @@ def invoke_agent(agent_id, agent_alias_id, session_id, prompt):
                 completion = completion + chunk["bytes"].decode()
 
         except ClientError as e:
-            print(f"Couldn't invoke agent. {e}")
+            logger.error("Couldn't invoke agent", error=str(e))
             raise
 
         return completion
 
+def get_customer_profile(customer_id):
+    """
+    Looks up the compact profile summary for a customer.
+
+    :param customer_id: The customer id from order history.
+    :return: The profile summary string, or None when no profile exists.
+    """
+    if not PROFILE_TABLE or not customer_id:
+        return None
+    item = runtime.table(PROFILE_TABLE).get_item(
+        Key={'customer_id': str(customer_id)},
+        ProjectionExpression='summary'
+    ).get('Item')
+    return item.get('summary') if item else None
+
+def customer_attributes(query):
+    """
+    Extracts the age group, gender, season and location from a message without a model call.
+
+    :param query: The customer's message.
+    :return: Prompt session attributes for the values found with enough confidence.
+    """
+    classifiers = None
+    if ARTIFACT_BUCKET and ATTRIBUTE_CLASSIFIERS_KEY:
+        classifiers = attributes.load_classifiers(ARTIFACT_BUCKET, ATTRIBUTE_CLASSIFIERS_KEY,
+                                                  ATTRIBUTE_CLASSIFIERS_TTL_SECONDS)
+    found = attributes.extract(query, classifiers)
+    logger.debug("Extracted attributes", attributes={name: list(value) for name, value in found.items()})
+    return {SESSION_ATTRIBUTE_NAMES[name]: value
+            for name, value in attributes.confident(found, ATTRIBUTE_CONFIDENCE).items()}
+
+def needs_agent(query):
+    """Whether a request needs the agent's tools or several steps rather than the direct path."""
+    if TEXT_MODE in ('agent', 'direct'):
+        return TEXT_MODE == 'agent'
+    return bool(AGENT_ONLY.search(query)) or complexity(query) >= AGENT_COMPLEXITY
+
+DIRECT_PROMPT = """You are a virtual personal stylist. Only answer fashion questions; for anything else reply "I'm sorry, I'm a Virtual Stylist, I will not be able to help you with this query".
+Recommend clothing and accessories from the catalog passages, suited to the customer and the weather when they are given. Do not mention the passages or any sources. Answer in a refined, professional tone in plain language, in at most 150 words."""
+
+def retrieve_passages(query):
+    with stage("retrieve"):
+        response = runtime.client('bedrock-agent-runtime').retrieve(
+            knowledgeBaseId=kb_id,
+            retrievalQuery={'text': query},
+            retrievalConfiguration={'vectorSearchConfiguration': {'numberOfResults': RETRIEVE_RESULTS}}
+        )
+    return [result['content']['text'][:PASSAGE_CHARS] for result in response['retrievalResults']]
+
+def lookup_weather(location):
+    if not location or not WEATHER_API_KEY:
+        return None
+    try:
+        with stage("weather"):
+            return weather.get_weather(location, WEATHER_API_KEY)
+    except Exception as e:
+        # The answer is still useful without the weather
+        logger.warning("Weather lookup failed", location=location, error=str(e))
+        return None
+
+def direct_prompt(query, passages, prompt_attributes, conditions):
+    lines = ["<catalog>"] + [f"<passage>{passage}</passage>" for passage in passages] + ["</catalog>"]
+    customer = {name: value for name, value in prompt_attributes.items() if name != 'customerProfile'}
+    if customer:
+        lines.append("Customer: " + ", ".join(f"{name} {value}" for name, value in customer.items()))
+    if prompt_attributes.get('customerProfile'):
+        lines.append("Customer profile: " + prompt_attributes['customerProfile'])
+    if conditions:
+        lines.append(f"Weather in {conditions['city']}: {conditions['temperature']}°C, {conditions['condition']}")
+    lines.append(f"Question: {query}")
+    return "\n".join(lines)
+
+def direct_answer(query, prompt_attributes):
+    """
+    Answers with knowledge base passages and a single model call instead of agent orchestration.
+
+    The knowledge base and the weather, when a location was found, are queried concurrently.
+    """
+    with stage("context"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Each lookup runs in a copy of the request's context so its logs and stages keep the request id
+            passages = executor.submit(contextvars.copy_context().run, retrieve_passages, query)
+            conditions = executor.submit(contextvars.copy_context().run, lookup_weather, prompt_attributes.get('location'))
+            prompt = direct_prompt(query, passages.result(), prompt_attributes, conditions.result())
+    request = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 512,
+        "temperature": 0.5,
+        "system": DIRECT_PROMPT,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+    })
+
+    def call(text_model_id):
+        model_response = json.loads(invoke_model(modelId=text_model_id, body=request)["body"].read())
+        usage = model_response.get("usage", {})
+        return Completion(model_response["content"][0]["text"], usage.get("input_tokens"),
+                          usage.get("output_tokens"), model_response.get("stop_reason"))
+
+    with stage("model"):
+        completion, route = text_router().run(query, call)
+    return completion, route
+
+def agent_answer(query, session_id, session_state):
+    """Answers through the agent, which plans, calls its tools and writes the answer."""
+    def ask_agent(alias_id, session_id):
+        # The completion stream can also be throttled, so read it inside the guarded call
+        response = runtime.client('bedrock-agent-runtime', max_attempts=1).invoke_agent(agentId=agent_id, agentAliasId=alias_id, sessionId=session_id, endSession=False, inputText=query, sessionState=session_state)
+        logger.debug("Agent response metadata", metadata=response.get("ResponseMetadata"))
+        chunks = []
+        for event in response["completion"]:
+            chunks.append(event["chunk"]["bytes"].decode("utf-8"))
+        return chunks
+
+    session_ids = [session_id]
+    def call(alias_id):
+        # The first call uses the logged session; an escalated request starts a new one with the other alias
+        call_session_id = session_ids.pop() if session_ids else str(uuid.uuid4())
+        chunks = invoker().call(f"agent:{agent_id}:{alias_id}", ask_agent, alias_id, call_session_id)
+        return Completion(" ".join(chunks))
+
+    with stage("agent"):
+        return ModelRouter(agent_alias_id, fast_agent_alias_id).run(query, call)
+
+@traced("text_function")
 def handler(event, context):
-    query = str(event.get('queryStringParameters')['query'])
+    params = event.get('queryStringParameters')
+    query = str(params['query'])
    
-    print(query)
     session_id = str(uuid.uuid4())
-    print(session_id)
+    logger.info("Text request", query=query, session_id=session_id)
+
+    # Inject the customer's precomputed profile instead of having the agent read raw order history
+    session_state = {}
+    with stage("profile_lookup"):
+        profile = get_customer_profile(params.get('customer_id'))
+    with stage("attribute_extraction"):
+        prompt_attributes = customer_attributes(query)
+    if profile:
+        prompt_attributes['customerProfile'] = profile
+    if prompt_attributes:
+        session_state['promptSessionAttributes'] = prompt_attributes
 
     #response = retrieveAndGenerate(query, kb_id,model_id=model_id,region_id=region_id)
-    response = bedrock_agent_client.invoke_agent(agentId=agent_id, agentAliasId=agent_alias_id, sessionId=session_id, endSession=False, inputText=query)
-    print(response)
-    
-    # completion = ""
-    chunks = []
-    # for event in response.get("completion"):
-    #             chunk = event["chunk"]
-    #             completion = completion + chunk["bytes"].decode()
-      
-    for event in response["completion"]:
-        chunks.append(event["chunk"]["bytes"].decode("utf-8"))
-    completion = " ".join(chunks)
+    mode = 'agent' if needs_agent(query) else 'direct'
+    try:
+        if mode == 'direct':
+            try:
+                completion, route = direct_answer(query, prompt_attributes)
+            except ClientError as e:
+                # The knowledge base could not be searched, so let the agent handle the request
+                logger.warning("Direct answer failed, asking the agent", error=str(e))
+                mode = 'agent'
+        if mode == 'agent':
+            completion, route = agent_answer(query, session_id, session_state)
+    except BedrockUnavailable as e:
+        logger.warning("Agent unavailable", error=str(e))
+        return {
+            "statusCode": 503,
+            "headers": {
+                "Content-Type": "*/*"
+            },
+            "body": "Your stylist is busy right now, please try again shortly."
+        }
+    completion = completion.text
         
-    print(f"Completion: {completion}")
+    logger.info("Agent completion", chars=len(completion), mode=mode, tier=route.tier)
+    logger.info("Agent completion text", sampled=True, completion=completion)
     
-    res = {
+    return {
         "statusCode": 200,
         "headers": {
             "Content-Type": "*/*"
         },
         "body": str(completion)
     }
-    print(res)
-    return res
\ No newline at end of file
@@ -1,55 +1,29 @@
-import datetime
-import json
-import sys
 import os
-import urllib.parse
-import urllib.request
-import subprocess
-import requests # imported from layers
+
+from stylist_common.actions import parse_parameters
+from stylist_common.log import get_logger
+from stylist_common.tracing import stage, traced
+from stylist_common.weather import get_weather
+
+logger = get_logger(__name__)
 
 # Replace with your OpenWeatherMap API key
 API_KEY = os.environ.get('YOUR_OPENWEATHERMAP_API_KEY')
 
+@traced("weather_function")
 def handler(event, context):
 
-    print("event ", event)
-    city = event["parameters"][0]["value"]
-    print(city)
-    
-    
-    # Get the location name from the input event
-    #location = event.get('location', 'Seattle')
+    # Prefer the named schema parameter, falling back to the first parameter for older schemas
+    parameters = parse_parameters(event)
+    city = parameters.get("location") or event["parameters"][0]["value"]
+    logger.info("Weather request", city=city, api_path=event.get("apiPath"))
     
-    # Construct the API request URL
-    base_url = 'https://api.openweathermap.org/data/2.5/weather'
-    params = {
-        'q': city,
-        'appid': API_KEY,
-        'units': 'metric'
-    }
-    url = f'{base_url}?{urllib.parse.urlencode(params)}'
-    
-    # Make the API request
-    response = requests.get(url)
-    response.raise_for_status()  # Raise an exception for HTTP errors
+    # Make the API request through the pooled, cached client shared with the action group router
+    with stage("weather_api"):
+        weather_data = get_weather(city, API_KEY)
         
-    # Parse JSON response
-    weather_data = response.json()
-    # response = urllib.request.urlopen(url)
-    # data = response.read().decode('utf-8')
-    # weather_data = json.loads(data)
-        
-    # Extract the relevant weather information
-    city = weather_data['name']
-    temperature = weather_data['main']['temp']
-    description = weather_data['weather'][0]['description']
-
     # Construct the response
-    response_body = {
-        'city': city,
-        'temperature': temperature,
-        'condition': description
-        }
+    response_body = weather_data
 
    
     # response_str = requests.get(api_url).text
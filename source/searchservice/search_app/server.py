@@ -0,0 +1,342 @@
+"""
+Long-lived product image search service, an optional alternative to the search Lambda.
+
+Every /search Lambda invocation reads the table, embeds its query and scores the
+catalog on its own. This service loads every vector once into memory (see
+`stylist_common.vector_index`) and gathers the queries that arrive within a few
+milliseconds of each other into micro-batches:
+
+- embedding: identical queries in a batch share one model call, recent query
+  embeddings are cached and the remaining calls run concurrently
+- scoring: each batch is scored with one matrix-matrix multiply per embedding space
+
+GET /search?query=... returns the same JSON as the search function and
+GET /health reports the index and batch sizes.
+
+Configured like the search function (dynamodb_table, bucket, EMBEDDINGS_MODEL_ID,
+the BEDROCK_* limits). With EMBEDDINGS_DEPLOYMENT_KEY the service serves the live
+generation of the embeddings deployment (see `stylist_common.migration`), checked
+every DEPLOYMENT_TTL_SECONDS (default 30): when a generation is promoted or rolled
+back, the index is rebuilt from its table and queries are embedded with its model.
+Tuned through environment variables:
+
+- SEARCH_MAX_BATCH: queries per micro-batch (default 32)
+- SEARCH_MAX_WAIT_MS: how long the first query of a batch waits for others (default 5)
+- SEARCH_EMBEDDING_CACHE: query embeddings kept in memory (default 1024)
+- SEARCH_WORKERS: threads for model, S3 and scoring calls (default 32)
+- INDEX_REFRESH_SECONDS: how often the index is refreshed (default 300)
+- INDEX_SNAPSHOT_BUCKET / INDEX_PREFIX: where index snapshots are kept, one set per
+  generation's table (see `stylist_common.index_snapshots`); when set, a refresh
+  applies only the changes since the last one instead of scanning the table
+  (default unset / index/)
+- PORT: listening port (default 8080)
+"""
+import asyncio
+import base64
+import json
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from stylist_common import runtime
+from stylist_common.bedrock import BedrockUnavailable, invoke_model
+from stylist_common.embeddings import NO_PROJECTION, load_projection, request_body, to_space
+from stylist_common.index_snapshots import DEFAULT_PREFIX, IndexFollower, S3Store, table_prefix
+from stylist_common.log import get_logger
+from stylist_common.migration import configured_generation, current_deployment
+from stylist_common.vector_index import load_indexes
+
+logger = get_logger(__name__)
+
+TOP_K = 3
+
+
+class MicroBatcher:
+    """
+    Calls `process` once per batch of submitted items.
+
+    The first item of a batch waits at most `max_wait` seconds for others to
+    join and a batch holds at most `max_batch` items. Batches are processed
+    concurrently, so a slow batch does not hold up the next one.
+
+    :param process: Coroutine function taking a list of items and returning one
+        result per item; a result that is an exception is raised to its submitter.
+    """
+
+    def __init__(self, process, max_batch=32, max_wait=0.005):
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._tasks = set()
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._start(self._collect())
+        future = loop.create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    def _start(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self.items += len(batch)
+            self._start(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        try:
+            results = await self.process([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @property
+    def mean_batch(self):
+        return self.items / self.batches if self.batches else 0.0
+
+
+def get_embedding(text, dimension, model_id):
+    response = invoke_model(
+        body=request_body(dimension, text=text),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    return json.loads(response.get("body").read()).get("embedding")
+
+
+def read_image(key):
+    return runtime.client("s3").get_object(Bucket=os.environ.get("bucket"), Key=key)["Body"].read()
+
+
+class SearchService:
+    """
+    Resident index plus the embedding and scoring batchers that serve /search.
+
+    :param table_name: Table to serve with the configured model; by default the live generation is followed.
+    :param snapshots: Returns the snapshot store of a table, or None, to follow its index snapshots instead of scanning it.
+    """
+
+    def __init__(self, table_name=None, max_batch=32, max_wait=0.005, cache_size=1024, workers=32, snapshots=None):
+        self.table_name = table_name
+        self.snapshots = snapshots
+        self.follower = None
+        self.generation = None
+        self.indexes = {}
+        self._refresh_lock = asyncio.Lock()
+        self.cache_size = cache_size
+        self.embedding_cache = OrderedDict()
+        self.embedding_calls = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.embedder = MicroBatcher(self._embed_batch, max_batch, max_wait)
+        self.scorer = MicroBatcher(self._score_batch, max_batch, max_wait)
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def live_generation(self):
+        if self.table_name is not None:
+            return configured_generation()._replace(table=self.table_name)
+        return current_deployment().live
+
+    def _load(self, generation):
+        # A follower reads one table's snapshots, so another generation starts with its own
+        follower = self.follower if self.generation is not None and generation.table == self.generation.table else None
+        if follower is None and self.snapshots is not None:
+            store = self.snapshots(generation.table)
+            follower = IndexFollower(store) if store is not None else None
+        if follower is not None:
+            follower.refresh()
+        if follower is not None and follower.indexes is not None:
+            indexes = follower.indexes
+        else:
+            # No snapshot has been compacted yet
+            indexes = load_indexes(runtime.table(generation.table))
+        # Fetch projections now so queries never wait on S3 for them
+        for space in indexes:
+            if space.projection != NO_PROJECTION:
+                load_projection(space.projection)
+        return follower, indexes
+
+    async def refresh(self):
+        """Reloads the index of the live generation and swaps it in, together with the generation, once complete."""
+        async with self._refresh_lock:
+            generation = await self._run(self.live_generation)
+            follower, indexes = await self._run(self._load, generation)
+            if generation == self.generation and indexes is self.indexes:
+                return
+            if generation != self.generation and self.generation is not None:
+                logger.info("Live generation changed", table=generation.table, model_id=generation.model_id,
+                            version=generation.version)
+            # Swapped together, between two awaits, so a search never pairs one generation's index with another's model
+            self.generation, self.indexes, self.follower = generation, indexes, follower
+            logger.info("Index loaded", spaces={f"{s.dimension}/{s.projection}": len(i) for s, i in indexes.items()})
+
+    async def follow_deployment(self):
+        """Rebuilds the index when another generation has been made live."""
+        if await self._run(self.live_generation) != self.generation:
+            await self.refresh()
+
+    async def _embed_batch(self, keys):
+        # keys are (query, dimension, model id); duplicates within the batch and recent repeats share one call
+        hits = {key: self.embedding_cache[key] for key in keys if key in self.embedding_cache}
+        missing = [key for key in dict.fromkeys(keys) if key not in hits]
+        self.embedding_calls += len(missing)
+        vectors = await asyncio.gather(*(self._run(get_embedding, *key) for key in missing), return_exceptions=True)
+        fresh = dict(zip(missing, vectors))
+        for key in hits:
+            if key in self.embedding_cache:
+                self.embedding_cache.move_to_end(key)
+        for key, vector in fresh.items():
+            if not isinstance(vector, BaseException):
+                self.embedding_cache[key] = vector
+        while len(self.embedding_cache) > self.cache_size:
+            self.embedding_cache.popitem(last=False)
+        return [hits[key] if key in hits else fresh[key] for key in keys]
+
+    @staticmethod
+    def _score_groups(groups, k):
+        results = {}
+        for index, entries in groups.items():
+            found = index.search_many([vector for _, vector in entries], k)
+            results.update((position, matches) for (position, _), matches in zip(entries, found))
+        return results
+
+    async def _score_batch(self, requests):
+        # requests are (index, query vector); one multiply per index scores the whole batch
+        groups = {}
+        for position, (index, vector) in enumerate(requests):
+            groups.setdefault(index, []).append((position, vector))
+        results = await self._run(self._score_groups, groups, TOP_K)
+        return [results[position] for position in range(len(requests))]
+
+    async def search(self, query):
+        """Returns the top results for a text query in the search function's response format."""
+        generation, indexes = self.generation, list(self.indexes.values())
+        dimensions = sorted({index.space.dimension for index in indexes})
+        embeddings = dict(zip(dimensions, await asyncio.gather(*(self.embedder.submit((query, d, generation.model_id))
+                                                                 for d in dimensions))))
+        matches = await asyncio.gather(*(self.scorer.submit((index, to_space(embeddings[index.space.dimension], index.space)))
+                                         for index in indexes))
+        results = sorted((pair for found in matches for pair in found), key=lambda pair: pair[1], reverse=True)[:TOP_K]
+        images = await asyncio.gather(*(self._run(read_image, image_key) for image_key, _ in results))
+        return [{"image_key": image_key, "score": score, "image_base64": base64.b64encode(data).decode("utf-8")}
+                for (image_key, score), data in zip(results, images)]
+
+    def health(self):
+        return {
+            "table": self.generation.table if self.generation else None,
+            "model_id": self.generation.model_id if self.generation else None,
+            "items": sum(len(index) for index in self.indexes.values()),
+            "spaces": len(self.indexes),
+            "embedding_calls": self.embedding_calls,
+            "embedding_mean_batch": round(self.embedder.mean_batch, 2),
+            "scoring_batches": self.scorer.batches,
+            "scoring_mean_batch": round(self.scorer.mean_batch, 2),
+        }
+
+
+def create_app(service, refresh_seconds=None, deployment_seconds=None):
+    """
+    Builds the aiohttp application; the index is loaded before the first request is accepted.
+
+    :param refresh_seconds: How often the index is refreshed.
+    :param deployment_seconds: How often the live generation is checked, to rebuild the index when it changes.
+    """
+    routes = web.RouteTableDef()
+
+    @routes.get("/search")
+    async def search(request):
+        request_id = request.headers.get("X-Request-Id") or str(uuid.uuid4())
+        headers = {"X-Request-Id": request_id}
+        query = request.query.get("query")
+        if not query:
+            return web.json_response({"message": "query is required"}, status=400, headers=headers)
+        try:
+            results = await service.search(query)
+        except BedrockUnavailable as e:
+            logger.warning("Embedding model unavailable", error=str(e), request_id=request_id)
+            return web.json_response({"message": "Search is busy, please try again shortly."}, status=503, headers=headers)
+        logger.info("Search results", query=query, request_id=request_id,
+                    top=[{"image_key": r["image_key"], "score": round(r["score"], 4)} for r in results])
+        return web.json_response(results, headers=headers)
+
+    @routes.get("/health")
+    async def health(request):
+        return web.json_response(service.health())
+
+    async def refresh_periodically(app):
+        await service.refresh()
+
+        async def loop(seconds, refresh):
+            while True:
+                await asyncio.sleep(seconds)
+                try:
+                    await refresh()
+                except Exception as e:
+                    # Keep serving the index already in memory
+                    logger.error("Index refresh failed", error=str(e))
+
+        tasks = [asyncio.get_running_loop().create_task(loop(seconds, refresh))
+                 for seconds, refresh in ((refresh_seconds, service.refresh),
+                                          (deployment_seconds, service.follow_deployment)) if seconds]
+        yield
+        for task in tasks:
+            task.cancel()
+
+    app = web.Application()
+    app.add_routes(routes)
+    app.cleanup_ctx.append(refresh_periodically)
+    return app
+
+
+def service_from_env():
+    env = os.environ.get
+    bucket = env("INDEX_SNAPSHOT_BUCKET")
+    return SearchService(
+        max_batch=int(env("SEARCH_MAX_BATCH", 32)),
+        max_wait=float(env("SEARCH_MAX_WAIT_MS", 5)) / 1000,
+        cache_size=int(env("SEARCH_EMBEDDING_CACHE", 1024)),
+        workers=int(env("SEARCH_WORKERS", 32)),
+        snapshots=(lambda table_name: S3Store(bucket, table_prefix(env("INDEX_PREFIX", DEFAULT_PREFIX), table_name)))
+        if bucket else None,
+    )
+
+
+if __name__ == "__main__":
+    deployment_seconds = float(os.environ.get("DEPLOYMENT_TTL_SECONDS", 30)) \
+        if os.environ.get("EMBEDDINGS_DEPLOYMENT_KEY") else None
+    web.run_app(create_app(service_from_env(), float(os.environ.get("INDEX_REFRESH_SECONDS", 300)), deployment_seconds),
+                port=int(os.environ.get("PORT", 8080)), access_log=None)
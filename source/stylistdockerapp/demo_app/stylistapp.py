@@ -2,10 +2,10 @@ import streamlit as st
 import boto3
 from botocore.exceptions import ClientError
 import requests
-from PIL import Image
-import io
 import base64
 import json
+import os
+import uuid
 from streamlit_cognito_auth import CognitoAuthenticator
 
 # Initialize the Streamlit app
@@ -50,6 +50,15 @@ YOUR_API_URL_TEXT = url + "text"
 YOUR_API_URL_IMAGE = url + "image"
 API_URL_DATABASE = url + "search"
 
+# Internal search service, when deployed with the `search_service` context; the API's /search is the fallback
+SEARCH_SERVICE_URL = os.environ.get("SEARCH_SERVICE_URL")
+SEARCH_SERVICE_TIMEOUT = 5
+
+# Generated images are requested as WebP at twice the displayed width, which is far smaller than the model's PNG
+IMAGE_FORMAT = "webp"
+IMAGE_QUALITY = 85
+IMAGE_MAX_SIZE = 800
+
 # ID of Secrets Manager containing cognito parameters
 cognito_secrets = get_secret("VirtualStylistCognitoSecrets")
 cognito_secrets = json.loads(cognito_secrets)
@@ -79,6 +88,8 @@ with st.sidebar:
     if st.button("Logout", key="logout_btn", on_click=logout):
         st.write("Logged out successfully.")
     st.markdown("---")  # Horizontal line
+    # Optional order history customer id used to personalize recommendations
+    customer_id = st.text_input("Customer ID (optional)", key="customer_id")
 
 # Custom CSS for better styling
 st.markdown("""
@@ -214,13 +225,21 @@ body {
 </style>
 """, unsafe_allow_html=True)
 
+def api_headers():
+    # A fresh request id per call lets API errors be matched to the handler's latency traces
+    request_id = str(uuid.uuid4())
+    return request_id, {"x-api-key": str(API_KEY), "Authorization": f"Bearer {access_token}", "X-Request-Id": request_id}
+
 def api_call_text(input_text):
     api_url = YOUR_API_URL_TEXT
     payload = {"query": str(input_text)}
+    if customer_id:
+        payload["customer_id"] = str(customer_id)
+    request_id, headers = api_headers()
     try:
         response = requests.get(
             api_url,
-            headers={"x-api-key": str(API_KEY), "Authorization": f"Bearer {access_token}"},
+            headers=headers,
             params=payload,
         )
         response.raise_for_status()  # Check for HTTP errors
@@ -230,16 +249,17 @@ def api_call_text(input_text):
             st.error("Empty response from the API.")
             return None
     except requests.exceptions.RequestException as e:
-        st.error(f"API call error: {e}")
+        st.error(f"API call error: {e} (request id {request_id})")
         return None
 
 def api_call_image(input_text):
     api_url = YOUR_API_URL_IMAGE
-    payload = {"query": str(input_text)}
+    payload = {"query": str(input_text), "format": IMAGE_FORMAT, "quality": IMAGE_QUALITY, "max_size": IMAGE_MAX_SIZE}
+    request_id, headers = api_headers()
     try:
         response = requests.get(
             api_url,
-            headers={"x-api-key": str(API_KEY), "Authorization": f"Bearer {access_token}"},
+            headers=headers,
             params=payload,
         )
         response.raise_for_status()  # Check for HTTP errors
@@ -249,16 +269,34 @@ def api_call_image(input_text):
             st.error("Empty response from the API.")
             return None
     except requests.exceptions.RequestException as e:
-        st.error(f"API call error: {e}")
+        st.error(f"API call error: {e} (request id {request_id})")
+        return None
+
+def search_service_call(input_text, request_id):
+    try:
+        response = requests.get(
+            SEARCH_SERVICE_URL + "/search",
+            headers={"X-Request-Id": request_id},
+            params={"query": str(input_text)},
+            timeout=SEARCH_SERVICE_TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError):
         return None
 
 def api_call_database(input_text):
     api_url = API_URL_DATABASE
     payload = {"query": str(input_text)}
+    request_id, headers = api_headers()
+    if SEARCH_SERVICE_URL:
+        data = search_service_call(input_text, request_id)
+        if data is not None:
+            return data
     try:
         response = requests.get(
             api_url,
-            headers={"x-api-key": str(API_KEY), "Authorization": f"Bearer {access_token}"},
+            headers=headers,
             params=payload,
         )
         response.raise_for_status()  # Check for HTTP errors
@@ -268,7 +306,7 @@ def api_call_database(input_text):
             st.error("Empty response from the API.")
             return None
     except requests.exceptions.RequestException as e:
-        st.error(f"API call error: {e}")
+        st.error(f"API call error: {e} (request id {request_id})")
         return None
     except json.JSONDecodeError as e:
         st.error(f"JSON decode error: {e}")
@@ -277,16 +315,8 @@ def api_call_database(input_text):
         
 def decode_and_display_image(base64_image):
     try:
-        # Decode base64 image to binary
-        image_data = base64.b64decode(base64_image)
-        
-        # Use a with statement to manage the BytesIO object
-        with io.BytesIO(image_data) as image_buffer:
-            # Convert binary data to PIL Image
-            image = Image.open(image_buffer)
-            
-            # Display the image in Streamlit with a limited width
-            st.image(image, use_column_width=False, width=400, output_format='PNG')
+        # The browser renders PNG, WebP and JPEG bytes as received, so skip decoding and re-encoding them here
+        st.image(base64.b64decode(base64_image), use_column_width=False, width=400)
     except Exception as e:
         st.error(f"Error decoding image: {e}")
 
@@ -349,8 +379,7 @@ def display_database_search():
                     st.markdown("Here are some products that match your description:")
                     for item in data:
                         image_data = base64.b64decode(item['image_base64'])
-                        image = Image.open(io.BytesIO(image_data))
-                        st.image(image, caption=f"Similarity Score: {item['score']:.2f}, Image Key: {item['image_key']}", use_column_width=False, width=400)
+                        st.image(image_data, caption=f"Similarity Score: {item['score']:.2f}, Image Key: {item['image_key']}", use_column_width=False, width=400)
                 else:
                     st.error("No data returned from the API.")
         except Exception as e:
@@ -0,0 +1,7 @@
+import os
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lambda")
+
+# Lambda code is packaged per function directory plus the common layer, so mirror that on sys.path
+sys.path.insert(0, os.path.join(LAMBDA_DIR, "CommonLayer", "python"))
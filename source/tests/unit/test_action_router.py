@@ -0,0 +1,113 @@
+import importlib
+import json
+import threading
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, DATA_BUCKET, SCENARIOS, TABLE_KEYS
+from stylist_common import weather
+from stylist_common.actions import ActionError, ActionRouter
+from stylist_common.tracing import current_request_id, traced
+
+
+def agent_event(api_path, **parameters):
+    return {
+        "actionGroup": "stylist-tools",
+        "apiPath": api_path,
+        "httpMethod": "GET",
+        "parameters": [{"name": name, "type": "string", "value": value} for name, value in parameters.items()],
+        "sessionAttributes": {},
+        "promptSessionAttributes": {},
+    }
+
+
+def body(response):
+    return json.loads(response["response"]["responseBody"]["application/json"]["body"])
+
+
+def test_routes_on_api_path_with_named_parameters():
+    router = ActionRouter()
+
+    @router.route("/echo")
+    def echo(parameters):
+        return parameters
+
+    @router.route("/fail")
+    def fail(parameters):
+        raise ActionError("bad input")
+
+    response = router.handle(agent_event("/echo", limit="3", location="Seattle"))
+    assert response["response"]["httpStatusCode"] == 200
+    assert body(response) == {"limit": "3", "location": "Seattle"}
+
+    assert router.handle(agent_event("/fail"))["response"]["httpStatusCode"] == 400
+    assert router.handle(agent_event("/missing"))["response"]["httpStatusCode"] == 404
+
+
+def test_batched_invocations_run_concurrently():
+    router = ActionRouter()
+    barrier = threading.Barrier(3, timeout=5)
+
+    @router.route("/wait")
+    def wait(parameters):
+        # Only completes if all three invocations are in flight at once
+        barrier.wait()
+        return {"id": parameters["id"]}
+
+    @router.route("/request-id")
+    def request_id(parameters):
+        return {"request_id": current_request_id()}
+
+    result = router.handle({"invocations": [agent_event("/wait", id=str(i)) for i in range(3)]})
+    assert [body(response)["id"] for response in result["responses"]] == ["0", "1", "2"]
+
+    # Tools running on worker threads still see the caller's request id
+    handler = traced("test")(lambda event, context: router.handle(event))
+    event = {"invocations": [agent_event("/request-id") for _ in range(3)], "requestContext": {"requestId": "req-7"}}
+    assert [body(response)["request_id"] for response in handler(event, None)["responses"]] == ["req-7"] * 3
+
+
+@pytest.fixture
+def action_group(monkeypatch):
+    scenario = SCENARIOS["action_group_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws(table_keys=TABLE_KEYS).install()
+    for seed in scenario["seed"]:
+        seed(fakes)
+    module = importlib.import_module("action_group_function")
+    module._copurchase_snapshot.reset()
+    module._order_history.reset()
+    return module, fakes
+
+
+def test_order_history_validates_limit_and_follows_new_uploads(action_group, monkeypatch):
+    module, fakes = action_group
+    history = body(module.handler(agent_event("/get-order-history", customer_id="2", limit="2"), None))
+    assert len(history["orders"]) == 2
+
+    response = module.handler(agent_event("/get-order-history", customer_id="2", limit="ten"), None)
+    assert response["response"]["httpStatusCode"] == 400 and "integer" in body(response)["error"]
+    response = module.handler(agent_event("/get-frequently-bought-together", item="Shirt", limit="0"), None)
+    assert response["response"]["httpStatusCode"] == 400
+
+    # A new export is picked up once the cached copy's TTL has passed
+    fakes.s3.objects[(DATA_BUCKET, "order_history.csv")] = (
+        b"orders/id,customer/id,orders/name,orders/size,orders/brand,orders/tags/0\n"
+        + b"".join(b"%d,2,Scarf,M,Acme,wool\n" % i for i in range(1, 81)))
+    monkeypatch.setattr(module._order_history, "ttl", 0)
+    history = body(module.handler(agent_event("/get-order-history", customer_id="2", limit="500"), None))
+    assert len(history["orders"]) == module.ORDER_HISTORY_LIMIT
+    assert history["orders"][0] == {"name": "Scarf", "size": "M", "brand": "Acme", "tags": ["wool"]}
+
+
+def test_weather_cache_is_bounded(action_group, monkeypatch):
+    module, fakes = action_group
+    monkeypatch.setattr(weather, "CACHE_MAX_ENTRIES", 3)
+    for city in ["Seattle", "Boston", "Miami", "Denver", "Seattle"]:
+        module.handler(agent_event("/get-weather-info", location=city), None)
+    assert list(weather._cache) == ["miami", "denver", "seattle"]
+    assert len([name for name, _ in fakes.http.calls]) == 5
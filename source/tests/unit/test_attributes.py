@@ -0,0 +1,72 @@
+import importlib
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS
+from stylist_common.attributes import (NONE, confident, dumps_classifiers, extract, load_classifiers, loads_classifiers,
+                                       train_classifiers)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I'm a 25 year old woman going to Paris in October", {"age_group": "20-30", "gender": "Womens", "season": "fall", "location": "Paris"}),
+    ("Need a suit for my husband, I'm Sarah", {"gender": "Mens"}),
+    ("My name is James and I need a coat for new york", {"gender": "Mens", "location": "New York"}),
+    ("Something for my niece's graduation in her early twenties", {"age_group": "20-30", "gender": "Womens"}),
+    ("A look for a woman in her fifties for Thanksgiving", {"age_group": "50+", "gender": "Womens", "season": "fall"}),
+    ("I'm from Chicago but spending the summer in Lisbon", {"season": "summer", "location": "Lisbon"}),
+    ("I'll fall asleep if I see another 70s revival, I may need help", {}),
+    ("Layering from winter to spring, size 12", {}),
+])
+def test_confident_attributes(text, expected):
+    assert confident(extract(text)) == expected
+
+
+def test_weak_cues_are_found_but_not_confident():
+    found = extract("Red evening dresses for a beach party in Napa")
+    assert {name: value.value for name, value in found.items()} == {"gender": "Womens", "season": "summer", "location": "Napa"}
+    assert confident(found) == {}
+
+
+def test_classifiers_fill_in_only_what_rules_miss():
+    examples = [("outfit for the office party", {"gender": "Womens"})] * 5 + [("hoodie for the gym", {})] * 5
+    classifiers = loads_classifiers(dumps_classifiers(train_classifiers(examples, attributes=("gender",))))
+    assert classifiers["gender"].predict("office party")[0] == "Womens"
+    assert classifiers["gender"].predict("gym hoodie")[0] == NONE
+    assert extract("office party look for my dad", classifiers)["gender"].source == "relation"
+    assert extract("office party look", classifiers)["gender"].source == "classifier"
+
+
+def test_classifiers_are_reloaded_when_retrained_and_optional_when_missing():
+    fakes = FakeAws().install()
+    # Missing or unreadable classifiers leave extraction to the rules
+    assert load_classifiers("artifacts", "attributes/reload.json", ttl=0) is None
+    fakes.s3.objects[("artifacts", "attributes/reload.json")] = b"not json"
+    assert load_classifiers("artifacts", "attributes/reload.json", ttl=0) is None
+
+    womens = [("outfit for the office party", {"gender": "Womens"})] * 5 + [("hoodie for the gym", {})] * 5
+    fakes.s3.objects[("artifacts", "attributes/reload.json")] = dumps_classifiers(
+        train_classifiers(womens, attributes=("gender",))).encode("utf-8")
+    assert load_classifiers("artifacts", "attributes/reload.json", ttl=0)["gender"].predict("office party")[0] == "Womens"
+
+    mens = [("outfit for the office party", {"gender": "Mens"})] * 5 + [("hoodie for the gym", {})] * 5
+    fakes.s3.objects[("artifacts", "attributes/reload.json")] = dumps_classifiers(
+        train_classifiers(mens, attributes=("gender",))).encode("utf-8")
+    assert load_classifiers("artifacts", "attributes/reload.json", ttl=0)["gender"].predict("office party")[0] == "Mens"
+
+
+def test_text_function_passes_confident_attributes_to_the_agent(monkeypatch):
+    scenario = SCENARIOS["text_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws(table_keys=TABLE_KEYS).install()
+    handler = importlib.import_module("text_function").handler
+
+    handler({"queryStringParameters": {"query": "Winter boots for my girlfriend in Montreal, maybe a dress"}}, None)
+    handler({"queryStringParameters": {"query": "How do I style a denim jacket?"}}, None)
+
+    (_, first), (_, second) = fakes.agent_runtime.calls
+    assert first["sessionState"] == {"promptSessionAttributes": {"gender": "Womens", "season": "winter", "location": "Montreal"}}
+    assert second["sessionState"] == {}
@@ -0,0 +1,85 @@
+import importlib
+import json
+from decimal import Decimal
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, deterministic_embedding
+from benchmarks.scenarios import COMMON_ENV, EMBEDDINGS_TABLE, IMAGE_BUCKET, SCENARIOS, seed_catalog
+from stylist_common import image_cache
+
+
+@pytest.fixture
+def search(monkeypatch):
+    scenario = SCENARIOS["imagequery_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=150)
+    return importlib.import_module("imagequery_function"), fakes
+
+
+def post(handler, body):
+    response = handler({"httpMethod": "POST", "body": json.dumps(body)}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+@pytest.mark.parametrize("quantizer", ["int8", "binary", "none"])
+def test_batch_matches_single_queries_with_one_pass(search, monkeypatch, quantizer):
+    module, fakes = search
+    monkeypatch.setattr(module, "QUANTIZER", quantizer)
+    queries = [{"query": "linen shirt", "k": 5}, "white sneakers", {"query": "linen shirt", "k": 2}]
+    singles = {text: json.loads(module.handler({"queryStringParameters": {"query": text}}, None)["body"])
+               for text in ("linen shirt", "white sneakers")}
+    for calls in (fakes.s3.calls, fakes.bedrock_runtime.calls, fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls):
+        calls.clear()
+    # Forget the images the single queries cached, so every result is read from S3
+    image_cache.reset()
+
+    status, body = post(module.handler, {"queries": queries})
+
+    assert status == 200
+    assert [(r["query"], r["k"], len(r["matches"])) for r in body["results"]] == [
+        ("linen shirt", 5, 5), ("white sneakers", 3, 3), ("linen shirt", 2, 2)]
+    for result in body["results"]:
+        expected = singles[result["query"]][:min(3, result["k"])]
+        assert [m["image_key"] for m in result["matches"][:3]] == [r["image_key"] for r in expected]
+        assert [m["score"] for m in result["matches"][:3]] == pytest.approx([r["score"] for r in expected], abs=1e-5)
+    keys = {m["image_key"] for r in body["results"] for m in r["matches"]}
+    assert set(body["images"]) == keys
+    assert len([c for c in fakes.s3.calls if c[0] == "GetObject"]) == len(keys)
+    assert len([c for c in fakes.bedrock_runtime.calls if c[0] == "InvokeModel"]) == 2
+    table_calls = [operation for operation, _ in fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls]
+    assert table_calls == (["Scan"] if quantizer == "none" else ["Scan", "BatchGetItem", "BatchGetItem"])
+
+
+@pytest.mark.parametrize("quantizer", ["int8", "none"])
+def test_batch_searches_rows_stored_before_spaces_and_codes(search, monkeypatch, quantizer):
+    module, fakes = search
+    monkeypatch.setattr(module, "QUANTIZER", quantizer)
+    # A legacy row: only its vector, no embedding_dim, projection or codes
+    fakes.dynamodb.Table(EMBEDDINGS_TABLE).items["legacy"] = {
+        "id": "legacy", "image_key": "catalog/legacy.png",
+        "vector": [Decimal(str(x)) for x in deterministic_embedding("linen shirt", 1024)]}
+    fakes.s3.objects[(IMAGE_BUCKET, "catalog/legacy.png")] = b"legacy"
+
+    status, body = post(module.handler, {"queries": ["linen shirt", "white sneakers"]})
+
+    assert status == 200
+    assert body["results"][0]["matches"][0]["image_key"] == "catalog/legacy.png"
+    assert len([c for c in fakes.bedrock_runtime.calls if c[0] == "InvokeModel"]) == 2
+
+
+@pytest.mark.parametrize("body", [
+    {}, {"queries": []}, {"queries": [""]}, {"queries": [{"query": "shirt", "k": 0}]},
+    {"queries": [{"query": "shirt", "k": "3"}]}, {"queries": ["shirt"] * 26}, ["shirt"],
+])
+def test_invalid_batches_are_rejected(search, body):
+    module, fakes = search
+
+    status, response = post(module.handler, body)
+
+    assert status == 400 and response["message"]
+    assert fakes.bedrock_runtime.calls == []
@@ -0,0 +1,105 @@
+import json
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmarks.fakes import FakeBedrockRuntime
+from stylist_common import runtime
+from stylist_common.bedrock import BedrockInvoker, BedrockUnavailable, LatencyWindow, parse_targets
+
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+BODY = json.dumps({"messages": []})
+
+
+@pytest.fixture
+def regions(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    runtime.reset()
+    fakes = {region: FakeBedrockRuntime() for region in ("us-east-1", "us-west-2")}
+    for region, fake in fakes.items():
+        runtime.set_client("bedrock-runtime", fake, region_name=region)
+    yield fakes
+    runtime.reset()
+
+
+def invoker(**kwargs):
+    options = dict(rate=1000, burst=1000, max_attempts=2, sleep=lambda seconds: None,
+                   hedge_targets=parse_targets("us-west-2"), hedge_delay=0.02, hedge_budget=0.5, hedge_burst=1)
+    options.update(kwargs)
+    return BedrockInvoker(**options)
+
+
+def models(fake):
+    return [kwargs["modelId"] for _, kwargs in fake.calls]
+
+
+def test_targets_name_regions_and_inference_profiles(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "us-east-1")
+    assert parse_targets(" us-west-2, us-east-1:us ,") == [("us-west-2", None), ("us-east-1", "us")]
+    endpoints = invoker(hedge_targets=parse_targets("us-west-2,us-east-1:us")).endpoints(MODEL_ID)
+    assert [(e.region, e.model_id, e.key) for e in endpoints] == [
+        ("us-east-1", MODEL_ID, MODEL_ID), ("us-west-2", MODEL_ID, f"us-west-2/{MODEL_ID}"),
+        ("us-east-1", f"us.{MODEL_ID}", f"us-east-1/us.{MODEL_ID}")]
+
+
+def test_slow_calls_are_hedged_and_the_first_answer_wins(regions):
+    regions["us-east-1"].latency = 0.5
+    hedging = invoker()
+
+    start = time.perf_counter()
+    response = hedging.invoke_model(MODEL_ID, BODY)
+    assert time.perf_counter() - start < 0.4
+    assert "content" in json.loads(response["body"].read())
+    assert models(regions["us-west-2"]) == [MODEL_ID]
+    assert hedging.guard(f"us-west-2/{MODEL_ID}").hedges == 1 and hedging.guard(f"us-west-2/{MODEL_ID}").wins == 1
+
+
+def test_hedges_stop_when_the_budget_is_spent(regions):
+    regions["us-east-1"].latency = 0.1
+    hedging = invoker(hedge_budget=0.0, hedge_burst=1)
+
+    hedging.invoke_model(MODEL_ID, BODY)
+    hedging.invoke_model(MODEL_ID, BODY)
+
+    assert len(regions["us-west-2"].calls) == 1 and len(regions["us-east-1"].calls) == 2
+    assert hedging.guard(MODEL_ID).wins == 1
+
+
+def test_regional_errors_fail_over_and_unhealthy_regions_go_last(regions):
+    regions["us-east-1"].throttle_probability = 1.0
+    hedging = invoker(hedge_burst=0, breaker_threshold=4)
+
+    for _ in range(2):
+        hedging.invoke_model(MODEL_ID, BODY)
+    assert len(regions["us-east-1"].calls) == 4 and len(regions["us-west-2"].calls) == 2
+
+    # The home region's breaker is open, so calls go straight to the healthy one
+    hedging.invoke_model(MODEL_ID, BODY)
+    assert len(regions["us-east-1"].calls) == 4 and len(regions["us-west-2"].calls) == 3
+
+    regions["us-west-2"].throttle_probability = 1.0
+    with pytest.raises(BedrockUnavailable):
+        hedging.invoke_model(MODEL_ID, BODY)
+
+
+def test_rejected_requests_do_not_fail_over(regions, monkeypatch):
+    def invalid(**kwargs):
+        raise ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeModel")
+    monkeypatch.setattr(regions["us-east-1"], "invoke_model", invalid)
+
+    with pytest.raises(ClientError):
+        invoker().invoke_model(MODEL_ID, BODY)
+    assert regions["us-west-2"].calls == []
+
+
+def test_adaptive_delay_follows_recent_latency():
+    window = LatencyWindow()
+    assert window.percentile(0.95) is None
+    for ms in range(1, 101):
+        window.add(ms / 1000)
+    assert window.percentile(0.95) == pytest.approx(0.096)
+    adaptive = invoker(hedge_delay=None)
+    assert adaptive.delay(MODEL_ID) == 2.0
+    adaptive.latencies[MODEL_ID] = window
+    assert adaptive.delay(MODEL_ID) == pytest.approx(0.096)
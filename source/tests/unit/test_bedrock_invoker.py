@@ -0,0 +1,112 @@
+import time
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+from stylist_common.bedrock import BedrockInvoker, BedrockUnavailable, CircuitBreaker
+
+
+def throttling_error():
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+
+
+def flaky(failures):
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise throttling_error()
+        return "ok"
+    return call, calls
+
+
+def test_throttles_are_retried_and_shrink_concurrency():
+    invoker = BedrockInvoker(rate=1000, burst=1000, max_concurrency=8, max_attempts=4, sleep=lambda seconds: None)
+    call, calls = flaky(failures=2)
+
+    assert invoker.call("model", call) == "ok"
+    assert len(calls) == 3
+    assert invoker.guard("model").limiter.limit < 4
+
+
+def test_exhausted_retries_raise_unavailable_instead_of_exiting():
+    invoker = BedrockInvoker(rate=1000, burst=1000, max_attempts=3, breaker_threshold=10, sleep=lambda seconds: None)
+    call, calls = flaky(failures=10)
+
+    with pytest.raises(BedrockUnavailable):
+        invoker.call("model", call)
+    assert len(calls) == 3
+
+
+def test_validation_errors_are_not_retried():
+    invoker = BedrockInvoker(rate=1000, burst=1000, sleep=lambda seconds: None)
+
+    def invalid():
+        raise ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeModel")
+
+    with pytest.raises(ClientError):
+        invoker.call("model", invalid)
+
+
+def test_circuit_breaker_opens_and_allows_a_trial_after_reset():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=0.0)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+
+    # With a zero reset window the breaker is immediately half-open and admits a single trial
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_transport_errors_count_as_failures_and_end_the_half_open_trial():
+    invoker = BedrockInvoker(rate=1000, burst=1000, max_attempts=2, breaker_threshold=2, breaker_reset_seconds=0.01,
+                             sleep=lambda seconds: None)
+    attempts = []
+
+    def unreachable():
+        attempts.append(1)
+        raise EndpointConnectionError(endpoint_url="https://bedrock-runtime.us-east-1.amazonaws.com")
+
+    with pytest.raises(BedrockUnavailable):
+        invoker.call("model", unreachable)
+    breaker = invoker.guard("model").breaker
+    assert len(attempts) == 2 and breaker.opened_at is not None
+
+    # The half-open trial times out; the next trial is still let through once the breaker resets
+    def timeout():
+        raise ReadTimeoutError(endpoint_url="https://bedrock-runtime.us-east-1.amazonaws.com")
+
+    time.sleep(0.02)
+    with pytest.raises(BedrockUnavailable):
+        invoker.call("model", timeout)
+    assert not breaker.trial_in_flight
+
+    # Any other error also ends the trial before it propagates
+    time.sleep(0.02)
+    with pytest.raises(KeyError):
+        invoker.call("model", lambda: {}["body"])
+    assert not breaker.trial_in_flight
+    time.sleep(0.02)
+    assert invoker.call("model", lambda: "ok") == "ok" and breaker.state == "closed"
+
+
+def test_clients_are_cached_per_max_attempts(monkeypatch):
+    from stylist_common import runtime
+
+    class Session:
+        def client(self, service_name, region_name=None, config=None):
+            return (service_name, config.retries["max_attempts"])
+
+    monkeypatch.setattr(runtime, "_clients", {})
+    monkeypatch.setattr(runtime, "_installed", {})
+    monkeypatch.setattr(runtime, "_session", Session())
+    # The default client created first must not be handed to a caller that retries itself
+    assert runtime.client("bedrock-agent-runtime", "us-east-1") == ("bedrock-agent-runtime", 3)
+    assert runtime.client("bedrock-agent-runtime", "us-east-1", max_attempts=1) == ("bedrock-agent-runtime", 1)
+
+    runtime.set_client("bedrock-agent-runtime", "fake", region_name="us-east-1")
+    assert runtime.client("bedrock-agent-runtime", "us-east-1", max_attempts=1) == "fake"
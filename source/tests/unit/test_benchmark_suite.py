@@ -0,0 +1,23 @@
+from benchmarks.fakes import FakeAws
+from benchmarks.suite import regressions
+
+BASELINE = {"p50_ms": 10.0, "peak_kib": 200.0, "retained_blocks": 5.0, "calls": 3}
+
+
+def test_noise_within_tolerance_is_not_a_regression():
+    current = {"p50_ms": 11.9, "peak_kib": 240.0, "retained_blocks": 14.0, "calls": 3}
+    assert regressions(current, BASELINE, tolerance=0.25, slack_ms=1.0) == []
+
+
+def test_slower_bigger_or_chattier_handlers_regress():
+    current = {"p50_ms": 14.0, "peak_kib": 400.0, "retained_blocks": 40.0, "calls": 4}
+    assert regressions(current, BASELINE, tolerance=0.25, slack_ms=1.0) == [
+        "p50 10.00ms -> 14.00ms", "peak memory 200KiB -> 400KiB",
+        "retained blocks 5 -> 40 per request", "AWS calls 3 -> 4 per request"]
+
+
+def test_operations_cover_every_fake():
+    fakes = FakeAws(table_keys={"profiles": "customer_id"})
+    fakes.s3.put_object(Bucket="b", Key="k", Body=b"x")
+    fakes.dynamodb.Table("profiles").get_item(Key={"customer_id": "1"})
+    assert sorted(fakes.operations()) == ["GetItem", "PutObject"]
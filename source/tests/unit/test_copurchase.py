@@ -0,0 +1,83 @@
+import importlib
+import json
+import os
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, agent_event
+from stylist_common.cached_object import CachedObject
+from stylist_common.copurchase import CoPurchaseIndex
+from stylist_common.orders import parse_orders
+
+ORDER_HISTORY = os.path.join(os.path.dirname(__file__), "..", "..", "csv_files", "order_history.csv")
+
+
+def load_orders():
+    with open(ORDER_HISTORY) as f:
+        return parse_orders(f.read())
+
+
+def test_incremental_updates_match_full_build():
+    orders = load_orders()
+    full = CoPurchaseIndex.build(orders)
+
+    index = CoPurchaseIndex.build(orders[:15])
+    assert index.add_orders(orders) == len(orders) - 15
+    assert index.neighbours == full.neighbours
+
+    # Snapshots compact the incremental counts without changing the rankings
+    assert CoPurchaseIndex.loads(index.dumps()).neighbours == full.neighbours
+
+
+def test_recommend_by_item_name_merges_brands():
+    index = CoPurchaseIndex.build(load_orders())
+
+    recommendations = index.recommend("shirt", limit=3)
+    assert len(recommendations) == 3
+    assert all(not label.startswith("Shirt (") for label, _ in recommendations)
+    assert index.recommend("Unknown item") == []
+
+
+def test_cached_snapshot_reloads_only_when_its_etag_changes():
+    fakes = FakeAws().install()
+    fakes.s3.objects[("artifacts", "copurchase.npz")] = CoPurchaseIndex.build(load_orders()[:15]).dumps()
+    now = [0.0]
+    snapshot = CachedObject("artifacts", "copurchase.npz", lambda body: CoPurchaseIndex.loads(body.read()),
+                            ttl=60, clock=lambda: now[0])
+    first = snapshot.get()
+    assert snapshot.get() is first and len(fakes.s3.calls) == 1
+
+    # Past the TTL an unchanged snapshot is confirmed with a conditional GET and not loaded again
+    now[0] = 61
+    assert snapshot.get() is first and snapshot.loads == 1
+    assert fakes.s3.calls[-1][1]["IfNoneMatch"]
+
+    # Another container saves a newer snapshot: it is picked up once the TTL has passed
+    full = CoPurchaseIndex.build(load_orders())
+    fakes.s3.objects[("artifacts", "copurchase.npz")] = full.dumps()
+    assert snapshot.get() is first
+    now[0] = 122
+    assert snapshot.get().neighbours == full.neighbours and snapshot.loads == 2
+
+
+def test_recommendation_action_validates_and_caps_limit(monkeypatch):
+    scenario = SCENARIOS["recommendation_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    for seed in scenario["seed"]:
+        seed(fakes)
+    module = importlib.import_module("recommendation_function")
+    module.snapshot.reset()
+
+    def recommend(limit):
+        response = module.handler(agent_event("/get-frequently-bought-together", item="Shirt", limit=limit), None)
+        action = response["response"]
+        return action["httpStatusCode"], json.loads(action["responseBody"]["application/json"]["body"])
+
+    for limit in ("ten", "-3", "0"):
+        status_code, body = recommend(limit)
+        assert status_code == 400 and "limit" in body["error"]
+    status_code, body = recommend("1000000")
+    assert status_code == 200 and 0 < len(body["frequently_bought_together"]) <= module.MAX_RECOMMENDATIONS
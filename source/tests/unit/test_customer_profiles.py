@@ -0,0 +1,56 @@
+import os
+
+from stylist_common.orders import parse_orders
+from stylist_common.profiles import LocalFileProfileStore, aggregate
+
+ORDER_HISTORY = os.path.join(os.path.dirname(__file__), "..", "..", "csv_files", "order_history.csv")
+
+
+def load_orders():
+    with open(ORDER_HISTORY) as f:
+        return parse_orders(f.read())
+
+
+def test_profiles_aggregate_order_history(tmp_path):
+    store = LocalFileProfileStore(str(tmp_path / "profiles.json"))
+    orders = load_orders()
+
+    assert aggregate(orders, store) == len(orders)
+
+    profile = LocalFileProfileStore(str(tmp_path / "profiles.json")).get("2")
+    assert profile["order_count"] == sum(1 for order in orders if order.customer_id == "2")
+    assert profile["sizes"]["M"] > 0
+    assert profile["colors"]["brown"] > 0
+    assert "full sleeve" not in profile["colors"]
+    assert profile["summary"].startswith("sizes: ")
+    assert "% formal" in profile["summary"]
+
+
+def test_profiles_update_incrementally(tmp_path):
+    store = LocalFileProfileStore(str(tmp_path / "profiles.json"))
+    orders = load_orders()
+    aggregate(orders[:10], store)
+
+    # Re-processing the full export only applies the orders not seen before
+    assert aggregate(orders, store) == len(orders) - 10
+    assert aggregate(orders, store) == 0
+    assert sum(profile["order_count"] for profile in store.profiles.values()) == len(orders)
+
+
+def test_dynamodb_store_reads_profiles_in_batches():
+    from benchmarks.fakes import FakeAws
+    from stylist_common.profiles import DynamoDBProfileStore
+    fakes = FakeAws(table_keys={"profiles": "customer_id"}).install()
+    table = fakes.dynamodb.Table("profiles")
+    store = DynamoDBProfileStore(table)
+    orders = load_orders()
+    aggregate(orders, store)
+    customers = sorted({order.customer_id for order in orders})
+    table.calls.clear()
+
+    profiles = store.get_many(customers + [str(n) for n in range(1000, 1250)])
+
+    assert set(profiles) == set(customers)
+    assert profiles["2"]["order_count"] == sum(1 for order in orders if order.customer_id == "2")
+    # Profiles are read with BatchGetItem, 100 keys at a time, never one GetItem each
+    assert [operation for operation, _ in table.calls if operation.endswith("GetItem")] == ["BatchGetItem"] * 3
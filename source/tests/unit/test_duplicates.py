@@ -0,0 +1,131 @@
+import importlib
+import json
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, EMBEDDINGS_TABLE, SCENARIOS, seed_catalog
+from stylist_common.duplicates import (DUPLICATE_ATTRIBUTE, SpilledVectors, assign_canonical, find_duplicates,
+                                       mark_duplicates, similar_pairs)
+from stylist_common.embeddings import Space
+from stylist_common.vector_index import VectorIndex
+
+
+def unit_rows(count, dimension, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_blocked_join_finds_every_pair_once():
+    matrix = unit_rows(50, 8)
+    matrix[40] = matrix[3]
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(matrix @ matrix.T, k=1) >= 0.6))}
+
+    found = {(int(i), int(j)) for rows, columns, _ in similar_pairs(matrix, 0.6, block=7)
+             for i, j in zip(rows, columns)}
+
+    assert (3, 40) in found and found == expected
+
+
+def test_spilled_blocks_find_the_same_duplicates_as_one_matrix(tmp_path):
+    matrix = unit_rows(30, 8, seed=1)
+    matrix[25] = matrix[2] * 3
+    matrix[12] = matrix[2] + 0.01
+    items = [{"id": f"id-{i}", "image_key": f"key-{i:02d}", "vector": row.tolist()} for i, row in enumerate(matrix)]
+    vectors = SpilledVectors(str(tmp_path), "space", 8, block=7)
+    for item in items:
+        vectors.add(item["id"], item["image_key"], item["vector"])
+
+    assert vectors.duplicates(0.97) == find_duplicates(items, 0.97) == {"id-12": "id-2", "id-25": "id-2"}
+    # Five blocks of at most 7 rows were written, and only those files hold the vectors
+    assert len(vectors.paths) == len(list(tmp_path.iterdir())) == 5
+
+
+def test_duplicates_join_the_first_image_not_a_chain():
+    # a~b and b~c, but a and c are different products
+    pairs = [(np.array([0, 1]), np.array([1, 2]), np.array([0.98, 0.98]))]
+    assert assign_canonical(["a", "b", "c"], pairs) == {1: 0}
+    assert assign_canonical(["b", "a", "c"], pairs) == {0: 1, 2: 1}
+
+
+def test_mmr_trades_relevance_for_diversity():
+    copy = np.array([1.0, 0.0, 0.0])
+    other = np.array([0.6, 0.8, 0.0])
+    index = VectorIndex(Space(3, "none"), ["copy-1", "copy-2", "other"],
+                        np.array([copy, copy, other], dtype=np.float32))
+    query = np.array([0.9, 0.44, 0.0])
+
+    assert [key for key, _ in index.search_diverse(query, 2, 1.0)] == ["copy-1", "copy-2"]
+    diverse = index.search_diverse(query, 2, 0.5)
+    assert [key for key, _ in diverse] == ["copy-1", "other"]
+    assert diverse[1][1] == pytest.approx(float(other @ query / np.linalg.norm(query)), abs=1e-6)
+
+
+@pytest.fixture
+def search(monkeypatch):
+    scenario = SCENARIOS["imagequery_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=60)
+    return importlib.import_module("imagequery_function"), fakes
+
+
+EVENT = {"queryStringParameters": {"query": "linen shirt"}}
+
+
+def reshoot_best_match(module, fakes):
+    """Stores another shot of the best match, as the embeddings function would; returns both items."""
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    top = json.loads(module.handler(EVENT, None)["body"])[0]["image_key"]
+    original = next(item for item in table.items.values() if item["image_key"] == top)
+    table.items["reshoot"] = {**original, "id": "reshoot", "image_key": top.replace(".png", "_2.png"),
+                              "vector": [x + Decimal("0.0001") for x in original["vector"]]}
+    fakes.s3.objects[(module.os.environ["bucket"], table.items["reshoot"]["image_key"])] = b"png"
+    return original, table.items["reshoot"]
+
+
+def result_keys(module):
+    return [r["image_key"] for r in json.loads(module.handler(EVENT, None)["body"])]
+
+
+def test_mmr_keeps_a_reshoot_out_of_the_top_results(search, monkeypatch):
+    module, fakes = search
+    original, reshoot = reshoot_best_match(module, fakes)
+    assert set(result_keys(module)[:2]) == {original["image_key"], reshoot["image_key"]}
+
+    monkeypatch.setattr(module, "MMR_LAMBDA", 0.5)
+    for quantizer in ("int8", "none"):
+        monkeypatch.setattr(module, "QUANTIZER", quantizer)
+        keys = result_keys(module)
+        assert len(keys) == 3 and len({original["image_key"], reshoot["image_key"]} & set(keys)) == 1
+    response = module.handler({"httpMethod": "POST", "body": json.dumps({"queries": ["linen shirt"]})}, None)
+    matches = [m["image_key"] for m in json.loads(response["body"])["results"][0]["matches"]]
+    assert len(matches) == 3 and len({original["image_key"], reshoot["image_key"]} & set(matches)) == 1
+
+
+def test_marked_duplicates_are_left_out_of_search(search, monkeypatch):
+    module, fakes = search
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    original, reshoot = reshoot_best_match(module, fakes)
+    top = original["image_key"]
+
+    assert mark_duplicates(EMBEDDINGS_TABLE) == (61, 1, 1)
+    assert table.items["reshoot"][DUPLICATE_ATTRIBUTE] == original["id"]
+    assert mark_duplicates(EMBEDDINGS_TABLE) == (61, 1, 0)
+
+    for quantizer in ("int8", "none"):
+        monkeypatch.setattr(module, "QUANTIZER", quantizer)
+        keys = result_keys(module)
+        assert top in keys and reshoot["image_key"] not in keys
+
+    # Blocks smaller than the catalog give the same marks
+    assert mark_duplicates(EMBEDDINGS_TABLE, block=8) == (61, 1, 0)
+
+    del table.items[original["id"]]
+    assert mark_duplicates(EMBEDDINGS_TABLE) == (60, 0, 1)
+    assert DUPLICATE_ATTRIBUTE not in table.items["reshoot"]
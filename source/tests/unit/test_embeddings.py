@@ -0,0 +1,56 @@
+import importlib
+import json
+from decimal import Decimal
+
+import numpy as np
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, deterministic_embedding, tiny_png
+from benchmarks.scenarios import COMMON_ENV, EMBEDDINGS_TABLE, IMAGE_BUCKET, SCENARIOS
+from stylist_common.embeddings import NO_PROJECTION, Projection, Space, item_space, request_body
+
+
+def test_projection_round_trip_preserves_neighbours():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 8)) @ rng.normal(size=(8, 64))
+    projection = Projection.loads(Projection.fit(vectors, 8, "pca8-v1").dumps())
+
+    assert projection.version == "pca8-v1"
+    assert (projection.input_dimension, projection.output_dimension) == (64, 8)
+    projected = np.asarray([projection.apply(v) for v in vectors])
+    assert np.allclose(np.linalg.norm(projected, axis=1), 1.0, atol=1e-5)
+    # The data is rank 8, so cosine neighbours survive the projection exactly
+    full = vectors - projection.mean
+    full /= np.linalg.norm(full, axis=1, keepdims=True)
+    assert (np.argsort(-(full @ full[0]))[:5] == np.argsort(-(projected @ projected[0]))[:5]).all()
+
+
+def test_spaces_and_requests():
+    assert item_space({"vector": [Decimal("0.1")] * 1024}) == Space(1024, NO_PROJECTION)
+    assert item_space({"vector": [0.1] * 64, "embedding_dim": Decimal(256), "projection": "pca64"}) == Space(256, "pca64")
+    assert "embeddingConfig" not in json.loads(request_body(1024, text="shirt"))
+    assert json.loads(request_body(256, image_base64="abc"))["embeddingConfig"] == {"outputEmbeddingLength": 256}
+
+
+def test_search_embeds_the_query_once_per_space_in_a_mixed_table(monkeypatch):
+    scenario = SCENARIOS["imagequery_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    query = "red evening dress"
+    for key, vector, extra in (
+            ("legacy-match.png", deterministic_embedding(query, 1024), {}),
+            ("legacy-other.png", deterministic_embedding("wool coat", 1024), {}),
+            ("small-match.png", deterministic_embedding(query, 256), {"embedding_dim": 256, "projection": NO_PROJECTION}),
+            ("small-other.png", deterministic_embedding("sandals", 256), {"embedding_dim": 256, "projection": NO_PROJECTION})):
+        table.items[key] = {"id": key, "image_key": key, "vector": [Decimal(str(x)) for x in vector], **extra}
+        fakes.s3.objects[(IMAGE_BUCKET, key)] = tiny_png()
+    handler = importlib.import_module("imagequery_function").handler
+
+    response = handler({"queryStringParameters": {"query": query}}, None)
+
+    results = json.loads(response["body"])
+    assert {r["image_key"] for r in results[:2]} == {"legacy-match.png", "small-match.png"}
+    assert len([call for call in fakes.bedrock_runtime.calls if call[0] == "InvokeModel"]) == 2
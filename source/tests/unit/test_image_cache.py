@@ -0,0 +1,97 @@
+import importlib
+import json
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, IMAGE_BUCKET, SCENARIOS, seed_catalog
+from stylist_common import tracing
+from stylist_common.image_cache import ImageCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def gets(fakes):
+    return sum(1 for operation, _ in fakes.s3.calls if operation == "GetObject")
+
+
+def test_memory_tier_is_bounded_by_bytes_and_evicts_least_recently_used():
+    fakes = FakeAws().install()
+    for name in "abc":
+        fakes.s3.objects[(IMAGE_BUCKET, name)] = name.encode() * 40
+    cache = ImageCache(memory_bytes=100)
+
+    assert cache.get(IMAGE_BUCKET, "a") == (b"a" * 40, "miss")
+    cache.get(IMAGE_BUCKET, "b")
+    assert cache.get(IMAGE_BUCKET, "a")[1] == "memory"
+    cache.get(IMAGE_BUCKET, "c")  # evicts b, the least recently used
+
+    assert cache.get(IMAGE_BUCKET, "a")[1] == "memory"
+    assert cache.get(IMAGE_BUCKET, "b")[1] == "miss"
+    assert cache._memory_size <= 100
+    assert cache.stats() == {"memory_hits": 2, "disk_hits": 0, "revalidated": 0, "misses": 4}
+
+
+def test_disk_tier_is_evicted_by_size(tmp_path):
+    fakes = FakeAws().install()
+    for name in "abc":
+        fakes.s3.objects[(IMAGE_BUCKET, name)] = name.encode() * 40
+    cache = ImageCache(memory_bytes=50, disk_dir=str(tmp_path), disk_bytes=100)
+
+    for name in "abc":
+        cache.get(IMAGE_BUCKET, name)
+
+    assert len(list(tmp_path.iterdir())) == 2
+    assert cache.get(IMAGE_BUCKET, "b") == (b"b" * 40, "disk")
+    assert cache.get(IMAGE_BUCKET, "b")[1] == "memory"
+    assert cache.get(IMAGE_BUCKET, "a")[1] == "miss"
+    assert gets(fakes) == 4
+
+
+def test_stale_entries_are_revalidated_and_changed_objects_refetched(tmp_path):
+    fakes = FakeAws().install()
+    fakes.s3.objects[(IMAGE_BUCKET, "a")] = b"old"
+    clock = Clock()
+    cache = ImageCache(disk_dir=str(tmp_path), ttl=60, clock=clock)
+    cache.get(IMAGE_BUCKET, "a")
+
+    clock.now = 61
+    assert cache.get(IMAGE_BUCKET, "a") == (b"old", "revalidated")
+    assert cache.get(IMAGE_BUCKET, "a") == (b"old", "memory")
+
+    fakes.s3.objects[(IMAGE_BUCKET, "a")] = b"new"
+    clock.now = 122
+    assert cache.get(IMAGE_BUCKET, "a") == (b"new", "miss")
+    assert [path.read_bytes() for path in tmp_path.iterdir()] == [b"new"]
+    assert [call[1].get("IfNoneMatch") is not None for call in fakes.s3.calls] == [False, True, True]
+
+
+def test_search_reuses_cached_images_and_reports_hits(monkeypatch, tmp_path):
+    scenario = SCENARIOS["imagequery_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"], "IMAGE_CACHE_DIR": str(tmp_path)}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=50)
+    module = importlib.import_module("imagequery_function")
+    records = []
+    tracing.set_sink(records.append)
+    try:
+        event = {"queryStringParameters": {"query": "linen shirt"}}
+        first = json.loads(module.handler(event, None)["body"])
+        second = json.loads(module.handler(event, None)["body"])
+    finally:
+        tracing.set_sink(print)
+
+    assert first == second and len(first) == 3
+    assert gets(fakes) == 3
+    counts = [json.loads(record) for record in records if "ImageCacheMisses" in record]
+    assert [(c["ImageCacheMisses"], c["ImageCacheMemoryHits"]) for c in counts] == [(3, 0), (0, 3)]
+    assert counts[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"][0]["Unit"] == "Count"
@@ -0,0 +1,100 @@
+import base64
+import importlib
+import io
+import json
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, FakeStreamingBody, tiny_png
+from benchmarks.scenarios import COMMON_ENV, EMBEDDINGS_TABLE, IMAGE_BUCKET, SCENARIOS, s3_event
+from stylist_common.images import InvalidImage, output_options, prepare_for_embedding, read_image_object, transcode
+
+
+def test_output_options_defaults_and_validation():
+    assert output_options({"query": "linen suit"}) == ("png", 80, None)
+    assert output_options({"format": "JPG", "quality": "60", "max_size": "512"}) == ("jpeg", 60, 512)
+    for params in ({"format": "gif"}, {"quality": "0"}, {"max_size": "4"}):
+        with pytest.raises(ValueError):
+            output_options(params)
+
+
+@pytest.mark.parametrize("fmt", ["webp", "jpeg", "png"])
+def test_transcode_encodes_once_within_max_size(fmt):
+    Image = pytest.importorskip("PIL.Image")
+    data = transcode(tiny_png(256, 128), fmt, quality=70, max_size=64)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.format == fmt.upper()
+        assert image.size == (64, 32)
+
+
+def test_png_artifact_is_passed_through_untouched(monkeypatch):
+    scenario = SCENARIOS["image_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    FakeAws().install()
+    handler = importlib.import_module("image_function").handler
+
+    response = handler({"queryStringParameters": {"query": "linen summer suit"}}, None)
+
+    assert response["headers"]["Content-Type"] == "image/png"
+    assert base64.b64decode(response["body"]) == tiny_png(64, 64)
+
+
+def studio_photo(Image, fmt="JPEG", size=(3000, 2000), mode="RGB", orientation=6):
+    image = Image.new(mode, size, (180, 40, 40, 0) if mode == "RGBA" else (180, 40, 40))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    out = io.BytesIO()
+    image.save(out, format=fmt, exif=exif, **({"quality": 95} if fmt == "JPEG" else {}))
+    return out.getvalue()
+
+
+def test_images_are_shrunk_upright_rgb_jpegs_without_metadata():
+    Image = pytest.importorskip("PIL.Image")
+    with Image.open(io.BytesIO(prepare_for_embedding(studio_photo(Image), max_size=512))) as image:
+        assert (image.format, image.mode, image.size) == ("JPEG", "RGB", (341, 512))
+        assert "exif" not in image.info
+    with Image.open(io.BytesIO(prepare_for_embedding(studio_photo(Image, "PNG", mode="RGBA", orientation=1)))) as image:
+        assert image.size == (512, 341) and image.getpixel((10, 10)) == pytest.approx((255, 255, 255), abs=2)
+    small = tiny_png(32, 32)
+    assert prepare_for_embedding(small) is small
+
+
+def test_objects_that_are_not_images_are_rejected_early():
+    pytest.importorskip("PIL.Image")
+    body = FakeStreamingBody(b"%PDF-1.7" + b"x" * 1000)
+    with pytest.raises(InvalidImage):
+        read_image_object({"Body": body, "ContentLength": 1008}, max_bytes=10_000)
+    assert body.closed and body.read() == b"x" * 1000
+    with pytest.raises(InvalidImage):
+        read_image_object({"Body": FakeStreamingBody(tiny_png()), "ContentLength": 60_000}, max_bytes=50_000)
+    with pytest.raises(InvalidImage):
+        prepare_for_embedding(tiny_png(600, 600)[:300])
+
+
+def test_embeddings_function_sends_the_prepared_image_and_skips_other_objects(monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    scenario = SCENARIOS["image_embeddings_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    photo = studio_photo(Image)
+    fakes.s3.objects[(IMAGE_BUCKET, "new/photo.jpg")] = photo
+    fakes.s3.objects[(IMAGE_BUCKET, "new/notes.txt")] = b"not an image"
+    sent = []
+    invoke_model = fakes.bedrock_runtime.invoke_model
+    monkeypatch.setattr(fakes.bedrock_runtime, "invoke_model",
+                        lambda body, **kwargs: sent.append(body) or invoke_model(body=body, **kwargs))
+    handler = importlib.import_module("image_embeddings_function").handler
+
+    handler({"Records": s3_event(IMAGE_BUCKET, "new/notes.txt")["Records"] + s3_event(IMAGE_BUCKET, "new/photo.jpg")["Records"]}, None)
+
+    (body,) = sent
+    image_data = base64.b64decode(json.loads(body)["inputImage"])
+    assert len(image_data) < len(photo) / 10
+    with Image.open(io.BytesIO(image_data)) as image:
+        assert max(image.size) == 512
+    assert [item["image_key"] for item in fakes.dynamodb.Table(EMBEDDINGS_TABLE).items.values()] == ["new/photo.jpg"]
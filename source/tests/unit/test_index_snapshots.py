@@ -0,0 +1,143 @@
+import importlib
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, deterministic_embedding
+from benchmarks.scenarios import ARTIFACT_BUCKET, COMMON_ENV, EMBEDDINGS_TABLE, seed_catalog
+from stylist_common.embeddings import Space
+from stylist_common.index_snapshots import DELTAS, IndexFollower, LocalStore, compact, table_prefix, write_delta
+from stylist_common.vector_index import apply_changes, build_indexes, dumps_indexes, loads_indexes
+
+
+def item(item_id, dimension=16, **extra):
+    return {"id": item_id, "image_key": f"{item_id}.png", "vector": deterministic_embedding(item_id, dimension), **extra}
+
+
+def keys(indexes):
+    return {space: sorted(index.image_keys) for space, index in indexes.items()}
+
+
+def test_changes_insert_replace_delete_and_move_between_spaces():
+    small, large = Space(16, "none"), Space(32, "none")
+    indexes = build_indexes([item("a"), item("b"), item("c", 32)])
+
+    updated = apply_changes(indexes, [
+        item("d"), {"id": "b", "deleted": True}, item("a", 32), {"id": "a", "deleted": True}, item("a", 32),
+    ])
+
+    assert keys(updated) == {small: ["d.png"], large: ["a.png", "c.png"]}
+    assert keys(indexes) == {small: ["a.png", "b.png"], large: ["c.png"]}
+    found = updated[large].search_many([deterministic_embedding("a", 32)], 1)[0]
+    assert found[0][0] == "a.png" and found[0][1] == pytest.approx(1.0)
+    assert apply_changes(updated, [item("e")])[large] is updated[large]
+    assert keys(loads_indexes(dumps_indexes(updated))) == keys(updated)
+
+
+def test_followers_hot_swap_to_compacted_snapshots(tmp_path):
+    table = FakeAws().install().dynamodb.Table(EMBEDDINGS_TABLE)
+    for i in range(5):
+        table.items[f"item-{i}"] = item(f"item-{i}", vector=[Decimal(str(x)) for x in deterministic_embedding(f"item-{i}", 16)])
+    store = LocalStore(str(tmp_path))
+    follower = IndexFollower(store)
+    assert not follower.refresh()
+
+    first = compact(store, table)
+    assert follower.refresh() and len(follower.indexes[Space(16, "none")]) == 5
+    assert compact(store, table) is None
+
+    write_delta(store, [item("new"), {"id": "item-0", "deleted": True}])
+    before = follower.indexes
+    assert follower.refresh() and not follower.refresh()
+    assert "new.png" in follower.indexes[Space(16, "none")].image_keys
+    assert "item-0.png" not in follower.indexes[Space(16, "none")].image_keys
+    assert "item-0.png" in before[Space(16, "none")].image_keys
+
+    second = compact(store, retain_seconds=0)
+    assert second != first and store.list("bases/") == [second] and store.list(DELTAS) == []
+    fresh = IndexFollower(store)
+    assert fresh.refresh() and keys(fresh.indexes) == keys(follower.indexes)
+    assert follower.refresh() and follower.base == second and keys(follower.indexes) == keys(fresh.indexes)
+
+
+def test_stream_records_become_deltas(monkeypatch, tmp_path):
+    from boto3.dynamodb.types import TypeSerializer
+    for name, value in COMMON_ENV.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code("IndexSnapshotFunction")
+    module = importlib.import_module("index_snapshot_function")
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=3, dimension=16)
+    monkeypatch.setattr(module, "TABLE_NAME", EMBEDDINGS_TABLE)
+    monkeypatch.setenv("dynamodb_table", EMBEDDINGS_TABLE)
+    store = LocalStore(str(tmp_path))
+    monkeypatch.setattr(module, "snapshot_store", lambda table_name: store)
+    module.handler({"source": "aws.events", "detail-type": "Scheduled Event"}, None)
+    serializer = TypeSerializer()
+    image = item("added", vector=[Decimal(str(x)) for x in deterministic_embedding("added", 16)], vector_int8=b"\x01")
+    removed = next(iter(fakes.dynamodb.Table(EMBEDDINGS_TABLE).items))
+    records = [
+        {"eventName": "INSERT", "dynamodb": {"Keys": {"id": {"S": "added"}},
+                                             "NewImage": {k: serializer.serialize(v) for k, v in image.items()}}},
+        {"eventName": "REMOVE", "dynamodb": {"Keys": {"id": {"S": removed}}}},
+    ]
+
+    assert module.handler({"Records": records}, None)["changes"] == 2
+
+    follower = IndexFollower(store)
+    follower.refresh()
+    index = follower.indexes[Space(16, "none")]
+    assert sorted(index.ids) == sorted(["added"] + [i for i in fakes.dynamodb.Table(EMBEDDINGS_TABLE).items if i != removed])
+    row = index.ids.index("added")
+    assert np.allclose(index.matrix[row], deterministic_embedding("added", 16), atol=1e-6)
+
+
+def test_each_generation_table_keeps_its_own_snapshots(monkeypatch, tmp_path):
+    from boto3.dynamodb.types import TypeSerializer
+    from stylist_common import migration
+    from stylist_common.migration import Deployment, Generation
+    for name, value in {**COMMON_ENV, "dynamodb_table": EMBEDDINGS_TABLE, "ARTIFACT_BUCKET": ARTIFACT_BUCKET,
+                        "EMBEDDINGS_DEPLOYMENT_KEY": migration.DEFAULT_KEY}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code("IndexSnapshotFunction")
+    module = importlib.import_module("index_snapshot_function")
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=3, dimension=16)
+    migration.reset()
+    live = Generation(EMBEDDINGS_TABLE, "amazon.titan-embed-image-v1", "1", 16, "none")
+    migration.write_deployment(ARTIFACT_BUCKET, Deployment(live).start(live._replace(table="embeddings-b", version="2"), 0.1))
+    stores = {}
+    monkeypatch.setattr(module, "snapshot_store",
+                        lambda table_name: stores.setdefault(table_name, LocalStore(str(tmp_path / table_name))))
+    serializer = TypeSerializer()
+
+    def record(table_name, item_id):
+        image = item(item_id, vector=[Decimal(str(x)) for x in deterministic_embedding(item_id, 16)])
+        return {"eventName": "INSERT", "eventSourceARN": f"arn:aws:dynamodb:us-east-1:123456789012:table/{table_name}"
+                                                         "/stream/2024-01-01T00:00:00.000",
+                "dynamodb": {"Keys": {"id": {"S": item_id}},
+                             "NewImage": {k: serializer.serialize(v) for k, v in image.items()}}}
+
+    # The shadow generation's table is compacted too, so its snapshot is ready when it is promoted
+    assert set(module.handler({"source": "aws.events"}, None)["bases"]) == {EMBEDDINGS_TABLE, "embeddings-b"}
+    written = module.handler({"Records": [record(EMBEDDINGS_TABLE, "live-new"), record("embeddings-b", "shadow-new")]},
+                             None)
+
+    assert written["changes"] == 2 and set(written["deltas"]) == {EMBEDDINGS_TABLE, "embeddings-b"}
+    followers = {name: IndexFollower(store) for name, store in stores.items()}
+    for follower in followers.values():
+        follower.refresh()
+    assert "shadow-new" in followers["embeddings-b"].indexes[Space(16, "none")].ids
+    assert "shadow-new" not in followers[EMBEDDINGS_TABLE].indexes[Space(16, "none")].ids
+    assert len(followers[EMBEDDINGS_TABLE].indexes[Space(16, "none")]) == 4
+    assert table_prefix("index/", "embeddings-b") == "index/embeddings-b/"
+
+
+def test_promotion_needs_a_stream_on_the_new_table():
+    from stylist_common import migration
+    fakes = FakeAws().install()
+    assert migration.has_stream("embeddings-b")
+    fakes.dynamodb.Table("embeddings-b").stream_specification = None
+    assert not migration.has_stream("embeddings-b")
@@ -0,0 +1,60 @@
+import base64
+import importlib
+import json
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, tiny_png
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS, prepare
+from stylist_common import log
+
+# Characters written to CloudWatch per request
+LOG_BUDGET = 2048
+TRACED_LOG_BUDGET = 8192
+
+
+def test_redact_replaces_binary_and_truncates_text():
+    image = base64.b64encode(tiny_png(64, 64)).decode("utf-8")
+    redacted = log.redact({
+        "artifacts": [{"base64": image}],
+        "raw": b"\x89PNG" * 100,
+        "text": "x " * 1000,
+        "inline": f"image_data: {image}",
+        "many": list(range(100)),
+    }, max_chars=100)
+
+    assert redacted["artifacts"] == [{"base64": f"<base64 {len(image)} chars>"}]
+    assert redacted["raw"] == "<400 bytes>"
+    assert redacted["text"].endswith("...<1900 more chars>")
+    assert redacted["inline"] == f"image_data: <base64 {len(image)} chars>"
+    assert len(redacted["many"]) == 21
+
+
+def test_level_and_sampling(capsys):
+    logger = log.get_logger("test")
+    logger.debug("hidden")
+    logger.info("payload", sampled=True, body="...")
+    logger.warning("shown", detail=1)
+    assert [json.loads(line)["message"] for line in capsys.readouterr().out.splitlines()] == ["shown"]
+
+
+@pytest.mark.parametrize("module", ["image_function", "text_function", "imagequery_function"])
+def test_log_volume_per_request_stays_under_budget(module, capsys, monkeypatch):
+    scenario = SCENARIOS[module]
+    for name, value in {**COMMON_ENV, **scenario["env"], "TRACE_SAMPLE_RATE": "0"}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws(table_keys=TABLE_KEYS).install()
+    event = prepare(module, fakes)
+    handler = importlib.import_module(module).handler
+
+    capsys.readouterr()
+
+    # Everything written to stdout counts, including stray prints and the latency metrics
+    response = handler(dict(event, headers={}), None)
+    assert response["statusCode"] == 200
+    assert len(capsys.readouterr().out) < LOG_BUDGET
+
+    handler(dict(event, headers={"X-Trace": "1"}), None)
+    assert len(capsys.readouterr().out) < TRACED_LOG_BUDGET
@@ -0,0 +1,208 @@
+import importlib
+import json
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, tiny_png
+from benchmarks.scenarios import ARTIFACT_BUCKET, COMMON_ENV, EMBEDDINGS_TABLE, IMAGE_BUCKET, SCENARIOS, s3_event, seed_catalog
+from stylist_common import migration, tracing
+from stylist_common.bedrock import BedrockUnavailable
+from stylist_common.duplicates import DUPLICATE_ATTRIBUTE
+from stylist_common.multivector import TEXT_PRODUCTS, TEXT_VECTORS, embed_catalog
+from stylist_common.migration import MODEL_ATTRIBUTE, VERSION_ATTRIBUTE, Deployment, Generation, Progress
+
+LIVE = Generation(EMBEDDINGS_TABLE, "amazon.titan-embed-image-v1", "1", 1024, "none")
+SHADOW = Generation("embeddings-b", "amazon.titan-embed-image-v2", "2", 1024, "none")
+
+
+def test_deployment_start_promote_and_rollback():
+    with pytest.raises(ValueError):
+        Deployment(LIVE).start(LIVE._replace(model_id="other"), 0.1)
+    started = Deployment(LIVE).start(SHADOW, 0.25)
+    assert started.generations() == [LIVE, SHADOW]
+
+    promoted = Deployment.loads(started.promote(rollback_seconds=3600, now=1000).dumps())
+    assert (promoted.live, promoted.shadow, promoted.previous) == (SHADOW, None, LIVE)
+    # New images keep reaching the previous generation while it can still be rolled back to
+    assert promoted.generations(now=2000) == [SHADOW, LIVE]
+    assert promoted.generations(now=5000) == [SHADOW]
+    with pytest.raises(ValueError):
+        promoted.rollback(now=5000)
+    rolled_back = promoted.rollback(now=2000)
+    assert (rolled_back.live, rolled_back.shadow, rolled_back.previous) == (LIVE, SHADOW, None)
+    with pytest.raises(ValueError):
+        rolled_back.rollback()
+
+
+def install(scenario, monkeypatch):
+    for name, value in {**COMMON_ENV, **scenario["env"], "EMBEDDINGS_DEPLOYMENT_KEY": migration.DEFAULT_KEY,
+                        "ARTIFACT_BUCKET": ARTIFACT_BUCKET}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    migration.reset()
+    return FakeAws().install()
+
+
+@pytest.fixture
+def search(monkeypatch):
+    fakes = install(SCENARIOS["imagequery_function"], monkeypatch)
+    seed_catalog(fakes, images=40)
+    return importlib.import_module("imagequery_function"), fakes
+
+
+def search_models(module, fakes):
+    fakes.bedrock_runtime.calls.clear()
+    results = json.loads(module.handler({"queryStringParameters": {"query": "linen shirt"}}, None)["body"])
+    return [r["image_key"] for r in results], {kwargs["modelId"] for _, kwargs in fakes.bedrock_runtime.calls}
+
+
+def test_reembedded_shadow_is_searched_after_promotion_and_rollback(search):
+    module, fakes = search
+    before, models = search_models(module, fakes)
+    assert models == {LIVE.model_id}
+
+    started = Deployment(LIVE).start(SHADOW, 0.0)
+    progress = migration.reembed(started, IMAGE_BUCKET, rate=1000, progress=Progress(40, every=0))
+    assert progress.summary()["done"] == 40 and progress.failed == 0
+    shadow_items = fakes.dynamodb.Table(SHADOW.table).items
+    assert {(item[MODEL_ATTRIBUTE], item[VERSION_ATTRIBUTE]) for item in shadow_items.values()} == {("amazon.titan-embed-image-v2", "2")}
+    assert set(shadow_items) == set(fakes.dynamodb.Table(EMBEDDINGS_TABLE).items)
+    # Re-running resumes: images already in the shadow generation are skipped
+    assert migration.reembed(started, IMAGE_BUCKET, rate=1000).total == 0
+    assert migration.coverage(started) == (40, 40)
+
+    migration.write_deployment(ARTIFACT_BUCKET, started.promote())
+    migration.reset()
+    after, models = search_models(module, fakes)
+    assert models == {SHADOW.model_id} and len(after) == 3
+
+    migration.write_deployment(ARTIFACT_BUCKET, started.promote().rollback())
+    migration.reset()
+    assert search_models(module, fakes) == (before, {LIVE.model_id})
+
+
+def test_sampled_searches_compare_the_shadow_without_changing_results(search):
+    module, fakes = search
+    started = Deployment(LIVE).start(SHADOW, 1.0)
+    migration.reembed(started, IMAGE_BUCKET, rate=1000, progress=Progress(40, every=0))
+    live, _ = search_models(module, fakes)
+    migration.write_deployment(ARTIFACT_BUCKET, started)
+    migration.reset()
+    records = []
+    tracing.set_sink(records.append)
+    try:
+        fakes.bedrock_runtime.calls.clear()
+        keys = [r["image_key"] for r in json.loads(module.handler({"queryStringParameters": {"query": "linen shirt"}},
+                                                                  None)["body"])]
+        # The comparison is reported once the shadow search finishes, after the response
+        module.shadow_executor().shutdown(wait=True)
+        models = {kwargs["modelId"] for _, kwargs in fakes.bedrock_runtime.calls}
+    finally:
+        tracing.set_sink(print)
+        module._shadow_executor = None
+
+    assert keys == live and models == {LIVE.model_id, SHADOW.model_id}
+    shadow_keys = {r["image_key"] for r in module.search_generation("linen shirt", SHADOW)[0]}
+    shadow = [json.loads(record) for record in records if "ShadowOverlap" in record]
+    assert len(shadow) == 1 and shadow[0]["ShadowLatency"] >= 0 and shadow[0]["request_id"] == "local"
+    assert shadow[0]["ShadowOverlap"] == round(len(shadow_keys & set(live)) / 3, 3)
+
+
+def test_new_images_are_written_to_every_generation(monkeypatch):
+    fakes = install(SCENARIOS["image_embeddings_function"], monkeypatch)
+    fakes.s3.objects[(IMAGE_BUCKET, "new/item.png")] = tiny_png(64, 64)
+    migration.write_deployment(ARTIFACT_BUCKET, Deployment(LIVE).start(SHADOW._replace(dimension=256), 0.1))
+    handler = importlib.import_module("image_embeddings_function").handler
+
+    handler(s3_event(IMAGE_BUCKET, "new/item.png"), None)
+
+    [(live_id, live)] = fakes.dynamodb.Table(LIVE.table).items.items()
+    [(shadow_id, shadow)] = fakes.dynamodb.Table(SHADOW.table).items.items()
+    assert live_id == shadow_id
+    assert (live[MODEL_ATTRIBUTE], live["embedding_dim"], len(live["vector"])) == (LIVE.model_id, 1024, 1024)
+    assert (shadow[MODEL_ATTRIBUTE], shadow["embedding_dim"], len(shadow["vector"])) == (SHADOW.model_id, 256, 256)
+
+
+def test_retried_images_keep_one_row_when_the_shadow_fails(monkeypatch):
+    fakes = install(SCENARIOS["image_embeddings_function"], monkeypatch)
+    fakes.s3.objects[(IMAGE_BUCKET, "new/item.png")] = tiny_png(64, 64)
+    migration.write_deployment(ARTIFACT_BUCKET, Deployment(LIVE).start(SHADOW, 0.1))
+    module = importlib.import_module("image_embeddings_function")
+    get_embedding = module.get_embedding
+
+    def shadow_unavailable(image_base64, dimension, model_id):
+        if model_id == SHADOW.model_id:
+            raise BedrockUnavailable(f"Circuit open for {model_id}")
+        return get_embedding(image_base64, dimension, model_id)
+
+    monkeypatch.setattr(module, "get_embedding", shadow_unavailable)
+    for _ in range(2):
+        assert module.handler(s3_event(IMAGE_BUCKET, "new/item.png"), None)["statusCode"] == 200
+
+    # The id comes from the object, so the retry rewrites the live row; reembed fills the shadow later
+    assert list(fakes.dynamodb.Table(LIVE.table).items) == [module.image_id(IMAGE_BUCKET, "new/item.png")]
+    assert not fakes.dynamodb.Table(SHADOW.table).items
+
+
+def test_reuploaded_images_keep_their_text_vectors_and_duplicate_mark(monkeypatch):
+    fakes = install(SCENARIOS["image_embeddings_function"], monkeypatch)
+    fakes.s3.objects[(IMAGE_BUCKET, "new/item.png")] = tiny_png(64, 64)
+    module = importlib.import_module("image_embeddings_function")
+    module.handler(s3_event(IMAGE_BUCKET, "new/item.png"), None)
+    embed_catalog(LIVE.table, [{"product_id": "item", "text": "linen shirt", "physical_ids": ["item"], "curated": ""}],
+                  LIVE.model_id)
+    [item] = fakes.dynamodb.Table(LIVE.table).items.values()
+    item[DUPLICATE_ATTRIBUTE] = "canonical"
+    text_vectors = item[TEXT_VECTORS]
+
+    fakes.s3.objects[(IMAGE_BUCKET, "new/item.png")] = tiny_png(64, 64, seed=1)
+    module.handler(s3_event(IMAGE_BUCKET, "new/item.png"), None)
+
+    [item] = fakes.dynamodb.Table(LIVE.table).items.values()
+    assert item[TEXT_VECTORS] == text_vectors and item[TEXT_PRODUCTS] == ["item"]
+    assert item[DUPLICATE_ATTRIBUTE] == "canonical" and item[MODEL_ATTRIBUTE] == LIVE.model_id
+
+
+def test_reembed_carries_duplicate_marks_and_text_vectors_into_the_shadow(search):
+    _, fakes = search
+    live_items = fakes.dynamodb.Table(EMBEDDINGS_TABLE).items
+    catalog = [{"product_id": f"look-{i}", "text": f"look {i}", "physical_ids": [f"item-{i:05d}"], "curated": ""}
+               for i in range(5)]
+    embed_catalog(EMBEDDINGS_TABLE, catalog, LIVE.model_id)
+    duplicate = sorted(live_items)[1]
+    live_items[duplicate][DUPLICATE_ATTRIBUTE] = sorted(live_items)[0]
+    started = Deployment(LIVE).start(SHADOW, 0.0)
+
+    migration.reembed(started, IMAGE_BUCKET, rate=1000, progress=Progress(40, every=0))
+    assert migration.missing_attributes(started) == {TEXT_PRODUCTS: 5, DUPLICATE_ATTRIBUTE: 0}
+    # Marks added after an image was re-embedded are copied when reembed runs again
+    later = sorted(live_items)[3]
+    live_items[later][DUPLICATE_ATTRIBUTE] = sorted(live_items)[2]
+    fakes.bedrock_runtime.calls.clear()
+    migration.reembed(started, IMAGE_BUCKET, rate=1000, progress=Progress(0, every=0), catalog=catalog)
+
+    assert migration.missing_attributes(started) == {TEXT_PRODUCTS: 0, DUPLICATE_ATTRIBUTE: 0}
+    shadow_items = fakes.dynamodb.Table(SHADOW.table).items
+    assert {item_id for item_id, item in shadow_items.items() if DUPLICATE_ATTRIBUTE in item} == {duplicate, later}
+    # The text is embedded again in the shadow model's space, not copied from the live one
+    assert {kwargs["modelId"] for _, kwargs in fakes.bedrock_runtime.calls} == {SHADOW.model_id}
+    assert all(shadow_items[item_id][TEXT_PRODUCTS] == live_items[item_id][TEXT_PRODUCTS]
+               for item_id in live_items if TEXT_PRODUCTS in live_items[item_id])
+
+
+def test_sharded_search_follows_the_promoted_generation(search, monkeypatch):
+    module, fakes = search
+    started = Deployment(LIVE).start(SHADOW, 0.0)
+    migration.reembed(started, IMAGE_BUCKET, rate=1000, progress=Progress(40, every=0))
+    migration.write_deployment(ARTIFACT_BUCKET, started.promote())
+    migration.reset()
+    monkeypatch.setattr(module, "SEARCH_SHARDS", 4)
+    monkeypatch.setattr(module, "_shard_executor", None)
+    fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls.clear()
+
+    keys, models = search_models(module, fakes)
+
+    assert models == {SHADOW.model_id} and len(keys) == 3
+    assert not fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls
+    assert any(operation == "Query" for operation, _ in fakes.dynamodb.Table(SHADOW.table).calls)
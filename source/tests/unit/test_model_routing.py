@@ -0,0 +1,90 @@
+import importlib
+import json
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS
+from stylist_common import tracing
+from stylist_common.bedrock import BedrockUnavailable
+from stylist_common.routing import FAST, STRONG, Completion, ModelRouter, complexity
+
+SIMPLE = "What color goes with navy?"
+COMPLEX = "Plan a capsule wardrobe for a 10 day trip to Italy with two dinners and a hike"
+ANSWER = "Try camel, grey or white; all of them sit well next to navy."
+
+
+@pytest.fixture
+def metrics():
+    records = []
+    tracing.set_sink(lambda line: records.append(json.loads(line)))
+    yield records
+    tracing.set_sink(print)
+
+
+def test_complexity_separates_quick_questions_from_plans():
+    assert complexity(SIMPLE) < 0.25 < complexity(COMPLEX)
+    assert ModelRouter("sonnet").route(SIMPLE).tier == STRONG
+    assert ModelRouter("sonnet", "haiku").route(SIMPLE) == (FAST, "haiku", complexity(SIMPLE))
+    assert ModelRouter("sonnet", "haiku").route(COMPLEX).tier == STRONG
+
+
+@pytest.mark.parametrize("fast_answer, escalated", [
+    (Completion(ANSWER, 20, 15, "end_turn"), False),
+    (Completion(ANSWER, 20, 1024, "max_tokens"), True),
+    (Completion("Navy."), True),
+    (Completion("I'm not sure, it depends on the shade of navy you mean."), True),
+    (BedrockUnavailable("throttled"), True),
+])
+def test_unreliable_fast_answers_escalate(fast_answer, escalated, metrics):
+    calls = []
+
+    def call(target):
+        calls.append(target)
+        answer = fast_answer if target == "haiku" else Completion(ANSWER, 30, 40, "end_turn")
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    completion, route = ModelRouter("sonnet", "haiku").run(SIMPLE, call)
+
+    assert calls == (["haiku", "sonnet"] if escalated else ["haiku"])
+    assert route.tier == (STRONG if escalated else FAST) and completion.text == ANSWER
+    assert [(m["Tier"], m["Escalated"]) for m in metrics] == [(FAST, False)] * (not isinstance(fast_answer, Exception)) + \
+        [(STRONG, True)] * escalated
+    units = {m["Name"]: m["Unit"] for m in metrics[-1]["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+    assert units == {"ModelLatency": "Milliseconds", "InputTokens": "Count", "OutputTokens": "Count"}
+
+
+def load(monkeypatch, module, **env):
+    scenario = SCENARIOS[module]
+    for name, value in {**COMMON_ENV, **scenario["env"], **env}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws(table_keys=TABLE_KEYS).install()
+    return fakes, importlib.reload(importlib.import_module(module))
+
+
+def test_image_function_refines_simple_styles_with_the_fast_model(monkeypatch, metrics):
+    fakes, module = load(monkeypatch, "image_function")
+    haiku, sonnet = module.os.environ["FAST_TEXT_MODEL_ID"], module.os.environ["TEXT_MODEL_ID"]
+
+    assert module.text_model("linen summer suit") == "Try a navy blazer with light chinos and white sneakers."
+    fakes.bedrock_runtime.texts[haiku] = ("A suit.", "end_turn")
+    module.text_model("linen summer suit")
+    module.text_model(COMPLEX)
+
+    assert [kwargs["modelId"] for _, kwargs in fakes.bedrock_runtime.calls] == [haiku, haiku, sonnet, sonnet]
+
+
+def test_text_function_escalates_to_the_default_agent_alias(monkeypatch, metrics):
+    fakes, module = load(monkeypatch, "text_function", FAST_AGENT_ALIAS_ID="FAST1")
+
+    assert module.handler({"queryStringParameters": {"query": SIMPLE}}, None)["statusCode"] == 200
+    fakes.agent_runtime.chunks = ("Hmm.",)
+    module.handler({"queryStringParameters": {"query": SIMPLE}}, None)
+
+    aliases = [(kwargs["agentAliasId"], kwargs["sessionId"]) for _, kwargs in fakes.agent_runtime.calls]
+    assert [alias for alias, _ in aliases] == ["FAST1", "FAST1", "ALIAS1"]
+    assert len({session for _, session in aliases}) == 3
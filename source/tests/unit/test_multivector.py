@@ -0,0 +1,80 @@
+import csv
+import importlib
+import json
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws
+from benchmarks.scenarios import COMMON_ENV, EMBEDDINGS_TABLE, SCENARIOS, seed_catalog
+from stylist_common.embeddings import Space
+from stylist_common.multivector import TEXT_VECTORS, MultiVectorIndex, catalog_products, embed_catalog
+
+CATALOG = os.path.join(os.path.dirname(__file__), "..", "..", "csv_files", "products_catalog.csv")
+
+
+def test_catalog_rows_become_looks_with_their_images():
+    with open(CATALOG, newline="", encoding="utf-8") as f:
+        products = catalog_products(csv.DictReader(f))
+
+    first = products[0]
+    assert first["physical_ids"] == ["41BBrjBcKeL", "31bRXfwSsuL", "31+mIlka-eL", "41hrvpJBGWL", "41XuFcnIZQL"]
+    assert first["text"].startswith("This activewear set for men")
+    assert "Mens fall activewear" in first["text"] and "Track & Active Jackets" in first["text"]
+    assert all(product["physical_ids"] and product["text"] for product in products)
+
+
+def test_each_image_owns_consecutive_rows_and_scores_fuse():
+    items = [
+        {"image_key": "a.png", "vector": [1, 0, 0], TEXT_VECTORS: [[0, 1, 0], [0, 0, 1]]},
+        {"image_key": "b.png", "vector": [0.8, 0.6, 0]},
+        {"image_key": "c.png", "vector": [0, 0, 1], TEXT_VECTORS: [[1, 0, 0]]},
+    ]
+    index = MultiVectorIndex.build(Space(3, "none"), items)
+    assert index.offsets.tolist() == [0, 3, 4, 6]
+    image, text = index.scores([1, 0, 0])
+    assert image.tolist() == pytest.approx([1, 0.8, 0])
+    assert text[[0, 2]].tolist() == pytest.approx([0, 1]) and text[1] == -np.inf
+
+    assert [key for key, _ in index.search([1, 0, 0], 3, "none")] == ["a.png", "b.png", "c.png"]
+    weighted = index.search([1, 0, 0], 3, "weighted", text_weight=0.5)
+    assert weighted == [("b.png", pytest.approx(0.8)), ("a.png", 0.5), ("c.png", 0.5)]
+    rrf = dict(index.search([1, 0, 0], 3, "rrf", rrf_k=0))
+    assert rrf == {"a.png": pytest.approx(1 + 1 / 2), "b.png": pytest.approx(1 / 2), "c.png": pytest.approx(1 / 3 + 1)}
+
+
+@pytest.fixture
+def search(monkeypatch):
+    scenario = SCENARIOS["imagequery_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=80)
+    return importlib.import_module("imagequery_function"), fakes
+
+
+@pytest.mark.parametrize("fusion", ["weighted", "rrf"])
+def test_catalog_text_lifts_the_described_images(search, monkeypatch, fusion):
+    module, fakes = search
+    rows = [{"data/department": "Womens", "data/occasion/0": "beach", "data/categories/0": "Swim",
+             "data/description": "Breezy linen cover-ups and sandals for the beach.",
+             "data/physical IDs/0": "item-00011", "data/physical IDs/1": "item-00042"}]
+    products = catalog_products(rows)
+    assert embed_catalog(EMBEDDINGS_TABLE, products, "amazon.titan-embed-image-v1") == (1, 2)
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    assert len(table.items["00000000-0000-0000-0000-00000000000b"][TEXT_VECTORS]) == 1
+
+    event = {"queryStringParameters": {"query": products[0]["text"]}}
+    keys = lambda: [r["image_key"] for r in json.loads(module.handler(event, None)["body"])]
+    assert not {"catalog/item-00011.png", "catalog/item-00042.png"} & set(keys()[:2])
+
+    monkeypatch.setattr(module, "FUSION", fusion)
+    for quantizer in ("int8", "none"):
+        monkeypatch.setattr(module, "QUANTIZER", quantizer)
+        assert set(keys()[:2]) == {"catalog/item-00011.png", "catalog/item-00042.png"}
+    response = module.handler({"httpMethod": "POST", "body": json.dumps({"queries": [products[0]["text"]]})}, None)
+    matches = json.loads(response["body"])["results"][0]["matches"]
+    assert {m["image_key"] for m in matches[:2]} == {"catalog/item-00011.png", "catalog/item-00042.png"}
@@ -0,0 +1,61 @@
+import importlib
+import json
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, deterministic_embedding
+from benchmarks.scenarios import COMMON_ENV, EMBEDDINGS_TABLE, SCENARIOS, seed_catalog
+from stylist_common.quantize import ATTRIBUTES, backfill, code_matrix, encode, prefilter_scores, top_indices
+
+
+@pytest.mark.parametrize("quantizer", ["int8", "binary"])
+def test_prefilter_keeps_the_exact_neighbours(quantizer):
+    rng = np.random.default_rng(0)
+    catalog = rng.normal(size=(500, 128)).astype(np.float32)
+    catalog /= np.linalg.norm(catalog, axis=1, keepdims=True)
+    query = catalog[7] + rng.normal(size=128).astype(np.float32) * 0.02
+
+    codes = code_matrix(quantizer, [encode(v)[ATTRIBUTES[quantizer]] for v in catalog])
+    candidates = top_indices(prefilter_scores(quantizer, query, codes), 50)
+
+    assert codes.shape == ((500, 128) if quantizer == "int8" else (500, 16))
+    assert set(top_indices(catalog @ query, 5)) <= set(candidates)
+    assert candidates[0] == 7
+
+
+def test_search_reranks_only_the_prefiltered_candidates(monkeypatch):
+    scenario = SCENARIOS["imagequery_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=120)
+    module = importlib.import_module("imagequery_function")
+    monkeypatch.setattr(module, "QUANTIZER", "binary")
+    monkeypatch.setattr(module, "RERANK_DEPTH", 20)
+    # Make one catalog image an exact match for the query
+    target = next(iter(fakes.dynamodb.Table(EMBEDDINGS_TABLE).items.values()))
+    vector = deterministic_embedding("red evening dress")
+    target.update(vector=[Decimal(str(x)) for x in vector], **encode(vector))
+
+    response = module.handler({"queryStringParameters": {"query": "red evening dress"}}, None)
+
+    assert json.loads(response["body"])[0]["image_key"] == target["image_key"]
+    table_calls = fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls
+    assert [operation for operation, _ in table_calls] == ["Scan", "BatchGetItem"]
+
+
+def test_backfill_adds_codes_from_the_stored_vector():
+    fakes = FakeAws().install()
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    vector = deterministic_embedding("linen shirt", 64)
+    table.items["a"] = {"id": "a", "image_key": "a.png", "vector": [Decimal(str(x)) for x in vector]}
+
+    assert backfill(EMBEDDINGS_TABLE) == 1
+    assert backfill(EMBEDDINGS_TABLE) == 0
+    item = table.items["a"]
+    assert item["vector_int8"] == encode(vector)["vector_int8"]
+    assert (item["embedding_dim"], item["projection"]) == (64, "none")
@@ -0,0 +1,98 @@
+import importlib
+import json
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, deterministic_embedding
+from benchmarks.scenarios import ARTIFACT_BUCKET, COMMON_ENV, DATA_BUCKET, SCENARIOS, eventbridge_event, read_csv
+from stylist_common import bedrock
+from stylist_common.reviews import ReviewDigests, central_sentences, parse_reviews, sentiment, split_sentences
+
+REVIEWS = parse_reviews(read_csv("customer_reviews.csv").decode("utf-8"))
+
+
+def test_reviews_are_parsed_split_and_scored():
+    assert len(REVIEWS) == 92 and REVIEWS[0][0] == "Hats & Caps"
+    assert split_sentences("Love it! The linen is soft and breathable. Great.") == ["The linen is soft and breathable."]
+    assert sentiment("I love the fabric and the fit is perfect.") == "positive"
+    assert sentiment("The seams ripped and the color faded after one wash.") == "negative"
+    assert sentiment("It is not comfortable and not great either.") == "negative"
+    assert sentiment("It arrived on Tuesday.") == "neutral"
+
+
+def test_central_sentences_skip_near_repeats():
+    sentences = ["a", "a again", "b", "outlier"]
+    vectors = [[1, 0.3, 0], [1, 0.28, 0], [0.6, 0.8, 0], [0, 0, 1]]
+    assert central_sentences(sentences, vectors, 2) == ["a", "b"]
+
+
+def count_embeddings(calls):
+    def embed(sentences):
+        calls.append(len(sentences))
+        return [deterministic_embedding(sentence, 16) for sentence in sentences]
+    return embed
+
+
+def test_digests_group_categories_and_update_incrementally():
+    calls = []
+    digests = ReviewDigests(sentences=2)
+    changed = digests.add_reviews(REVIEWS, embed=count_embeddings(calls))
+    assert "dresses" in changed and len(digests.categories) == len(changed) == 51
+    dresses = digests.digest("dresses")
+    assert dresses["reviews"] == 2 and sum(dresses["sentiment"].values()) == 2
+    assert len(dresses["sentences"]) == 2
+    assert sum(digests.digest(key)["reviews"] for key in digests.categories) == 92
+
+    # Reviews already seen change nothing and embed nothing
+    assert digests.add_reviews(REVIEWS, embed=count_embeddings(calls)) == set() and len(calls) == 1
+    review = "These dresses shrank after one wash and the zipper broke within a week of wearing them."
+    assert digests.add_reviews([("Dresses", review)], embed=count_embeddings(calls)) == {"dresses"}
+    assert calls[-1] == 1 and digests.digest("dresses")["sentiment"]["negative"] == 1
+
+    restored = ReviewDigests.loads(digests.dumps())
+    assert restored.document("dresses") == digests.document("dresses")
+    document = digests.document("dresses")
+    assert document.startswith("Customer reviews of dresses: 3 reviews (2 positive, 1 negative).")
+    raw = sum(len(text) for category, text in REVIEWS if category.lower() == "dresses") + len(review)
+    assert len(document) < raw / 2
+
+
+@pytest.fixture
+def digest_function(monkeypatch):
+    scenario = SCENARIOS["review_digest_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"], "BEDROCK_RATE_LIMIT": "10000", "BEDROCK_BURST": "10000"}.items():
+        monkeypatch.setenv(name, value)
+    # A fresh invoker reads the rate limit above, so embedding the catalog's sentences is not throttled
+    monkeypatch.setattr(bedrock, "_default", None)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    for seed in scenario["seed"]:
+        seed(fakes)
+    return importlib.import_module("review_digest_function").handler, fakes
+
+
+def test_handler_publishes_only_changed_digests(digest_function):
+    handler, fakes = digest_function
+    event = eventbridge_event(DATA_BUCKET, "customer_reviews.csv")
+
+    assert json.loads(handler(event, None)["body"]) == {"reviews": 92, "updated": 51}
+    documents = {key for bucket, key in fakes.s3.objects if bucket == DATA_BUCKET and key.startswith("review-digests/")}
+    assert len(documents) == 51 and "review-digests/hats-caps.txt" in documents
+    assert (ARTIFACT_BUCKET, "reviews/digests.json") in fakes.s3.objects
+    # The export is moved out of the data bucket, so the knowledge base indexes only the digests
+    assert (DATA_BUCKET, "customer_reviews.csv") not in fakes.s3.objects
+    assert (ARTIFACT_BUCKET, "reviews/raw/customer_reviews.csv") in fakes.s3.objects
+
+    # A retried event reads the archived export
+    embedded = len(fakes.bedrock_runtime.calls)
+    assert json.loads(handler(event, None)["body"]) == {"reviews": 92, "updated": 0}
+    assert len(fakes.bedrock_runtime.calls) == embedded
+
+    fakes.s3.objects[(DATA_BUCKET, "customer_reviews-new.csv")] = (
+        b'customer reviews/category/product name,customer reviews/customer review\n'
+        b'Belts,"The buckle is sturdy and the leather looks great with jeans."\n')
+    assert json.loads(handler(eventbridge_event(DATA_BUCKET, "customer_reviews-new.csv"), None)["body"]) == {
+        "reviews": 1, "updated": 1}
+    assert "3 reviews" in fakes.s3.objects[(DATA_BUCKET, "review-digests/belts.txt")].decode("utf-8")
+    assert not [key for bucket, key in fakes.s3.objects if bucket == DATA_BUCKET and key.endswith(".csv")]
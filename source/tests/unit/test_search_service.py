@@ -0,0 +1,147 @@
+import asyncio
+import importlib
+import json
+from decimal import Decimal
+
+import pytest
+
+from benchmarks import use_lambda_code, use_search_service
+from benchmarks.fakes import FakeAws, deterministic_embedding
+from benchmarks.scenarios import ARTIFACT_BUCKET, COMMON_ENV, EMBEDDINGS_TABLE, IMAGE_BUCKET, SCENARIOS, seed_catalog
+
+pytest.importorskip("aiohttp")
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for name, value in {**COMMON_ENV, **SCENARIOS["imagequery_function"]["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_search_service()
+    return importlib.import_module("server")
+
+
+def test_micro_batcher_groups_concurrent_submissions(server):
+    batches = []
+
+    async def process(items):
+        batches.append(items)
+        return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+    async def main():
+        batcher = server.MicroBatcher(process, max_batch=4, max_wait=0.05)
+        results = await asyncio.gather(*(batcher.submit(i) for i in (1, 2, 3, 4, 5, -1)), return_exceptions=True)
+        return batcher, results
+
+    batcher, results = asyncio.run(main())
+
+    assert results[:5] == [2, 4, 6, 8, 10] and isinstance(results[5], ValueError)
+    assert batches == [[1, 2, 3, 4], [5, -1]]
+    assert batcher.mean_batch == 3
+
+
+def test_concurrent_searches_share_one_scoring_pass(server):
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=50)
+    target = next(iter(fakes.dynamodb.Table(EMBEDDINGS_TABLE).items.values()))
+    target["vector"] = [Decimal(str(x)) for x in deterministic_embedding("red evening dress")]
+    service = server.SearchService(EMBEDDINGS_TABLE, max_wait=0.05)
+
+    async def main():
+        await service.refresh()
+        return await asyncio.gather(*(service.search(q) for q in ("red evening dress", "red evening dress", "wool coat")))
+
+    results = asyncio.run(main())
+
+    assert [len(r) for r in results] == [3, 3, 3]
+    assert results[0][0]["image_key"] == target["image_key"] and results[0][0]["score"] == pytest.approx(1.0)
+    assert set(results[0][0]) == {"image_key", "score", "image_base64"}
+    assert service.scorer.batches == 1
+    # The repeated query is embedded once
+    assert service.embedding_calls == 2
+    assert [operation for operation, _ in fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls] == ["Scan"]
+
+
+def test_search_endpoint_matches_the_search_function(server):
+    from aiohttp.test_utils import TestClient, TestServer
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=20)
+    use_lambda_code(SCENARIOS["imagequery_function"]["function_dir"])
+    expected = json.loads(importlib.import_module("imagequery_function").handler(
+        {"queryStringParameters": {"query": "linen shirt"}}, None)["body"])
+
+    async def main():
+        async with TestClient(TestServer(server.create_app(server.SearchService(EMBEDDINGS_TABLE)))) as client:
+            found = await client.get("/search", params={"query": "linen shirt"})
+            missing = await client.get("/search")
+            return await found.json(), missing.status
+
+    found, missing_status = asyncio.run(main())
+
+    assert [r["image_key"] for r in found] == [r["image_key"] for r in expected]
+    assert [r["score"] for r in found] == pytest.approx([r["score"] for r in expected], abs=1e-5)
+    assert missing_status == 400
+
+
+def test_service_follows_index_snapshots_without_rescanning(server, tmp_path):
+    from stylist_common.index_snapshots import IndexFollower, LocalStore, compact, write_delta
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=10)
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    store = LocalStore(str(tmp_path))
+    compact(store, table)
+    table.calls.clear()
+    service = server.SearchService(EMBEDDINGS_TABLE, snapshots=lambda table_name: store)
+    vector = deterministic_embedding("red evening dress")
+    fakes.s3.objects[(SCENARIOS["imagequery_function"]["env"]["bucket"], "new.png")] = b"png"
+
+    async def main():
+        await service.refresh()
+        write_delta(store, [{"id": "new", "image_key": "new.png", "vector": vector}])
+        await service.refresh()
+        return await service.search("red evening dress")
+
+    results = asyncio.run(main())
+
+    assert results[0]["image_key"] == "new.png"
+    assert service.health()["items"] == 11
+    assert table.calls == []
+
+
+def test_service_follows_the_promoted_generation(server, monkeypatch):
+    from stylist_common import migration
+    from stylist_common.migration import Deployment, Generation, Progress
+    monkeypatch.setenv("EMBEDDINGS_DEPLOYMENT_KEY", migration.DEFAULT_KEY)
+    monkeypatch.setenv("ARTIFACT_BUCKET", ARTIFACT_BUCKET)
+    migration.reset()
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=20)
+    live = Generation(EMBEDDINGS_TABLE, "amazon.titan-embed-image-v1", "1", 1024, "none")
+    started = Deployment(live).start(Generation("embeddings-b", "amazon.titan-embed-image-v2", "2", 1024, "none"), 0.0)
+    migration.reembed(started, IMAGE_BUCKET, rate=1000, progress=Progress(20, every=0))
+    service = server.SearchService()
+
+    async def search(query):
+        fakes.bedrock_runtime.calls.clear()
+        results = await service.search(query)
+        return len(results), {kwargs["modelId"] for _, kwargs in fakes.bedrock_runtime.calls}
+
+    async def follow(deployment, query):
+        migration.write_deployment(ARTIFACT_BUCKET, deployment)
+        migration.reset()
+        table_b = fakes.dynamodb.Table("embeddings-b")
+        table_b.calls.clear()
+        await service.follow_deployment()
+        return service.health()["table"], await search(query), len(table_b.calls)
+
+    async def main():
+        await service.refresh()
+        return [(EMBEDDINGS_TABLE, await search("linen shirt"), 0), await follow(started.promote(), "wool coat"),
+                await follow(started.promote(), "silk scarf"),
+                await follow(started.promote().rollback(), "denim jacket")]
+
+    before, promoted, unchanged, rolled_back = asyncio.run(main())
+
+    assert before == rolled_back == (EMBEDDINGS_TABLE, (3, {live.model_id}), 0)
+    assert promoted == ("embeddings-b", (3, {"amazon.titan-embed-image-v2"}), 1)
+    # An unchanged deployment keeps the index in memory
+    assert unchanged == ("embeddings-b", (3, {"amazon.titan-embed-image-v2"}), 0)
@@ -0,0 +1,180 @@
+import importlib
+import json
+import time
+from decimal import Decimal
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, deterministic_embedding
+from benchmarks.scenarios import ARTIFACT_BUCKET, COMMON_ENV, EMBEDDINGS_TABLE, IMAGE_BUCKET, SCENARIOS, seed_catalog
+from stylist_common import shards
+from stylist_common.multivector import catalog_products, embed_catalog
+from stylist_common.shards import SLOTS, ShardMap, merge_top_k, slot_of
+
+
+@pytest.fixture
+def search(monkeypatch):
+    scenario = SCENARIOS["imagequery_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws().install()
+    seed_catalog(fakes, images=150)
+    module = importlib.import_module("imagequery_function")
+    monkeypatch.setattr(module, "_shard_executor", None)
+    return module, fakes
+
+
+def get(module, query="red evening dress"):
+    response = module.handler({"queryStringParameters": {"query": query}}, None)
+    return response, json.loads(response["body"])
+
+
+def test_maps_assign_every_slot_once():
+    assert slot_of("catalog/item-00001.png") == slot_of("catalog/item-00001.png") < SLOTS
+    even = ShardMap.even(3)
+    assert [len(shard) for shard in even.shards] == [85, 85, 86]
+    counts = {slot: (1000 if slot < 4 else 1) for slot in range(SLOTS)}
+    balanced = ShardMap.balanced(counts, 4, spaces=[(1024, "none")])
+    assert [sum(counts[slot] for slot in shard) for shard in balanced.shards] == [1063, 1063, 1063, 1063]
+    assert ShardMap.loads(balanced.dumps()).shards == balanced.shards
+    with pytest.raises(ValueError):
+        ShardMap([[0, 1], [1]])
+
+
+def test_warm_containers_follow_a_rebalanced_map(monkeypatch):
+    fakes = FakeAws().install()
+    monkeypatch.setattr(shards, "_maps", {})
+    now = [0.0]
+    monkeypatch.setattr(shards.time, "monotonic", lambda: now[0])
+    assert shards.load_shard_map(ARTIFACT_BUCKET, "search/map.json", 4, ttl=60).shards == ShardMap.even(4).shards
+
+    balanced = ShardMap.balanced({slot: (1000 if slot < 4 else 1) for slot in range(SLOTS)}, 4)
+    fakes.s3.objects[(ARTIFACT_BUCKET, "search/map.json")] = balanced.dumps().encode("utf-8")
+    now[0] = 30
+    assert shards.load_shard_map(ARTIFACT_BUCKET, "search/map.json", 4, ttl=60).shards == ShardMap.even(4).shards
+    now[0] = 61
+    assert shards.load_shard_map(ARTIFACT_BUCKET, "search/map.json", 4, ttl=60).shards == balanced.shards
+
+    # A later rebalance is picked up once the TTL has passed, and an unchanged map is not read again
+    rebalanced = ShardMap.balanced({slot: (1000 if slot >= 250 else 1) for slot in range(SLOTS)}, 4)
+    fakes.s3.objects[(ARTIFACT_BUCKET, "search/map.json")] = rebalanced.dumps().encode("utf-8")
+    now[0] = 122
+    assert shards.load_shard_map(ARTIFACT_BUCKET, "search/map.json", 4, ttl=60).shards == rebalanced.shards
+    now[0] = 183
+    assert shards.load_shard_map(ARTIFACT_BUCKET, "search/map.json", 4, ttl=60).shards == rebalanced.shards
+    assert shards._maps[(ARTIFACT_BUCKET, "search/map.json")]["object"].loads == 2
+
+
+def test_merge_keeps_the_best_of_every_shard():
+    assert merge_top_k([[("a", 0.9), ("b", 0.1)], [], [("c", 0.5)]], 2) == [("a", 0.9), ("c", 0.5)]
+
+
+@pytest.mark.parametrize("quantizer", ["int8", "none"])
+def test_sharded_search_matches_a_single_scan(search, monkeypatch, quantizer):
+    module, fakes = search
+    monkeypatch.setattr(module, "QUANTIZER", quantizer)
+    _, single = get(module)
+
+    monkeypatch.setattr(module, "SEARCH_SHARDS", 4)
+    fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls.clear()
+    response, sharded = get(module)
+
+    assert response["statusCode"] == 200 and response["headers"]["X-Search-Shards"] == "4/4"
+    assert [r["image_key"] for r in sharded] == [r["image_key"] for r in single]
+    assert [r["score"] for r in sharded] == pytest.approx([r["score"] for r in single], abs=1e-5)
+    assert all(r["image_base64"] for r in sharded)
+    queries = [kwargs for operation, kwargs in fakes.dynamodb.Table(EMBEDDINGS_TABLE).calls if operation == "Query"]
+    assert len(queries) == SLOTS and {kwargs["IndexName"] for kwargs in queries} == {"shard-index"}
+
+
+@pytest.mark.parametrize("quantizer", ["int8", "none"])
+@pytest.mark.parametrize("setting, value", [("FUSION", "weighted"), ("FUSION", "rrf"), ("MMR_LAMBDA", 0.5)])
+def test_sharded_search_applies_fusion_and_diversity_like_a_single_scan(search, monkeypatch, quantizer, setting,
+                                                                        value):
+    module, fakes = search
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    # Catalog text for two images, and another shot of the best match, near-identical to it
+    rows = [{"data/department": "Womens", "data/description": "Breezy linen cover-ups and sandals for the beach.",
+             "data/physical IDs/0": "item-00011", "data/physical IDs/1": "item-00042"}]
+    embed_catalog(EMBEDDINGS_TABLE, catalog_products(rows), "amazon.titan-embed-image-v1")
+    top = get(module)[1][0]["image_key"]
+    original = next(item for item in table.items.values() if item["image_key"] == top)
+    reshoot_key = top.replace(".png", "_2.png")
+    table.items["reshoot"] = {**original, "id": "reshoot", "image_key": reshoot_key,
+                              shards.SLOT_ATTRIBUTE: slot_of(reshoot_key),
+                              "vector": [x + Decimal("0.0001") for x in original["vector"]]}
+    fakes.s3.objects[(IMAGE_BUCKET, reshoot_key)] = b"png"
+    monkeypatch.setattr(module, "QUANTIZER", quantizer)
+    monkeypatch.setattr(module, setting, value)
+    _, single = get(module)
+
+    monkeypatch.setattr(module, "SEARCH_SHARDS", 4)
+    _, sharded = get(module)
+
+    assert [r["image_key"] for r in sharded] == [r["image_key"] for r in single]
+    # Reciprocal ranks depend on the candidate pool, which every shard's own prefilter widens
+    if (value, quantizer) != ("rrf", "int8"):
+        assert [r["score"] for r in sharded] == pytest.approx([r["score"] for r in single], abs=1e-5)
+    if setting == "MMR_LAMBDA":
+        assert len({top, reshoot_key} & {r["image_key"] for r in sharded}) == 1
+
+
+def test_shard_functions_that_fail_or_miss_the_deadline_are_left_out(search, monkeypatch):
+    module, fakes = search
+    monkeypatch.setattr(module, "SEARCH_SHARDS", 4)
+    monkeypatch.setattr(module, "SHARD_FUNCTION", "search-shard")
+    monkeypatch.setattr(module, "SHARD_TIMEOUT_MS", 200)
+    even = ShardMap.even(4).shards
+
+    def shard(event, context):
+        if event["slots"] == even[1]:
+            time.sleep(0.5)
+        if event["slots"] == even[2]:
+            raise RuntimeError("out of memory")
+        return module.shard_handler(event, context)
+    fakes.lambda_.functions["search-shard"] = shard
+
+    response, results = get(module)
+
+    assert response["statusCode"] == 200 and response["headers"]["X-Search-Shards"] == "2/4"
+    assert len(results) == 3
+    assert len(fakes.lambda_.calls) == 4
+    assert {slot_of(r["image_key"]) for r in results} <= set(even[0] + even[3])
+
+
+def test_rebalance_backfills_rows_stored_before_slots_and_spaces(search, monkeypatch):
+    module, fakes = search
+    table = fakes.dynamodb.Table(EMBEDDINGS_TABLE)
+    # A legacy row: only its vector, no shard_slot or embedding_dim
+    table.items["legacy"] = {"id": "legacy", "image_key": "catalog/legacy.png",
+                             "vector": [Decimal(str(x)) for x in deterministic_embedding("red evening dress", 1024)]}
+    fakes.s3.objects[(IMAGE_BUCKET, "catalog/legacy.png")] = b"legacy"
+    monkeypatch.setattr(module, "SEARCH_SHARDS", 4)
+    monkeypatch.setattr(shards, "_maps", {})
+
+    shard_map, counts, missing = shards.rebalance(EMBEDDINGS_TABLE, ARTIFACT_BUCKET, 4)
+    assert missing == 1 and shard_map.unslotted == 1 and sum(counts) == 150
+    assert ShardMap.loads(fakes.s3.objects[(ARTIFACT_BUCKET, shards.DEFAULT_MAP_KEY)]).unslotted == 1
+    assert "catalog/legacy.png" not in [r["image_key"] for r in get(module)[1]]
+
+    monkeypatch.setattr(shards, "_maps", {})
+    shard_map, counts, missing = shards.rebalance(EMBEDDINGS_TABLE, ARTIFACT_BUCKET, 4, backfill=True)
+    assert missing == 1 and shard_map.unslotted == 0 and sum(counts) == 151
+    assert table.items["legacy"]["embedding_dim"] == 1024
+    assert table.items["legacy"][shards.SLOT_ATTRIBUTE] == slot_of("catalog/legacy.png")
+    assert get(module)[1][0]["image_key"] == "catalog/legacy.png"
+
+
+def test_shards_search_slotted_rows_without_embedding_dim(search, monkeypatch):
+    module, fakes = search
+    monkeypatch.setattr(module, "SEARCH_SHARDS", 4)
+    fakes.dynamodb.Table(EMBEDDINGS_TABLE).items["legacy"] = {
+        "id": "legacy", "image_key": "catalog/legacy.png", shards.SLOT_ATTRIBUTE: slot_of("catalog/legacy.png"),
+        "vector": [Decimal(str(x)) for x in deterministic_embedding("red evening dress", 1024)]}
+    fakes.s3.objects[(IMAGE_BUCKET, "catalog/legacy.png")] = b"legacy"
+
+    response, results = get(module)
+
+    assert response["statusCode"] == 200 and results[0]["image_key"] == "catalog/legacy.png"
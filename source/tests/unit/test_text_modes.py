@@ -0,0 +1,71 @@
+import importlib
+
+import pytest
+
+from benchmarks import use_lambda_code
+from benchmarks.fakes import FakeAws, _client_error
+from benchmarks.scenarios import COMMON_ENV, SCENARIOS, TABLE_KEYS
+
+
+@pytest.fixture
+def text_function(monkeypatch):
+    scenario = SCENARIOS["text_function"]
+    for name, value in {**COMMON_ENV, **scenario["env"]}.items():
+        monkeypatch.setenv(name, value)
+    use_lambda_code(scenario["function_dir"])
+    fakes = FakeAws(table_keys=TABLE_KEYS).install()
+    module = importlib.import_module("text_function")
+    monkeypatch.setattr(module, "TEXT_MODE", "auto")
+    return fakes, module
+
+
+def operations(fakes):
+    return [name for name, _ in fakes.agent_runtime.calls + fakes.bedrock_runtime.calls + fakes.http.calls]
+
+
+@pytest.mark.parametrize("query, agent", [
+    ("What color goes with navy?", False),
+    ("What should I wear to the office in Seattle?", False),
+    ("What goes with what I bought last month?", True),
+    ("Show me my last orders", True),
+    ("Plan a capsule wardrobe for a 10 day trip to Italy and Greece with dinners and a hike", True),
+])
+def test_only_requests_needing_tools_or_several_steps_use_the_agent(text_function, query, agent):
+    _, module = text_function
+    assert module.needs_agent(query) is agent
+
+
+def test_direct_answer_searches_the_knowledge_base_and_weather_then_calls_one_model(text_function):
+    fakes, module = text_function
+
+    response = module.handler({"queryStringParameters": {"query": "What should I wear to the office in Seattle?"}}, None)
+
+    assert response["statusCode"] == 200 and response["body"] == "Try a navy blazer with light chinos and white sneakers."
+    assert sorted(operations(fakes)) == ["HttpRequest", "InvokeModel", "Retrieve"]
+    (_, retrieve), = fakes.agent_runtime.calls
+    assert retrieve["retrievalConfiguration"]["vectorSearchConfiguration"]["numberOfResults"] == module.RETRIEVE_RESULTS
+    (_, invoke), = fakes.bedrock_runtime.calls
+    assert invoke["modelId"] == "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+def test_direct_prompt_is_compact(text_function):
+    _, module = text_function
+    prompt = module.direct_prompt("What should I wear?", ["Linen shirt", "Rain jacket"],
+                                  {"location": "Seattle", "customerProfile": "Buys shirts"},
+                                  {"city": "Seattle", "temperature": 14.2, "condition": "light rain"})
+    assert prompt.splitlines() == [
+        "<catalog>", "<passage>Linen shirt</passage>", "<passage>Rain jacket</passage>", "</catalog>",
+        "Customer: location Seattle", "Customer profile: Buys shirts",
+        "Weather in Seattle: 14.2°C, light rain", "Question: What should I wear?"]
+
+
+def test_agent_answers_when_the_knowledge_base_fails(text_function, monkeypatch):
+    fakes, module = text_function
+
+    def fail(**kwargs):
+        raise _client_error("AccessDeniedException", "Retrieve")
+    monkeypatch.setattr(fakes.agent_runtime, "retrieve", fail)
+
+    response = module.handler({"queryStringParameters": {"query": "Is denim on denim okay?"}}, None)
+    assert response["statusCode"] == 200 and response["body"] == "Here are some outfit ideas  for your trip."
+    assert operations(fakes) == ["InvokeAgent"]
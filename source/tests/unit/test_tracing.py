@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from stylist_common import tracing
+
+
+@pytest.fixture
+def records():
+    lines = []
+    tracing.set_sink(lines.append)
+    yield lines
+    tracing.set_sink(print)
+
+
+def api_event(**headers):
+    return {"queryStringParameters": {"query": "linen shirt"}, "headers": headers,
+            "requestContext": {"requestId": "gateway-id"}}
+
+
+def test_forced_trace_emits_stage_latencies_with_client_request_id(records):
+    @tracing.traced("search")
+    def handler(event, context):
+        with tracing.stage("embed"):
+            pass
+        with tracing.stage("s3_fetch"):
+            pass
+        with tracing.stage("s3_fetch"):
+            pass
+        assert tracing.current_request_id() == "client-id"
+        return {"statusCode": 200, "body": "[]"}
+
+    response = handler(api_event(**{"X-Request-Id": "client-id", "X-Trace": "1"}), None)
+
+    assert response["headers"]["X-Request-Id"] == "client-id"
+    assert len(records) == 1
+    record = json.loads(records[0])
+    metrics = record["_aws"]["CloudWatchMetrics"][0]
+    assert metrics["Namespace"] == "VirtualStylist"
+    assert metrics["Dimensions"] == [["Function"]]
+    assert {m["Name"] for m in metrics["Metrics"]} == {"embedLatency", "s3_fetchLatency", "TotalLatency"}
+    assert record["Function"] == "search"
+    assert record["RequestId"] == "client-id"
+    assert record["TotalLatency"] >= record["s3_fetchLatency"]
+
+
+def test_unsampled_requests_emit_nothing_but_still_carry_the_request_id(records, monkeypatch):
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "0")
+
+    @tracing.traced("search")
+    def handler(event, context):
+        with tracing.stage("embed"):
+            pass
+        return {"statusCode": 200, "body": "[]"}
+
+    response = handler(api_event(), None)
+
+    assert records == []
+    assert response["headers"]["X-Request-Id"] == "gateway-id"
+    assert tracing.current_request_id() is None
+
+
+def test_trace_is_emitted_when_the_handler_raises(records, monkeypatch):
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "1")
+
+    @tracing.traced("embeddings")
+    def handler(event, context):
+        with tracing.stage("embed"):
+            raise RuntimeError("model unavailable")
+
+    with pytest.raises(RuntimeError):
+        handler({"Records": []}, None)
+
+    assert "embedLatency" in json.loads(records[0])
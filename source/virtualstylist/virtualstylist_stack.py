@@ -27,6 +27,9 @@ from aws_cdk import (
     aws_bedrock as bedrock,
     aws_cloudformation as cfn,
     aws_dynamodb as dynamodb,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_lambda_event_sources as lambda_event_sources,
     aws_cloudfront as cloudfront,
     aws_cloudfront_origins as origins,
     aws_apigatewayv2 as apigatewayv2,
@@ -79,16 +82,17 @@ class VirtualstylistStack(Stack):
 
         # Define S3 bucket
         s3_bucket = s3.Bucket(self, "VirtualStylistAppBucketCDK", versioned=True, removal_policy=RemovalPolicy.DESTROY,
-            auto_delete_objects=True, enforce_ssl=True)
+            auto_delete_objects=True, enforce_ssl=True, event_bridge_enabled=True)
 
         # Specify the local directory containing the CSV files
         local_asset_dir = os.path.join(os.getcwd(), "csv_files")
 
-        # Deploy the CSV files to the S3 bucket
+        # Deploy the CSV files to the S3 bucket, keeping the review digests written there by the review digest function
         s3_deployment.BucketDeployment(
             self, "DeployCSVFiles",
             sources=[s3_deployment.Source.asset(local_asset_dir)],
-            destination_bucket=s3_bucket
+            destination_bucket=s3_bucket,
+            exclude=["review-digests/*"]
             )
         
 
@@ -112,6 +116,44 @@ class VirtualstylistStack(Stack):
             actions=["bedrock:InvokeAgent","bedrock:GetAgent"],
             resources=[f"arn:aws:bedrock:{region}:{account_id}:agent-alias/*"])
 
+        # Shared helper code for the Lambda functions
+        common_layer = lambda_.LayerVersion(
+            self, "CommonLayer",
+            code=lambda_.Code.from_asset("lambda/CommonLayer"),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_12],
+            description="Shared helpers for the Virtual Stylist functions",
+        )
+
+        # numpy for the vector and recommendation functions, from the managed AWS SDK for pandas layer
+        numpy_layer = lambda_.LayerVersion.from_layer_version_arn(
+            self, "NumpyLayer",
+            Node.of(self).try_get_context("numpy_layer_arn")
+            or f"arn:aws:lambda:{region}:336392948345:layer:AWSSDKPandas-Python312:13"
+        )
+
+        # Optional Pillow layer that lets the image function serve WebP/JPEG and resized images,
+        # and the image embeddings function shrink catalog photos before embedding them
+        pillow_layer_arn = Node.of(self).try_get_context("pillow_layer_arn")
+        pillow_layers = []
+        if pillow_layer_arn:
+            pillow_layers.append(lambda_.LayerVersion.from_layer_version_arn(self, "PillowLayer", pillow_layer_arn))
+        image_layers = [common_layer] + pillow_layers
+
+        # Define S3 bucket for derived artifacts such as recommendation snapshots, kept out of the knowledge base data source
+        artifact_bucket = s3.Bucket(self, "VirtualStylistArtifactsBucket", versioned=True, removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True, enforce_ssl=True)
+
+        # Define dynamo DB for storing precomputed customer profiles
+        customer_profiles_table = dynamodb.Table(
+            self, "CustomerProfilesTable",
+            partition_key=dynamodb.Attribute(
+                name="customer_id",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY
+            )
+
         # Define the Text Generation Lambda function
         text_lambda = lambda_.Function(
             self, "TextFunction",
@@ -119,12 +161,22 @@ class VirtualstylistStack(Stack):
             timeout=Duration.seconds(900),
             code=lambda_.Code.from_asset("lambda/TextFunction"),  # Path to your Lambda code
             handler="text_function.handler",  # File name.function name
+            layers=[common_layer],
             environment= {
                 "IMAGE_MODEL_ID": "stability.stable-diffusion-xl-v1",  # Replace with your desired model ID
                 "TEXT_MODEL_ID" : "anthropic.claude-3-sonnet-20240229-v1:0",
+                "FAST_TEXT_MODEL_ID": "anthropic.claude-3-haiku-20240307-v1:0",
+                # Set to "auto" to answer requests that need no tools from the knowledge base with one model call
+                "TEXT_MODE": "agent",
+                "YOUR_OPENWEATHERMAP_API_KEY": "ENTER OPENWEATHERMAP API_KEY",
                 "knowledgeBaseId": "ENTER KNOWLEDGE BASE ID",
                 "agentId": "ENTER BEDROCK AGENT ID",
-                "agentAliasId": "ENTER AGENT ALIAS ID"
+                "agentAliasId": "ENTER AGENT ALIAS ID",
+                # Optional: alias of an agent version using Claude 3 Haiku, which then answers simple requests
+                "FAST_AGENT_ALIAS_ID": "",
+                "PROFILE_TABLE": customer_profiles_table.table_name,
+                # Set ATTRIBUTE_CLASSIFIERS_KEY to the key of trained attribute classifiers in this bucket
+                "ARTIFACT_BUCKET": artifact_bucket.bucket_name
             },
         )
 
@@ -139,6 +191,17 @@ class VirtualstylistStack(Stack):
         # Add the policy statement to the Lambda function's role
         text_lambda.role.add_to_principal_policy(bedrock_policy_statement)
         text_lambda.role.add_to_principal_policy(bedrock_agent_policy_statement)
+        # The direct path searches the knowledge base itself
+        text_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["bedrock:Retrieve"],
+                resources=[f"arn:aws:bedrock:{region}:{account_id}:knowledge-base/*"]
+            )
+        )
+
+        # Allow the text function to look up customer profiles
+        customer_profiles_table.grant_read_data(text_lambda)
+        artifact_bucket.grant_read(text_lambda)
 
         # Define the Image Generation Lambda function
         image_lambda = lambda_.Function(
@@ -147,9 +210,12 @@ class VirtualstylistStack(Stack):
             runtime=lambda_.Runtime.PYTHON_3_12,
             code=lambda_.Code.from_asset("lambda/ImageFunction"),  # Path to your Lambda code
             handler="image_function.handler",  # File name.function name
+            layers=image_layers,
             environment= {
                 "IMAGE_MODEL_ID": "stability.stable-diffusion-xl-v1",  # Replace with your desired model ID
-                "TEXT_MODEL_ID" : "anthropic.claude-3-haiku-20240307-v1:0"
+                # Simple styles are refined by the fast model and detailed ones by the text model
+                "TEXT_MODEL_ID" : "anthropic.claude-3-sonnet-20240229-v1:0",
+                "FAST_TEXT_MODEL_ID": "anthropic.claude-3-haiku-20240307-v1:0"
             },
         )
         
@@ -170,6 +236,7 @@ class VirtualstylistStack(Stack):
             timeout=Duration.seconds(900),
             code=lambda_.Code.from_asset("lambda/IngestionFunction"),  # Path to your Lambda code
             handler="ingestion_function.handler",  # File name.function name
+            layers=[common_layer],
             environment= {
                 "DATASOURCEID": "ENTER DATASOURCE ID",
                 "KNOWLEDGEBASEID": "ENTER KNOWLEDGEBASE ID"},
@@ -197,6 +264,107 @@ class VirtualstylistStack(Stack):
             )
         )
 
+        # Define the Customer Profile aggregation function, rebuilding profiles when order history changes
+        customer_profile_lambda = lambda_.Function(
+            self, "CustomerProfileFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(900),
+            code=lambda_.Code.from_asset("lambda/CustomerProfileFunction"),  # Path to your Lambda code
+            handler="customer_profile_function.handler",  # File name.function name
+            layers=[common_layer],
+            environment= {
+                "PROFILE_TABLE": customer_profiles_table.table_name
+            },
+        )
+
+        s3_bucket.grant_read(customer_profile_lambda)
+        customer_profiles_table.grant_read_write_data(customer_profile_lambda)
+
+        # The bucket already notifies the ingestion function for every object, so use EventBridge for the suffix filter
+        order_history_rule = events.Rule(
+            self, "OrderHistoryUploadedRule",
+            event_pattern=events.EventPattern(
+                source=["aws.s3"],
+                detail_type=["Object Created"],
+                detail={
+                    "bucket": {"name": [s3_bucket.bucket_name]},
+                    "object": {"key": [{"suffix": "order_history.csv"}]}
+                }
+            ),
+            targets=[events_targets.LambdaFunction(customer_profile_lambda)]
+        )
+
+        # Define the review digest function, summarising customer reviews per category for the knowledge base
+        review_digest_lambda = lambda_.Function(
+            self, "ReviewDigestFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(900),
+            code=lambda_.Code.from_asset("lambda/ReviewDigestFunction"),  # Path to your Lambda code
+            handler="review_digest_function.handler",  # File name.function name
+            layers=[common_layer, numpy_layer],
+            environment= {
+                "ARTIFACT_BUCKET": artifact_bucket.bucket_name,
+                "DIGEST_STATE_KEY": "reviews/digests.json",
+                "DIGEST_PREFIX": "review-digests/",
+                # Review exports are moved out of the knowledge base data source once digested
+                "RAW_REVIEWS_PREFIX": "reviews/raw/",
+                "EMBEDDINGS_MODEL_ID": "amazon.titan-embed-image-v1"
+            },
+        )
+
+        s3_bucket.grant_read_write(review_digest_lambda)
+        artifact_bucket.grant_read_write(review_digest_lambda)
+        review_digest_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["bedrock:InvokeModel"],
+                resources=[f"arn:aws:bedrock:{region}::foundation-model/amazon.titan-embed-image-v1"]
+            )
+        )
+
+        # New review exports (customer_reviews.csv, customer_reviews-2024-06.csv, ...) update the digests
+        events.Rule(
+            self, "CustomerReviewsUploadedRule",
+            event_pattern=events.EventPattern(
+                source=["aws.s3"],
+                detail_type=["Object Created"],
+                detail={
+                    "bucket": {"name": [s3_bucket.bucket_name]},
+                    "object": {"key": [{"wildcard": "*customer_reviews*.csv"}]}
+                }
+            ),
+            targets=[events_targets.LambdaFunction(review_digest_lambda)]
+        )
+
+        # Define the "frequently bought together" recommendation function, used as a Bedrock Agent action group
+        recommendation_lambda = lambda_.Function(
+            self, "RecommendationFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(900),
+            memory_size=1024,
+            code=lambda_.Code.from_asset("lambda/RecommendationFunction"),  # Path to your Lambda code
+            handler="recommendation_function.handler",  # File name.function name
+            layers=[common_layer, numpy_layer],
+            environment= {
+                "DATA_BUCKET": s3_bucket.bucket_name,
+                "ORDER_HISTORY_KEY": "order_history.csv",
+                "ARTIFACT_BUCKET": artifact_bucket.bucket_name,
+                "SNAPSHOT_KEY": "recommendations/copurchase.npz"
+            },
+        )
+
+        s3_bucket.grant_read(recommendation_lambda)
+        artifact_bucket.grant_read_write(recommendation_lambda)
+
+        # Apply new orders to the co-purchase index as they arrive
+        order_history_rule.add_target(events_targets.LambdaFunction(recommendation_lambda))
+
+        recommendation_lambda.add_permission(
+            "BedrockInvokePermission",
+            principal=iam.ServicePrincipal("bedrock.amazonaws.com"),
+            action="lambda:invokeFunction",
+        )
+
         # Define the weather Generation Lambda function
         weather_lambda = lambda_.Function(
             self, "WeatherFunction",
@@ -204,6 +372,7 @@ class VirtualstylistStack(Stack):
             timeout=Duration.seconds(900),
             code=lambda_.Code.from_asset("lambda/WeatherFunction"),  # Path to your Lambda code
             handler="weather_function.handler",  # File name.function name
+            layers=[common_layer],
             environment= {
                 "YOUR_OPENWEATHERMAP_API_KEY": "ENTER OPENWEATHERMAP API_KEY"
             },
@@ -240,6 +409,35 @@ class VirtualstylistStack(Stack):
             action="lambda:invokeFunction",
         )
         
+        # Define the action group router function serving every agent tool from one warm container
+        action_group_lambda = lambda_.Function(
+            self, "ActionGroupFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(60),
+            memory_size=1024,
+            code=lambda_.Code.from_asset("lambda/ActionGroupFunction"),  # Path to your Lambda code
+            handler="action_group_function.handler",  # File name.function name
+            layers=[common_layer, numpy_layer],
+            environment= {
+                "YOUR_OPENWEATHERMAP_API_KEY": "ENTER OPENWEATHERMAP API_KEY",
+                "PROFILE_TABLE": customer_profiles_table.table_name,
+                "DATA_BUCKET": s3_bucket.bucket_name,
+                "ORDER_HISTORY_KEY": "order_history.csv",
+                "ARTIFACT_BUCKET": artifact_bucket.bucket_name,
+                "SNAPSHOT_KEY": "recommendations/copurchase.npz"
+            },
+        )
+
+        s3_bucket.grant_read(action_group_lambda)
+        artifact_bucket.grant_read(action_group_lambda)
+        customer_profiles_table.grant_read_data(action_group_lambda)
+
+        action_group_lambda.add_permission(
+            "BedrockInvokePermission",
+            principal=iam.ServicePrincipal("bedrock.amazonaws.com"),
+            action="lambda:invokeFunction",
+        )
+
         # Define dynamo DB for storing vector embeddings
         product_embeddings_table = dynamodb.Table(
             self, "EmbeddingsTable",
@@ -248,9 +446,21 @@ class VirtualstylistStack(Stack):
                 type=dynamodb.AttributeType.STRING
             ),
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            # Changes feed the incremental index snapshots
+            stream=dynamodb.StreamViewType.NEW_IMAGE,
             removal_policy=RemovalPolicy.DESTROY
             )
             
+        # Embedding size and optional PCA projection shared by the writer and the search function
+        embedding_space_env = {
+            "EMBEDDING_DIMENSION": str(Node.of(self).try_get_context("embedding_dimension") or 1024),
+            "PROJECTION_VERSION": Node.of(self).try_get_context("projection_version") or "none",
+            "ARTIFACT_BUCKET": artifact_bucket.bucket_name,
+            # Deployment document naming the live and shadow embeddings generations (see stylist_common.migration)
+            "EMBEDDINGS_DEPLOYMENT_KEY": "search/embedding-deployment.json",
+            "EMBEDDINGS_VERSION": str(Node.of(self).try_get_context("embeddings_version") or 1),
+        }
+
         # Define Image embeddings Lambda function for generating embeddings and storing in DynamoDB
         imageembeddings_lambda = lambda_.Function(
             self, "ImageEmbeddingsFunction",
@@ -258,9 +468,11 @@ class VirtualstylistStack(Stack):
             timeout=Duration.seconds(900),
             code=lambda_.Code.from_asset("lambda/ImageEmbeddingFunction"),  # Path to your Lambda code
             handler="image_embeddings_function.handler",  # File name.function name
+            layers=[common_layer, numpy_layer] + pillow_layers,
             environment= {
                 "EMBEDDINGS_MODEL_ID" : "amazon.titan-embed-image-v1",
-                "dynamodb_table" : product_embeddings_table.table_name
+                "dynamodb_table" : product_embeddings_table.table_name,
+                **embedding_space_env
             },
         )
         
@@ -306,15 +518,21 @@ class VirtualstylistStack(Stack):
             timeout=Duration.seconds(900),
             code=lambda_.Code.from_asset("lambda/ImageQueryHandlingFunction"),  # Path to your Lambda code
             handler="imagequery_function.handler",  # File name.function name
+            layers=[common_layer, numpy_layer],
             environment= {
                 "dynamodb_table" : product_embeddings_table.table_name, # Replace with your desired dynamodb table 
                 "EMBEDDINGS_MODEL_ID" : "amazon.titan-embed-image-v1",
-                "bucket": s3_imagebucket.bucket_name
+                "bucket": s3_imagebucket.bucket_name,
+                **embedding_space_env
             },
             )
             
          # Add the policy to the Lambda function's role
         imagequery_lambda.add_to_role_policy(bedrock_policy_embeddings)
+
+        # Allow both functions to load the embedding projection
+        artifact_bucket.grant_read(imagequery_lambda)
+        artifact_bucket.grant_read(imageembeddings_lambda)
         
         # Add dynamodb permissions to imagequery_lambda
         imagequery_lambda.add_to_role_policy(
@@ -323,6 +541,7 @@ class VirtualstylistStack(Stack):
                 actions=[
                     "dynamodb:Query",
                     "dynamodb:GetItem",
+                    "dynamodb:BatchGetItem",
                     "dynamodb:PutItem",
                     "dynamodb:UpdateItem",
                     "dynamodb:DeleteItem",
@@ -356,7 +575,116 @@ class VirtualstylistStack(Stack):
                 resources=[s3_imagebucket.bucket_arn, f"{s3_imagebucket.bucket_arn}/*"]
             ))
 
-        
+
+        # Optional second embeddings table and model for a migration to a new embeddings model, e.g.
+        # cdk deploy -c embedding_migration_model=<model id>, then run stylist_common.migration start
+        migration_model = Node.of(self).try_get_context("embedding_migration_model")
+        migration_table = None
+        if migration_model:
+            migration_table = dynamodb.Table(
+                self, "EmbeddingsTableB",
+                partition_key=dynamodb.Attribute(name="id", type=dynamodb.AttributeType.STRING),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                # Keeps its own index snapshots current, so it can be served once promoted
+                stream=dynamodb.StreamViewType.NEW_IMAGE,
+                removal_policy=RemovalPolicy.DESTROY
+            )
+            migration_policy = iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["bedrock:InvokeModel"],
+                resources=[f"arn:aws:bedrock:{region}::foundation-model/{migration_model}"]
+            )
+            imageembeddings_lambda.add_to_role_policy(migration_policy)
+            imagequery_lambda.add_to_role_policy(migration_policy)
+            CfnOutput(self, "MigrationEmbeddingsTable", value=migration_table.table_name)
+
+        # Optional scatter-gather search over hash-partitioned shards, e.g. cdk deploy -c search_shards=8.
+        # Each shard worker queries its slots of the shard index, which holds the compact codes but not the vectors.
+        # Shards search the live generation's table, so a migration table gets the index too
+        search_shards = int(Node.of(self).try_get_context("search_shards") or 1)
+        if search_shards > 1:
+            shard_tables = [table for table in (product_embeddings_table, migration_table) if table is not None]
+            for table in shard_tables:
+                table.add_global_secondary_index(
+                    index_name="shard-index",
+                    partition_key=dynamodb.Attribute(name="shard_slot", type=dynamodb.AttributeType.NUMBER),
+                    projection_type=dynamodb.ProjectionType.INCLUDE,
+                    non_key_attributes=["image_key", "embedding_dim", "projection", "vector_int8", "vector_bits",
+                                        "text_vector_int8", "text_vector_bits", "duplicate_of"],
+                )
+            shard_lambda = lambda_.Function(
+                self, "ImageQueryShardFunction",
+                runtime=lambda_.Runtime.PYTHON_3_12,
+                timeout=Duration.seconds(30),
+                memory_size=1024,
+                code=lambda_.Code.from_asset("lambda/ImageQueryHandlingFunction"),  # Same code as the search function
+                handler="imagequery_function.shard_handler",  # File name.function name
+                layers=[common_layer, numpy_layer],
+                environment= {
+                    "dynamodb_table" : product_embeddings_table.table_name,
+                    **embedding_space_env
+                },
+            )
+            for table in shard_tables:
+                table.grant_read_data(shard_lambda)
+            artifact_bucket.grant_read(shard_lambda)
+            shard_lambda.grant_invoke(imagequery_lambda)
+            imagequery_lambda.add_environment("SEARCH_SHARDS", str(search_shards))
+            imagequery_lambda.add_environment("SHARD_FUNCTION", shard_lambda.function_name)
+            imagequery_lambda.add_environment("SHARD_TIMEOUT_MS", str(Node.of(self).try_get_context("search_shard_timeout_ms") or 2000))
+
+        # Keep versioned index snapshots in the artifacts bucket current from the stream of each embeddings table
+        index_snapshot_lambda = lambda_.Function(
+            self, "IndexSnapshotFunction",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=Duration.seconds(900),
+            memory_size=1024,
+            code=lambda_.Code.from_asset("lambda/IndexSnapshotFunction"),  # Path to your Lambda code
+            handler="index_snapshot_function.handler",  # File name.function name
+            layers=[common_layer, numpy_layer],
+            environment= {
+                "dynamodb_table" : product_embeddings_table.table_name,
+                "INDEX_PREFIX": "index/",
+                # Compaction covers every generation of the embeddings deployment
+                **embedding_space_env
+            },
+        )
+        snapshot_tables = [table for table in (product_embeddings_table, migration_table) if table is not None]
+        for table in snapshot_tables:
+            index_snapshot_lambda.add_event_source(lambda_event_sources.DynamoEventSource(
+                table,
+                starting_position=lambda_.StartingPosition.TRIM_HORIZON,
+                batch_size=100,
+                max_batching_window=Duration.seconds(10),
+                retry_attempts=10,
+            ))
+        # Fold the deltas into a new base snapshot; the first run builds it from a table scan
+        events.Rule(
+            self, "IndexCompactionRule",
+            schedule=events.Schedule.rate(Duration.minutes(int(Node.of(self).try_get_context("index_compaction_minutes") or 60))),
+            targets=[events_targets.LambdaFunction(index_snapshot_lambda)]
+        )
+        for table in snapshot_tables:
+            table.grant_read_data(index_snapshot_lambda)
+        artifact_bucket.grant_read_write(index_snapshot_lambda)
+        artifact_bucket.grant_delete(index_snapshot_lambda)
+
+        # Optional hedging and failover of model calls to other regions or inference profiles,
+        # e.g. cdk deploy -c bedrock_hedge_targets=us-west-2 or -c bedrock_hedge_targets=us-east-1:us
+        bedrock_hedge_targets = Node.of(self).try_get_context("bedrock_hedge_targets")
+        if bedrock_hedge_targets:
+            hedged_models = ["anthropic.claude-3-sonnet-20240229-v1:0", "anthropic.claude-3-haiku-20240307-v1:0",
+                             "stability.stable-diffusion-xl-v1", "amazon.titan-embed-image-v1"]
+            bedrock_hedge_policy = iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["bedrock:InvokeModel"],
+                resources=[f"arn:aws:bedrock:*::foundation-model/{model}" for model in hedged_models]
+                    + [f"arn:aws:bedrock:*:{account_id}:inference-profile/*"]
+            )
+            for hedged_lambda in [text_lambda, image_lambda, imagequery_lambda, imageembeddings_lambda]:
+                hedged_lambda.add_environment("BEDROCK_HEDGE_TARGETS", bedrock_hedge_targets)
+                hedged_lambda.add_to_role_policy(bedrock_hedge_policy)
+
         apigw_log_group = logs.LogGroup(self, "ApiGatewayStylistLogs")
         
         api = apigateway.RestApi(self, "virtual-stylist-api",
@@ -448,6 +776,14 @@ class VirtualstylistStack(Stack):
                                                     "application/json": apigateway.Model.EMPTY_MODEL
                                                     }
                                     )])
+        # Several queries in one request, e.g. every item of an outfit
+        search_resource.add_method("POST", apigateway.LambdaIntegration(imagequery_lambda), api_key_required=True,
+                                  method_responses=[apigateway.MethodResponse(
+                                                    status_code="200",
+                                                    response_models={
+                                                    "application/json": apigateway.Model.EMPTY_MODEL
+                                                    }
+                                    )])
         
         
         # !--------------Virtual Stylist APP DEPLOYMENT ASSETS----------------!
@@ -481,6 +817,59 @@ class VirtualstylistStack(Stack):
             directory="./stylistdockerapp",
         )
         
+        # Optional long-lived search service that keeps the image index in memory; the search Lambda stays as the fallback
+        app_environment = {}
+        search_service = None
+        if Node.of(self).try_get_context("search_service"):
+            search_image_asset = ecr_assets.DockerImageAsset(
+                self, "VirtualStylistSearchImage",
+                directory=".",
+                file="searchservice/Dockerfile",
+                exclude=["cdk.out", "stylistdockerapp", "tests", "benchmarks", "csv_files", "**/__pycache__"],
+            )
+            # Internal load balancer, reachable only from the Streamlit service
+            search_load_balancer = elbv2.ApplicationLoadBalancer(
+                self, "VirtualStylistSearchLoadBalancer",
+                vpc=vpc,
+                internet_facing=False,
+                vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
+            )
+            search_service = ecs_patterns.ApplicationLoadBalancedFargateService(
+                self, "VirtualStylistSearchService",
+                cluster=cluster,
+                service_name="ecs-virtualstylist-search",
+                cpu=1024,
+                memory_limit_mib=4096,
+                load_balancer=search_load_balancer,
+                open_listener=False,
+                assign_public_ip=True,
+                task_image_options=ecs_patterns.ApplicationLoadBalancedTaskImageOptions(
+                    image=ecs.ContainerImage.from_docker_image_asset(search_image_asset),
+                    container_port=8080,
+                    environment={
+                        "dynamodb_table": product_embeddings_table.table_name,
+                        "EMBEDDINGS_MODEL_ID": "amazon.titan-embed-image-v1",
+                        "bucket": s3_imagebucket.bucket_name,
+                        "INDEX_SNAPSHOT_BUCKET": artifact_bucket.bucket_name,
+                        "INDEX_PREFIX": "index/",
+                        "INDEX_REFRESH_SECONDS": "30",
+                        **embedding_space_env
+                    },
+                ),
+                health_check_grace_period=Duration.seconds(120),
+            )
+            search_service.target_group.configure_health_check(path="/health")
+            task_role = search_service.task_definition.task_role
+            product_embeddings_table.grant_read_data(task_role)
+            s3_imagebucket.grant_read(task_role)
+            artifact_bucket.grant_read(task_role)
+            task_role.add_to_principal_policy(bedrock_policy_embeddings)
+            # The service follows the live generation, so it reads the migration table with the new model once promoted
+            if migration_table is not None:
+                migration_table.grant_read_data(task_role)
+                task_role.add_to_principal_policy(migration_policy)
+            app_environment["SEARCH_SERVICE_URL"] = f"http://{search_load_balancer.load_balancer_dns_name}"
+
         # Create a new Fargate service with the image from ECR and specify the service name
         app_service = ecs_patterns.ApplicationLoadBalancedFargateService(
             self, "VirtualStylistFargateService",
@@ -489,6 +878,7 @@ class VirtualstylistStack(Stack):
             task_image_options=ecs_patterns.ApplicationLoadBalancedTaskImageOptions(
                 image=ecs.ContainerImage.from_registry(app_image_asset.image_uri),
                 container_port=8501,
+                environment=app_environment,
             ),
             public_load_balancer=True,
             assign_public_ip=True,
@@ -539,6 +929,9 @@ class VirtualstylistStack(Stack):
         # Attach the security group to the ECS service
         app_service.service.connections.add_security_group(service_security_group)
         
+        if search_service is not None:
+            search_service.load_balancer.connections.allow_from(app_service.service, ec2.Port.tcp(80))
+
         # Create a CloudFront distribution
         distribution = cloudfront.Distribution(
             self, "VirtualStylistDistribution",